@@ -7,20 +7,70 @@ their output directory after the program is running. This behaviour can be overr
 suppling the '-o' flag.
 
 This script can also be used to launch a shell in a Singularity image with sdf_helper
-pre-installed.
+pre-installed, to run parameter sweeps over an input deck, and to record and query a
+history of runs.
 """
 
+import csv
+import fcntl
+import hashlib
+import itertools
+import json
+import os
+import re
+import signal
+import sqlite3
+import statistics
 import subprocess
+import threading
+import time
 from argparse import ArgumentParser, Namespace
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing, contextmanager, nullcontext
 from pathlib import Path
 from textwrap import dedent
-from typing import Optional
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from urllib.error import HTTPError
+from urllib.parse import urlencode
+from urllib.request import Request, urlopen
+
+# File which Epoch checks for periodically, writing a restart dump and exiting if found
+_STOP_FILE = "STOP"
 
 _CONTAINERS = dict(
     docker="ghcr.io/plasmafair/epoch:latest",
     singularity="oras://ghcr.io/plasmafair/epoch.sif:latest",
 )
 
+# Media types of the manifests and indexes that tags may point to
+_MANIFEST_TYPES = ", ".join(
+    (
+        "application/vnd.oci.image.manifest.v1+json",
+        "application/vnd.oci.image.index.v1+json",
+        "application/vnd.docker.distribution.manifest.v2+json",
+        "application/vnd.docker.distribution.manifest.list.v2+json",
+    )
+)
+
+# Table of runs in the history database. Matches epoch_containers.history.
+_HISTORY_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    deck_hash TEXT,
+    output TEXT,
+    launcher TEXT,
+    identity TEXT,
+    args TEXT,
+    dims INTEGER,
+    photons INTEGER,
+    nprocs INTEGER,
+    start_time REAL,
+    end_time REAL,
+    exit_status INTEGER,
+    metrics TEXT
+)
+"""
+
 
 def parse_args() -> Namespace:
     """Reads arguments from the command line."""
@@ -56,6 +106,33 @@ def parse_args() -> Namespace:
             help=f"The container to {cmd}. The default is {default}.",
         )
 
+    # Image cache args, for every subcommand that runs a Singularity image
+    def cache_args(parser: ArgumentParser) -> None:
+        parser.add_argument(
+            "--image-cache",
+            default=os.environ.get("EPOCH_IMAGE_CACHE") or None,
+            type=Path,
+            help=(
+                "Shared directory in which to cache images, named by digest, so that "
+                "jobs pull each image once. Remote containers are replaced by their "
+                "cached copy. Defaults to $EPOCH_IMAGE_CACHE, if set."
+            ),
+        )
+        parser.add_argument(
+            "--cache-size",
+            default=float(os.environ.get("EPOCH_IMAGE_CACHE_SIZE", 20)),
+            type=float,
+            help=(
+                "Size in GiB above which the least recently used images are removed "
+                "from the cache. Defaults to $EPOCH_IMAGE_CACHE_SIZE, or 20."
+            ),
+        )
+        parser.add_argument(
+            "--refresh",
+            action="store_true",
+            help="Check for a new image, even if the tag was checked in the last hour.",
+        )
+
     subparser_tuple = (docker_parser, singularity_parser)
     container_tuple = (_CONTAINERS["docker"], _CONTAINERS["singularity"])
     for subparser, container in zip(subparser_tuple, container_tuple):
@@ -89,6 +166,172 @@ def parse_args() -> Namespace:
             "--no-run", action="store_true", help="Print the command but don't run it."
         )
 
+        subparser.add_argument(
+            "--history",
+            default=None,
+            type=Path,
+            help=(
+                "SQLite database in which to record this run. "
+                "See the 'history' subcommand."
+            ),
+        )
+
+        subparser.add_argument(
+            "--progress",
+            action="store_true",
+            help=(
+                "Print a compact progress line, with throughput and estimated time "
+                "remaining, while Epoch's output streams through."
+            ),
+        )
+
+        subparser.add_argument(
+            "--metrics",
+            default=None,
+            type=str,
+            help=(
+                "File name, within the output directory, to which throughput is "
+                "appended as JSON lines during the run."
+            ),
+        )
+
+        subparser.add_argument(
+            "--sample-resources",
+            action="store_true",
+            help=(
+                "Sample the memory, CPU time, context switches and I/O of each rank. "
+                "Summaries are written to 'resources' in the output directory."
+            ),
+        )
+
+        subparser.add_argument(
+            "--sample-interval",
+            default=1.0,
+            type=float,
+            help="Seconds between resource samples. The default is 1.",
+        )
+
+        subparser.add_argument(
+            "--graceful",
+            action="store_true",
+            help=(
+                "On SIGTERM, SIGUSR1 or SIGUSR2, ask Epoch to write a restart dump "
+                "and stop, using its stop file. Use with Slurm's --signal option."
+            ),
+        )
+
+        subparser.add_argument(
+            "--walltime",
+            default=None,
+            type=parse_time_limit,
+            help=(
+                "Time limit of the job, in seconds or Slurm's format such as "
+                "'1-12:00:00'. Epoch is asked to stop --grace seconds before it. "
+                "Implies --graceful."
+            ),
+        )
+
+        subparser.add_argument(
+            "--grace",
+            default=300.0,
+            type=float,
+            help=(
+                "Seconds before --walltime at which to stop, allowing time to write "
+                "a restart dump. The default is 300."
+            ),
+        )
+
+        subparser.add_argument(
+            "--requeue",
+            action="store_true",
+            help="Requeue the Slurm job after a graceful stop. Use with --resume.",
+        )
+
+        subparser.add_argument(
+            "--resume",
+            action="store_true",
+            help=(
+                "Continue from the latest complete restart dump in the output "
+                "directory, or start from the beginning if there isn't one."
+            ),
+        )
+
+        subparser.add_argument(
+            "--stage",
+            default=None,
+            help=(
+                "Fast node-local directory, such as $TMPDIR or /dev/shm, in which to "
+                "run Epoch. Dumps are copied to the output directory as they are "
+                "finished, and everything else at the end. Only for single node runs."
+            ),
+        )
+
+        subparser.add_argument(
+            "--drain-interval",
+            default=10.0,
+            type=float,
+            help="Seconds between checks for finished dumps. The default is 10.",
+        )
+
+        subparser.add_argument(
+            "--compress",
+            default=None,
+            choices=["gzip", "bz2", "xz"],
+            help=(
+                "Compress dumps in the background once Epoch has finished writing "
+                "them. Restart dumps are not compressed."
+            ),
+        )
+
+        subparser.add_argument(
+            "--keep-restarts",
+            default=None,
+            type=int,
+            help="Remove all but the latest this many restart dumps during the run.",
+        )
+
+        subparser.add_argument(
+            "--keep-every",
+            default=None,
+            type=int,
+            help=(
+                "Remove dumps other than restart dumps during the run, unless their "
+                "number is a multiple of this. The latest dump is always kept."
+            ),
+        )
+
+        subparser.add_argument(
+            "--analyse",
+            action="append",
+            default=None,
+            metavar="CALLBACK",
+            help=(
+                "Python function to call with the path of each dump while Epoch "
+                "runs, such as 'analysis.py:function' for a file in the output "
+                "directory, or 'package.module:function' if installed in the "
+                "container. May be given more than once."
+            ),
+        )
+
+        subparser.add_argument(
+            "--analysis-workers",
+            default=1,
+            type=int,
+            help="Number of processes running --analyse callbacks. The default is 1.",
+        )
+
+        subparser.add_argument(
+            "--analysis-reserve",
+            default=0.2,
+            type=float,
+            help=(
+                "Fraction of memory to leave for Epoch when starting callbacks. The "
+                "default is 0.2."
+            ),
+        )
+
+    cache_args(singularity_parser)
+
     # Singularity multiprocess utilties
     singularity_parser.add_argument(
         "-n",
@@ -107,6 +350,19 @@ def parse_args() -> Namespace:
         ),
     )
 
+    singularity_parser.add_argument(
+        "--bind-policy",
+        default=None,
+        choices=("compact", "spread", "socket"),
+        help=(
+            "Bind each rank to a core, found from /sys, so that ranks and their "
+            "memory stay in place. 'compact' fills each socket in turn, 'spread' "
+            "places ranks round-robin on each NUMA node, and 'socket' places an "
+            "equal block of ranks on each socket. With --no-run, the core of each "
+            "rank is printed."
+        ),
+    )
+
     # Extra singularity utilities
     subsubparsers = singularity_parser.add_subparsers(
         required=False,
@@ -126,10 +382,14 @@ def parse_args() -> Namespace:
         "-o",
         "--output",
         type=Path,
-        default=Path("epoch.sif"),
-        help="Filename of local image file",
+        default=None,
+        help=(
+            "Filename of local image file. The default is epoch.sif, or with "
+            "--image-cache, a link to the cached image is made only if given."
+        ),
     )
     container_arg(pull_parser, _CONTAINERS["singularity"], cmd="pull")
+    cache_args(pull_parser)
 
     # Shell: Open a shell inside the container
     shell_parser = subsubparsers.add_parser(
@@ -147,11 +407,315 @@ def parse_args() -> Namespace:
         help="Run a specific command on entering the shell.",
     )
     container_arg(shell_parser, _CONTAINERS["singularity"])
+    cache_args(shell_parser)
+
+    # History: Query the database of previous runs
+    history_parser = subparsers.add_parser(
+        "history",
+        help="Query the history of runs recorded with --history.",
+    )
+    history_parser.add_argument("db", type=Path, help="Path to the history database.")
+    history_parser.add_argument(
+        "command",
+        choices=("list", "compare"),
+        help=(
+            "'list' prints every recorded run. 'compare' flags runs that were "
+            "slower than the historical median for the same deck."
+        ),
+    )
+    history_parser.add_argument(
+        "--tolerance",
+        default=0.1,
+        type=float,
+        help="Fractional slowdown allowed before flagging a run. The default is 0.1.",
+    )
+    history_parser.add_argument(
+        "--min-history",
+        default=3,
+        type=int,
+        help="Earlier runs needed before a run is compared. The default is 3.",
+    )
+
+    # Sweep: Run many variants of one input deck concurrently
+    sweep_parser = subparsers.add_parser(
+        "sweep",
+        help="Run a parameter sweep over a template input deck.",
+        description=(
+            "Render one output directory per point of a parameter grid, and run "
+            "them concurrently within a budget of cores. Points that have already "
+            "finished are skipped, so an interrupted sweep can be resumed by "
+            "running the same command again."
+        ),
+    )
+    sweep_parser.add_argument(
+        "template",
+        type=Path,
+        help="Template 'input.deck' file, or the directory containing it.",
+    )
+    sweep_parser.add_argument(
+        "-p",
+        "--param",
+        action="append",
+        default=[],
+        metavar="BLOCK.KEY=V1,V2,...",
+        help=(
+            "A parameter to sweep over, such as 'laser.intensity_w_cm2=1e18,1e19'. "
+            "Keys without a block are set in the control block. May be repeated, "
+            "in which case every combination is run."
+        ),
+    )
+    sweep_parser.add_argument(
+        "--grid",
+        default=None,
+        type=Path,
+        help=(
+            "JSON file mapping 'block.key' to lists of values, as an alternative "
+            "to --param."
+        ),
+    )
+    sweep_parser.add_argument(
+        "-o",
+        "--output",
+        default=Path("sweep"),
+        type=Path,
+        help="Directory in which to create a directory per point. Default 'sweep'.",
+    )
+    sweep_parser.add_argument(
+        "-m",
+        "--launcher",
+        default="singularity",
+        choices=("docker", "singularity", "native"),
+        help=(
+            "How to run each point. 'native' calls the run_epoch command directly, "
+            "such as from inside a container. The default is singularity."
+        ),
+    )
+    sweep_parser.add_argument(
+        "-c",
+        "--container",
+        default=None,
+        help="The container to run. Defaults to that of the chosen launcher.",
+    )
+    sweep_parser.add_argument(
+        "-d",
+        "--dims",
+        default=None,
+        type=int,
+        choices=range(1, 4),
+        help="The number of dimensions. Inferred from the deck if not given.",
+    )
+    sweep_parser.add_argument(
+        "--photons", action="store_true", help="Run with QED features enabled."
+    )
+    sweep_parser.add_argument(
+        "-n",
+        "--nprocs",
+        default=1,
+        type=int,
+        help="The number of processes for each run. The default is 1.",
+    )
+    sweep_parser.add_argument(
+        "--cores",
+        default=os.cpu_count() or 1,
+        type=int,
+        help="Total cores shared by concurrent runs. Defaults to all of them.",
+    )
+    sweep_parser.add_argument(
+        "--warm",
+        action="store_true",
+        help=(
+            "With the docker launcher, keep a container running for each concurrent "
+            "run, and start each point in one with 'docker exec', rather than "
+            "creating a container per point. Saves time for many short runs."
+        ),
+    )
+    sweep_parser.add_argument(
+        "--idle-timeout",
+        default=300.0,
+        type=float,
+        help="Seconds after which an unused --warm container is removed. Default 300.",
+    )
+    sweep_parser.add_argument(
+        "--retries",
+        default=1,
+        type=int,
+        help="Times to retry a run that fails. The default is 1.",
+    )
+    sweep_parser.add_argument(
+        "--history",
+        default=None,
+        type=Path,
+        help="SQLite database in which to record each run.",
+    )
+    sweep_parser.add_argument(
+        "--no-run",
+        action="store_true",
+        help="Render the output directories and print the commands, but don't run.",
+    )
+    cache_args(sweep_parser)
+
+    # Farm: Pack many runs into one allocation
+    farm_parser = subparsers.add_parser(
+        "farm",
+        help="Run a manifest of runs concurrently inside a single Slurm allocation.",
+        description=(
+            "Launch each run in a manifest as a job step within the current "
+            "allocation, starting the longest runs first and starting another "
+            "whenever cores are freed."
+        ),
+    )
+    farm_parser.add_argument(
+        "manifest",
+        type=Path,
+        help=(
+            "JSON lines file with one run per line, such as "
+            '{"output": "run_1", "nprocs": 4, "estimate": 3600}. Only "output" is '
+            "required. It may also give 'dims' and 'photons'. Outputs are relative "
+            "to the manifest. The 'sweep' subcommand writes a manifest."
+        ),
+    )
+    farm_parser.add_argument(
+        "-m",
+        "--launcher",
+        default="singularity",
+        choices=("singularity", "native"),
+        help=(
+            "Run each step in a Singularity container, or call the run_epoch command "
+            "directly. The default is singularity."
+        ),
+    )
+    container_arg(farm_parser, _CONTAINERS["singularity"])
+    cache_args(farm_parser)
+    farm_parser.add_argument(
+        "--step",
+        default="srun" if "SLURM_JOB_ID" in os.environ else "mpirun",
+        choices=("srun", "mpirun"),
+        help=(
+            "How to launch each step. Defaults to srun within a Slurm job, and mpirun "
+            "otherwise."
+        ),
+    )
+    farm_parser.add_argument(
+        "--exclusive",
+        action="store_true",
+        help="Use 'srun --exclusive' rather than '--exact', for Slurm before 21.08.",
+    )
+    farm_parser.add_argument(
+        "--cores",
+        default=int(os.environ.get("SLURM_NTASKS", os.cpu_count() or 1)),
+        type=int,
+        help="Total cores to share between runs. Defaults to the tasks in the job.",
+    )
+    farm_parser.add_argument(
+        "--poll",
+        default=0.5,
+        type=float,
+        help="Seconds between checks for finished runs. The default is 0.5.",
+    )
+    farm_parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Continue each run from its latest complete restart dump, if it has one.",
+    )
+    farm_parser.add_argument(
+        "--stage",
+        default=None,
+        help="Fast node-local directory in which to run each single node run.",
+    )
+    farm_parser.add_argument(
+        "--drain-interval",
+        default=10.0,
+        type=float,
+        help="Seconds between checks for finished dumps. The default is 10.",
+    )
+    farm_parser.add_argument(
+        "--compress",
+        default=None,
+        choices=["gzip", "bz2", "xz"],
+        help="Compress dumps once Epoch has finished writing them.",
+    )
+    farm_parser.add_argument(
+        "--keep-restarts",
+        default=None,
+        type=int,
+        help="Remove all but the latest this many restart dumps of each run.",
+    )
+    farm_parser.add_argument(
+        "--keep-every",
+        default=None,
+        type=int,
+        help="Remove other dumps unless their number is a multiple of this.",
+    )
+    farm_parser.add_argument(
+        "--analyse",
+        action="append",
+        default=None,
+        metavar="CALLBACK",
+        help="Python function to call with the path of each dump of each run.",
+    )
+    farm_parser.add_argument(
+        "--analysis-workers",
+        default=1,
+        type=int,
+        help="Number of processes running callbacks for each run. The default is 1.",
+    )
+    farm_parser.add_argument(
+        "--analysis-reserve",
+        default=0.2,
+        type=float,
+        help="Fraction of memory to leave for Epoch. The default is 0.2.",
+    )
+    farm_parser.add_argument(
+        "--history",
+        default=None,
+        type=Path,
+        help="SQLite database in which to record each run.",
+    )
+    farm_parser.add_argument(
+        "--no-run",
+        action="store_true",
+        help="Print the commands in the order they would start, but don't run.",
+    )
 
     return parser.parse_args()
 
 
-def docker_cmd(container: str, output: Path, dims: int, photons: bool) -> str:
+def run_epoch_args(args: Namespace) -> List[str]:
+    """Extra arguments passed to run_epoch inside the container."""
+    extra = []
+    if getattr(args, "progress", False):
+        extra.append("--progress")
+    if getattr(args, "metrics", None) is not None:
+        extra.append(f"--metrics /output/{args.metrics}")
+    if getattr(args, "resume", False):
+        extra.append("--resume")
+    if getattr(args, "sample_resources", False):
+        extra.append(f"--sample-resources --sample-interval {args.sample_interval}")
+    if getattr(args, "stage", None) is not None:
+        extra.append(f"--stage {args.stage} --drain-interval {args.drain_interval}")
+    if getattr(args, "compress", None) is not None:
+        extra.append(f"--compress {args.compress}")
+    if getattr(args, "keep_restarts", None) is not None:
+        extra.append(f"--keep-restarts {args.keep_restarts}")
+    if getattr(args, "keep_every", None) is not None:
+        extra.append(f"--keep-every {args.keep_every}")
+    for callback in getattr(args, "analyse", None) or []:
+        extra.append(f"--analyse {callback}")
+    if getattr(args, "analyse", None):
+        extra.append(
+            f"--analysis-workers {args.analysis_workers} "
+            f"--analysis-reserve {args.analysis_reserve}"
+        )
+    return extra
+
+
+def docker_cmd(
+    container: str,
+    output: Path,
+    dims: int,
+    photons: bool,
+    extra: Optional[List[str]] = None,
+) -> str:
     """Constructs the command to run Epoch via a Docker container."""
     return dedent(
         f"""\
@@ -161,14 +725,216 @@ def docker_cmd(container: str, output: Path, dims: int, photons: bool) -> str:
         -d {dims}
         -o /output
         {'--photons' if photons else ''}
+        {' '.join(extra or [])}
         """
     ).replace("\n", " ")
 
 
+class DockerPool:
+    """Long-lived Docker containers in which runs are started with 'docker exec'.
+
+    Creating and removing a container for every run adds a fixed cost, which is a
+    large part of a short run. Instead, up to ``size`` containers are started as
+    they are needed, with ``root`` mounted at the same path, and each run is started
+    in a free one. Before each run the container is checked, and replaced if it has
+    stopped. Containers left idle for ``idle_timeout`` seconds are removed, and the
+    rest when the pool is closed. Use as a context manager.
+
+    Parameters
+    ----------
+    container
+        The Docker image to run.
+    root
+        Directory containing the output directories of every run.
+    size
+        Most containers to run at once.
+    idle_timeout
+        Seconds after which an unused container is removed.
+    """
+
+    def __init__(
+        self, container: str, root: Path, size: int = 1, idle_timeout: float = 300.0
+    ) -> None:
+        self.container = container
+        self.root = Path(root).resolve()
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self.runs = 0
+        self.replaced = 0
+        self.start_seconds: List[float] = []
+        self.remove_seconds: List[float] = []
+        # Containers not running an Epoch, with the time they were last used
+        self._free: Dict[str, float] = {}
+        self._containers = 0
+        self._started = 0
+        self._condition = threading.Condition()
+        self._stop = threading.Event()
+        self._reaper = threading.Thread(target=self._reap, daemon=True)
+
+    def _start(self) -> str:
+        with self._condition:
+            self._started += 1
+            name = f"epoch-pool-{os.getpid()}-{self._started}"
+        start = time.perf_counter()
+        result = subprocess.run(
+            [
+                "docker",
+                "run",
+                "--detach",
+                "--rm",
+                "--name",
+                name,
+                "--label",
+                "epoch-pool",
+                "--volume",
+                f"{self.root}:{self.root}",
+                "--entrypoint",
+                "sleep",
+                self.container,
+                "infinity",
+            ],
+            capture_output=True,
+            text=True,
+        )
+        if result.returncode != 0:
+            raise OSError(f"Failed to start {self.container}: {result.stderr.strip()}")
+        self.start_seconds.append(time.perf_counter() - start)
+        return name
+
+    def _remove(self, name: str) -> None:
+        start = time.perf_counter()
+        subprocess.run(["docker", "rm", "--force", name], capture_output=True)
+        self.remove_seconds.append(time.perf_counter() - start)
+
+    def healthy(self, name: str) -> bool:
+        """Check that the container ``name`` is still running."""
+        result = subprocess.run(
+            ["docker", "inspect", "--format", "{{.State.Running}}", name],
+            capture_output=True,
+            text=True,
+        )
+        return result.returncode == 0 and result.stdout.strip() == "true"
+
+    @contextmanager
+    def acquire(self) -> Iterator[str]:
+        """Wait for a free, running container, starting one if there is room."""
+        with self._condition:
+            while not self._free and self._containers >= self.size:
+                self._condition.wait()
+            self.runs += 1
+            name: Optional[str] = None
+            if self._free:
+                # The most recently used, so that the others can time out
+                name = max(self._free, key=self._free.__getitem__)
+                del self._free[name]
+            else:
+                self._containers += 1
+        try:
+            if name is not None and not self.healthy(name):
+                print(f"Container {name} has stopped, replacing it")
+                self.replaced += 1
+                self._remove(name)
+                name = None
+            if name is None:
+                name = self._start()
+        except BaseException:
+            with self._condition:
+                self._containers -= 1
+                self._condition.notify()
+            raise
+        try:
+            yield name
+        finally:
+            with self._condition:
+                self._free[name] = time.monotonic()
+                self._condition.notify()
+
+    def exec_cmd(
+        self,
+        name: str,
+        output: Path,
+        dims: int,
+        photons: bool,
+        extra: Optional[List[str]] = None,
+    ) -> str:
+        """Constructs the command to run Epoch in the container ``name``."""
+        output = output.resolve()
+        if self.root != output and self.root not in output.parents:
+            raise ValueError(f"{output} is not within {self.root}")
+        return dedent(
+            f"""\
+            docker exec
+            --workdir {output}
+            {name}
+            run_epoch
+            -d {dims}
+            -o {output}
+            {'--photons' if photons else ''}
+            {' '.join(extra or [])}
+            """
+        ).replace("\n", " ")
+
+    def _reap(self) -> None:
+        while not self._stop.wait(self.idle_timeout / 4):
+            now = time.monotonic()
+            with self._condition:
+                idle = [
+                    name
+                    for name, used in self._free.items()
+                    if now - used > self.idle_timeout
+                ]
+                for name in idle:
+                    del self._free[name]
+                self._containers -= len(idle)
+                self._condition.notify_all()
+            for name in idle:
+                self._remove(name)
+
+    def report(self) -> str:
+        """Summarise the time saved by reusing containers."""
+        started = len(self.start_seconds)
+        cold = 0.0
+        if started:
+            cold = statistics.mean(self.start_seconds)
+        if self.remove_seconds:
+            cold += statistics.mean(self.remove_seconds)
+        reused = max(self.runs - started, 0)
+        return (
+            f"Ran {self.runs} runs in {started} warm containers "
+            f"({self.replaced} replaced). Starting and removing a container took "
+            f"{cold:.2f}s, which {reused} runs in reused containers each saved over "
+            f"'docker run', about {reused * cold:.1f}s in total"
+        )
+
+    def __enter__(self) -> "DockerPool":
+        self._reaper.start()
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self._stop.set()
+        self._reaper.join()
+        with self._condition:
+            names = list(self._free)
+            self._free.clear()
+            self._containers -= len(names)
+        for name in names:
+            self._remove(name)
+
+
 def singularity_cmd(
-    container: str, output: Path, dims: int, photons: bool, nprocs: int, srun: bool
+    container: str,
+    output: Path,
+    dims: int,
+    photons: bool,
+    nprocs: int,
+    srun: bool,
+    extra: Optional[List[str]] = None,
+    binding: Optional[List[str]] = None,
 ) -> str:
-    """Constructs the command to run Epoch via a Singularity container."""
+    """Constructs the command to run Epoch via a Singularity container.
+
+    ``binding`` are options placing ranks on cores, given to srun or mpirun.
+    """
     cmd = dedent(
         f"""\
         singularity exec
@@ -178,25 +944,453 @@ def singularity_cmd(
         -d {dims}
         -o /output
         {'--photons' if photons else ''}
+        {' '.join(extra or [])}
         """
     ).replace("\n", " ")
 
     run_mode: str
     if srun:
-        run_mode = "srun"
+        run_mode = " ".join(["srun", *(binding or [])])
     elif nprocs != 1:
-        run_mode = f"mpirun -n {nprocs}"
+        run_mode = " ".join(["mpirun", "-n", str(nprocs), *(binding or [])])
     else:
         run_mode = ""
 
     return f"{run_mode} {cmd}".strip()
 
 
+def rank_binding(args: Namespace) -> Optional[List[str]]:
+    """Options binding ranks to cores using ``args.bind_policy``, if any.
+
+    With ``args.no_run``, the core of each rank on this node is printed.
+    """
+    if args.bind_policy is None or (args.nprocs == 1 and not args.srun):
+        return None
+    step = "srun" if args.srun else "mpirun"
+    nprocs = args.nprocs
+    if args.srun and nprocs == 1:
+        # srun starts the tasks of the allocation, so bind those on this node
+        on_node = slurm_tasks_on_node()
+        if on_node is None:
+            print("Could not find the number of Slurm tasks on this node, not binding")
+            return None
+        nprocs = on_node
+    cores = read_topology()
+    mapped = rank_map(cores, nprocs, args.bind_policy, step)
+    if args.no_run:
+        print(format_rank_map(mapped, args.bind_policy))
+    return binding_options(cores, nprocs, args.bind_policy, step)
+
+
+def slurm_tasks_on_node() -> Optional[int]:
+    """Number of tasks in the Slurm allocation on this node, if known.
+
+    ``SLURM_TASKS_PER_NODE`` lists the tasks on each node, such as '4(x2),3' for four
+    tasks on each of two nodes and three on a third, and this node is found from
+    ``SLURM_NODEID``. Falls back to ``SLURM_NTASKS_PER_NODE``, which is only set with
+    ``--ntasks-per-node``.
+    """
+    counts: List[int] = []
+    for part in os.environ.get("SLURM_TASKS_PER_NODE", "").split(","):
+        match = re.fullmatch(r"(\d+)(?:\(x(\d+)\))?", part.strip())
+        if match is None:
+            counts = []
+            break
+        counts.extend([int(match[1])] * int(match[2] or 1))
+    if counts:
+        node = int(os.environ.get("SLURM_NODEID") or 0)
+        return counts[min(node, len(counts) - 1)]
+    per_node = os.environ.get("SLURM_NTASKS_PER_NODE", "")
+    return int(per_node) if per_node.isdigit() else None
+
+
+def parse_cpu_list(text: str) -> List[int]:
+    """Read a list of CPUs in the kernel's format, such as '0-3,8-11'."""
+    cpus: List[int] = []
+    for part in text.strip().split(","):
+        if not part:
+            continue
+        first, _, last = part.partition("-")
+        cpus.extend(range(int(first), int(last or first) + 1))
+    return cpus
+
+
+def read_topology(sysfs: Path = Path("/sys/devices/system")) -> List[Dict[str, Any]]:
+    """Find the physical cores of this machine, from sysfs.
+
+    Returns a dict for each core, with its ``socket``, NUMA ``node``, ``core`` id
+    and the ``cpus`` of its hardware threads, ordered by socket, node and first
+    CPU. Without NUMA information, each socket is its own node.
+    """
+    online = sysfs / "cpu" / "online"
+    if online.is_file():
+        cpus = parse_cpu_list(online.read_text())
+    else:
+        cpus = sorted(
+            int(path.name[3:])
+            for path in (sysfs / "cpu").glob("cpu[0-9]*")
+            if path.name[3:].isdigit()
+        )
+    nodes = {}
+    for path in (sysfs / "node").glob("node[0-9]*"):
+        if (path / "cpulist").is_file():
+            for cpu in parse_cpu_list((path / "cpulist").read_text()):
+                nodes[cpu] = int(path.name[4:])
+
+    cores: Dict[Tuple[int, int], Dict[str, Any]] = {}
+    for cpu in cpus:
+        topology = sysfs / "cpu" / f"cpu{cpu}" / "topology"
+        try:
+            socket = int((topology / "physical_package_id").read_text())
+            core_id = int((topology / "core_id").read_text())
+        except (OSError, ValueError):
+            socket, core_id = 0, cpu
+        # Core ids are only unique within a socket
+        core = cores.setdefault(
+            (socket, core_id),
+            dict(socket=socket, node=nodes.get(cpu, socket), core=core_id, cpus=[]),
+        )
+        core["cpus"].append(cpu)
+    return sorted(
+        cores.values(), key=lambda c: (c["socket"], c["node"], min(c["cpus"]))
+    )
+
+
+def rank_map(
+    cores: List[Dict[str, Any]], nprocs: int, policy: str, step: str = "mpirun"
+) -> List[Dict[str, Any]]:
+    """Find the core each rank is bound to by :func:`binding_options`.
+
+    'compact' fills each socket in turn, 'spread' places ranks round-robin on each
+    NUMA node (each socket, for srun), and 'socket' places an equal block of
+    consecutive ranks on each socket. Returns the core of each rank.
+    """
+    if nprocs > len(cores):
+        raise ValueError(f"Can't bind {nprocs} ranks to {len(cores)} cores")
+    if policy == "compact":
+        return cores[:nprocs]
+    key = "socket" if policy == "socket" or step == "srun" else "node"
+    domains: Dict[int, List[Dict[str, Any]]] = {}
+    for core in cores:
+        domains.setdefault(core[key], []).append(core)
+    groups = list(domains.values())
+    if policy == "spread":
+        mapped: List[Dict[str, Any]] = []
+        for layer in itertools.zip_longest(*groups):
+            mapped.extend(core for core in layer if core is not None)
+        return mapped[:nprocs]
+    if policy == "socket":
+        per_socket = -(-nprocs // len(groups))
+        if per_socket > min(len(group) for group in groups):
+            raise ValueError(
+                f"Can't place {per_socket} ranks on each of {len(groups)} sockets"
+            )
+        return [core for group in groups for core in group[:per_socket]][:nprocs]
+    raise ValueError(f"Unknown binding policy {policy}")
+
+
+def binding_options(
+    cores: List[Dict[str, Any]], nprocs: int, policy: str, step: str = "mpirun"
+) -> List[str]:
+    """Options binding each rank to a core, for mpirun (OpenMPI 4.1) or srun."""
+    sockets = len({core["socket"] for core in cores})
+    per_socket = -(-nprocs // sockets)
+    if step == "srun":
+        distribution = dict(compact="block:block", spread="block:cyclic")
+        if policy == "socket":
+            return [
+                "--cpu-bind=cores",
+                "--distribution=block:block",
+                f"--ntasks-per-socket={per_socket}",
+            ]
+        return ["--cpu-bind=cores", f"--distribution={distribution[policy]}"]
+    mapping = dict(compact="core", spread="numa", socket=f"ppr:{per_socket}:socket")
+    return ["--map-by", mapping[policy], "--bind-to", "core"]
+
+
+def format_rank_map(mapped: List[Dict[str, Any]], policy: str) -> str:
+    """Tabulate the core, socket, NUMA node and CPUs of each rank."""
+    sockets = len({core["socket"] for core in mapped})
+    nodes = len({core["node"] for core in mapped})
+    rows = [["rank", "socket", "node", "core", "cpus"]]
+    for rank, core in enumerate(mapped):
+        cpus = ",".join(str(cpu) for cpu in core["cpus"])
+        rows.append(
+            [str(rank), str(core["socket"]), str(core["node"]), str(core["core"]), cpus]
+        )
+    widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+    lines = [
+        f"Binding {len(mapped)} ranks with the {policy} policy, using {sockets} "
+        f"sockets and {nodes} NUMA nodes:"
+    ]
+    for row in rows:
+        lines.append("  ".join(c.ljust(w) for c, w in zip(row, widths)).rstrip())
+    return "\n".join(lines)
+
+
 def pull_cmd(container: str, output: Path) -> str:
     """Constructs the command to pull to a local Singularity image."""
     return f"singularity pull {output} {container}"
 
 
+def split_reference(container: str) -> Tuple[str, str, str, str]:
+    """Split an image URI into its scheme, registry, repository and tag.
+
+    For example, 'oras://ghcr.io/plasmafair/epoch.sif:latest' gives 'oras',
+    'ghcr.io', 'plasmafair/epoch.sif' and 'latest'. Images without a registry are
+    taken from Docker Hub.
+    """
+    scheme, sep, rest = container.partition("://")
+    if not sep:
+        raise ValueError(f"Not an image URI: {container}")
+    name, tag = rest, "latest"
+    if ":" in rest.rsplit("/", 1)[-1]:
+        name, _, tag = rest.rpartition(":")
+    registry, _, repository = name.partition("/")
+    if not repository or not re.search(r"[.:]|^localhost$", registry):
+        registry = "registry-1.docker.io"
+        repository = name if "/" in name else f"library/{name}"
+    return scheme, registry, repository, tag
+
+
+def pinned(container: str, digest: str) -> str:
+    """Refer to an image by ``digest``, in place of its tag."""
+    name = container.partition("@")[0]
+    if ":" in name.rsplit("/", 1)[-1]:
+        name = name.rpartition(":")[0]
+    return f"{name}@{digest}"
+
+
+def registry_digest(container: str, timeout: float = 30.0) -> str:
+    """Ask the registry of an 'oras://' or 'docker://' image for the digest of its tag.
+
+    Anonymous tokens are requested from registries that need them, such as ghcr.io.
+    """
+    scheme, registry, repository, tag = split_reference(container)
+    if scheme not in ("oras", "docker"):
+        raise ValueError(f"Can't resolve the digests of {scheme}:// images")
+    url = f"https://{registry}/v2/{repository}/manifests/{tag}"
+    headers = {"Accept": _MANIFEST_TYPES}
+    try:
+        response = urlopen(
+            Request(url, headers=headers, method="HEAD"), timeout=timeout
+        )
+    except HTTPError as exc:
+        if exc.code != 401:
+            raise
+        challenge = dict(
+            re.findall(r'(\w+)="([^"]*)"', exc.headers["WWW-Authenticate"])
+        )
+        query = {
+            key: challenge[key] for key in ("service", "scope") if key in challenge
+        }
+        with urlopen(f"{challenge['realm']}?{urlencode(query)}", timeout=timeout) as f:
+            token = json.load(f)
+        headers[
+            "Authorization"
+        ] = f"Bearer {token.get('token', token.get('access_token'))}"
+        response = urlopen(
+            Request(url, headers=headers, method="HEAD"), timeout=timeout
+        )
+    with response:
+        digest = response.headers.get("Docker-Content-Digest")
+    if not digest:
+        raise ValueError(f"{registry} didn't give the digest of {container}")
+    return digest
+
+
+@contextmanager
+def file_lock(path: Path) -> Iterator[None]:
+    """Hold an exclusive lock on ``path``, waiting for other processes to release it.
+
+    The file system must support ``flock``, as local and most shared ones do.
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with path.open("a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class ImageCache:
+    """Singularity images shared between jobs, named by the digest of their tag.
+
+    Each tag is resolved to a digest at most once every ``ttl`` seconds, and the
+    image is pulled by digest, so jobs started together all use the same image
+    even if the tag moves. Jobs needing the same image wait for one of them to pull
+    it, and images are renamed into place once complete. Once the cache holds more
+    than ``max_bytes``, the images used least recently are removed, other than
+    those used within ``ttl`` seconds.
+
+    Parameters
+    ----------
+    directory
+        Shared directory in which to keep images.
+    max_bytes
+        Size above which to remove images. If ``None``, images are never removed.
+    ttl
+        Seconds for which a resolved digest is trusted.
+    """
+
+    index_name = "index.json"
+
+    def __init__(
+        self, directory: Path, max_bytes: Optional[float] = None, ttl: float = 3600.0
+    ) -> None:
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+
+    def _read_index(self) -> Dict[str, Any]:
+        try:
+            return json.loads((self.directory / self.index_name).read_text())
+        except (OSError, ValueError):
+            return {}
+
+    def _write_index(self, index: Dict[str, Any]) -> None:
+        path = self.directory / self.index_name
+        partial = path.with_name(f".{path.name}.{os.getpid()}")
+        partial.write_text(json.dumps(index, indent=1))
+        os.replace(partial, path)
+
+    def _record(self, container: str, digest: str) -> None:
+        # Called with the index locked
+        index = self._read_index()
+        index[container] = dict(digest=digest, resolved=time.time())
+        self._write_index(index)
+
+    def digest(self, container: str, refresh: bool = False) -> Optional[str]:
+        """Find the digest of ``container``, asking its registry if need be.
+
+        If the registry can't be reached, the last digest found is used. Returns
+        ``None`` if there isn't one.
+        """
+        if "@" in container:
+            return container.rpartition("@")[2]
+        with file_lock(self.directory / ".index.lock"):
+            entry = self._read_index().get(container)
+            if entry and not refresh and time.time() - entry["resolved"] < self.ttl:
+                return entry["digest"]
+            try:
+                digest = registry_digest(container)
+            except (OSError, ValueError, KeyError) as exc:
+                if entry:
+                    print(
+                        f"Couldn't resolve {container}, using {entry['digest']}: {exc}"
+                    )
+                    return entry["digest"]
+                print(f"Couldn't resolve {container}: {exc}")
+                return None
+            self._record(container, digest)
+            return digest
+
+    def path(self, digest: str) -> Path:
+        """Location of the image with ``digest``."""
+        return self.directory / f"{digest.replace(':', '-')}.sif"
+
+    def _pull(self, source: str, destination: Path) -> None:
+        partial = destination.with_name(
+            f".{destination.name}.{os.getpid()}.{threading.get_ident()}.part"
+        )
+        result = subprocess.run(["singularity", "pull", str(partial), source])
+        if result.returncode != 0 or not partial.is_file():
+            partial.unlink(missing_ok=True)
+            raise OSError(f"Failed to pull {source}")
+        os.replace(partial, destination)
+
+    def image(self, container: str, refresh: bool = False) -> Path:
+        """Find ``container`` in the cache, pulling it first if it isn't there."""
+        digest = self.digest(container, refresh)
+        if digest is not None:
+            path = self.path(digest)
+            with file_lock(self.directory / ".locks" / path.name):
+                if not path.is_file():
+                    print(f"Pulling {container} to {path}")
+                    self._pull(pinned(container, digest), path)
+        else:
+            # Without a digest, pull the tag and name the image by its contents
+            key = hashlib.sha256(container.encode()).hexdigest()[:16]
+            with file_lock(self.directory / ".locks" / f"tag-{key}"):
+                # Another job may have pulled it while this one waited
+                entry = self._read_index().get(container)
+                if entry and self.path(entry["digest"]).is_file():
+                    path = self.path(entry["digest"])
+                else:
+                    pulled = self.directory / f".tag-{key}.sif"
+                    self._pull(container, pulled)
+                    contents = hashlib.sha256()
+                    with pulled.open("rb") as f:
+                        while chunk := f.read(16 * 1024**2):
+                            contents.update(chunk)
+                    digest = f"sha256:{contents.hexdigest()}"
+                    path = self.path(digest)
+                    os.replace(pulled, path)
+                    with file_lock(self.directory / ".index.lock"):
+                        self._record(container, digest)
+        os.utime(path)
+        self.evict()
+        return path
+
+    def evict(self) -> List[Path]:
+        """Remove the images used least recently until the cache fits. Returns them.
+
+        Partial downloads left for more than a day are also removed.
+        """
+        now = time.time()
+        for partial in self.directory.glob(".*.part"):
+            if now - partial.stat().st_mtime > 86400:
+                partial.unlink(missing_ok=True)
+        if self.max_bytes is None:
+            return []
+        images = sorted(
+            (path.stat().st_mtime, path.stat().st_size, path)
+            for path in self.directory.glob("sha256-*.sif")
+        )
+        total = sum(size for _, size, _ in images)
+        removed = []
+        for used, size, path in images:
+            if total <= self.max_bytes:
+                break
+            if now - used < self.ttl:
+                continue
+            with file_lock(self.directory / ".locks" / path.name):
+                path.unlink(missing_ok=True)
+            total -= size
+            removed.append(path)
+            print(f"Removed {path.name} from the image cache")
+        return removed
+
+
+def pull(args: Namespace) -> int:
+    """Pull an image, into the image cache if one is chosen. Returns an exit code."""
+    cache = image_cache(args)
+    if cache is None:
+        return run_cmd(pull_cmd(args.container, args.output or Path("epoch.sif"))) or 0
+    path = cache.image(args.container, refresh=args.refresh)
+    print(f"Cached {args.container} at {path}")
+    if args.output is not None:
+        args.output.unlink(missing_ok=True)
+        args.output.symlink_to(path.resolve())
+    return 0
+
+
+def image_cache(args: Namespace) -> Optional[ImageCache]:
+    """The image cache chosen on the command line, if any."""
+    if getattr(args, "image_cache", None) is None:
+        return None
+    return ImageCache(Path(args.image_cache), args.cache_size * 1024**3)
+
+
+def cached_container(args: Namespace, container: str) -> str:
+    """Replace a remote image with its copy in the image cache, if there is one."""
+    cache = image_cache(args)
+    if cache is None or "://" not in container or getattr(args, "no_run", False):
+        return container
+    return str(cache.image(container, refresh=args.refresh))
+
+
 def shell_cmd(container: str, python: bool, cmd: Optional[str] = None) -> str:
     """Construct the command to open a shell in a Singularity container."""
     if python:
@@ -207,7 +1401,7 @@ def shell_cmd(container: str, python: bool, cmd: Optional[str] = None) -> str:
 
 
 def prompt_output(output: Optional[Path]) -> Path:
-    """If output is None, prompt the user to supply it. 
+    """If output is None, prompt the user to supply it.
 
     Otherwise return unchanged.
     Allows the user to run the code using ``echo output_dir | run_epoch.py``.
@@ -215,38 +1409,701 @@ def prompt_output(output: Optional[Path]) -> Path:
     return Path(input("Please enter output directory:\n")) if output is None else output
 
 
-def run_cmd(cmd: str, no_run: bool = False) -> None:
-    """Execute ``cmd`` in a subprocess, or just print ``no_run`` is ``True``."""
+def parse_time_limit(text: str) -> float:
+    """Convert a time limit in seconds, or in Slurm's format, to seconds.
+
+    Slurm accepts 'minutes', 'minutes:seconds', 'hours:minutes:seconds', and
+    'days-hours', 'days-hours:minutes' or 'days-hours:minutes:seconds'.
+    """
+    try:
+        return float(text)
+    except ValueError:
+        pass
+    match = re.match(r"^(?:(\d+)-)?(\d+(?::\d+){0,2})$", text.strip())
+    if match is None:
+        raise ValueError(f"Unrecognised time limit: {text}")
+    parts = [int(part) for part in match[2].split(":")]
+    if match[1] is not None:
+        hours, minutes, seconds = [*parts, 0, 0][:3]
+        return ((int(match[1]) * 24 + hours) * 60 + minutes) * 60.0 + seconds
+    if len(parts) == 3:
+        return (parts[0] * 60 + parts[1]) * 60.0 + parts[2]
+    return parts[0] * 60.0 + (parts[1] if len(parts) == 2 else 0)
+
+
+class GracefulStop:
+    """Asks Epoch to write a restart dump and stop before it is killed.
+
+    While active, SIGTERM, SIGUSR1 and SIGUSR2, or a timer firing ``grace`` seconds
+    before ``walltime``, create Epoch's stop file in ``output``. The stop file is
+    removed on entry and exit, so that it can't stop a later run. Matches
+    epoch_containers.shutdown.
+    """
+
+    signals = (signal.SIGTERM, signal.SIGUSR1, signal.SIGUSR2)
+
+    def __init__(
+        self, output: Path, walltime: Optional[float] = None, grace: float = 300.0
+    ) -> None:
+        self.stop_file = output / _STOP_FILE
+        self.walltime = walltime
+        self.grace = grace
+        self.reason: Optional[str] = None
+        self._timer: Optional[threading.Timer] = None
+        self._handlers: Dict[int, Any] = {}
+
+    def stop(self, reason: str) -> None:
+        """Create the stop file, if it hasn't been already."""
+        if self.reason is None:
+            self.reason = reason
+            print(f"Asking Epoch to stop after {reason}", flush=True)
+            self.stop_file.touch()
+
+    def __enter__(self) -> "GracefulStop":
+        if self.stop_file.exists():
+            self.stop_file.unlink()
+        for signum in self.signals:
+            self._handlers[signum] = signal.signal(
+                signum, lambda s, _: self.stop(f"signal {signal.Signals(s).name}")
+            )
+        if self.walltime is not None:
+            delay = max(self.walltime - self.grace, 0.0)
+            self._timer = threading.Timer(delay, self.stop, args=("walltime",))
+            self._timer.daemon = True
+            self._timer.start()
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+        for signum, handler in self._handlers.items():
+            signal.signal(signum, handler)
+        if self.stop_file.exists():
+            self.stop_file.unlink()
+
+
+def run_cmd(
+    cmd: str, no_run: bool = False, stop: Optional[GracefulStop] = None
+) -> Optional[int]:
+    """Execute ``cmd`` in a subprocess, or just print ``no_run`` is ``True``.
+
+    If ``stop`` is given, Epoch is asked to stop gracefully on a signal or when the
+    walltime runs out. Returns the exit code of the subprocess, or ``None`` if it
+    wasn't run.
+    """
     if no_run:
         print(f"Generated the command:\n{cmd}")
+        return None
+    print(f"Running with the command:\n{cmd}")
+    if stop is None:
+        return subprocess.run(cmd.split()).returncode
+    with stop:
+        return subprocess.run(cmd.split()).returncode
+
+
+def requeue_job() -> bool:
+    """Requeue the current Slurm job. Returns ``True`` on success."""
+    job = os.environ.get("SLURM_JOB_ID")
+    if job is None:
+        print("Not running under Slurm, so can't requeue")
+        return False
+    return subprocess.run(["scontrol", "requeue", job]).returncode == 0
+
+
+def container_identity(mode: str, container: str) -> str:
+    """Identify the image used for a run, including its digest where available."""
+    if mode == "docker":
+        result = subprocess.run(
+            ["docker", "image", "inspect", "--format", "{{.Id}}", container],
+            capture_output=True,
+            text=True,
+        )
+        if result.returncode == 0 and result.stdout.strip():
+            return f"{container}@{result.stdout.strip()}"
+    elif Path(container).is_file():
+        stat = Path(container).stat()
+        return f"{Path(container).resolve()}@{stat.st_size}:{int(stat.st_mtime)}"
+    return container
+
+
+def record_run(
+    db: Path,
+    args: Namespace,
+    output: Path,
+    start: float,
+    end: float,
+    exit_status: int,
+    metrics: Optional[dict] = None,
+) -> None:
+    """Append a run to the history database, creating it if needed."""
+    deck = output / "input.deck"
+    deck_hash = hashlib.sha256(deck.read_bytes()).hexdigest() if deck.is_file() else ""
+    row = (
+        deck_hash,
+        str(output.resolve()),
+        args.mode,
+        container_identity(args.mode, args.container),
+        json.dumps(
+            ["-d", str(args.dims), "-o", str(output)]
+            + (["--photons"] if args.photons else [])
+        ),
+        args.dims,
+        int(args.photons),
+        getattr(args, "nprocs", 1),
+        start,
+        end,
+        exit_status,
+        json.dumps(metrics or {}),
+    )
+    db.parent.mkdir(parents=True, exist_ok=True)
+    with closing(sqlite3.connect(str(db), timeout=30)) as connection, connection:
+        connection.execute(_HISTORY_SCHEMA)
+        connection.execute(
+            "INSERT INTO runs (deck_hash, output, launcher, identity, args, dims, "
+            "photons, nprocs, start_time, end_time, exit_status, metrics) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            row,
+        )
+
+
+def query_runs(db: Path) -> List[sqlite3.Row]:
+    """Read all runs from the history database in the order they started."""
+    with closing(sqlite3.connect(str(db), timeout=30)) as connection:
+        connection.execute(_HISTORY_SCHEMA)
+        connection.row_factory = sqlite3.Row
+        return connection.execute(
+            "SELECT * FROM runs ORDER BY start_time, id"
+        ).fetchall()
+
+
+def find_regressions(
+    runs: List[sqlite3.Row], tolerance: float = 0.1, min_history: int = 3
+) -> List[tuple]:
+    """Find runs that were slower than the median of earlier runs of the same deck.
+
+    Runs are only compared with earlier successful runs of the same deck, number of
+    dimensions, QED setting and process count. Returns pairs of ``(run, median)``.
+    """
+    history: dict = {}
+    regressions = []
+    for run in runs:
+        if run["exit_status"] != 0 or not run["deck_hash"]:
+            continue
+        key = (run["deck_hash"], run["dims"], run["photons"], run["nprocs"])
+        previous = history.setdefault(key, [])
+        duration = run["end_time"] - run["start_time"]
+        if len(previous) >= min_history:
+            median = statistics.median(previous)
+            if duration > median * (1 + tolerance):
+                regressions.append((run, median))
+        previous.append(duration)
+    return regressions
+
+
+def history(args: Namespace) -> int:
+    """Print the run history, or regressions within it. Returns an exit code."""
+    runs = query_runs(args.db)
+    if args.command == "list":
+        for run in runs:
+            print(
+                f"{run['id']:>5} {run['deck_hash'][:12]:12} {run['launcher']:11} "
+                f"{run['dims']}d{' photons' if run['photons'] else ''} "
+                f"n={run['nprocs']} {run['end_time'] - run['start_time']:10.2f}s "
+                f"exit={run['exit_status']} {run['identity']}"
+            )
+        return 0
+    regressions = find_regressions(runs, args.tolerance, args.min_history)
+    for run, median in regressions:
+        duration = run["end_time"] - run["start_time"]
+        print(
+            f"Run {run['id']} of deck {run['deck_hash'][:12]} took {duration:.2f}s, "
+            f"{duration / median:.2f}x the median of {median:.2f}s "
+            f"({run['identity']})"
+        )
+    if not regressions:
+        print("No regressions found")
+    return 1 if regressions else 0
+
+
+def last_metrics(path: Path) -> dict:
+    """Read the last throughput written to a metrics file, if there is one."""
+    if not path.is_file():
+        return {}
+    lines = path.read_text().splitlines()
+    try:
+        return json.loads(lines[-1]) if lines else {}
+    except json.JSONDecodeError:
+        return {}
+
+
+def launch(cmd: str, args: Namespace, output: Path) -> int:
+    """Run an Epoch command, recording it in the history database if requested.
+
+    Returns an exit code for this script: that of the command, or 128 plus the
+    signal number if it was killed, as a shell would give. Zero if not run.
+    """
+    stop = None
+    if getattr(args, "graceful", False) or getattr(args, "walltime", None) is not None:
+        stop = GracefulStop(output, args.walltime, args.grace)
+    start = time.time()
+    exit_status = run_cmd(cmd, no_run=args.no_run, stop=stop)
+    if stop is not None and stop.reason is not None:
+        print(f"Epoch stopped early after {stop.reason}")
+        if args.requeue:
+            requeue_job()
+    if exit_status is not None and args.history is not None:
+        metrics = {}
+        if getattr(args, "metrics", None) is not None:
+            metrics = last_metrics(output / args.metrics)
+        summary = output / "resources" / "summary.json"
+        if getattr(args, "sample_resources", False) and summary.is_file():
+            metrics["resources"] = json.loads(summary.read_text())["aggregate"]
+        record_run(args.history, args, output, start, time.time(), exit_status, metrics)
+    if exit_status is None:
+        return 0
+    return 128 - exit_status if exit_status < 0 else exit_status
+
+
+def set_deck_values(text: str, block: str, values: Dict[str, Any]) -> str:
+    """Set ``key = value`` assignments in the first ``block`` of an input deck.
+
+    Existing assignments are replaced, and new ones are added at the end of the
+    block. If the block doesn't exist, it is appended to the deck.
+    """
+    remaining = {key.lower(): (key, value) for key, value in values.items()}
+    lines: List[str] = []
+    in_block = done = False
+    for line in text.splitlines(keepends=True):
+        begin = re.match(r"^\s*begin\s*:\s*(\w+)", line, re.IGNORECASE)
+        key = re.match(r"^\s*([\w.]+)\s*=", line)
+        if not done and begin:
+            in_block = begin[1].lower() == block.lower()
+        elif in_block and re.match(r"^\s*end\s*:", line, re.IGNORECASE):
+            lines.extend(f"  {k} = {v}\n" for k, v in remaining.values())
+            remaining, in_block, done = {}, False, True
+        elif in_block and key and key[1].lower() in remaining:
+            name, value = remaining.pop(key[1].lower())
+            line = f"  {name} = {value}\n"
+        lines.append(line)
+    if remaining:
+        body = "".join(f"  {k} = {v}\n" for k, v in remaining.values())
+        lines.append(f"\nbegin:{block}\n{body}end:{block}\n")
+    return "".join(lines)
+
+
+def deck_dims(text: str) -> int:
+    """Infer the number of dimensions of a deck from its grid size."""
+    for dims, key in ((3, "nz"), (2, "ny"), (1, "nx")):
+        if re.search(rf"^\s*{key}\s*=", text, re.IGNORECASE | re.MULTILINE):
+            return dims
+    raise ValueError("Could not find grid size in control block")
+
+
+def sweep_grid(params: List[str], grid: Optional[Path] = None) -> Dict[str, List[str]]:
+    """Read the values of each parameter from ``--param`` and ``--grid``."""
+    values: Dict[str, List[str]] = {}
+    if grid is not None:
+        for name, choices in json.loads(grid.read_text()).items():
+            values[name] = [str(choice) for choice in choices]
+    for param in params:
+        name, sep, choices = param.partition("=")
+        if not sep or not choices:
+            raise ValueError(f"Parameters should be 'block.key=v1,v2,...', not {param}")
+        values[name.strip()] = [choice.strip() for choice in choices.split(",")]
+    return values
+
+
+def sweep_points(values: Dict[str, List[str]]) -> List[Dict[str, str]]:
+    """Every combination of parameter values, in a stable order."""
+    names = list(values)
+    return [dict(zip(names, point)) for point in itertools.product(*values.values())]
+
+
+def point_name(point: Dict[str, str]) -> str:
+    """Name of the output directory of a point, from a hash of its parameters.
+
+    The name doesn't depend on the order of the parameters, or on the other points
+    in the sweep, so adding values to a sweep doesn't move existing points.
+    """
+    params = json.dumps(point, sort_keys=True)
+    return f"point_{hashlib.sha256(params.encode()).hexdigest()[:12]}"
+
+
+def render_deck(template: str, point: Dict[str, str]) -> str:
+    """Set the parameters of a point in a template deck."""
+    blocks: Dict[str, Dict[str, str]] = {}
+    for name, value in point.items():
+        block, _, key = name.rpartition(".")
+        blocks.setdefault(block or "control", {})[key] = value
+    for block, values in blocks.items():
+        template = set_deck_values(template, block, values)
+    return template
+
+
+def sweep_cmd(args: Namespace, output: Path, dims: int) -> str:
+    """Constructs the command to run a single point of a sweep."""
+    if args.launcher == "docker":
+        if args.nprocs != 1:
+            raise ValueError("Docker mode only supports a single process")
+        container = args.container or _CONTAINERS["docker"]
+        return docker_cmd(container, output, dims, args.photons)
+    if args.launcher == "singularity":
+        container = args.container or _CONTAINERS["singularity"]
+        return singularity_cmd(
+            container, output, dims, args.photons, args.nprocs, srun=False
+        )
+    mpirun = f"mpirun -n {args.nprocs} " if args.nprocs != 1 else ""
+    photons = " --photons" if args.photons else ""
+    return f"{mpirun}run_epoch -d {dims} -o {output.resolve()}{photons}"
+
+
+def run_logged(cmd: str, log: Path) -> int:
+    """Execute ``cmd``, writing its output to ``log``. Returns the exit code."""
+    with log.open("w") as f:
+        f.write(f"{cmd}\n")
+        f.flush()
+        return subprocess.run(
+            cmd.split(), stdout=f, stderr=subprocess.STDOUT
+        ).returncode
+
+
+def run_point(
+    args: Namespace,
+    output: Path,
+    point: Dict[str, str],
+    pool: Optional[DockerPool] = None,
+) -> Dict[str, Any]:
+    """Run a single point of a sweep, retrying if it fails.
+
+    A '.done' file is written to ``output`` on success, and points that already have
+    one are skipped. If ``pool`` is given, each attempt runs in one of its containers.
+    """
+    result: Dict[str, Any] = dict(point=output.name, params=point, attempts=0)
+    done = output / ".done"
+    if done.is_file():
+        return dict(result, status="skipped", **json.loads(done.read_text()))
+    dims = args.dims or deck_dims((output / "input.deck").read_text())
+    cmd = sweep_cmd(args, output, dims)
+    if args.no_run:
+        print(f"{output.name}: {cmd}")
+        return dict(result, status="not run", exit_status=None, seconds=0.0)
+
+    exit_status = -1
+    start = time.time()
+    for attempt in range(1, args.retries + 2):
+        result["attempts"] = attempt
+        start = time.time()
+        if pool is None:
+            exit_status = run_logged(cmd, output / "run.log")
+        else:
+            with pool.acquire() as name:
+                exec_cmd = pool.exec_cmd(name, output, dims, args.photons)
+                exit_status = run_logged(exec_cmd, output / "run.log")
+        if args.history is not None:
+            run_args = Namespace(
+                mode=args.launcher,
+                container=args.container or _CONTAINERS.get(args.launcher, "run_epoch"),
+                dims=dims,
+                photons=args.photons,
+                nprocs=args.nprocs,
+            )
+            record_run(args.history, run_args, output, start, time.time(), exit_status)
+        if exit_status == 0:
+            break
+    seconds = time.time() - start
+    result.update(exit_status=exit_status, seconds=seconds)
+    if exit_status == 0:
+        done.write_text(json.dumps(dict(exit_status=0, seconds=seconds)))
+        result["status"] = "done"
     else:
-        print(f"Running with the command:\n{cmd}")
-        subprocess.run(cmd.split())
+        result["status"] = "failed"
+    print(f"{output.name}: {result['status']} after {result['attempts']} attempt(s)")
+    return result
+
+
+def sweep(args: Namespace) -> int:
+    """Run every point of a parameter sweep concurrently. Returns an exit code.
+
+    Runs are scheduled so that no more than ``args.cores`` cores are in use, with
+    ``args.nprocs`` cores for each run. A new run starts as soon as one finishes.
+    """
+    template = args.template / "input.deck" if args.template.is_dir() else args.template
+    text = template.read_text()
+    points = sweep_points(sweep_grid(args.param, args.grid))
+    if args.nprocs > args.cores:
+        raise ValueError(
+            f"Each run needs {args.nprocs} cores, but only {args.cores} given"
+        )
+
+    outputs = []
+    for point in points:
+        output = args.output / point_name(point)
+        output.mkdir(parents=True, exist_ok=True)
+        # Don't touch a finished point, in case the template changed
+        if not (output / ".done").is_file():
+            (output / "input.deck").write_text(render_deck(text, point))
+            (output / "params.json").write_text(json.dumps(point, indent=2))
+        outputs.append(output)
+    # Allows the same points to be run later with the 'farm' subcommand
+    with (args.output / "manifest.jsonl").open("w") as f:
+        for output in outputs:
+            entry = dict(output=output.name, nprocs=args.nprocs, photons=args.photons)
+            f.write(json.dumps(entry) + "\n")
+
+    workers = max(1, args.cores // args.nprocs)
+    print(f"Running {len(points)} points, {workers} at a time")
+    docker_pool = None
+    if getattr(args, "warm", False) and not args.no_run:
+        if args.launcher != "docker":
+            raise ValueError("--warm is only supported by the docker launcher")
+        container = args.container or _CONTAINERS["docker"]
+        docker_pool = DockerPool(container, args.output, workers, args.idle_timeout)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        with docker_pool or nullcontext():
+            results = list(
+                pool.map(
+                    lambda x: run_point(args, x[0], x[1], docker_pool),
+                    zip(outputs, points),
+                )
+            )
+    if docker_pool is not None:
+        print(docker_pool.report())
+
+    rows = sweep_rows(results)
+    widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+    for row in rows:
+        print("  ".join(c.ljust(w) for c, w in zip(row, widths)).rstrip())
+    with (args.output / "summary.csv").open("w", newline="") as f:
+        csv.writer(f).writerows(rows)
+    return 1 if any(result["status"] == "failed" for result in results) else 0
+
+
+def sweep_rows(results: List[Dict[str, Any]]) -> List[List[str]]:
+    """Tabulate the results of a sweep, including a header row."""
+    names = list(results[0]["params"]) if results else []
+    rows = [["point", *names, "status", "attempts", "seconds"]]
+    for result in results:
+        rows.append(
+            [
+                result["point"],
+                *result["params"].values(),
+                result["status"],
+                str(result["attempts"]),
+                f"{result.get('seconds', 0.0):.2f}",
+            ]
+        )
+    return rows
+
+
+def read_manifest(manifest: Path) -> List[Dict[str, Any]]:
+    """Read the runs in a farm manifest, filling in defaults.
+
+    Blank lines and lines starting with '#' are ignored.
+    """
+    runs = []
+    for line in manifest.read_text().splitlines():
+        if not line.strip() or line.lstrip().startswith("#"):
+            continue
+        run = json.loads(line)
+        output = manifest.parent / run["output"]
+        run["output"] = output
+        run.setdefault("nprocs", 1)
+        run.setdefault("photons", False)
+        run.setdefault("estimate", None)
+        if run.get("dims") is None:
+            run["dims"] = deck_dims((output / "input.deck").read_text())
+        runs.append(run)
+    return runs
+
+
+def farm_order(runs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Sort runs so that the longest start first.
+
+    Runs are ordered by estimated duration, and then by size, as larger runs are
+    harder to fit in later. Otherwise the order of the manifest is kept.
+    """
+    return sorted(runs, key=lambda run: (-(run["estimate"] or 0), -run["nprocs"]))
+
+
+def farm_cmd(args: Namespace, run: Dict[str, Any]) -> str:
+    """Constructs the command to run one job step of a farm."""
+    output, nprocs = run["output"], run["nprocs"]
+    extra = run_epoch_args(args)
+    if args.launcher == "singularity":
+        # Without srun or mpirun, this is a single copy of the container command
+        cmd = singularity_cmd(
+            args.container, output, run["dims"], run["photons"], 1, False, extra
+        )
+    else:
+        photons = " --photons" if run["photons"] else ""
+        cmd = f"run_epoch -d {run['dims']} -o {output.resolve()}{photons}"
+        cmd = " ".join([cmd, *extra])
+    if args.step == "srun":
+        placement = "--exclusive" if args.exclusive else "--exact"
+        return f"srun {placement} --ntasks={nprocs} --cpus-per-task=1 {cmd}"
+    # Concurrent mpiruns would otherwise all bind to the first cores
+    return f"mpirun -n {nprocs} --bind-to none {cmd}"
+
+
+def start_step(args: Namespace, run: Dict[str, Any]) -> Dict[str, Any]:
+    """Start one run of a farm in the background, logging to 'run.log'.
+
+    If the command can't be started, the run is finished straight away as failed,
+    with the exit code a shell would give.
+    """
+    cmd = farm_cmd(args, run)
+    log = (run["output"] / "run.log").open("w")
+    log.write(f"{cmd}\n")
+    log.flush()
+    start = time.time()
+    try:
+        process = subprocess.Popen(cmd.split(), stdout=log, stderr=subprocess.STDOUT)
+    except OSError as exc:
+        log.write(f"{exc}\n")
+        print(f"{run['output'].name}: could not start: {exc}")
+        exit_status = 127 if isinstance(exc, FileNotFoundError) else 126
+        return finish_step(args, dict(run, log=log, start=start), exit_status)
+    print(f"{run['output'].name}: started on {run['nprocs']} cores")
+    return dict(run, process=process, log=log, start=start)
+
+
+def finish_step(
+    args: Namespace, step: Dict[str, Any], exit_status: Optional[int] = None
+) -> Dict[str, Any]:
+    """Record the exit code of a finished run of a farm.
+
+    The exit code is taken from the run's process, unless ``exit_status`` is given.
+    """
+    end = time.time()
+    step["log"].close()
+    output = step["output"]
+    if exit_status is None:
+        exit_status = step["process"].returncode
+    seconds = end - step["start"]
+    (output / "exit_code").write_text(f"{exit_status}\n")
+    if exit_status == 0:
+        done = json.dumps(dict(exit_status=0, seconds=seconds))
+        (output / ".done").write_text(done)
+    if args.history is not None:
+        run_args = Namespace(
+            mode=f"farm-{args.launcher}",
+            container=args.container,
+            dims=step["dims"],
+            photons=step["photons"],
+            nprocs=step["nprocs"],
+        )
+        record_run(args.history, run_args, output, step["start"], end, exit_status)
+    status = "done" if exit_status == 0 else "failed"
+    print(f"{output.name}: {status} with exit code {exit_status}")
+    return dict(step, status=status, exit_status=exit_status, seconds=seconds)
+
+
+def farm(args: Namespace) -> int:
+    """Run the manifest of a farm within a budget of cores. Returns an exit code.
+
+    The longest pending run that fits in the free cores is started whenever any
+    cores are free, so smaller runs fill gaps left by larger ones. Each run writes
+    its output to 'run.log' and its exit code to 'exit_code' in its directory, and
+    a '.done' file on success. Runs with a '.done' file are skipped. A line per run
+    is written to the manifest with the suffix '.results.jsonl'.
+    """
+    pending = []
+    results: List[Dict[str, Any]] = []
+    for run in farm_order(read_manifest(args.manifest)):
+        if (run["output"] / ".done").is_file():
+            results.append(dict(run, status="skipped", exit_status=0))
+        elif run["nprocs"] > args.cores:
+            print(f"{run['output'].name}: needs {run['nprocs']} cores, skipping")
+            results.append(dict(run, status="too large", exit_status=None))
+        else:
+            pending.append(run)
+
+    if args.no_run:
+        for run in pending:
+            print(farm_cmd(args, run))
+        return 0
+
+    free = args.cores
+    running: List[Dict[str, Any]] = []
+    while pending or running:
+        for run in [run for run in pending if run["nprocs"] <= free]:
+            # Cores may have been taken by a longer run earlier in this pass
+            if run["nprocs"] <= free:
+                step = start_step(args, run)
+                pending.remove(run)
+                # Runs that couldn't be started have already finished
+                if "process" not in step:
+                    results.append(step)
+                    continue
+                running.append(step)
+                free -= run["nprocs"]
+
+        finished = [step for step in running if step["process"].poll() is not None]
+        if not finished:
+            time.sleep(args.poll)
+        for step in finished:
+            running.remove(step)
+            free += step["nprocs"]
+            results.append(finish_step(args, step))
+
+    keys = ("status", "exit_status", "nprocs", "estimate", "start", "seconds")
+    with args.manifest.with_suffix(".results.jsonl").open("w") as f:
+        for result in results:
+            entry: Dict[str, Any] = dict(output=str(result["output"]))
+            entry.update((key, result.get(key)) for key in keys)
+            f.write(json.dumps(entry) + "\n")
+    failed = [r for r in results if r["status"] in ("failed", "too large")]
+    succeeded = len(results) - len(failed)
+    print(f"Farm finished: {succeeded} succeeded, {len(failed)} failed")
+    return 1 if failed else 0
 
 
 def main() -> None:
     args = parse_args()
 
     if args.mode == "docker":
+        output = prompt_output(args.output)
         cmd = docker_cmd(
-            args.container, prompt_output(args.output), args.dims, args.photons
+            args.container, output, args.dims, args.photons, run_epoch_args(args)
         )
-        run_cmd(cmd, no_run=args.no_run)
+        raise SystemExit(launch(cmd, args, output))
     elif args.mode == "singularity":
         if args.singularity_mode == "pull":
-            run_cmd(pull_cmd(args.container, args.output))
-        elif args.singularity_mode == "shell":
-            run_cmd(shell_cmd(args.container, args.python, args.cmd))
+            raise SystemExit(pull(args))
+        args.container = cached_container(args, args.container)
+        if args.singularity_mode == "shell":
+            raise SystemExit(run_cmd(shell_cmd(args.container, args.python, args.cmd)))
         else:
+            output = prompt_output(args.output)
+            try:
+                binding = rank_binding(args)
+            except ValueError as exc:
+                raise SystemExit(f"Error: {exc}")
             cmd = singularity_cmd(
                 args.container,
-                prompt_output(args.output),
+                output,
                 args.dims,
                 args.photons,
                 args.nprocs,
                 args.srun,
+                run_epoch_args(args),
+                binding,
             )
-            run_cmd(cmd, no_run=args.no_run)
+            raise SystemExit(launch(cmd, args, output))
+    elif args.mode == "history":
+        raise SystemExit(history(args))
+    elif args.mode == "sweep":
+        if args.launcher == "singularity":
+            container = args.container or _CONTAINERS["singularity"]
+            args.container = cached_container(args, container)
+        try:
+            raise SystemExit(sweep(args))
+        except ValueError as exc:
+            raise SystemExit(f"Error: {exc}")
+    elif args.mode == "farm":
+        if args.launcher == "singularity":
+            args.container = cached_container(args, args.container)
+        raise SystemExit(farm(args))
 
 
 if __name__ == "__main__":
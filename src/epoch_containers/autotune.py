@@ -0,0 +1,352 @@
+import argparse
+import itertools
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Iterator
+
+from .build_epoch import build_epoch, share_jobs, variant_tree
+from .deck import set_control
+from .utils import CoreBudget, exe_name, required_cpu_flags, write_cpu_flags
+
+#: Search space used when none is provided. Each axis lists alternative options.
+_DEFAULT_SPACE = dict(opt=["-O2", "-O3"], arch=["", "-march=native"])
+
+
+def parse_autotune_args() -> argparse.Namespace:
+    """Defines command line interface for autotuning Epoch builds."""
+
+    parser = argparse.ArgumentParser(
+        prog="autotune_epoch",
+        description=(
+            "Build Epoch with each combination of compiler flags and DEFINES in a "
+            "search space, time each build on a benchmark deck, and install the "
+            "fastest."
+        ),
+        epilog="Remember to set your WORKDIR to the top-level of the Epoch repo!",
+    )
+
+    parser.add_argument(
+        "-d",
+        "--dims",
+        default=1,
+        type=int,
+        choices=range(1, 4),
+        help="The number of dimensions in your Epoch build",
+    )
+
+    parser.add_argument(
+        "-c",
+        "--compiler",
+        default="gfortran",
+        type=str,
+        help="The compiler to use for the build",
+    )
+
+    parser.add_argument(
+        "--photons", action="store_true", help="Build with QED features enabled"
+    )
+
+    parser.add_argument(
+        "--deck",
+        required=True,
+        type=Path,
+        help="Benchmark 'input.deck' file, or a directory containing one",
+    )
+
+    parser.add_argument(
+        "--space",
+        default=None,
+        type=Path,
+        help=(
+            "JSON file mapping each axis of the search space to a list of options. "
+            "Each option is a space-separated list of compiler flags, or of Epoch "
+            "DEFINES for the axis named 'defines'. Empty strings switch an axis "
+            f"off. The default is {json.dumps(_DEFAULT_SPACE)}."
+        ),
+    )
+
+    parser.add_argument(
+        "--steps",
+        default=100,
+        type=int,
+        help="The number of steps in each benchmark run. The default is 100.",
+    )
+
+    parser.add_argument(
+        "-n",
+        "--nprocs",
+        default=1,
+        type=int,
+        help="The number of MPI processes in each benchmark run. The default is 1.",
+    )
+
+    parser.add_argument(
+        "-j",
+        "--cores",
+        default=None,
+        type=int,
+        help=(
+            "The total number of cores shared between concurrent builds and "
+            "benchmark runs. Defaults to the number of CPUs."
+        ),
+    )
+
+    parser.add_argument(
+        "--report",
+        default=Path("autotune_report.json"),
+        type=Path,
+        help="Where to write the ranked report. The default is autotune_report.json.",
+    )
+
+    return parser.parse_args()
+
+
+@dataclass
+class Candidate:
+    """A single combination of compiler flags and Epoch DEFINES."""
+
+    name: str
+    fflags: list[str]
+    defines: list[str]
+
+
+@dataclass
+class TuneResult:
+    """Build and benchmark timings of a :class:`Candidate`."""
+
+    candidate: Candidate
+    exe: Path | None = None
+    build_seconds: float | None = None
+    run_seconds: float | None = None
+    steps: int = 0
+    error: str | None = None
+
+    @property
+    def seconds_per_step(self) -> float | None:
+        """Wall time per step of the benchmark run, or ``None`` if it failed."""
+        if self.run_seconds is None or self.steps < 1:
+            return None
+        return self.run_seconds / self.steps
+
+    def to_dict(self) -> dict[str, Any]:
+        return dict(
+            name=self.candidate.name,
+            fflags=self.candidate.fflags,
+            defines=self.candidate.defines,
+            build_seconds=self.build_seconds,
+            run_seconds=self.run_seconds,
+            steps=self.steps,
+            seconds_per_step=self.seconds_per_step,
+            error=self.error,
+        )
+
+
+def load_space(path: Path | None = None) -> dict[str, list[str]]:
+    """Read a search space from a JSON file, or return the default."""
+    if path is None:
+        return dict(_DEFAULT_SPACE)
+    space = json.loads(Path(path).read_text())
+    if not isinstance(space, dict) or not all(
+        isinstance(v, list) and v and all(isinstance(o, str) for o in v)
+        for v in space.values()
+    ):
+        raise ValueError(f"{path} should map axis names to lists of strings")
+    return space
+
+
+def candidates(space: dict[str, list[str]]) -> Iterator[Candidate]:
+    """Generate every combination of options in the search ``space``."""
+    axes = list(space)
+    for n, options in enumerate(itertools.product(*space.values())):
+        fflags: list[str] = []
+        defines: list[str] = []
+        for axis, option in zip(axes, options):
+            (defines if axis == "defines" else fflags).extend(option.split())
+        yield Candidate(f"candidate_{n}", fflags, defines)
+
+
+def time_run(exe: Path, deck: Path, output: Path, steps: int, nprocs: int = 1) -> float:
+    """Time a run of ``exe`` on a copy of ``deck`` limited to ``steps`` steps.
+
+    The copy of the deck is written to ``output``, which also receives the Epoch
+    output and a ``stdout.log``. Returns the wall time in seconds.
+    """
+    output.mkdir(parents=True, exist_ok=True)
+    # Remove t_end so that every run completes the full number of steps
+    text = set_control(Path(deck).read_text(), nsteps=steps, t_end=None)
+    (output / "input.deck").write_text(text)
+    cmd = [str(exe)] if nprocs == 1 else ["mpirun", "-n", str(nprocs), str(exe)]
+    with (output / "stdout.log").open("w") as log:
+        start = time.perf_counter()
+        subprocess.run(
+            cmd,
+            input=str(output.resolve()).encode("utf-8"),
+            stdout=log,
+            stderr=subprocess.STDOUT,
+            check=True,
+        )
+        return time.perf_counter() - start
+
+
+def autotune(
+    epoch_dir: Path,
+    dims: int,
+    compiler: str,
+    deck: Path,
+    photons: bool = False,
+    space: dict[str, list[str]] | None = None,
+    steps: int = 100,
+    nprocs: int = 1,
+    cores: int | None = None,
+) -> list[TuneResult]:
+    """Build and benchmark every candidate in a search space, installing the fastest.
+
+    Each candidate is built in its own copy of the Epoch sources, and then timed on
+    ``deck`` for a fixed number of steps. Builds are scheduled concurrently, sharing
+    a budget of ``cores``, while benchmark runs follow one at a time once every build
+    has finished, so that timings aren't disturbed by compilation. The fastest
+    executable is installed in the ``bin`` directory of ``epoch_dir`` with the suffix
+    ``_tuned``, so that :func:`~epoch_containers.utils.select_exe` chooses it over
+    any microarchitecture variants on machines with the CPU flags it was built for.
+
+    Returns results ranked by wall time per step, fastest first. Candidates that
+    failed to build or run are ranked last, with their error recorded.
+
+    Parameters
+    ----------
+    epoch_dir
+        Path to top level of Epoch repository
+    dims
+        Number of dimensions in build
+    compiler
+        Compiler to use for build
+    deck
+        Benchmark 'input.deck' file, or a directory containing one
+    photons
+        Switch for QED features
+    space
+        Search space mapping axis names to lists of options. Options on the axis
+        ``"defines"`` are Epoch DEFINES, while all others are compiler flags.
+    steps
+        Number of steps in each benchmark run
+    nprocs
+        Number of MPI processes in each benchmark run
+    cores
+        Total number of cores available. Defaults to the number of CPUs.
+    """
+    epoch_dir = Path(epoch_dir)
+    deck = Path(deck) / "input.deck" if Path(deck).is_dir() else Path(deck)
+    if not deck.is_file():
+        raise FileNotFoundError(f"Benchmark deck {deck} not found")
+
+    results = [TuneResult(c) for c in candidates(space or _DEFAULT_SPACE)]
+    budget = CoreBudget(cores or os.cpu_count() or 1)
+    shares = share_jobs(budget.cores, len(results))
+
+    with tempfile.TemporaryDirectory(dir=epoch_dir, prefix=".build_") as work_dir:
+
+        def build(result: TuneResult, jobs: int) -> None:
+            candidate = result.candidate
+            work = Path(work_dir) / candidate.name
+            try:
+                with budget.reserve(jobs) as reserved:
+                    start = time.perf_counter()
+                    variant_tree(epoch_dir, work / "epoch", dims)
+                    result.exe = build_epoch(
+                        work / "epoch",
+                        dims,
+                        compiler,
+                        photons=photons,
+                        jobs=reserved,
+                        fflags=candidate.fflags,
+                        ldflags=candidate.fflags,
+                        defines=candidate.defines,
+                    )
+                    result.build_seconds = time.perf_counter() - start
+            except (OSError, subprocess.CalledProcessError) as exc:
+                result.error = str(exc)
+
+        threads = [
+            threading.Thread(target=build, args=(result, shares[n % len(shares)]))
+            for n, result in enumerate(results)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # Time builds one at a time, so that they don't compete for cores
+        for result in results:
+            candidate = result.candidate
+            if result.exe is not None:
+                try:
+                    result.run_seconds = time_run(
+                        result.exe,
+                        deck,
+                        Path(work_dir) / candidate.name / "run",
+                        steps,
+                        nprocs=nprocs,
+                    )
+                    result.steps = steps
+                except (OSError, subprocess.CalledProcessError) as exc:
+                    result.error = str(exc)
+            print(
+                f"{candidate.name} {' '.join(candidate.fflags + candidate.defines)}: "
+                + (
+                    f"{result.seconds_per_step:.4g}s/step"
+                    if result.seconds_per_step is not None
+                    else f"failed ({result.error})"
+                )
+            )
+
+        ranked = sorted(
+            results,
+            key=lambda r: (r.seconds_per_step is None, r.seconds_per_step or 0.0),
+        )
+        best = ranked[0]
+        if best.exe is None or best.seconds_per_step is None:
+            raise RuntimeError("No candidate was built and run successfully")
+
+        # Install fastest executable
+        bin_dir = epoch_dir / "bin"
+        bin_dir.mkdir(exist_ok=True)
+        installed = bin_dir / exe_name(dims, photons, variant="tuned")
+        shutil.copy2(best.exe, installed)
+        write_cpu_flags(installed, required_cpu_flags(best.candidate.fflags))
+        print(f"Installed {best.candidate.name} as {installed}")
+
+    # Executables in the work directory no longer exist
+    for result in results:
+        result.exe = None
+    return ranked
+
+
+def write_report(results: list[TuneResult], report: Path) -> None:
+    """Write ranked autotuning results to a JSON file."""
+    ranked = [dict(rank=n + 1, **r.to_dict()) for n, r in enumerate(results)]
+    Path(report).write_text(json.dumps(ranked, indent=2))
+
+
+def main() -> None:
+    """Entrypoint function for autotuning Epoch builds."""
+    args = parse_autotune_args()
+    results = autotune(
+        Path.cwd(),
+        args.dims,
+        args.compiler,
+        args.deck,
+        photons=args.photons,
+        space=load_space(args.space),
+        steps=args.steps,
+        nprocs=args.nprocs,
+        cores=args.cores,
+    )
+    write_report(results, args.report)
+    print(f"Report written to {args.report}")
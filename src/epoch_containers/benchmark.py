@@ -0,0 +1,447 @@
+import argparse
+import csv
+import json
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import asdict, dataclass
+from pathlib import Path
+
+from .deck import block_values, deck_dims, set_control
+from .progress import parse_progress, parse_runtime
+from .utils import select_exe
+
+#: Launch modes, matching the subcommands of run_epoch.py
+_MODES = ("native", "docker", "singularity")
+
+#: Default containers, matching those used by run_epoch.py
+_CONTAINERS = dict(
+    docker="ghcr.io/plasmafair/epoch:latest",
+    singularity="oras://ghcr.io/plasmafair/epoch.sif:latest",
+)
+
+
+def parse_benchmark_args() -> argparse.Namespace:
+    """Defines command line interface for benchmarking Epoch."""
+
+    parser = argparse.ArgumentParser(
+        prog="benchmark_epoch",
+        description=(
+            "Run strong and weak scaling studies of Epoch on a set of benchmark "
+            "decks, recording wall time, time per step, parallel efficiency and "
+            "launcher overhead."
+        ),
+    )
+
+    parser.add_argument(
+        "decks",
+        nargs="*",
+        type=Path,
+        help=(
+            "Benchmark 'input.deck' files, or directories containing them. "
+            "Directories containing several decks in subdirectories are expanded."
+        ),
+    )
+
+    parser.add_argument(
+        "--set",
+        default=None,
+        dest="deck_set",
+        help=(
+            "Name of a deck set in test_decks/benchmarks, such as 'laptop' or "
+            "'node'. Used if no decks are given."
+        ),
+    )
+
+    parser.add_argument(
+        "-m",
+        "--mode",
+        default="native",
+        choices=_MODES,
+        help=(
+            "How to launch Epoch. 'native' runs executables directly, while "
+            "'docker' and 'singularity' go through run_epoch.py. The default is "
+            "native."
+        ),
+    )
+
+    parser.add_argument(
+        "-n",
+        "--nprocs",
+        nargs="+",
+        default=[1],
+        type=int,
+        help="Process counts to sweep over. The default is 1.",
+    )
+
+    parser.add_argument(
+        "--study",
+        nargs="+",
+        default=["strong"],
+        choices=("strong", "weak"),
+        help=(
+            "Scaling studies to run. Weak scaling multiplies nx in each deck by the "
+            "number of processes relative to the smallest process count. The "
+            "default is strong."
+        ),
+    )
+
+    parser.add_argument(
+        "--steps",
+        default=50,
+        type=int,
+        help="The number of steps in each run. The default is 50.",
+    )
+
+    parser.add_argument(
+        "--photons", action="store_true", help="Run with QED features enabled."
+    )
+
+    parser.add_argument(
+        "--bin-dir",
+        default=None,
+        type=Path,
+        help="Directory of Epoch executables for native mode. Defaults to PATH.",
+    )
+
+    parser.add_argument(
+        "-c",
+        "--container",
+        default=None,
+        help="The container to run in docker or singularity mode.",
+    )
+
+    parser.add_argument(
+        "--script",
+        default=Path("run_epoch.py"),
+        type=Path,
+        help="Path to run_epoch.py, for docker and singularity modes.",
+    )
+
+    parser.add_argument(
+        "-o",
+        "--output",
+        default=Path("benchmark"),
+        type=Path,
+        help=(
+            "Prefix of the results files. Writes <prefix>.csv and <prefix>.json. "
+            "The default is 'benchmark'."
+        ),
+    )
+
+    return parser.parse_args()
+
+
+@dataclass
+class BenchmarkResult:
+    """Timings of a single benchmark run."""
+
+    deck: str
+    mode: str
+    study: str
+    dims: int
+    nprocs: int
+    nx: str
+    steps: int
+    wall_seconds: float
+    epoch_seconds: float | None
+    seconds_per_step: float | None
+    launch_overhead: float
+    efficiency: float | None = None
+    returncode: int = 0
+
+
+def find_decks(paths: list[Path]) -> list[Path]:
+    """Expand directories into the 'input.deck' files they contain."""
+    decks: list[Path] = []
+    for path in map(Path, paths):
+        if path.is_file():
+            decks.append(path)
+        elif (path / "input.deck").is_file():
+            decks.append(path / "input.deck")
+        elif path.is_dir():
+            decks.extend(sorted(path.glob("*/input.deck")))
+        else:
+            raise FileNotFoundError(f"No benchmark deck found at {path}")
+    return decks
+
+
+def launch_cmd(
+    mode: str,
+    dims: int,
+    output: Path,
+    nprocs: int,
+    photons: bool = False,
+    bin_dir: Path | None = None,
+    container: str | None = None,
+    script: Path = Path("run_epoch.py"),
+) -> tuple[list[str], bytes | None]:
+    """Construct the command used to run Epoch in each mode.
+
+    Returns the command and any input it should be sent on stdin.
+    """
+    if mode == "native":
+        exe = select_exe(dims, photons=photons, bin_dir=bin_dir)
+        mpirun = ["mpirun", "-n", str(nprocs)] if nprocs != 1 else []
+        return [*mpirun, exe], str(output.resolve()).encode("utf-8")
+    if mode not in _MODES:
+        raise ValueError(f"Unknown mode {mode}")
+    if mode == "docker" and nprocs != 1:
+        raise ValueError("Docker mode only supports a single process")
+    cmd = [sys.executable, str(script), mode, "-d", str(dims), "-o", str(output)]
+    if photons:
+        cmd.append("--photons")
+    if container is not None:
+        cmd.extend(["-c", container])
+    if mode == "singularity":
+        cmd.extend(["-n", str(nprocs)])
+    return cmd, None
+
+
+def noop_cmd(mode: str, nprocs: int, container: str | None = None) -> list[str]:
+    """Construct a command that goes through the launcher but does no work."""
+    mpirun = ["mpirun", "-n", str(nprocs)] if nprocs != 1 else []
+    if mode == "native":
+        return [*mpirun, "true"]
+    container = container or _CONTAINERS[mode]
+    if mode == "docker":
+        return ["docker", "run", "--rm", "--entrypoint", "true", container]
+    return [*mpirun, "singularity", "exec", container, "true"]
+
+
+def pull_container(container: str, directory: Path) -> str:
+    """Pull a Singularity image from a registry into ``directory``.
+
+    Returns the path of the local image, or ``container`` if it isn't in a registry,
+    so that downloads aren't included in timings.
+    """
+    if "://" not in container:
+        return container
+    image = Path(directory) / "epoch.sif"
+    subprocess.run(
+        ["singularity", "pull", str(image), container],
+        check=True,
+        stdout=subprocess.DEVNULL,
+    )
+    return str(image)
+
+
+def launch_overhead(mode: str, nprocs: int, container: str | None = None) -> float:
+    """Measure the wall time of launching a command that does nothing."""
+    start = time.perf_counter()
+    subprocess.run(noop_cmd(mode, nprocs, container), capture_output=True)
+    return time.perf_counter() - start
+
+
+def run_benchmark(
+    deck: Path,
+    mode: str,
+    nprocs: int,
+    steps: int,
+    study: str = "strong",
+    scale: int = 1,
+    photons: bool = False,
+    bin_dir: Path | None = None,
+    container: str | None = None,
+    script: Path = Path("run_epoch.py"),
+    overhead: float = 0.0,
+) -> BenchmarkResult:
+    """Run a single benchmark on a copy of ``deck``, limited to ``steps`` steps.
+
+    For weak scaling studies, ``nx`` is multiplied by ``scale``.
+    """
+    text = Path(deck).read_text()
+    dims = deck_dims(text)
+    nx = block_values(text, "control")["nx"]
+    values: dict[str, object] = dict(nsteps=steps, t_end=None)
+    if scale != 1:
+        nx = f"({nx}) * {scale}"
+        values["nx"] = nx
+    text = set_control(text, **values)
+
+    with tempfile.TemporaryDirectory(prefix="benchmark_") as d:
+        output = Path(d)
+        (output / "input.deck").write_text(text)
+        cmd, stdin = launch_cmd(
+            mode,
+            dims,
+            output,
+            nprocs,
+            photons=photons,
+            bin_dir=bin_dir,
+            container=container,
+            script=script,
+        )
+        start = time.perf_counter()
+        result = subprocess.run(
+            cmd, input=stdin, stdout=subprocess.PIPE, stderr=subprocess.STDOUT
+        )
+        wall = time.perf_counter() - start
+
+    # Read the number of steps completed and Epoch's own timings
+    last_step = 0
+    epoch_seconds = None
+    for line in result.stdout.decode("utf-8", errors="replace").splitlines():
+        if (progress := parse_progress(line)) is not None:
+            last_step = progress.step
+            epoch_seconds = progress.walltime
+        elif (runtime := parse_runtime(line)) is not None:
+            epoch_seconds = runtime
+    completed = max(last_step, steps if result.returncode == 0 else 0)
+
+    return BenchmarkResult(
+        deck=str(deck),
+        mode=mode,
+        study=study,
+        dims=dims,
+        nprocs=nprocs,
+        nx=nx,
+        steps=completed,
+        wall_seconds=wall,
+        epoch_seconds=epoch_seconds,
+        seconds_per_step=(epoch_seconds or wall) / completed if completed else None,
+        launch_overhead=overhead,
+        returncode=result.returncode,
+    )
+
+
+def add_efficiency(results: list[BenchmarkResult]) -> None:
+    """Set the parallel efficiency of each result, relative to the fewest processes.
+
+    Strong scaling efficiency is ``(n0 * t0) / (n * t)``, while weak scaling
+    efficiency is ``t0 / t``, where ``t`` is the time per step.
+    """
+    groups: dict[tuple[str, str, str], list[BenchmarkResult]] = {}
+    for result in results:
+        groups.setdefault((result.deck, result.mode, result.study), []).append(result)
+    for group in groups.values():
+        reference = min(group, key=lambda r: r.nprocs)
+        if not reference.seconds_per_step:
+            continue
+        for result in group:
+            if not result.seconds_per_step:
+                continue
+            ratio = reference.seconds_per_step / result.seconds_per_step
+            if result.study == "strong":
+                ratio *= reference.nprocs / result.nprocs
+            result.efficiency = ratio
+
+
+def benchmark(
+    decks: list[Path],
+    mode: str = "native",
+    nprocs: list[int] | None = None,
+    studies: list[str] | None = None,
+    steps: int = 50,
+    photons: bool = False,
+    bin_dir: Path | None = None,
+    container: str | None = None,
+    script: Path = Path("run_epoch.py"),
+) -> list[BenchmarkResult]:
+    """Run scaling studies over a set of benchmark decks.
+
+    Parameters
+    ----------
+    decks
+        Benchmark 'input.deck' files, or directories containing them.
+    mode
+        One of 'native', 'docker', or 'singularity'.
+    nprocs
+        Process counts to sweep over. For weak scaling, each must be a multiple of
+        the smallest, which ``nx`` is scaled relative to.
+    studies
+        Scaling studies to run, 'strong' and/or 'weak'.
+    steps
+        Number of steps in each run.
+    photons
+        Switch to run with QED features.
+    bin_dir
+        Directory of Epoch executables for native mode. Defaults to PATH.
+    container
+        Container for docker and singularity modes. Singularity images in a
+        registry are pulled once, before anything is timed.
+    script
+        Path to run_epoch.py, for docker and singularity modes.
+    """
+    nprocs = sorted(set(nprocs or [1]))
+    studies = studies or ["strong"]
+    if "weak" in studies and (uneven := [n for n in nprocs if n % nprocs[0]]):
+        raise ValueError(
+            f"Weak scaling needs process counts that are multiples of {nprocs[0]}, "
+            f"not {', '.join(map(str, uneven))}"
+        )
+    results: list[BenchmarkResult] = []
+    with tempfile.TemporaryDirectory(prefix="benchmark_") as d:
+        if mode == "singularity":
+            container = pull_container(container or _CONTAINERS[mode], Path(d))
+        overheads = {n: launch_overhead(mode, n, container) for n in nprocs}
+        for deck in find_decks(decks):
+            for study in studies:
+                for n in nprocs:
+                    scale = n // nprocs[0] if study == "weak" else 1
+                    result = run_benchmark(
+                        deck,
+                        mode,
+                        n,
+                        steps,
+                        study=study,
+                        scale=scale,
+                        photons=photons,
+                        bin_dir=bin_dir,
+                        container=container,
+                        script=script,
+                        overhead=overheads[n],
+                    )
+                    print(
+                        f"{deck} ({study}, {n} procs): {result.wall_seconds:.2f}s, "
+                        + (
+                            f"{result.seconds_per_step:.4g}s/step"
+                            if result.seconds_per_step
+                            else f"failed with code {result.returncode}"
+                        )
+                    )
+                    results.append(result)
+    add_efficiency(results)
+    return results
+
+
+def write_results(results: list[BenchmarkResult], prefix: Path) -> None:
+    """Write benchmark results to ``<prefix>.csv`` and ``<prefix>.json``."""
+    rows = [asdict(result) for result in results]
+    with Path(f"{prefix}.csv").open("w", newline="") as f:
+        writer = csv.DictWriter(
+            f, fieldnames=list(BenchmarkResult.__dataclass_fields__)
+        )
+        writer.writeheader()
+        writer.writerows(rows)
+    Path(f"{prefix}.json").write_text(json.dumps(rows, indent=2))
+
+
+def main() -> None:
+    """Entrypoint function for benchmarking Epoch."""
+    args = parse_benchmark_args()
+    decks = args.decks
+    if not decks:
+        if args.deck_set is None:
+            raise SystemExit("Provide benchmark decks or a deck set with --set")
+        decks = [Path("test_decks") / "benchmarks" / args.deck_set]
+    if args.mode != "native" and shutil.which(args.mode) is None:
+        raise SystemExit(f"Could not find '{args.mode}' on the system PATH")
+    try:
+        results = benchmark(
+            decks,
+            mode=args.mode,
+            nprocs=args.nprocs,
+            studies=args.study,
+            steps=args.steps,
+            photons=args.photons,
+            bin_dir=args.bin_dir,
+            container=args.container,
+            script=args.script,
+        )
+    except ValueError as exc:
+        raise SystemExit(str(exc)) from exc
+    write_results(results, args.output)
+    print(f"Results written to {args.output}.csv and {args.output}.json")
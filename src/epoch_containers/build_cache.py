@@ -0,0 +1,166 @@
+import functools
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+from pathlib import Path
+
+#: Executable whose version identifies each value of the Makefile COMPILER variable
+_COMPILER_EXES = dict(gfortran="gfortran", intel="ifort", pgi="pgfortran")
+
+#: Build products and metadata that should not contribute to the source hash
+_IGNORE_DIRS = frozenset((".git", "bin", "obj", "lib"))
+_IGNORE_SUFFIXES = frozenset((".o", ".mod", ".a", ".copy"))
+
+
+def source_hash(directory: Path) -> str:
+    """Hash the source tree used to build the ``epochNd`` ``directory``.
+
+    Includes the ``SDF`` directory alongside it if present. Build products, such as
+    object files and the ``bin`` directory, are ignored.
+    """
+    directory = Path(directory)
+    roots = [directory, directory.parent / "SDF"]
+    digest = hashlib.sha256()
+    for root in roots:
+        if not root.is_dir():
+            continue
+        for dirpath, dirnames, filenames in os.walk(root):
+            dirnames[:] = sorted(d for d in dirnames if d not in _IGNORE_DIRS)
+            for filename in sorted(filenames):
+                path = Path(dirpath) / filename
+                if path.suffix in _IGNORE_SUFFIXES or not path.is_file():
+                    continue
+                digest.update(str(path.relative_to(root.parent)).encode())
+                digest.update(b"\0")
+                digest.update(path.read_bytes())
+                digest.update(b"\0")
+    return digest.hexdigest()
+
+
+@functools.cache
+def compiler_version(compiler: str) -> str:
+    """Get the version string of the compiler selected by ``COMPILER=compiler``.
+
+    Returns ``"unknown"`` if the compiler can't be found.
+    """
+    exe = _COMPILER_EXES.get(compiler, compiler)
+    try:
+        result = subprocess.run(
+            [exe, "--version"], capture_output=True, text=True, check=False
+        )
+    except OSError:
+        return "unknown"
+    lines = result.stdout.strip().splitlines()
+    return lines[0] if lines else "unknown"
+
+
+def cache_key(directory: Path, compiler: str, flags: list[str] | None = None) -> str:
+    """Content-addressed key for a build of ``directory``.
+
+    Combines the hash of the source tree with the compiler, its version, and the
+    enabled Makefile flags. Changing any of these gives a new key.
+    """
+    digest = hashlib.sha256()
+    for part in (
+        source_hash(directory),
+        compiler,
+        compiler_version(compiler),
+        *sorted(flags or []),
+    ):
+        digest.update(part.encode())
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class BuildCache:
+    """Local cache of Epoch executables, keyed by :func:`cache_key`.
+
+    Each entry is a directory named after its key. Entries are evicted in least
+    recently used order once the total size exceeds ``max_size`` bytes.
+
+    Parameters
+    ----------
+    cache_dir
+        Directory in which to store cached builds. Created if it doesn't exist.
+    max_size
+        Maximum total size of the cache in bytes.
+    """
+
+    def __init__(self, cache_dir: Path, max_size: int = 5 * 1024**3) -> None:
+        self.cache_dir = Path(cache_dir)
+        self.max_size = max_size
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    def _entry(self, key: str) -> Path:
+        return self.cache_dir / key
+
+    def get(self, key: str, dest: Path) -> bool:
+        """Restore the executable stored under ``key`` to ``dest``.
+
+        Returns ``True`` on a cache hit, and ``False`` otherwise.
+        """
+        entry = self._entry(key)
+        info_file = entry / "info.json"
+        if not info_file.is_file():
+            return False
+        exe = entry / json.loads(info_file.read_text())["exe"]
+        if not exe.is_file():
+            return False
+        # Mark as recently used
+        os.utime(entry)
+        Path(dest).parent.mkdir(parents=True, exist_ok=True)
+        shutil.copy2(exe, dest)
+        return True
+
+    def put(self, key: str, exe: Path) -> None:
+        """Store a copy of ``exe`` under ``key``, then evict old entries."""
+        exe = Path(exe)
+        entry = self._entry(key)
+        # Copy to a temporary directory first so readers never see partial entries
+        tmp = Path(tempfile.mkdtemp(dir=self.cache_dir, prefix=".tmp-"))
+        try:
+            shutil.copy2(exe, tmp / exe.name)
+            info = dict(exe=exe.name, created=time.time())
+            (tmp / "info.json").write_text(json.dumps(info))
+            try:
+                os.rename(tmp, entry)
+            except OSError:
+                # Another build stored the same key first
+                pass
+        finally:
+            if tmp.exists():
+                shutil.rmtree(tmp)
+        self.evict()
+
+    def entries(self) -> list[Path]:
+        """List cache entries, least recently used first."""
+        entries = [
+            p for p in self.cache_dir.iterdir() if p.is_dir() and p.name[0] != "."
+        ]
+        return sorted(entries, key=lambda p: p.stat().st_mtime)
+
+    def size(self, entry: Path | None = None) -> int:
+        """Total size in bytes of ``entry``, or of the whole cache."""
+        paths = self.entries() if entry is None else [entry]
+        return sum(f.stat().st_size for p in paths for f in p.rglob("*") if f.is_file())
+
+    def evict(self) -> list[Path]:
+        """Remove least recently used entries until the cache fits ``max_size``.
+
+        Returns the removed entries.
+        """
+        entries = self.entries()
+        sizes = {entry: self.size(entry) for entry in entries}
+        total = sum(sizes.values())
+        removed: list[Path] = []
+        for entry in entries:
+            if total <= self.max_size:
+                break
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= sizes[entry]
+            removed.append(entry)
+        return removed
@@ -1,12 +1,48 @@
 import argparse
+import itertools
+import os
+import queue
 import re
 import shutil
 import subprocess
+import tempfile
+import threading
+import time
 from contextlib import contextmanager
+from dataclasses import dataclass
 from pathlib import Path
-from typing import Any, Generator
+from typing import Any, Generator, Iterable
 
-from .utils import exe_name
+from .build_cache import BuildCache, cache_key
+from .bundle import check_bundle, export_bundle
+from .run_epoch import run_epoch
+from .utils import (
+    BASELINE,
+    MICROARCH_FLAGS,
+    exe_name,
+    required_cpu_flags,
+    write_cpu_flags,
+)
+
+#: Compiler flags used to generate and use profile data, keyed by compiler.
+#: ``{}`` is replaced by the profile directory.
+_PGO_FLAGS = dict(
+    gfortran=(
+        ["-fprofile-generate={}"],
+        ["-fprofile-use={}", "-fprofile-correction", "-Wno-missing-profile"],
+    ),
+    intel=(["-prof-gen", "-prof-dir={}"], ["-prof-use", "-prof-dir={}"]),
+)
+
+#: Compiler flags used to target each microarchitecture, keyed by compiler.
+#: Compilers not listed here use ``-march``.
+_MARCH_FLAGS = dict(
+    intel={
+        "x86-64-v2": ["-xSSE4.2"],
+        "x86-64-v3": ["-xCORE-AVX2"],
+        "x86-64-v4": ["-xCORE-AVX512"],
+    },
+)
 
 
 def parse_build_args() -> argparse.Namespace:
@@ -39,14 +75,143 @@ def parse_build_args() -> argparse.Namespace:
         "--photons", action="store_true", help="Build with QED features enabled"
     )
 
-    return parser.parse_args()
+    parser.add_argument(
+        "--all",
+        action="store_true",
+        help=(
+            "Build every combination of dimensions and QED features concurrently. "
+            "Overrides -d/--dims and --photons."
+        ),
+    )
+
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        default=None,
+        type=int,
+        help=(
+            "The total number of parallel make jobs. With --all, this budget is "
+            "shared between the concurrent builds. Defaults to the number of CPUs."
+        ),
+    )
+
+    parser.add_argument(
+        "--cache-dir",
+        default=None,
+        type=Path,
+        help=(
+            "Directory in which to cache builds. Builds with unchanged sources, "
+            "compiler and flags are restored from here instead of recompiling."
+        ),
+    )
+
+    parser.add_argument(
+        "--cache-size",
+        default=5.0,
+        type=float,
+        help="Maximum size of the build cache in GiB. The default is 5.",
+    )
+
+    parser.add_argument(
+        "--pgo",
+        nargs="*",
+        default=None,
+        type=Path,
+        metavar="DECK",
+        help=(
+            "Build with profile-guided optimisation. An instrumented build is run "
+            "on each training DECK (an 'input.deck' file or a directory containing "
+            "one), and the resulting profile is used to build an executable with "
+            "the suffix '_pgo'. If no decks are given, an existing profile is "
+            "reused. Can't be combined with --all, --march or --cache-dir."
+        ),
+    )
+
+    parser.add_argument(
+        "--profile-dir",
+        default=None,
+        type=Path,
+        help=(
+            "Directory in which to store profile data for --pgo. The default is "
+            "'profiles/<executable name>' at the top level of the Epoch repo."
+        ),
+    )
+
+    parser.add_argument(
+        "--march",
+        nargs="+",
+        default=None,
+        choices=[BASELINE, *MICROARCH_FLAGS],
+        help=(
+            "Build a variant for each CPU microarchitecture. Executables are "
+            "suffixed with the microarchitecture name, except for the baseline. At "
+            "run time, run_epoch chooses the best variant supported by the host."
+        ),
+    )
+
+    parser.add_argument(
+        "--export",
+        default=None,
+        type=Path,
+        metavar="DIR",
+        help=(
+            "After building, copy the Epoch executables and only the libraries they "
+            "load, with Python and run_epoch, into DIR. This tree can be copied "
+            "into an empty image, such as the 'runtime' stage of the Dockerfile."
+        ),
+    )
+
+    parser.add_argument(
+        "--export-include",
+        nargs="+",
+        default=[],
+        type=Path,
+        metavar="PATH",
+        help=(
+            "Further files or directories to export, such as the plugins MPI loads "
+            "at run time, and the libraries they need."
+        ),
+    )
+
+    parser.add_argument(
+        "--check-bundle",
+        action="store_true",
+        help=(
+            "Check that each exported executable can load its libraries with only "
+            "the exported tree as root. Fails if any can't."
+        ),
+    )
+
+    args = parser.parse_args()
+    if args.pgo is not None:
+        # Profiles are specific to one build, and aren't part of the cache key
+        ignored = [
+            option
+            for option, value in (
+                ("--all", args.all),
+                ("--march", args.march),
+                ("--cache-dir", args.cache_dir),
+            )
+            if value
+        ]
+        if ignored:
+            parser.error(f"{', '.join(ignored)} can't be used with --pgo")
+    return args
 
 
 @contextmanager
 def compiler_flags(
-    directory: Path, flags: list[str] | None = None
+    directory: Path,
+    flags: list[str] | None = None,
+    fflags: list[str] | None = None,
+    ldflags: list[str] | None = None,
 ) -> Generator[None, Any, Any]:
-    """Set compiler flags to Makefile in current working directory."""
+    """Set compiler flags to Makefile in current working directory.
+
+    ``flags`` are Epoch DEFINES, which are uncommented in the Makefile. ``fflags``
+    and ``ldflags`` are arbitrary compiler and link flags, which are appended to the
+    Makefile variables ``FFLAGS`` and ``LDFLAGS`` respectively.
+    """
     makefile = Path(directory) / "Makefile"
     tmp = Path(directory) / "Makefile.copy"
 
@@ -55,7 +220,7 @@ def compiler_flags(
         raise FileNotFoundError("Makefile not in current working directory")
 
     # If not given any compiler flags, do nothing
-    if not flags:
+    if not (flags or fflags or ldflags):
         yield
         return
 
@@ -69,12 +234,18 @@ def compiler_flags(
         # Copy to new list, uncommenting lines that match flags
         newlines: list[str] = []
         for line in lines:
-            for flag in flags:
+            for flag in flags or []:
                 if re.search(rf"\$\(D\){flag}$", line):
                     newlines.append(line.replace("#", ""))
                     break
             else:
                 newlines.append(line)
+        # Append extra compiler and link flags
+        if newlines and not newlines[-1].endswith("\n"):
+            newlines[-1] += "\n"
+        for variable, extra in (("FFLAGS", fflags), ("LDFLAGS", ldflags)):
+            if extra:
+                newlines.append(f"{variable} += {' '.join(extra)}\n")
         # Write back to file
         with makefile.open("w") as f:
             f.writelines(newlines)
@@ -87,8 +258,17 @@ def compiler_flags(
 
 
 def build_epoch(
-    epoch_dir: Path, dims: int, compiler: str, photons: bool = False
-) -> None:
+    epoch_dir: Path,
+    dims: int,
+    compiler: str,
+    photons: bool = False,
+    jobs: int | None = None,
+    cache: BuildCache | None = None,
+    fflags: list[str] | None = None,
+    ldflags: list[str] | None = None,
+    variant: str | None = None,
+    defines: list[str] | None = None,
+) -> Path:
     """Builds an Epoch executable. Returns path to executable.
 
     Parameters
@@ -101,34 +281,373 @@ def build_epoch(
         Compiler to use for build
     photons
         Switch for QED features
+    jobs
+        Number of parallel make jobs. Defaults to the number of CPUs.
+    cache
+        Cache of previous builds. If an identical build is found, the executable
+        is restored from the cache instead of invoking make. New builds are added.
+    fflags
+        Extra compiler flags.
+    ldflags
+        Extra link flags.
+    variant
+        Suffix added to the name of the executable, used to distinguish builds with
+        different ``fflags``, ``ldflags`` and ``defines``.
+    defines
+        Extra Epoch DEFINES to uncomment in the Makefile.
     """
     # Get directory
     directory = Path(epoch_dir) / f"epoch{dims}d"
     if not directory.is_dir():
         raise NotADirectoryError(f"{directory} is not a directory")
     # Set up compiler flags
-    flags: list[str] = []
-    if photons:
+    flags: list[str] = list(defines or [])
+    if photons and "PHOTONS" not in flags:
         flags.append("PHOTONS")
 
+    bin_dir = Path(epoch_dir) / "bin"
+    new_exe = bin_dir / exe_name(dims=dims, photons=photons, variant=variant)
+
+    # Check for identical previous builds
+    key = None
+    if cache is not None:
+        key = cache_key(
+            directory,
+            compiler,
+            [
+                *flags,
+                *(f"FFLAGS+={f}" for f in fflags or []),
+                *(f"LDFLAGS+={f}" for f in ldflags or []),
+            ],
+        )
+        if cache.get(key, new_exe):
+            print(f"Restored {new_exe.name} from build cache")
+            return new_exe
+
     # Build
-    with compiler_flags(directory, flags=flags):
+    with compiler_flags(directory, flags=flags, fflags=fflags, ldflags=ldflags):
+        # A bare -j would start an unlimited number of jobs
+        jobs = jobs or os.cpu_count() or 1
         subprocess.run(
-            ["make", "-j", "--directory", str(directory), f"COMPILER={compiler}"]
+            ["make", f"-j{jobs}", "--directory", str(directory), f"COMPILER={compiler}"]
         )
 
     # Move executable to bin dir (executable has same filename as directory)
     exe = directory / "bin" / directory.name
-    bin_dir = epoch_dir / "bin"
     bin_dir.mkdir(exist_ok=True)
-    new_exe = bin_dir / exe_name(dims=dims, photons=photons)
     shutil.move(str(exe), str(new_exe))
+    if cache is not None and key is not None:
+        cache.put(key, new_exe)
 
     # Clean up
     subprocess.run(["make", "--directory", str(directory), "clean"])
+    return new_exe
+
+
+@dataclass
+class BuildResult:
+    """Summary of a single variant built by :func:`build_matrix`."""
+
+    dims: int
+    photons: bool
+    exe: Path
+    jobs: int
+    seconds: float
+    march: str = BASELINE
+
+
+def march_flags(compiler: str, march: str) -> list[str]:
+    """Get compiler flags targeting the microarchitecture ``march``."""
+    if march == BASELINE:
+        return []
+    if march not in MICROARCH_FLAGS:
+        raise ValueError(f"Unknown microarchitecture {march}")
+    if compiler in _MARCH_FLAGS:
+        return list(_MARCH_FLAGS[compiler][march])
+    return [f"-march={march}"]
+
+
+def share_jobs(jobs: int, builds: int) -> list[int]:
+    """Split a budget of make jobs between concurrent builds.
+
+    Returns one entry per concurrent build slot. There are never more slots than
+    builds or jobs, every slot gets at least one job, and the shares sum to the
+    budget.
+    """
+    if jobs < 1 or builds < 1:
+        raise ValueError("Require at least one job and one build")
+    slots = min(jobs, builds)
+    base, extra = divmod(jobs, slots)
+    return [base + (1 if slot < extra else 0) for slot in range(slots)]
+
+
+def variant_tree(epoch_dir: Path, tree: Path, dims: int) -> Path:
+    """Copy the Epoch sources needed to build ``dims`` into ``tree``.
+
+    The copy mirrors the top level of the Epoch repository, so relative paths in the
+    Makefile (such as ``../SDF``) still resolve, but leaves out the other
+    ``epochNd`` directories, the shared ``bin`` directory, git metadata, and any
+    stale build products. Returns the path to the copied ``epochNd`` directory.
+    """
+    ignore = shutil.ignore_patterns(".git", "*.o", "*.mod", "*.a")
+    tree.mkdir(parents=True)
+    for child in Path(epoch_dir).iterdir():
+        if child.name in (".git", "bin") or child.name.startswith(".build_"):
+            continue
+        if re.fullmatch(r"epoch\dd", child.name) and child.name != f"epoch{dims}d":
+            continue
+        if child.is_dir():
+            shutil.copytree(child, tree / child.name, symlinks=True, ignore=ignore)
+        else:
+            shutil.copy2(child, tree / child.name)
+    return tree / f"epoch{dims}d"
+
+
+def build_matrix(
+    epoch_dir: Path,
+    compiler: str,
+    variants: Iterable[tuple[int, bool]] | None = None,
+    jobs: int | None = None,
+    cache: BuildCache | None = None,
+    marches: Iterable[str] = (BASELINE,),
+) -> list[BuildResult]:
+    """Builds several Epoch variants concurrently.
+
+    Each variant is built in its own copy of the Epoch sources, so concurrent builds
+    never share a Makefile or object directory. The finished executables are moved
+    to the usual ``bin`` directory at the top level of the Epoch repository.
+
+    Parameters
+    ----------
+    epoch_dir
+        Path to top level of Epoch repository
+    compiler
+        Compiler to use for all builds
+    variants
+        Pairs of ``(dims, photons)`` to build. Defaults to every combination.
+    jobs
+        Total number of make jobs shared between the concurrent builds. Defaults
+        to the number of CPUs.
+    cache
+        Cache of previous builds, shared between all variants.
+    marches
+        Microarchitectures to target. Each ``(dims, photons)`` variant is built once
+        for each, with the microarchitecture name as a suffix.
+    """
+    epoch_dir = Path(epoch_dir)
+    if variants is None:
+        variants = itertools.product(range(1, 4), (False, True))
+    pending: queue.Queue[tuple[int, bool, str]] = queue.Queue()
+    for (dims, photons), march in itertools.product(variants, marches):
+        pending.put((dims, photons, march))
+    if pending.empty():
+        return []
+
+    shares = share_jobs(jobs or os.cpu_count() or 1, pending.qsize())
+    results: list[BuildResult] = []
+    errors: list[BaseException] = []
+    lock = threading.Lock()
+    bin_dir = epoch_dir / "bin"
+    bin_dir.mkdir(exist_ok=True)
+
+    def worker(share: int) -> None:
+        while True:
+            try:
+                dims, photons, march = pending.get_nowait()
+            except queue.Empty:
+                return
+            start = time.perf_counter()
+            try:
+                with tempfile.TemporaryDirectory(dir=epoch_dir, prefix=".build_") as d:
+                    tree = Path(d) / "epoch"
+                    variant_tree(epoch_dir, tree, dims)
+                    fflags = march_flags(compiler, march)
+                    exe = build_epoch(
+                        tree,
+                        dims,
+                        compiler,
+                        photons=photons,
+                        jobs=share,
+                        cache=cache,
+                        fflags=fflags,
+                        ldflags=fflags,
+                        variant=march,
+                    )
+                    new_exe = bin_dir / exe.name
+                    shutil.move(str(exe), str(new_exe))
+            except BaseException as exc:  # Re-raised in the main thread
+                with lock:
+                    errors.append(exc)
+                continue
+            result = BuildResult(
+                dims, photons, new_exe, share, time.perf_counter() - start, march
+            )
+            print(f"Built {new_exe.name} in {result.seconds:.1f}s ({share} jobs)")
+            with lock:
+                results.append(result)
+
+    threads = [threading.Thread(target=worker, args=(share,)) for share in shares]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
+    return sorted(results, key=lambda r: (r.dims, r.photons, r.exe.name))
+
+
+def pgo_flags(compiler: str, profile_dir: Path) -> tuple[list[str], list[str]]:
+    """Get flags used to generate and use profile data in ``profile_dir``."""
+    if compiler not in _PGO_FLAGS:
+        raise ValueError(f"Profile-guided optimisation not supported for {compiler}")
+    generate, use = _PGO_FLAGS[compiler]
+    return (
+        [f.format(Path(profile_dir).resolve()) for f in generate],
+        [f.format(Path(profile_dir).resolve()) for f in use],
+    )
+
+
+def build_pgo(
+    epoch_dir: Path,
+    dims: int,
+    compiler: str,
+    photons: bool = False,
+    training_decks: Iterable[Path] = (),
+    profile_dir: Path | None = None,
+    jobs: int | None = None,
+) -> Path:
+    """Builds an Epoch executable using profile-guided optimisation.
+
+    This works in three stages. First, an instrumented executable is built. This is
+    then run on each training deck, collecting profile data in ``profile_dir``.
+    Finally, Epoch is rebuilt using the profile data. The profile data is kept so
+    that it may be reused by later builds. Returns the path to the executable, which
+    has the suffix ``_pgo``, and records the CPU flags it needs beside it.
+
+    Parameters
+    ----------
+    epoch_dir
+        Path to top level of Epoch repository
+    dims
+        Number of dimensions in build
+    compiler
+        Compiler to use for build
+    photons
+        Switch for QED features
+    training_decks
+        Input decks used to generate profile data. Each may be an ``input.deck``
+        file or a directory containing one. If empty, the existing profile data in
+        ``profile_dir`` is reused.
+    profile_dir
+        Directory in which to store profile data. Defaults to
+        ``profiles/<executable name>`` in ``epoch_dir``.
+    jobs
+        Number of parallel make jobs. Defaults to the number of CPUs.
+    """
+    epoch_dir = Path(epoch_dir)
+    if profile_dir is None:
+        profile_dir = epoch_dir / "profiles" / exe_name(dims, photons)
+    profile_dir = Path(profile_dir)
+    generate, use = pgo_flags(compiler, profile_dir)
+
+    decks = [
+        Path(d) / "input.deck" if Path(d).is_dir() else Path(d) for d in training_decks
+    ]
+    for deck in decks:
+        if not deck.is_file():
+            raise FileNotFoundError(f"Training deck {deck} not found")
+
+    if decks:
+        # Stage 1: Instrumented build. Discard any stale profile data.
+        shutil.rmtree(profile_dir, ignore_errors=True)
+        profile_dir.mkdir(parents=True)
+        instrumented = build_epoch(
+            epoch_dir,
+            dims,
+            compiler,
+            photons=photons,
+            jobs=jobs,
+            fflags=generate,
+            ldflags=generate,
+            variant="instrumented",
+        )
+
+        # Stage 2: Training runs. run_epoch expects the usual executable name.
+        with tempfile.TemporaryDirectory() as train_dir:
+            train_bin = Path(train_dir) / "bin"
+            train_bin.mkdir()
+            shutil.move(str(instrumented), str(train_bin / exe_name(dims, photons)))
+            for n, deck in enumerate(decks):
+                output = Path(train_dir) / f"run_{n}"
+                output.mkdir()
+                shutil.copyfile(deck, output / "input.deck")
+                print(f"Training run {n + 1}/{len(decks)}: {deck}")
+                run_epoch(dims, output, photons=photons, bin_dir=train_bin)
+
+    if not profile_dir.is_dir() or not any(profile_dir.rglob("*")):
+        raise FileNotFoundError(f"No profile data found in {profile_dir}")
+
+    # Stage 3: Optimised build
+    exe = build_epoch(
+        epoch_dir,
+        dims,
+        compiler,
+        photons=photons,
+        jobs=jobs,
+        fflags=use,
+        ldflags=use,
+        variant="pgo",
+    )
+    write_cpu_flags(exe, required_cpu_flags(use))
+    return exe
 
 
 def main():
     """Entrypoint function for building Epoch."""
     args = parse_build_args()
-    build_epoch(Path.cwd(), args.dims, args.compiler, photons=args.photons)
+    cache = None
+    if args.cache_dir is not None:
+        cache = BuildCache(args.cache_dir, max_size=int(args.cache_size * 1024**3))
+    if args.pgo is not None:
+        build_pgo(
+            Path.cwd(),
+            args.dims,
+            args.compiler,
+            photons=args.photons,
+            training_decks=args.pgo,
+            profile_dir=args.profile_dir,
+            jobs=args.jobs,
+        )
+    elif args.all or args.march:
+        variants = None if args.all else [(args.dims, args.photons)]
+        build_matrix(
+            Path.cwd(),
+            args.compiler,
+            variants=variants,
+            jobs=args.jobs,
+            cache=cache,
+            marches=args.march or [BASELINE],
+        )
+    else:
+        build_epoch(
+            Path.cwd(),
+            args.dims,
+            args.compiler,
+            photons=args.photons,
+            jobs=args.jobs,
+            cache=cache,
+        )
+    if args.export is not None:
+        bundle = export_bundle(
+            Path.cwd() / "bin", args.export, include=args.export_include
+        )
+        print(bundle.report())
+        if args.check_bundle:
+            failed = {
+                exe: error for exe, error in check_bundle(bundle).items() if error
+            }
+            for exe, error in failed.items():
+                print(f"{exe.name} doesn't start in {bundle.root}: {error}")
+            if failed:
+                raise SystemExit(1)
+            print(f"All executables start in {bundle.root}")
@@ -0,0 +1,404 @@
+import json
+import os
+import re
+import shutil
+import struct
+import subprocess
+import sys
+import sysconfig
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from .resources import format_bytes
+from .utils import CPU_FLAGS_SUFFIX
+
+#: Program header types
+_PT_LOAD, _PT_DYNAMIC, _PT_INTERP = 1, 2, 3
+
+#: Dynamic section tags
+_DT_NULL, _DT_NEEDED, _DT_STRTAB, _DT_RPATH, _DT_RUNPATH = 0, 1, 5, 15, 29
+
+#: Directories searched by the dynamic loader without being told, such as
+#: '/usr/lib64' and '/lib/x86_64-linux-gnu'
+_SYSTEM_DIR = re.compile(r"^/(usr/)?lib(32|64)?(/[^/]+-linux-gnu\w*)?$")
+
+#: Library directories searched after the loader's cache, in order
+_DEFAULT_DIRS = ("/lib64", "/usr/lib64", "/lib", "/usr/lib")
+
+#: Parts of the standard library that run_epoch doesn't need. Extension modules
+#: are matched by the name before their suffix.
+_STDLIB_EXCLUDE = frozenset(
+    (
+        "__pycache__",
+        "_tkinter",
+        "dist-packages",
+        "ensurepip",
+        "idlelib",
+        "lib2to3",
+        "site-packages",
+        "test",
+        "tkinter",
+        "turtledemo",
+    )
+)
+
+#: Script started by the image, in place of the one installed by pip
+_ENTRY_POINT = """\
+#!{python}
+import sys
+
+sys.path.insert(0, "{path}")
+from epoch_containers.run_epoch import main
+
+sys.exit(main())
+"""
+
+#: File in the bundle listing its contents
+MANIFEST = "etc/epoch_bundle.json"
+
+
+@dataclass
+class ElfInfo:
+    """What the dynamic loader needs to start an ELF file."""
+
+    elf_class: int
+    machine: int
+    interpreter: str | None = None
+    needed: list[str] = field(default_factory=list)
+    rpath: list[str] = field(default_factory=list)
+    runpath: list[str] = field(default_factory=list)
+
+
+def read_elf(path: Path) -> ElfInfo | None:
+    """Read the interpreter, needed libraries and search paths of an ELF file.
+
+    Returns ``None`` if ``path`` isn't an ELF file.
+    """
+    with Path(path).open("rb") as f:
+        data = f.read()
+    if data[:4] != b"\x7fELF" or len(data) < 64:
+        return None
+    elf_class, byteorder = data[4], "<" if data[5] == 1 else ">"
+    if elf_class == 2:
+        header = struct.unpack_from(f"{byteorder}HHIQQQIHHHHHH", data, 16)
+        phdr_fmt, dyn_fmt = f"{byteorder}IIQQQQQQ", f"{byteorder}qQ"
+    else:
+        header = struct.unpack_from(f"{byteorder}HHIIIIIHHHHHH", data, 16)
+        phdr_fmt, dyn_fmt = f"{byteorder}IIIIIIII", f"{byteorder}iI"
+    machine, phoff, phentsize, phnum = header[1], header[4], header[8], header[9]
+    info = ElfInfo(elf_class, machine)
+
+    loads = []
+    dynamic = None
+    for index in range(phnum):
+        values = struct.unpack_from(phdr_fmt, data, phoff + index * phentsize)
+        if elf_class == 2:
+            kind, _, offset, vaddr, _, filesz = values[:6]
+        else:
+            kind, offset, vaddr, _, filesz = values[:5]
+        if kind == _PT_LOAD:
+            loads.append((vaddr, offset, filesz))
+        elif kind == _PT_DYNAMIC:
+            dynamic = (offset, filesz)
+        elif kind == _PT_INTERP:
+            info.interpreter = data[offset : offset + filesz].rstrip(b"\0").decode()
+    if dynamic is None:
+        return info
+
+    entries = []
+    size = struct.calcsize(dyn_fmt)
+    for offset in range(dynamic[0], dynamic[0] + dynamic[1], size):
+        tag, value = struct.unpack_from(dyn_fmt, data, offset)
+        if tag == _DT_NULL:
+            break
+        entries.append((tag, value))
+    strtab = next((value for tag, value in entries if tag == _DT_STRTAB), None)
+    if strtab is None:
+        return info
+    # The string table is given by its address once loaded
+    for vaddr, offset, filesz in loads:
+        if vaddr <= strtab < vaddr + filesz:
+            strtab = strtab - vaddr + offset
+            break
+
+    def string(position: int) -> str:
+        end = data.index(b"\0", strtab + position)
+        return data[strtab + position : end].decode()
+
+    for tag, value in entries:
+        if tag == _DT_NEEDED:
+            info.needed.append(string(value))
+        elif tag == _DT_RPATH:
+            info.rpath.extend(string(value).split(":"))
+        elif tag == _DT_RUNPATH:
+            info.runpath.extend(string(value).split(":"))
+    return info
+
+
+def loader_cache() -> dict[str, list[Path]]:
+    """Read the libraries known to the dynamic loader's cache, from 'ldconfig -p'."""
+    try:
+        result = subprocess.run(
+            ["ldconfig", "-p"], capture_output=True, text=True, check=False
+        )
+    except OSError:
+        return {}
+    found: dict[str, list[Path]] = {}
+    for line in result.stdout.splitlines():
+        if (match := re.match(r"^\s+(\S+) \(.*\) => (\S+)$", line)) is not None:
+            found.setdefault(match[1], []).append(Path(match[2]))
+    return found
+
+
+class LibraryResolver:
+    """Finds libraries the way the dynamic loader does.
+
+    Libraries are searched for in the ``DT_RPATH`` of the object loading them, if
+    it has no ``DT_RUNPATH``, then ``LD_LIBRARY_PATH``, ``DT_RUNPATH``, the loader's
+    cache and finally the default directories. Only libraries of the same class
+    and machine as the object loading them are used.
+
+    Parameters
+    ----------
+    cache
+        Libraries in the loader's cache. Read from 'ldconfig -p' by default.
+    library_path
+        Directories from ``LD_LIBRARY_PATH``. Read from the environment by default.
+    """
+
+    def __init__(
+        self,
+        cache: dict[str, list[Path]] | None = None,
+        library_path: list[str] | None = None,
+    ) -> None:
+        self.cache = loader_cache() if cache is None else cache
+        if library_path is None:
+            library_path = os.environ.get("LD_LIBRARY_PATH", "").split(":")
+        self.library_path = [d for d in library_path if d]
+
+    def _matches(self, path: Path, info: ElfInfo) -> bool:
+        try:
+            found = read_elf(path)
+        except OSError:
+            return False
+        return found is not None and (found.elf_class, found.machine) == (
+            info.elf_class,
+            info.machine,
+        )
+
+    def find(self, name: str, info: ElfInfo, origin: Path) -> Path | None:
+        """Find the library ``name`` needed by an object in ``origin``."""
+        if "/" in name:
+            return Path(name) if Path(name).is_file() else None
+        dirs = [] if info.runpath else list(info.rpath)
+        dirs += self.library_path + info.runpath
+        candidates = [
+            Path(
+                os.path.normpath(
+                    d.replace("$ORIGIN", str(origin)).replace("${ORIGIN}", str(origin))
+                )
+            )
+            / name
+            for d in dirs
+        ]
+        candidates += self.cache.get(name, [])
+        candidates += [Path(d) / name for d in _DEFAULT_DIRS]
+        for candidate in candidates:
+            if candidate.is_file() and self._matches(candidate, info):
+                return candidate
+        return None
+
+
+@dataclass
+class Bundle:
+    """Contents of a runtime bundle. Sizes are in bytes."""
+
+    root: Path
+    executables: list[Path] = field(default_factory=list)
+    libraries: dict[str, Path] = field(default_factory=dict)
+    missing: dict[str, list[str]] = field(default_factory=dict)
+    files: int = 0
+    size: int = 0
+
+    def report(self) -> str:
+        """Summarise the bundle, listing the libraries it includes."""
+        lines = [
+            f"Exported {len(self.executables)} executables to {self.root}: "
+            f"{self.files} files, {format_bytes(self.size)}",
+        ]
+        for name, path in sorted(self.libraries.items()):
+            lines.append(f"  {name} => {path} ({format_bytes(path.stat().st_size)})")
+        for name, needed_by in sorted(self.missing.items()):
+            lines.append(f"  {name} => not found, needed by {', '.join(needed_by)}")
+        return "\n".join(lines)
+
+
+class _Exporter:
+    """Copies files into a bundle, mirroring their paths, along with what they need."""
+
+    def __init__(self, root: Path, resolver: LibraryResolver) -> None:
+        self.bundle = Bundle(Path(root))
+        self.resolver = resolver
+        self._copied: set[Path] = set()
+
+    def target(self, path: Path) -> Path:
+        return self.bundle.root / Path(os.path.abspath(path)).relative_to("/")
+
+    def copy(self, source: Path, destination: Path | None = None) -> None:
+        """Copy a file, following links, and add the libraries it needs."""
+        destination = Path(destination or source)
+        if destination in self._copied:
+            return
+        self._copied.add(destination)
+        target = self.target(destination)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        shutil.copy2(source, target)
+        self.bundle.files += 1
+        self.bundle.size += target.stat().st_size
+        self._add_needed(Path(source))
+
+    def copy_tree(self, source: Path, exclude: frozenset[str] = frozenset()) -> None:
+        for dirpath, dirnames, filenames in os.walk(source):
+            dirnames[:] = sorted(d for d in dirnames if d not in exclude)
+            for name in sorted(filenames):
+                path = Path(dirpath) / name
+                if path.is_file() and name.split(".")[0] not in exclude:
+                    self.copy(path)
+
+    def _add_needed(self, path: Path) -> None:
+        try:
+            info = read_elf(path)
+        except OSError:
+            return
+        if info is None:
+            return
+        if info.interpreter is not None:
+            self.copy(Path(os.path.realpath(info.interpreter)), Path(info.interpreter))
+        origin = Path(os.path.realpath(path)).parent
+        for name in info.needed:
+            if name in self.bundle.libraries:
+                continue
+            found = self.resolver.find(name, info, origin)
+            if found is None:
+                self.bundle.missing.setdefault(name, []).append(path.name)
+                continue
+            self.bundle.libraries[name] = found
+            self.copy(Path(os.path.realpath(found)), found)
+            if not _SYSTEM_DIR.match(str(found.parent)):
+                # Without the loader's cache, only the default directories are found
+                link = self.bundle.root / "usr" / "lib" / name
+                link.parent.mkdir(parents=True, exist_ok=True)
+                if not link.is_symlink():
+                    link.symlink_to(os.path.abspath(found))
+
+
+def python_executable() -> Path:
+    """The Python interpreter running this, outside of any virtual environment."""
+    version = f"python{sys.version_info.major}.{sys.version_info.minor}"
+    base = Path(sys.base_prefix) / "bin" / version
+    return base if base.is_file() else Path(os.path.realpath(sys.executable))
+
+
+def export_bundle(
+    bin_dir: Path,
+    root: Path,
+    include: list[Path] | None = None,
+    python: bool = True,
+    resolver: LibraryResolver | None = None,
+) -> Bundle:
+    """Copy Epoch executables, and only what they need to run, into ``root``.
+
+    Files keep their absolute paths within ``root``, so that it can be copied to
+    the root of an empty image. For each ELF file, its interpreter and the
+    libraries it needs are found as the dynamic loader would, and copied too.
+    Libraries outside the default search path are linked from '/usr/lib', as the
+    loader's cache isn't copied. By default, the Python interpreter, its standard
+    library and this package are also copied, with a 'run_epoch' script in
+    '/usr/local/bin'. The contents are listed in 'etc/epoch_bundle.json'.
+
+    Parameters
+    ----------
+    bin_dir
+        Directory containing the 'epoch*' executables.
+    root
+        Directory in which to create the bundle.
+    include
+        Further files or directories to copy, such as the plugins loaded by MPI at
+        run time, or '/bin/sh'.
+    python
+        Switch to include Python and the run_epoch entry point.
+    resolver
+        How to find libraries. Uses the host's loader settings by default.
+    """
+    exporter = _Exporter(Path(root), resolver or LibraryResolver())
+    bundle = exporter.bundle
+    for exe in sorted(Path(bin_dir).glob("epoch*")):
+        if exe.is_file() and read_elf(exe) is not None:
+            exporter.copy(exe)
+            exporter.target(exe).chmod(0o755)
+            bundle.executables.append(exe)
+            required = exe.with_name(exe.name + CPU_FLAGS_SUFFIX)
+            if required.is_file():
+                exporter.copy(required)
+    for path in include or []:
+        if Path(path).is_dir():
+            exporter.copy_tree(Path(path))
+        else:
+            exporter.copy(Path(os.path.realpath(path)), Path(path))
+    if python:
+        exe = python_executable()
+        exporter.copy(exe)
+        exporter.copy_tree(Path(sysconfig.get_paths()["stdlib"]), _STDLIB_EXCLUDE)
+        package = Path(__file__).parent
+        exporter.copy_tree(package, frozenset(("__pycache__",)))
+        script = exporter.target(Path("/usr/local/bin/run_epoch"))
+        script.parent.mkdir(parents=True, exist_ok=True)
+        script.write_text(_ENTRY_POINT.format(python=exe, path=package.parent))
+        script.chmod(0o755)
+    # Epoch, and MPI, expect somewhere to write temporary files
+    (bundle.root / "tmp").mkdir(exist_ok=True)
+    (bundle.root / "tmp").chmod(0o1777)
+
+    manifest = bundle.root / MANIFEST
+    manifest.parent.mkdir(parents=True, exist_ok=True)
+    manifest.write_text(
+        json.dumps(
+            dict(
+                executables=[str(exe) for exe in bundle.executables],
+                libraries={name: str(path) for name, path in bundle.libraries.items()},
+                missing=bundle.missing,
+                files=bundle.files,
+                size=bundle.size,
+            ),
+            indent=2,
+        )
+    )
+    return bundle
+
+
+def check_bundle(bundle: Bundle) -> dict[Path, str | None]:
+    """Check that each executable in ``bundle`` starts with only the bundle as root.
+
+    The dynamic loader is asked to load each executable and its libraries without
+    running it, within the bundle using ``chroot``, or ``unshare`` when not root.
+    Returns the error for each executable, or ``None`` if it loads.
+    """
+    if os.geteuid() == 0:
+        prefix = ["chroot", str(bundle.root)]
+    else:
+        prefix = ["unshare", "--map-root-user", f"--root={bundle.root}"]
+    results: dict[Path, str | None] = {}
+    for exe in bundle.executables:
+        info = read_elf(exe)
+        if info is None or info.interpreter is None:
+            results[exe] = None
+            continue
+        cmd = [*prefix, info.interpreter, "--list", str(Path(os.path.abspath(exe)))]
+        try:
+            result = subprocess.run(cmd, capture_output=True, text=True, check=False)
+        except OSError as exc:
+            results[exe] = str(exc)
+            continue
+        failed = result.returncode != 0 or "not found" in result.stdout
+        results[exe] = (result.stderr or result.stdout).strip() if failed else None
+    return results
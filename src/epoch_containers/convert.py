@@ -0,0 +1,435 @@
+import argparse
+import fnmatch
+import itertools
+import json
+import math
+import os
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any
+
+from .sdf import (
+    BLOCKTYPE_PLAIN_MESH,
+    BLOCKTYPE_PLAIN_VARIABLE,
+    COMPRESSION,
+    SdfFile,
+    is_complete,
+    require_numpy,
+)
+
+#: Version of the Zarr storage specification written
+ZARR_FORMAT = 2
+
+#: Largest size of each chunk of a dump, in bytes
+_CHUNK_BYTES = 4 * 1024**2
+
+
+@dataclass
+class ArraySpec:
+    """An array in the store, filled from the same SDF variable in each dump.
+
+    ``shape`` and ``chunks`` exclude the time axis, along which there is one chunk
+    per dump.
+    """
+
+    name: str
+    id: str
+    dtype: str
+    shape: tuple[int, ...]
+    chunks: tuple[int, ...]
+    dims: list[str]
+    units: str = ""
+
+
+def array_name(id: str) -> str:
+    """Name of the array in the store holding an SDF block, such as 'grid_x'."""
+    return id.replace("/", "_")
+
+
+def chunk_shape(
+    shape: tuple[int, ...], itemsize: int, target: int = _CHUNK_BYTES
+) -> tuple[int, ...]:
+    """Choose chunks of an array no larger than ``target`` bytes.
+
+    The longest axis is halved until the chunk fits, so that chunks stay roughly
+    cubic.
+    """
+    chunks = list(shape) or [1]
+    while math.prod(chunks) * itemsize > target and max(chunks) > 1:
+        axis = chunks.index(max(chunks))
+        chunks[axis] = math.ceil(chunks[axis] / 2)
+    return tuple(chunks[: len(shape)])
+
+
+def _fill_value(dtype: str) -> Any:
+    return "NaN" if dtype[1] == "f" else 0
+
+
+def _write_json(path: Path, value: dict[str, Any]) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f"{path.name}.tmp")
+    tmp.write_text(json.dumps(value, indent=2))
+    os.replace(tmp, path)
+
+
+def _read_json(path: Path) -> dict[str, Any]:
+    return json.loads(path.read_text()) if path.is_file() else {}
+
+
+def write_array_metadata(
+    path: Path,
+    shape: tuple[int, ...],
+    chunks: tuple[int, ...],
+    dtype: str,
+    dims: list[str],
+    level: int = 1,
+    attrs: dict[str, Any] | None = None,
+) -> None:
+    """Write the '.zarray' and '.zattrs' of an array in a Zarr directory store.
+
+    Dimension names are stored in the convention used by xarray.
+    """
+    _write_json(
+        path / ".zarray",
+        dict(
+            zarr_format=ZARR_FORMAT,
+            shape=list(shape),
+            chunks=list(chunks),
+            dtype=dtype,
+            compressor=dict(id="zlib", level=level),
+            fill_value=_fill_value(dtype),
+            order="C",
+            filters=None,
+            dimension_separator=".",
+        ),
+    )
+    _write_json(path / ".zattrs", dict(_ARRAY_DIMENSIONS=dims, **(attrs or {})))
+
+
+def write_chunk(path: Path, data: bytes, level: int = 1) -> None:
+    """Compress and write a chunk, renaming it into place once complete."""
+    tmp = path.with_name(f".{path.name}.tmp")
+    tmp.write_bytes(zlib.compress(data, level))
+    os.replace(tmp, path)
+
+
+def write_array(path: Path, values: Any, dims: list[str], level: int = 1) -> None:
+    """Write a small array to the store as a single chunk."""
+    shape = tuple(values.shape)
+    chunks = tuple(max(n, 1) for n in shape)
+    write_array_metadata(path, shape, chunks, values.dtype.str, dims, level)
+    if all(shape):
+        write_chunk(path / ".".join("0" * len(shape)), values.tobytes(), level)
+
+
+def write_mesh(store: Path, name: str, edges: Any, level: int = 1) -> None:
+    """Write an axis of a mesh, as cell edges and as cell centres.
+
+    Epoch's grid variables are defined at cell centres, so the centres are named
+    after the dimension of the variables, such as 'grid_x', and the edges have
+    their own dimension, such as 'grid_x_edges'.
+    """
+    write_array(store / f"{name}_edges", edges, [f"{name}_edges"], level)
+    write_array(store / name, (edges[1:] + edges[:-1]) / 2, [name], level)
+
+
+def convert_dump(
+    path: Path, store: Path, time_index: int, arrays: list[ArraySpec], level: int = 1
+) -> list[str]:
+    """Write the variables of a single dump into the store at ``time_index``.
+
+    Variables are read a chunk at a time, so memory use is bounded by the size of a
+    chunk. Variables whose shape or type doesn't match the store are skipped.
+    Returns the names of the arrays written.
+    """
+    numpy = require_numpy()
+    sdf = SdfFile(path)
+    written = []
+    for spec in arrays:
+        variable = sdf.variables.get(spec.id)
+        if variable is None or variable.shape != spec.shape:
+            continue
+        if variable.dtype != spec.dtype:
+            continue
+        data = sdf[spec.id]
+        fill = numpy.nan if spec.dtype[1] == "f" else 0
+        grid = [range(math.ceil(n / c)) for n, c in zip(spec.shape, spec.chunks)]
+        for index in itertools.product(*grid):
+            region = tuple(
+                slice(i * c, min((i + 1) * c, n))
+                for i, c, n in zip(index, spec.chunks, spec.shape)
+            )
+            # Chunks at the edges are padded to full size
+            chunk = numpy.full(spec.chunks, fill, dtype=spec.dtype)
+            chunk[tuple(slice(0, r.stop - r.start) for r in region)] = data[region]
+            key = ".".join(str(i) for i in (time_index, *index))
+            write_chunk(store / spec.name / key, chunk.tobytes(), level)
+        written.append(spec.name)
+    return written
+
+
+def convert_step(
+    paths: list[Path],
+    store: Path,
+    time_index: int,
+    arrays: list[ArraySpec],
+    level: int = 1,
+) -> list[str]:
+    """Write the variables of every dump at the same step into the store.
+
+    Each array is written from the first dump in ``paths`` that holds it, so that
+    its chunks at ``time_index`` are written once. Returns the names of the arrays
+    written.
+    """
+    written: list[str] = []
+    for path in paths:
+        remaining = [spec for spec in arrays if spec.name not in written]
+        written.extend(convert_dump(path, store, time_index, remaining, level))
+    return written
+
+
+def find_dumps(directory: Path) -> list[Path]:
+    """Find the complete dumps in ``directory``, compressed or not."""
+    paths = sorted(Path(directory).glob("*.sdf"))
+    for suffix in COMPRESSION:
+        paths.extend(sorted(Path(directory).glob(f"*.sdf{suffix}")))
+    return [path for path in paths if is_complete(path)]
+
+
+def _selected(id: str, patterns: list[str] | None) -> bool:
+    return patterns is None or any(fnmatch.fnmatch(id, p) for p in patterns)
+
+
+def convert(
+    directory: Path,
+    store: Path,
+    variables: list[str] | None = None,
+    workers: int | None = None,
+    chunk_bytes: int = _CHUNK_BYTES,
+    level: int = 1,
+) -> list[Path]:
+    """Convert the SDF dumps in ``directory`` to a time-indexed Zarr store.
+
+    Each grid variable becomes an array indexed by time and then by its grid, so
+    that xarray can open the store with ``xarray.open_zarr``. Dumps written at the
+    same step, such as by different output blocks, share a time, and new times are
+    appended in order of step. Mesh axes are taken from the first dump converted.
+    Particle data is skipped, as the number of particles changes between dumps.
+
+    The store is updated incrementally, converting only dumps that haven't been
+    converted before, with the dumps at each step converted in parallel. Returns
+    the dumps converted. Raises ``ValueError`` if a new dump is earlier than the
+    latest step already in the store, which would leave times out of order.
+
+    Parameters
+    ----------
+    directory
+        Output directory of a run.
+    store
+        Zarr directory store to create or update.
+    variables
+        Block ids to convert, which may include wildcards such as 'e*'. By
+        default, every grid variable is converted.
+    workers
+        Number of processes converting dumps. Defaults to one per CPU.
+    chunk_bytes
+        Largest size of each chunk before compression.
+    level
+        Compression level, from 1 to 9.
+    """
+    numpy = require_numpy()
+    store = Path(store)
+    attrs = _read_json(store / ".zattrs")
+    sources: list[str] = attrs.get("sources", [])
+    steps: list[int] = attrs.get("steps", [])
+    times: list[float] = attrs.get("times", [])
+
+    new = [path for path in find_dumps(directory) if path.name not in sources]
+    if not new:
+        return []
+    dumps = sorted(
+        ((SdfFile(path), path) for path in new), key=lambda d: d[0].header.step
+    )
+    earlier = [
+        path.name
+        for sdf, path in dumps
+        if steps and sdf.header.step not in steps and sdf.header.step < max(steps)
+    ]
+    if earlier:
+        raise ValueError(
+            f"Dumps {', '.join(earlier)} are earlier than step {max(steps)}, already "
+            f"in {store}. Convert them to a new store."
+        )
+    by_step: dict[int, list[Path]] = {}
+    for sdf, path in dumps:
+        if sdf.header.step not in steps:
+            steps.append(sdf.header.step)
+            times.append(sdf.header.time)
+        by_step.setdefault(sdf.header.step, []).append(path)
+
+    _write_json(store / ".zgroup", dict(zarr_format=ZARR_FORMAT))
+    arrays: dict[str, ArraySpec] = {}
+    for name, array_attrs in _existing_arrays(store).items():
+        arrays[name] = ArraySpec(name=name, **array_attrs)
+    for sdf, _ in dumps:
+        for id, variable in sdf.variables.items():
+            name = array_name(id)
+            if name in arrays or (store / name).exists():
+                continue
+            if variable.blocktype == BLOCKTYPE_PLAIN_MESH:
+                write_mesh(store, name, numpy.array(sdf[id]), level)
+            if variable.blocktype != BLOCKTYPE_PLAIN_VARIABLE:
+                continue
+            if not _selected(id, variables):
+                continue
+            itemsize = numpy.dtype(variable.dtype).itemsize
+            arrays[name] = ArraySpec(
+                name=name,
+                id=id,
+                dtype=variable.dtype,
+                shape=variable.shape,
+                chunks=chunk_shape(variable.shape, itemsize, chunk_bytes),
+                dims=[
+                    f"{array_name(variable.mesh_id)}_{axis}"
+                    for axis in "xyz"[: len(variable.shape)]
+                ],
+                units=variable.units,
+            )
+
+    specs = list(arrays.values())
+    for spec in specs:
+        (store / spec.name).mkdir(parents=True, exist_ok=True)
+    # Dumps at the same step share chunks, so are converted by the same task
+    with ProcessPoolExecutor(workers) as pool:
+        futures = [
+            pool.submit(convert_step, paths, store, steps.index(step), specs, level)
+            for step, paths in by_step.items()
+        ]
+        for future in futures:
+            future.result()
+
+    # Only extend the arrays once every chunk has been written
+    for spec in specs:
+        write_array_metadata(
+            store / spec.name,
+            (len(steps), *spec.shape),
+            (1, *spec.chunks),
+            spec.dtype,
+            ["time", *spec.dims],
+            level,
+            dict(sdf_id=spec.id, units=spec.units, sdf_chunks=list(spec.chunks)),
+        )
+    write_array(store / "time", numpy.array(times, dtype="<f8"), ["time"], level)
+    write_array(store / "step", numpy.array(steps, dtype="<i8"), ["time"], level)
+    sources.extend(path.name for _, path in dumps)
+    _write_json(
+        store / ".zattrs", dict(sources=sorted(sources), steps=steps, times=times)
+    )
+    consolidate(store)
+    return [path for _, path in dumps]
+
+
+def _existing_arrays(store: Path) -> dict[str, dict[str, Any]]:
+    """Read the specs of time-indexed arrays already in the store."""
+    found = {}
+    for zattrs in sorted(store.glob("*/.zattrs")):
+        attrs = _read_json(zattrs)
+        if "sdf_id" not in attrs:
+            continue
+        zarray = _read_json(zattrs.with_name(".zarray"))
+        found[zattrs.parent.name] = dict(
+            id=attrs["sdf_id"],
+            dtype=zarray["dtype"],
+            shape=tuple(zarray["shape"][1:]),
+            chunks=tuple(attrs["sdf_chunks"]),
+            dims=attrs["_ARRAY_DIMENSIONS"][1:],
+            units=attrs.get("units", ""),
+        )
+    return found
+
+
+def consolidate(store: Path) -> None:
+    """Gather the metadata of the store into '.zmetadata', as zarr does.
+
+    This lets readers open the store without listing every array.
+    """
+    metadata = {}
+    for path in sorted(store.rglob(".z*")):
+        if path.name in (".zgroup", ".zattrs", ".zarray"):
+            metadata[str(path.relative_to(store))] = _read_json(path)
+    _write_json(
+        store / ".zmetadata", dict(zarr_consolidated_format=1, metadata=metadata)
+    )
+
+
+def parse_convert_args() -> argparse.Namespace:
+    """Defines command line interface for converting Epoch output."""
+
+    parser = argparse.ArgumentParser(
+        prog="convert_epoch",
+        description=(
+            "Convert the SDF dumps in an Epoch output directory to a single "
+            "compressed, chunked Zarr store, indexed by time, which can be opened "
+            "with xarray.open_zarr. Running it again only converts new dumps."
+        ),
+    )
+
+    parser.add_argument("output", type=Path, help="Output directory of the run.")
+
+    parser.add_argument(
+        "-s",
+        "--store",
+        default=None,
+        type=Path,
+        help="Zarr store to create or update. Defaults to 'epoch.zarr' in output.",
+    )
+
+    parser.add_argument(
+        "-v",
+        "--variables",
+        nargs="+",
+        default=None,
+        help="Block ids to convert, which may include wildcards, such as 'e*' 'bz'.",
+    )
+
+    parser.add_argument(
+        "-j",
+        "--workers",
+        default=None,
+        type=int,
+        help="Number of processes converting dumps. Defaults to one per CPU.",
+    )
+
+    parser.add_argument(
+        "--chunk-size",
+        default=4.0,
+        type=float,
+        help="Largest size of each chunk in MiB, before compression. Default is 4.",
+    )
+
+    parser.add_argument(
+        "--level",
+        default=1,
+        type=int,
+        choices=range(1, 10),
+        help="Compression level, from 1 (fastest) to 9 (smallest). Default is 1.",
+    )
+
+    return parser.parse_args()
+
+
+def main() -> None:
+    """Entrypoint function for converting Epoch output."""
+    args = parse_convert_args()
+    store = args.store or args.output / "epoch.zarr"
+    converted = convert(
+        args.output,
+        store,
+        variables=args.variables,
+        workers=args.workers,
+        chunk_bytes=int(args.chunk_size * 1024**2),
+        level=args.level,
+    )
+    print(f"Converted {len(converted)} new dumps to {store}")
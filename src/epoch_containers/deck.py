@@ -0,0 +1,216 @@
+import ast
+import math
+import operator
+import re
+from typing import Any, Callable
+
+_BEGIN = re.compile(r"^\s*begin\s*:\s*(\w+)", re.IGNORECASE)
+_END = re.compile(r"^\s*end\s*:\s*(\w+)", re.IGNORECASE)
+
+
+def set_block_values(text: str, block: str, values: dict[str, Any]) -> str:
+    """Set ``key = value`` assignments in the first ``block`` of an input deck.
+
+    Existing assignments are replaced, and new ones are added at the end of the
+    block. Keys with the value ``None`` are removed. If the block doesn't exist, it
+    is appended to the deck. Returns the modified deck.
+    """
+    remaining = {key.lower(): (key, value) for key, value in values.items()}
+    lines = text.splitlines(keepends=True)
+    newlines: list[str] = []
+    in_block = done = False
+    for line in lines:
+        if not done and (match := _BEGIN.match(line)):
+            in_block = match[1].lower() == block.lower()
+        elif in_block and _END.match(line):
+            newlines.extend(
+                f"  {key} = {value}\n"
+                for key, value in remaining.values()
+                if value is not None
+            )
+            in_block, done = False, True
+        elif in_block and (match := re.match(r"^\s*([\w.]+)\s*=", line)):
+            key = match[1].lower()
+            if key in remaining:
+                name, value = remaining.pop(key)
+                if value is not None:
+                    newlines.append(f"  {name} = {value}\n")
+                continue
+        newlines.append(line)
+
+    if not done and any(value is not None for _, value in remaining.values()):
+        if newlines and not newlines[-1].endswith("\n"):
+            newlines[-1] += "\n"
+        newlines.append(f"\nbegin:{block}\n")
+        newlines.extend(
+            f"  {key} = {value}\n"
+            for key, value in remaining.values()
+            if value is not None
+        )
+        newlines.append(f"end:{block}\n")
+    return "".join(newlines)
+
+
+def set_control(text: str, **values: Any) -> str:
+    """Set ``key = value`` assignments in the control block of an input deck."""
+    return set_block_values(text, "control", values)
+
+
+def deck_blocks(text: str) -> list[tuple[str, dict[str, str]]]:
+    """Get the raw ``key = value`` assignments in every block of a deck, in order.
+
+    Block names and keys are converted to lower case, and comments are removed.
+    Blocks such as 'species' may appear more than once.
+    """
+    blocks: list[tuple[str, dict[str, str]]] = []
+    values: dict[str, str] | None = None
+    for line in text.splitlines():
+        line = line.split("#", 1)[0]
+        if match := _BEGIN.match(line):
+            values = {}
+            blocks.append((match[1].lower(), values))
+        elif values is not None and _END.match(line):
+            values = None
+        elif values is not None and (
+            match := re.match(r"^\s*([\w.]+)\s*=\s*(.*?)\s*$", line)
+        ):
+            values[match[1].lower()] = match[2]
+    return blocks
+
+
+def block_values(text: str, block: str) -> dict[str, str]:
+    """Get the raw ``key = value`` assignments in the first ``block`` of a deck.
+
+    Keys are converted to lower case, and comments are removed.
+    """
+    for name, values in deck_blocks(text):
+        if name == block.lower():
+            return values
+    return {}
+
+
+def deck_dims(text: str) -> int:
+    """Infer the number of dimensions of a deck from its grid size."""
+    control = block_values(text, "control")
+    for dims, key in ((3, "nz"), (2, "ny"), (1, "nx")):
+        if key in control:
+            return dims
+    raise ValueError("Could not find grid size in control block")
+
+
+#: Constants and functions available to expressions in Epoch input decks
+_DECK_NAMES: dict[str, Any] = dict(
+    pi=math.pi,
+    kb=1.380649e-23,
+    me=9.1093837015e-31,
+    mp=1.67262192369e-27,
+    qe=1.602176634e-19,
+    c=2.99792458e8,
+    epsilon0=8.8541878128e-12,
+    mu0=1.25663706212e-6,
+    ev=1.602176634e-19,
+    kev=1.602176634e-16,
+    mev=1.602176634e-13,
+    milli=1e-3,
+    micro=1e-6,
+    micron=1e-6,
+    nano=1e-9,
+    pico=1e-12,
+    femto=1e-15,
+    atto=1e-18,
+    kilo=1e3,
+    mega=1e6,
+    giga=1e9,
+    sqrt=math.sqrt,
+    exp=math.exp,
+    log=math.log,
+    log10=math.log10,
+    abs=abs,
+    sin=math.sin,
+    cos=math.cos,
+    tan=math.tan,
+    asin=math.asin,
+    acos=math.acos,
+    atan=math.atan,
+    floor=math.floor,
+    ceil=math.ceil,
+)
+
+_BINARY_OPS: dict[type[ast.operator], Callable[[Any, Any], Any]] = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.truediv,
+    ast.Pow: operator.pow,
+}
+_UNARY_OPS: dict[type[ast.unaryop], Callable[[Any], Any]] = {
+    ast.UAdd: operator.pos,
+    ast.USub: operator.neg,
+}
+
+
+def evaluate(expr: str, names: dict[str, Any] | None = None) -> float:
+    """Evaluate a numeric expression from an input deck.
+
+    Supports arithmetic, Epoch's physical constants and unit multipliers, and
+    common maths functions. Extra ``names``, such as values from the constant
+    block, may be supplied. Raises ``ValueError`` for anything else, including
+    spatially varying expressions.
+    """
+    scope = {**_DECK_NAMES, **{k.lower(): v for k, v in (names or {}).items()}}
+
+    def _eval(node: ast.AST) -> Any:
+        if isinstance(node, ast.Expression):
+            return _eval(node.body)
+        if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)):
+            return node.value
+        if isinstance(node, ast.Name) and node.id.lower() in scope:
+            return scope[node.id.lower()]
+        if isinstance(node, ast.BinOp) and type(node.op) in _BINARY_OPS:
+            return _BINARY_OPS[type(node.op)](_eval(node.left), _eval(node.right))
+        if isinstance(node, ast.UnaryOp) and type(node.op) in _UNARY_OPS:
+            return _UNARY_OPS[type(node.op)](_eval(node.operand))
+        if isinstance(node, ast.Call) and not node.keywords:
+            func = _eval(node.func)
+            if callable(func):
+                return func(*(_eval(arg) for arg in node.args))
+        raise ValueError(f"Unsupported expression: {expr}")
+
+    try:
+        # Epoch uses '^' for powers
+        tree = ast.parse(expr.replace("^", "**").strip(), mode="eval")
+        return float(_eval(tree))
+    except (SyntaxError, TypeError, ZeroDivisionError, OverflowError) as exc:
+        raise ValueError(f"Unsupported expression: {expr}") from exc
+
+
+def evaluate_values(
+    values: dict[str, str], names: dict[str, float] | None = None
+) -> dict[str, float]:
+    """Evaluate the assignments in a block, skipping values that can't be.
+
+    Values may refer to ``names``, and to earlier values in the block, such as
+    'ny = nx'.
+    """
+    scope = dict(names or {})
+    evaluated: dict[str, float] = {}
+    for key, value in values.items():
+        try:
+            evaluated[key] = scope[key] = evaluate(value, scope)
+        except ValueError:
+            continue
+    return evaluated
+
+
+def deck_constants(text: str) -> dict[str, float]:
+    """Evaluate the constant block of a deck, skipping values that can't be."""
+    return evaluate_values(block_values(text, "constant"))
+
+
+def control_value(text: str, key: str) -> float | None:
+    """Evaluate ``key`` in the control block of a deck.
+
+    Returns ``None`` if it is missing or can't be evaluated.
+    """
+    control = evaluate_values(block_values(text, "control"), deck_constants(text))
+    return control.get(key.lower())
@@ -0,0 +1,382 @@
+import argparse
+import json
+import math
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+
+from .deck import deck_blocks, deck_constants, deck_dims, evaluate_values
+from .resources import format_bytes
+
+#: Speed of light, used for the CFL time step
+_C = 2.99792458e8
+
+#: Double precision reals per grid cell held by Epoch: fields, currents, their
+#: ghost cells and work arrays. Deliberately generous.
+_FIELD_REALS_PER_CELL = 40
+
+#: Bytes per macro-particle: position, momentum, weight and linked list pointers,
+#: plus the optical depths and energies tracked when QED is enabled.
+_PARTICLE_BYTES = 120
+_PHOTON_PARTICLE_BYTES = 40
+
+#: Memory used on each rank by the executable, MPI buffers and I/O, in bytes
+_RANK_OVERHEAD = 200 * 1024**2
+
+#: Rough throughput of a single core, in particle pushes and cell updates per second
+_PARTICLE_RATE = 4e6
+_CELL_RATE = 4e7
+
+#: Grid quantities in the output block, and how many components each dumps
+_FIELD_OUTPUTS = dict(
+    ex=1, ey=1, ez=1, bx=1, by=1, bz=1, jx=1, jy=1, jz=1, poynt_flux=3
+)
+
+#: Quantities in the output block that are derived per species when followed by
+#: '+ species'
+_DERIVED_OUTPUTS = (
+    "number_density",
+    "charge_density",
+    "mass_density",
+    "average_particle_energy",
+    "ekbar",
+    "ekflux",
+    "temperature",
+    "particles_per_cell",
+    "average_weight",
+)
+
+#: Per-particle quantities in the output block, and how many reals each dumps
+_PARTICLE_OUTPUTS = dict(
+    particles=3,
+    particle_grid=3,
+    px=1,
+    py=1,
+    pz=1,
+    vx=1,
+    vy=1,
+    vz=1,
+    charge=1,
+    mass=1,
+    particle_weight=1,
+    weight=1,
+    id=1,
+    gamma=1,
+    particle_energy=1,
+    optical_depth=1,
+    qed_energy=1,
+)
+
+
+@dataclass
+class Estimate:
+    """Resources needed to run an input deck.
+
+    Memory and dump volumes are in bytes.
+    """
+
+    dims: int
+    cells: int
+    particles: int
+    steps: int
+    dt: float | None
+    t_end: float | None
+    dumps: int
+    dump_bytes: int
+    total_dump_bytes: int
+    memory: int
+    cell_steps: float
+    particle_steps: float
+    core_seconds: float
+    species: list[str] = field(default_factory=list)
+    notes: list[str] = field(default_factory=list)
+
+
+@dataclass
+class Recommendation:
+    """Job size recommended for an estimate."""
+
+    nprocs: int
+    nodes: int
+    memory_per_rank: int
+    mem_per_cpu: str
+    walltime: float
+    notes: list[str] = field(default_factory=list)
+
+
+def is_dumped(value: str) -> bool:
+    """Whether an output block setting, such as 'always + species', dumps anything."""
+    return value.split("+")[0].strip().lower() not in ("never", "", "0", "f", "false")
+
+
+def timestep(control: dict[str, float], dims: int) -> float | None:
+    """Estimate Epoch's CFL limited time step from the grid spacing."""
+    inverse = 0.0
+    for axis in "xyz"[:dims]:
+        try:
+            extent = control[f"{axis}_max"] - control[f"{axis}_min"]
+            cells = control[f"n{axis}"]
+        except KeyError:
+            return None
+        inverse += (cells / extent) ** 2
+    return control.get("dt_multiplier", 0.95) / (_C * math.sqrt(inverse))
+
+
+def estimate(text: str, photons: bool = False) -> Estimate:
+    """Estimate the memory, dump volume and cost of running an input deck.
+
+    Particle counts assume every cell is filled, so are an upper bound for decks
+    in which the density is zero in places.
+
+    Parameters
+    ----------
+    text
+        Contents of the input deck.
+    photons
+        Switch to include the memory used by QED features.
+    """
+    dims = deck_dims(text)
+    constants = deck_constants(text)
+    blocks = deck_blocks(text)
+    raw_control = next((values for name, values in blocks if name == "control"), {})
+    control = evaluate_values(raw_control, constants)
+    notes: list[str] = []
+
+    cells = 1
+    for axis in "xyz"[:dims]:
+        if f"n{axis}" not in control:
+            raise ValueError(f"Could not evaluate n{axis} in control block")
+        cells *= int(control[f"n{axis}"])
+
+    species: list[str] = []
+    particles = 0
+    for name, values in blocks:
+        if name != "species":
+            continue
+        species.append(values.get("name", f"species{len(species) + 1}"))
+        evaluated = evaluate_values(values, {**constants, **control})
+        # Epoch accepts both the older 'npart' names and the newer 'nparticles'
+        total = evaluated.get("nparticles", evaluated.get("npart"))
+        per_cell = evaluated.get("nparticles_per_cell", evaluated.get("npart_per_cell"))
+        if total is not None:
+            particles += int(total)
+        elif per_cell is not None:
+            particles += int(per_cell * cells)
+        else:
+            notes.append(f"Could not find the number of particles of {species[-1]}")
+
+    t_end = control.get("t_end")
+    dt = timestep(control, dims)
+    if dt is None:
+        notes.append("Could not find the domain size, so the time step is unknown")
+    steps = 0
+    if t_end is not None and dt is not None:
+        steps = math.ceil(t_end / dt)
+    if "nsteps" in control and control["nsteps"] >= 0:
+        steps = min(steps, int(control["nsteps"])) if steps else int(control["nsteps"])
+    if not steps:
+        notes.append("Could not find t_end or nsteps, so the run length is unknown")
+
+    # Size of each snapshot, from the quantities listed in the output block
+    output = next((values for name, values in blocks if name == "output"), {})
+    reals = 0
+    for key, value in output.items():
+        if not is_dumped(value):
+            continue
+        if key in _FIELD_OUTPUTS:
+            reals += _FIELD_OUTPUTS[key] * cells
+        elif key in _DERIVED_OUTPUTS:
+            # '+ species' dumps each species as well as the total
+            reals += cells * (1 + len(species) if "species" in value.lower() else 1)
+        elif key in _PARTICLE_OUTPUTS:
+            reals += _PARTICLE_OUTPUTS[key] * particles
+    dump_bytes = 8 * reals
+    dumps = 0
+    output_values = evaluate_values(output, {**constants, **control})
+    if (snapshot := output_values.get("dt_snapshot")) and t_end is not None:
+        dumps = int(t_end // snapshot) + 1
+    elif (nstep := output_values.get("nstep_snapshot")) and steps:
+        dumps = steps // int(nstep) + 1
+
+    particle_bytes = _PARTICLE_BYTES + (_PHOTON_PARTICLE_BYTES if photons else 0)
+    memory = 8 * _FIELD_REALS_PER_CELL * cells + particle_bytes * particles
+    cell_steps = float(cells) * steps
+    particle_steps = float(particles) * steps
+    return Estimate(
+        dims=dims,
+        cells=cells,
+        particles=particles,
+        steps=steps,
+        dt=dt,
+        t_end=t_end,
+        dumps=dumps,
+        dump_bytes=dump_bytes,
+        total_dump_bytes=dumps * dump_bytes,
+        memory=memory,
+        cell_steps=cell_steps,
+        particle_steps=particle_steps,
+        core_seconds=cell_steps / _CELL_RATE + particle_steps / _PARTICLE_RATE,
+        species=species,
+        notes=notes,
+    )
+
+
+def recommend(
+    estimate: Estimate,
+    walltime: float = 24 * 3600,
+    cores_per_node: int = 96,
+    memory_per_core: int = 4 * 1024**3,
+    min_cells_per_rank: int = 4096,
+    headroom: float = 1.5,
+) -> Recommendation:
+    """Recommend the number of processes, nodes and memory for a job.
+
+    The fewest processes are chosen that finish within ``walltime`` and fit within
+    ``memory_per_core``. To meet ``walltime``, ranks are not given fewer than
+    ``min_cells_per_rank`` cells, beyond which communication dominates, but more
+    ranks are used when needed to fit in memory.
+
+    Parameters
+    ----------
+    estimate
+        Resources needed to run the deck.
+    walltime
+        Target wall time of the job in seconds.
+    cores_per_node
+        Cores on each node.
+    memory_per_core
+        Memory available per core, in bytes.
+    min_cells_per_rank
+        Fewest grid cells worth giving each rank.
+    headroom
+        Factor by which to increase the memory request over the estimate, to allow
+        for load imbalance.
+    """
+    by_time = math.ceil(estimate.core_seconds / walltime)
+    # Each rank needs (memory / nprocs + overhead) * headroom <= memory_per_core
+    usable = max(memory_per_core / headroom - _RANK_OVERHEAD, 1.0)
+    by_memory = math.ceil(estimate.memory / usable)
+    most = max(1, estimate.cells // min_cells_per_rank)
+    nprocs = max(1, by_memory, min(by_time, most))
+    notes = []
+    if nprocs > most:
+        notes.append(
+            f"Each rank has fewer than {min_cells_per_rank:,} cells in order to fit "
+            "in memory, so communication may dominate"
+        )
+    elif by_time > nprocs:
+        notes.append(
+            f"The job may not finish within the wall time, as more than {most:,} "
+            f"processes would give each rank fewer than {min_cells_per_rank:,} cells"
+        )
+    # Fill whole nodes once more than one is needed
+    if nprocs > cores_per_node:
+        nprocs = math.ceil(nprocs / cores_per_node) * cores_per_node
+    memory_per_rank = int(estimate.memory / nprocs + _RANK_OVERHEAD)
+    mem_per_cpu = math.ceil(memory_per_rank * headroom / 1024**2)
+    return Recommendation(
+        nprocs=nprocs,
+        nodes=math.ceil(nprocs / cores_per_node),
+        memory_per_rank=memory_per_rank,
+        mem_per_cpu=f"{math.ceil(mem_per_cpu / 1024)}G"
+        if mem_per_cpu >= 1024
+        else f"{mem_per_cpu}M",
+        walltime=estimate.core_seconds / nprocs,
+        notes=notes,
+    )
+
+
+def format_report(estimate: Estimate, recommendation: Recommendation) -> str:
+    """Describe an estimate and the recommended job size."""
+    hours = recommendation.walltime / 3600
+    lines = [
+        f"Grid: {estimate.cells:,} cells in {estimate.dims}D",
+        f"Particles: {estimate.particles:,} ({', '.join(estimate.species) or 'none'})",
+        f"Steps: {estimate.steps:,}"
+        + (f" (dt = {estimate.dt:.3g}s)" if estimate.dt is not None else ""),
+        f"Cost: {estimate.cell_steps:.3g} cell-steps, "
+        f"{estimate.particle_steps:.3g} particle-steps, "
+        f"~{estimate.core_seconds / 3600:.3g} core-hours",
+        f"Memory: {format_bytes(estimate.memory)} in total",
+        f"Dumps: {estimate.dumps} of {format_bytes(estimate.dump_bytes)}, "
+        f"{format_bytes(estimate.total_dump_bytes)} in total",
+        "",
+        f"Recommended: {recommendation.nprocs} "
+        f"process{'es' if recommendation.nprocs != 1 else ''} on "
+        f"{recommendation.nodes} node{'s' if recommendation.nodes != 1 else ''}, "
+        f"~{format_bytes(recommendation.memory_per_rank)} per rank, "
+        f"~{hours:.2g} hours",
+        f"  #SBATCH --nodes={recommendation.nodes}",
+        f"  #SBATCH --ntasks={recommendation.nprocs}",
+        f"  #SBATCH --mem-per-cpu={recommendation.mem_per_cpu}",
+    ]
+    lines.extend(f"Note: {note}" for note in [*estimate.notes, *recommendation.notes])
+    return "\n".join(lines)
+
+
+def parse_estimate_args() -> argparse.Namespace:
+    """Defines command line interface for estimating the resources of a run."""
+
+    parser = argparse.ArgumentParser(
+        prog="estimate_epoch",
+        description=(
+            "Estimate the memory, dump volume and cost of an Epoch input deck, and "
+            "recommend the number of processes, nodes and Slurm memory settings."
+        ),
+    )
+
+    parser.add_argument(
+        "deck",
+        type=Path,
+        help="An 'input.deck' file, or the directory containing it.",
+    )
+
+    parser.add_argument(
+        "--photons", action="store_true", help="Run with QED features enabled."
+    )
+
+    parser.add_argument(
+        "--walltime",
+        default=24.0,
+        type=float,
+        help="Target wall time of the job in hours. The default is 24.",
+    )
+
+    parser.add_argument(
+        "--cores-per-node",
+        default=96,
+        type=int,
+        help="Cores on each node. The default is 96.",
+    )
+
+    parser.add_argument(
+        "--mem-per-core",
+        default=4.0,
+        type=float,
+        help="Memory available per core in GiB. The default is 4.",
+    )
+
+    parser.add_argument(
+        "--json", action="store_true", help="Print the estimate as JSON."
+    )
+
+    return parser.parse_args()
+
+
+def main() -> None:
+    """Entrypoint function for estimating the resources of a run."""
+    args = parse_estimate_args()
+    deck = args.deck / "input.deck" if args.deck.is_dir() else args.deck
+    try:
+        result = estimate(deck.read_text(), photons=args.photons)
+    except ValueError as exc:
+        raise SystemExit(f"Could not estimate {deck}: {exc}")
+    recommendation = recommend(
+        result,
+        walltime=args.walltime * 3600,
+        cores_per_node=args.cores_per_node,
+        memory_per_core=int(args.mem_per_core * 1024**3),
+    )
+    if args.json:
+        print(json.dumps(dict(estimate=asdict(result), job=asdict(recommendation))))
+    else:
+        print(format_report(result, recommendation))
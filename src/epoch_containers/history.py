@@ -0,0 +1,244 @@
+import argparse
+import hashlib
+import json
+import sqlite3
+import statistics
+from contextlib import closing
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any
+
+#: Table of runs. Shared with the history recorded by run_epoch.py.
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    deck_hash TEXT,
+    output TEXT,
+    launcher TEXT,
+    identity TEXT,
+    args TEXT,
+    dims INTEGER,
+    photons INTEGER,
+    nprocs INTEGER,
+    start_time REAL,
+    end_time REAL,
+    exit_status INTEGER,
+    metrics TEXT
+)
+"""
+
+
+@dataclass
+class RunRecord:
+    """A single Epoch run stored in the history database."""
+
+    deck_hash: str
+    output: str
+    launcher: str
+    identity: str
+    dims: int
+    photons: bool
+    nprocs: int
+    start_time: float
+    end_time: float
+    exit_status: int
+    args: list[str] = field(default_factory=list)
+    metrics: dict[str, Any] = field(default_factory=dict)
+    id: int | None = None
+
+    @property
+    def duration(self) -> float:
+        return self.end_time - self.start_time
+
+
+@dataclass
+class Regression:
+    """A run that was slower than the historical median for its deck."""
+
+    run: RunRecord
+    median: float
+
+    @property
+    def ratio(self) -> float:
+        return self.run.duration / self.median
+
+
+def deck_hash(output: Path) -> str:
+    """Hash the 'input.deck' file in ``output``. Empty if there is no deck."""
+    deck = Path(output) / "input.deck"
+    if not deck.is_file():
+        return ""
+    return hashlib.sha256(deck.read_bytes()).hexdigest()
+
+
+def file_hash(path: Path) -> str:
+    """Hash a file, such as an Epoch executable, in chunks."""
+    digest = hashlib.sha256()
+    with Path(path).open("rb") as f:
+        while chunk := f.read(1 << 20):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def connect(db: Path) -> sqlite3.Connection:
+    """Open the history database, creating it if needed."""
+    Path(db).parent.mkdir(parents=True, exist_ok=True)
+    # Concurrent jobs may record runs at the same time
+    connection = sqlite3.connect(str(db), timeout=30)
+    connection.execute(_SCHEMA)
+    return connection
+
+
+def record_run(db: Path, run: RunRecord) -> int:
+    """Append ``run`` to the history database. Returns its id."""
+    with closing(connect(db)) as connection, connection:
+        cursor = connection.execute(
+            """
+            INSERT INTO runs (
+                deck_hash, output, launcher, identity, args, dims, photons, nprocs,
+                start_time, end_time, exit_status, metrics
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            (
+                run.deck_hash,
+                run.output,
+                run.launcher,
+                run.identity,
+                json.dumps(run.args),
+                run.dims,
+                int(run.photons),
+                run.nprocs,
+                run.start_time,
+                run.end_time,
+                run.exit_status,
+                json.dumps(run.metrics),
+            ),
+        )
+        run.id = cursor.lastrowid
+    return run.id or 0
+
+
+def query_runs(db: Path, deck_hash: str | None = None) -> list[RunRecord]:
+    """Read runs from the history database in the order they started."""
+    sql = "SELECT * FROM runs"
+    params: tuple[str, ...] = ()
+    if deck_hash is not None:
+        sql += " WHERE deck_hash = ?"
+        params = (deck_hash,)
+    with closing(connect(db)) as connection:
+        connection.row_factory = sqlite3.Row
+        rows = connection.execute(sql + " ORDER BY start_time, id", params).fetchall()
+    return [
+        RunRecord(
+            deck_hash=row["deck_hash"],
+            output=row["output"],
+            launcher=row["launcher"],
+            identity=row["identity"],
+            dims=row["dims"],
+            photons=bool(row["photons"]),
+            nprocs=row["nprocs"],
+            start_time=row["start_time"],
+            end_time=row["end_time"],
+            exit_status=row["exit_status"],
+            args=json.loads(row["args"] or "[]"),
+            metrics=json.loads(row["metrics"] or "{}"),
+            id=row["id"],
+        )
+        for row in rows
+    ]
+
+
+def find_regressions(
+    runs: list[RunRecord], tolerance: float = 0.1, min_history: int = 3
+) -> list[Regression]:
+    """Find runs that were slower than the median of earlier runs of the same deck.
+
+    Runs are only compared with earlier successful runs of the same deck, number of
+    dimensions, QED setting and process count.
+
+    Parameters
+    ----------
+    runs
+        Runs in the order they started.
+    tolerance
+        Fractional slowdown allowed before a run is flagged.
+    min_history
+        Number of earlier runs needed before a run is compared.
+    """
+    history: dict[tuple[str, int, bool, int], list[float]] = {}
+    regressions: list[Regression] = []
+    for run in runs:
+        if run.exit_status != 0 or not run.deck_hash:
+            continue
+        key = (run.deck_hash, run.dims, run.photons, run.nprocs)
+        previous = history.setdefault(key, [])
+        if len(previous) >= min_history:
+            median = statistics.median(previous)
+            if run.duration > median * (1 + tolerance):
+                regressions.append(Regression(run, median))
+        previous.append(run.duration)
+    return regressions
+
+
+def parse_history_args() -> argparse.Namespace:
+    """Defines command line interface for querying the run history."""
+
+    parser = argparse.ArgumentParser(
+        prog="epoch_history",
+        description="Query the history of Epoch runs and find performance regressions.",
+    )
+
+    parser.add_argument("db", type=Path, help="Path to the history database.")
+
+    subparsers = parser.add_subparsers(required=True, dest="command")
+
+    list_parser = subparsers.add_parser("list", help="List recorded runs.")
+    list_parser.add_argument(
+        "--deck", default=None, help="Only list runs with this deck hash."
+    )
+
+    compare_parser = subparsers.add_parser(
+        "compare",
+        help="Flag runs that were slower than the historical median for their deck.",
+    )
+    compare_parser.add_argument(
+        "--tolerance",
+        default=0.1,
+        type=float,
+        help="Fractional slowdown allowed before flagging a run. The default is 0.1.",
+    )
+    compare_parser.add_argument(
+        "--min-history",
+        default=3,
+        type=int,
+        help="Earlier runs needed before a run is compared. The default is 3.",
+    )
+
+    return parser.parse_args()
+
+
+def main() -> None:
+    """Entrypoint function for querying the run history."""
+    args = parse_history_args()
+    if args.command == "list":
+        for run in query_runs(args.db, deck_hash=args.deck):
+            print(
+                f"{run.id:>5} {run.deck_hash[:12]:12} {run.launcher:11} "
+                f"{run.dims}d{' photons' if run.photons else ''} "
+                f"n={run.nprocs} {run.duration:10.2f}s exit={run.exit_status} "
+                f"{run.identity}"
+            )
+    else:
+        regressions = find_regressions(
+            query_runs(args.db), args.tolerance, args.min_history
+        )
+        for regression in regressions:
+            run = regression.run
+            print(
+                f"Run {run.id} of deck {run.deck_hash[:12]} took {run.duration:.2f}s, "
+                f"{regression.ratio:.2f}x the median of {regression.median:.2f}s "
+                f"({run.identity})"
+            )
+        if regressions:
+            raise SystemExit(1)
+        print("No regressions found")
@@ -0,0 +1,346 @@
+import importlib
+import importlib.util
+import json
+import multiprocessing
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    BrokenExecutor,
+    Future,
+    ProcessPoolExecutor,
+    wait,
+)
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Any, Callable, Union
+
+from .sdf import finished_dumps
+
+#: A callback, or a reference to one such as 'package.module:function' or
+#: 'analysis.py:function'
+Callback = Union[Callable[[Path], Any], str]
+
+#: File in the output directory to which the result of each callback is appended
+RESULTS = "analysis.jsonl"
+
+#: Callbacks loaded in this process, by reference
+_loaded: dict[str, Callable[[Path], Any]] = {}
+
+
+def callback_name(callback: Callback) -> str:
+    """Name a callback in results and summaries."""
+    if isinstance(callback, str):
+        return callback
+    return f"{callback.__module__}:{callback.__qualname__}"
+
+
+def load_callback(spec: str, directory: Path | None = None) -> Callable[[Path], Any]:
+    """Find the function referred to by ``spec``.
+
+    This is either 'package.module:function', for an importable module, or
+    'path/to/file.py:function'. Relative file paths are found in ``directory``, if
+    given.
+    """
+    if spec in _loaded:
+        return _loaded[spec]
+    module_name, sep, function = spec.rpartition(":")
+    if not sep or not module_name or not function:
+        raise ValueError(f"Callback '{spec}' should be 'module:function'")
+    if module_name.endswith(".py"):
+        path = Path(module_name)
+        if directory is not None and not path.is_absolute():
+            path = directory / path
+        module_spec = importlib.util.spec_from_file_location(path.stem, path)
+        if module_spec is None or module_spec.loader is None:
+            raise ImportError(f"Can't import callbacks from {path}")
+        module = importlib.util.module_from_spec(module_spec)
+        module_spec.loader.exec_module(module)
+    else:
+        module = importlib.import_module(module_name)
+    _loaded[spec] = getattr(module, function)
+    return _loaded[spec]
+
+
+def available_memory(proc: Path = Path("/proc")) -> float:
+    """Fraction of memory that is available, read from /proc/meminfo.
+
+    Returns 1 if it can't be read.
+    """
+    fields = {}
+    try:
+        for line in (Path(proc) / "meminfo").read_text().splitlines():
+            key, _, value = line.partition(":")
+            fields[key] = int(value.split()[0])
+        return fields["MemAvailable"] / fields["MemTotal"]
+    except (OSError, KeyError, ValueError, IndexError, ZeroDivisionError):
+        return 1.0
+
+
+@dataclass
+class AnalysisResult:
+    """Outcome of one callback on one dump. Times are in seconds."""
+
+    callback: str
+    dump: str
+    seconds: float
+    result: Any = None
+    error: str | None = None
+
+
+def _lower_priority(niceness: int) -> None:
+    os.nice(niceness)
+
+
+def run_callback(
+    callback: Callback, path: Path, directory: Path | None = None
+) -> AnalysisResult:
+    """Run ``callback`` on the dump at ``path``, timing it and catching errors."""
+    start = time.perf_counter()
+    result = None
+    error = None
+    try:
+        function = (
+            load_callback(callback, directory)
+            if isinstance(callback, str)
+            else callback
+        )
+        result = function(path)
+    except Exception as exc:
+        error = f"{type(exc).__name__}: {exc}"
+    return AnalysisResult(
+        callback_name(callback),
+        str(path),
+        time.perf_counter() - start,
+        result,
+        error,
+    )
+
+
+@dataclass
+class CallbackTiming:
+    """Time taken by a callback over every dump, in seconds."""
+
+    callback: str
+    calls: int = 0
+    failures: int = 0
+    total: float = 0.0
+    longest: float = 0.0
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.calls if self.calls else 0.0
+
+    def add(self, result: AnalysisResult) -> None:
+        self.calls += 1
+        self.failures += result.error is not None
+        self.total += result.seconds
+        self.longest = max(self.longest, result.seconds)
+
+
+class AnalysisPipeline:
+    """Runs Python callbacks on each dump in an output directory as Epoch writes it.
+
+    Each callback is called with the path of a dump once Epoch has finished writing
+    it, in a pool of processes running at a lower priority than Epoch. Callbacks
+    should be functions at the top level of a module, and can open the dump with
+    :class:`~epoch_containers.sdf.SdfFile`. Whatever they return is appended to
+    'analysis.jsonl' in ``directory``, with how long they took.
+
+    So that analysis can't crowd out the run, at most ``workers`` callbacks run at
+    once, and none are started while less than ``reserve`` of memory is available.
+    Dumps wait their turn in order, and are held back from :class:`OutputManager`
+    until every callback has run on them.
+
+    Use as a context manager around a run. On exit, the callbacks are run on any
+    remaining dumps, and the time taken by each callback is printed. When a run is
+    resumed, callbacks already recorded in 'analysis.jsonl' for a dump aren't run
+    on it again.
+
+    Parameters
+    ----------
+    directory
+        Output directory of the run. Relative paths to callback files are found
+        here.
+    callbacks
+        Functions taking the path of a dump, or references to them such as
+        'package.module:function' or 'analysis.py:function'.
+    workers
+        Number of processes running callbacks.
+    reserve
+        Fraction of memory to leave for Epoch.
+    niceness
+        Amount by which to lower the priority of the workers.
+    interval
+        Seconds between checks for finished dumps.
+    proc
+        Location of the proc filesystem, used to find available memory.
+    """
+
+    def __init__(
+        self,
+        directory: Path,
+        callbacks: list[Callback],
+        workers: int = 1,
+        reserve: float = 0.2,
+        niceness: int = 10,
+        interval: float = 5.0,
+        proc: Path = Path("/proc"),
+    ) -> None:
+        self.directory = Path(directory)
+        self.callbacks = callbacks
+        self.workers = workers
+        self.reserve = reserve
+        self.niceness = niceness
+        self.interval = interval
+        self.proc = proc
+        self.timings = {
+            callback_name(c): CallbackTiming(callback_name(c)) for c in callbacks
+        }
+        self.analysed: list[Path] = []
+        self.after_run = 0
+        self.resumed = 0
+        self._seen: dict[Path, tuple[int, int]] = {}
+        self._done: set[Path] = set()
+        self._recorded = self._read_results()
+        self._queue: deque[tuple[Path, Callback]] = deque()
+        self._running: dict[Future[AnalysisResult], tuple[Path, Callback]] = {}
+        self._remaining: dict[Path, int] = {}
+        self._pool: ProcessPoolExecutor | None = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _read_results(self) -> dict[Path, set[str]]:
+        """Find the callbacks recorded for each dump by an earlier run."""
+        recorded: dict[Path, set[str]] = {}
+        results = self.directory / RESULTS
+        if not results.is_file():
+            return recorded
+        text = results.read_text()
+        if text and not text.endswith("\n"):
+            # Cut short when the earlier run was stopped, so start new results afresh
+            with results.open("a") as f:
+                f.write("\n")
+        for line in text.splitlines():
+            try:
+                result = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            path = Path(result["dump"]).resolve()
+            recorded.setdefault(path, set()).add(result["callback"])
+        return recorded
+
+    def held(self) -> set[Path]:
+        """Dumps in ``directory`` not yet analysed by every callback."""
+        with self._lock:
+            analysed = set(self.analysed)
+        return {path for path in self.directory.rglob("*.sdf") if path not in analysed}
+
+    def _collect(self) -> None:
+        for future in [future for future in self._running if future.done()]:
+            path, callback = self._running.pop(future)
+            try:
+                result = future.result()
+            except BrokenExecutor as exc:
+                # A worker died, perhaps killed for using too much memory
+                name = callback_name(callback)
+                result = AnalysisResult(name, str(path), 0.0, error=repr(exc))
+                self._pool = None
+            if result.error is not None:
+                print(
+                    f"Analysis '{result.callback}' failed on {path.name}: "
+                    f"{result.error}",
+                    flush=True,
+                )
+            self.timings[result.callback].add(result)
+            with (self.directory / RESULTS).open("a") as f:
+                f.write(json.dumps(asdict(result), default=str) + "\n")
+            with self._lock:
+                self._remaining[path] -= 1
+                if not self._remaining[path]:
+                    del self._remaining[path]
+                    self.analysed.append(path)
+
+    def _submit(self, reserve: float) -> None:
+        while self._queue and len(self._running) < self.workers:
+            if available_memory(self.proc) < reserve:
+                return
+            if self._pool is None:
+                # Forking while other threads run can deadlock, so start afresh
+                self._pool = ProcessPoolExecutor(
+                    self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_lower_priority,
+                    initargs=(self.niceness,),
+                )
+            path, callback = self._queue.popleft()
+            future = self._pool.submit(run_callback, callback, path, self.directory)
+            self._running[future] = (path, callback)
+
+    def scan(self) -> None:
+        """Queue newly finished dumps, and start callbacks while there is room."""
+        self._collect()
+        for path in finished_dumps(self.directory, self._seen):
+            if path in self._done:
+                continue
+            self._done.add(path)
+            recorded = self._recorded.get(path.resolve(), set())
+            callbacks = [c for c in self.callbacks if callback_name(c) not in recorded]
+            with self._lock:
+                if callbacks:
+                    self._remaining[path] = len(callbacks)
+                else:
+                    self.resumed += 1
+                    self.analysed.append(path)
+            self._queue.extend((path, callback) for callback in callbacks)
+        self._submit(self.reserve)
+
+    def finish(self) -> None:
+        """Run the callbacks on every queued dump, and print the time taken."""
+        start = time.perf_counter()
+        self.after_run = len(self._remaining)
+        while self._queue or self._running:
+            # Epoch has exited, so there is no need to leave memory for it
+            self._submit(reserve=0.0)
+            wait(self._running, return_when=FIRST_COMPLETED)
+            self._collect()
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+        resumed = f", {self.resumed} before resuming" if self.resumed else ""
+        print(
+            f"Analysed {len(self.analysed)} dumps{resumed}, {self.after_run} after "
+            f"Epoch finished, taking {time.perf_counter() - start:.1f}s",
+            flush=True,
+        )
+        for timing in self.timings.values():
+            print(format_timing(timing), flush=True)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.scan()
+
+    def __enter__(self) -> "AnalysisPipeline":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self._stop.set()
+        self._thread.join()
+        # Epoch has exited, so any dump that is still unchanged is finished
+        finished_dumps(self.directory, self._seen)
+        self.scan()
+        self.finish()
+
+
+def format_timing(timing: CallbackTiming) -> str:
+    """Summarise the time taken by a callback on one line."""
+    failures = f", {timing.failures} failed" if timing.failures else ""
+    return (
+        f"{timing.callback}: {timing.calls} calls{failures}, "
+        f"{timing.total:.2f}s total, {timing.mean:.2f}s mean, "
+        f"{timing.longest:.2f}s longest"
+    )
@@ -0,0 +1,378 @@
+import asyncio
+import os
+import time
+from collections import deque
+from pathlib import Path
+from typing import IO, Any, Callable, Generator, Sequence
+
+from .shutdown import STOP_FILE
+
+#: Status of a run waiting for a free slot in its :class:`Launcher`
+PENDING = "pending"
+#: Status of a run whose process has started
+RUNNING = "running"
+#: Status of a run that exited with code zero
+SUCCEEDED = "succeeded"
+#: Status of a run that exited with any other code
+FAILED = "failed"
+#: Status of a run stopped by :meth:`EpochRun.cancel`, or as its event loop shut down
+CANCELLED = "cancelled"
+#: Status of a run stopped on reaching its timeout
+TIMED_OUT = "timed out"
+
+
+def run_epoch_argv(
+    dims: int,
+    output: Path,
+    photons: bool = False,
+    nprocs: int = 1,
+    extra: Sequence[str] = (),
+) -> list[str]:
+    """Arguments to run Epoch with the run_epoch command, using mpirun if needed.
+
+    ``extra`` are further arguments to run_epoch, such as ``["--resume"]``.
+    """
+    mpirun = ["mpirun", "-n", str(nprocs)] if nprocs != 1 else []
+    photons_arg = ["--photons"] if photons else []
+    return [
+        *mpirun,
+        "run_epoch",
+        "-d",
+        str(dims),
+        "-o",
+        str(output),
+        *photons_arg,
+        *extra,
+    ]
+
+
+def docker_argv(
+    container: str,
+    output: Path,
+    dims: int,
+    photons: bool = False,
+    extra: Sequence[str] = (),
+) -> list[str]:
+    """Arguments to run Epoch in a Docker container, with ``output`` mounted."""
+    photons_arg = ["--photons"] if photons else []
+    return [
+        "docker",
+        "run",
+        "--rm",
+        "-v",
+        f"{Path(output).resolve()}:/output",
+        container,
+        "-d",
+        str(dims),
+        "-o",
+        "/output",
+        *photons_arg,
+        *extra,
+    ]
+
+
+def singularity_argv(
+    container: str,
+    output: Path,
+    dims: int,
+    photons: bool = False,
+    nprocs: int = 1,
+    srun: bool = False,
+    extra: Sequence[str] = (),
+) -> list[str]:
+    """Arguments to run Epoch in a Singularity container, with srun or mpirun."""
+    if srun:
+        run_mode = ["srun"]
+    elif nprocs != 1:
+        run_mode = ["mpirun", "-n", str(nprocs)]
+    else:
+        run_mode = []
+    return [
+        *run_mode,
+        "singularity",
+        "exec",
+        "--bind",
+        f"{Path(output).resolve()}:/output",
+        container,
+        *run_epoch_argv(dims, Path("/output"), photons, extra=extra),
+    ]
+
+
+class EpochRun:
+    """A run started as an asyncio subprocess, and the handle used to supervise it.
+
+    Standard output and error are read a line at a time, kept in :attr:`tail`, and
+    passed to ``on_line`` and ``log`` as they arrive. Awaiting the run gives its exit
+    code once it has finished, which is ``None`` if it never started. Cancelling a
+    task awaiting the run doesn't stop it; use :meth:`cancel`. Runs are usually
+    created and started by :meth:`Launcher.launch`.
+
+    A run that takes longer than ``timeout`` is stopped, as is one that is cancelled.
+    On a timeout, if the run has an ``output`` directory, Epoch is first asked to
+    write a restart dump and stop by creating its stop file. The process is then
+    sent SIGTERM, and finally SIGKILL, waiting ``grace`` seconds after each step.
+
+    Parameters
+    ----------
+    argv
+        The command to run, such as from :func:`run_epoch_argv`.
+    output
+        Output directory of the run, used to ask Epoch to stop.
+    timeout
+        Seconds after starting at which to stop the run. If ``None``, the run isn't
+        stopped.
+    grace
+        Seconds to wait for each step of stopping the run.
+    on_line
+        Called with each line of output, including its newline, such as
+        :meth:`~epoch_containers.progress.ProgressTracker.update`.
+    log
+        File to which output is written.
+    input
+        Bytes written to the standard input of the process, such as the output
+        directory for an Epoch executable.
+    cwd
+        Working directory of the process.
+    env
+        Environment of the process. Inherited by default.
+    tail
+        Number of the latest lines of output to keep.
+    """
+
+    def __init__(
+        self,
+        argv: Sequence[str],
+        output: Path | None = None,
+        timeout: float | None = None,
+        grace: float = 30.0,
+        on_line: Callable[[str], Any] | None = None,
+        log: IO[str] | None = None,
+        input: bytes | None = None,
+        cwd: Path | None = None,
+        env: dict[str, str] | None = None,
+        tail: int = 100,
+    ) -> None:
+        self.argv = [os.fspath(arg) for arg in argv]
+        self.output = Path(output) if output is not None else None
+        self.timeout = timeout
+        self.grace = grace
+        self.on_line = on_line
+        self.log = log
+        self.input = input
+        self.cwd = cwd
+        self.env = env
+        self.tail: deque[str] = deque(maxlen=tail)
+        self.status = PENDING
+        self.returncode: int | None = None
+        self.queued_time = time.time()
+        self.start_time: float | None = None
+        self.end_time: float | None = None
+        self.pid: int | None = None
+        self._cancel = asyncio.Event()
+        self._task: asyncio.Task[int | None] | None = None
+
+    def __repr__(self) -> str:
+        return f"<EpochRun {self.status} {' '.join(self.argv)!r}>"
+
+    @property
+    def done(self) -> bool:
+        """Whether the run has finished, or will never start."""
+        return self._task is not None and self._task.done()
+
+    @property
+    def waited(self) -> float | None:
+        """Seconds spent waiting for a free slot before starting."""
+        if self.start_time is None:
+            return None
+        return self.start_time - self.queued_time
+
+    @property
+    def duration(self) -> float | None:
+        """Seconds the process ran for, or has run for so far."""
+        if self.start_time is None:
+            return None
+        return (self.end_time or time.time()) - self.start_time
+
+    def start(self, limit: asyncio.Semaphore | None = None) -> None:
+        """Start supervising the run in the running event loop.
+
+        If ``limit`` is given, the process starts once it can be acquired.
+        """
+        if self._task is not None:
+            raise RuntimeError("Run has already been started")
+        self._task = asyncio.get_running_loop().create_task(self._supervise(limit))
+
+    def cancel(self) -> None:
+        """Stop the run, or stop it from starting if it is still pending."""
+        self._cancel.set()
+
+    async def wait(self) -> int | None:
+        """Wait for the run to finish. Returns its exit code."""
+        if self._task is None:
+            raise RuntimeError("Run hasn't been started")
+        return await asyncio.shield(self._task)
+
+    def __await__(self) -> Generator[Any, None, int | None]:
+        return self.wait().__await__()
+
+    async def _read(self, process: asyncio.subprocess.Process) -> None:
+        assert process.stdout is not None
+        while raw := await process.stdout.readline():
+            line = raw.decode("utf-8", errors="replace")
+            self.tail.append(line.rstrip("\n"))
+            if self.log is not None:
+                self.log.write(line)
+                self.log.flush()
+            if self.on_line is not None:
+                self.on_line(line)
+
+    async def _stop(self, process: asyncio.subprocess.Process, stop_file: bool) -> None:
+        steps = [process.terminate, process.kill]
+        if stop_file and self.output is not None:
+            steps.insert(0, (self.output / STOP_FILE).touch)
+        for step in steps:
+            if process.returncode is not None:
+                return
+            try:
+                step()
+            except ProcessLookupError:
+                return
+            try:
+                await asyncio.wait_for(asyncio.shield(process.wait()), self.grace)
+            except asyncio.TimeoutError:
+                continue
+            return
+
+    async def _supervise(self, limit: asyncio.Semaphore | None) -> int | None:
+        cancelled = asyncio.ensure_future(self._cancel.wait())
+        acquire = None
+        try:
+            if limit is not None:
+                # Runs cancelled while pending shouldn't wait for a free slot
+                acquire = asyncio.ensure_future(limit.acquire())
+                await asyncio.wait(
+                    (acquire, cancelled), return_when=asyncio.FIRST_COMPLETED
+                )
+            if self._cancel.is_set():
+                self.status = CANCELLED
+                return None
+            return await self._run(cancelled)
+        except asyncio.CancelledError:
+            self.status = CANCELLED
+            raise
+        finally:
+            cancelled.cancel()
+            if acquire is not None:
+                if not acquire.done():
+                    acquire.cancel()
+                elif not acquire.cancelled():
+                    assert limit is not None
+                    limit.release()
+
+    async def _run(self, cancelled: asyncio.Future[Any]) -> int | None:
+        process = await asyncio.create_subprocess_exec(
+            *self.argv,
+            stdin=(
+                asyncio.subprocess.PIPE
+                if self.input is not None
+                else asyncio.subprocess.DEVNULL
+            ),
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.STDOUT,
+            cwd=self.cwd,
+            env=self.env,
+        )
+        self.pid = process.pid
+        self.start_time = time.time()
+        self.status = RUNNING
+        reader = asyncio.ensure_future(self._read(process))
+        stop_file = False
+        try:
+            if self.input is not None and process.stdin is not None:
+                process.stdin.write(self.input)
+                process.stdin.close()
+            exited = asyncio.ensure_future(process.wait())
+            done, _ = await asyncio.wait(
+                (exited, cancelled),
+                timeout=self.timeout,
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+            if exited not in done:
+                exited.cancel()
+                self.status = CANCELLED if cancelled in done else TIMED_OUT
+                stop_file = self.status == TIMED_OUT
+                await self._stop(process, stop_file)
+        except asyncio.CancelledError:
+            self.status = CANCELLED
+            await self._stop(process, stop_file=False)
+            raise
+        finally:
+            # Children left running may hold the output open, so don't wait forever
+            try:
+                await asyncio.wait_for(reader, self.grace)
+            except asyncio.TimeoutError:
+                pass
+            self.end_time = time.time()
+            self.returncode = process.returncode
+            if stop_file and self.output is not None:
+                # So that a resumed run isn't stopped straight away
+                (self.output / STOP_FILE).unlink(missing_ok=True)
+        if self.status == RUNNING:
+            self.status = SUCCEEDED if self.returncode == 0 else FAILED
+        return self.returncode
+
+
+class Launcher:
+    """Starts and supervises many runs from one event loop.
+
+    Use as an async context manager. On leaving it, every run is waited for, or
+    cancelled if an exception was raised.
+
+    Parameters
+    ----------
+    limit
+        Most runs whose processes may run at once. Others wait in the order they
+        were launched. If ``None``, every run starts straight away.
+    """
+
+    def __init__(self, limit: int | None = None) -> None:
+        self.limit = limit
+        self.runs: list[EpochRun] = []
+        self._semaphore: asyncio.Semaphore | None = None
+
+    def launch(self, argv: Sequence[str], **kwargs: Any) -> EpochRun:
+        """Start a run of ``argv``. Keyword arguments are passed to :class:`EpochRun`.
+
+        Must be called from a running event loop.
+        """
+        if self.limit is not None and self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.limit)
+        run = EpochRun(argv, **kwargs)
+        run.start(self._semaphore)
+        self.runs.append(run)
+        return run
+
+    async def wait(self) -> list[int | None]:
+        """Wait for every run to finish. Returns their exit codes, in launch order."""
+        return list(await asyncio.gather(*(run.wait() for run in self.runs)))
+
+    def cancel(self) -> None:
+        """Cancel every run that hasn't finished."""
+        for run in self.runs:
+            if not run.done:
+                run.cancel()
+
+    def summary(self) -> dict[str, int]:
+        """Count the runs with each status."""
+        counts: dict[str, int] = {}
+        for run in self.runs:
+            counts[run.status] = counts.get(run.status, 0) + 1
+        return counts
+
+    async def __aenter__(self) -> "Launcher":
+        return self
+
+    async def __aexit__(self, *exc: Any) -> None:
+        if exc[0] is not None:
+            self.cancel()
+        await asyncio.gather(*(run.wait() for run in self.runs), return_exceptions=True)
@@ -0,0 +1,464 @@
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import re
+import shutil
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import IO, Any, Callable
+
+from .resources import format_bytes
+from .sdf import COMPRESSION, SdfHeader, finished_dumps, open_sdf, read_header
+
+#: Codecs that dumps can be compressed with, and the suffixes they add
+CODECS = {"gzip": ".gz", "bz2": ".bz2", "xz": ".xz"}
+
+#: File in the output directory recording the checksums of compressed dumps
+CHECKSUMS = "checksums.jsonl"
+
+#: Epoch names dumps with a prefix, taken from the output block, and a number
+_DUMP_NAME = re.compile(r"^(?P<prefix>.*?)(?P<number>\d+)\.sdf(?:\.\w+)?$")
+
+#: Bytes read and written at a time
+_CHUNK = 16 * 1024**2
+
+
+@dataclass
+class RetentionPolicy:
+    """Which finished dumps to keep.
+
+    Only the latest ``keep_restarts`` restart dumps are kept, if set. Other dumps
+    are only kept if their number is a multiple of ``keep_every``, if set, though
+    the latest dump with each prefix is always kept.
+    """
+
+    keep_restarts: int | None = None
+    keep_every: int | None = None
+
+
+@dataclass
+class CompressedDump:
+    """Record of a compressed dump. Sizes are in bytes."""
+
+    name: str
+    codec: str
+    size: int
+    compressed_size: int
+    sha256: str
+    time: float
+
+
+def _sha256(f: IO[bytes]) -> str:
+    digest = hashlib.sha256()
+    while chunk := f.read(_CHUNK):
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def compress_dump(path: Path, codec: str = "gzip", level: int = 6) -> CompressedDump:
+    """Compress a dump, replacing it with a copy such as '0001.sdf.gz'.
+
+    The compressed copy is decompressed and checked against the original before it
+    is renamed into place and the original is removed. Raises ``OSError`` if the
+    check fails, leaving the original untouched.
+    """
+    path = Path(path)
+    module = COMPRESSION[CODECS[codec]]
+    target = path.with_name(path.name + CODECS[codec])
+    partial = target.with_name(f".{target.name}.part")
+    options = dict(preset=level) if codec == "xz" else dict(compresslevel=level)
+    digest = hashlib.sha256()
+    with path.open("rb") as src, module.open(partial, "wb", **options) as dst:
+        while chunk := src.read(_CHUNK):
+            digest.update(chunk)
+            dst.write(chunk)
+    with module.open(partial, "rb") as f:
+        if _sha256(f) != digest.hexdigest():
+            partial.unlink()
+            raise OSError(f"Compressed copy of {path} failed verification")
+    os.replace(partial, target)
+    shutil.copystat(path, target)
+    record = CompressedDump(
+        name=path.name,
+        codec=codec,
+        size=path.stat().st_size,
+        compressed_size=target.stat().st_size,
+        sha256=digest.hexdigest(),
+        time=time.time(),
+    )
+    path.unlink()
+    return record
+
+
+def decompress_dump(path: Path) -> Path:
+    """Restore a compressed dump, such as a restart dump to resume from.
+
+    The compressed copy is kept. Returns the decompressed dump.
+    """
+    path = Path(path)
+    target = path.with_suffix("")
+    partial = target.with_name(f".{target.name}.part")
+    with open_sdf(path) as src, partial.open("wb") as dst:
+        shutil.copyfileobj(src, dst, _CHUNK)
+    os.replace(partial, target)
+    return target
+
+
+def read_checksums(directory: Path) -> dict[str, CompressedDump]:
+    """Read the records of dumps compressed in ``directory``, by name."""
+    path = Path(directory) / CHECKSUMS
+    if not path.is_file():
+        return {}
+    records = {}
+    for line in path.read_text().splitlines():
+        if line.strip():
+            record = CompressedDump(**json.loads(line))
+            records[record.name] = record
+    return records
+
+
+def verify_dumps(directory: Path) -> list[Path]:
+    """Check that compressed dumps decompress to what was originally written.
+
+    Returns the dumps that fail, either because they are corrupt or have no
+    checksum recorded.
+    """
+    directory = Path(directory)
+    records = read_checksums(directory)
+    failed = []
+    for suffix in COMPRESSION:
+        for path in sorted(directory.rglob(f"*.sdf{suffix}")):
+            record = records.get(path.with_suffix("").name)
+            try:
+                with open_sdf(path) as f:
+                    ok = record is not None and _sha256(f) == record.sha256
+            except (OSError, EOFError):
+                ok = False
+            if not ok:
+                failed.append(path)
+    return failed
+
+
+def open_files(proc: Path = Path("/proc")) -> set[Path]:
+    """Find files held open by any process that can be inspected.
+
+    Processes in other containers, or belonging to other users, are not seen.
+    """
+    found = set()
+    for fd in Path(proc).glob("[0-9]*/fd/*"):
+        try:
+            target = os.readlink(fd)
+        except OSError:
+            continue
+        if target.startswith("/"):
+            found.add(Path(target))
+    return found
+
+
+def expired(dumps: dict[Path, SdfHeader], policy: RetentionPolicy) -> list[Path]:
+    """Choose the dumps that ``policy`` doesn't keep."""
+    restarts = sorted(
+        (header.step, path) for path, header in dumps.items() if header.restart
+    )
+    remove: list[Path] = []
+    if policy.keep_restarts is not None:
+        stale = max(len(restarts) - policy.keep_restarts, 0)
+        remove.extend(path for _, path in restarts[:stale])
+    if not policy.keep_every:
+        return remove
+    latest: dict[str, tuple[int, Path]] = {}
+    numbered = []
+    for path, header in dumps.items():
+        if header.restart or (match := _DUMP_NAME.match(path.name)) is None:
+            continue
+        numbered.append((int(match["number"]), path))
+        key = str(path.parent / match["prefix"])
+        latest[key] = max(latest.get(key, (header.step, path)), (header.step, path))
+    newest = {path for _, path in latest.values()}
+    remove.extend(
+        path
+        for number, path in sorted(numbered)
+        if number % policy.keep_every and path not in newest
+    )
+    return remove
+
+
+class OutputManager:
+    """Compresses and prunes the dumps in an output directory as Epoch writes them.
+
+    Only dumps that Epoch has finished with are touched: they must be complete,
+    unchanged between scans, and not held open by any process. Finished dumps are
+    compressed in a pool of processes, other than restart dumps, which Epoch can't
+    resume from once compressed. Dumps that ``policy`` doesn't keep are removed.
+    The checksum of each compressed dump is recorded in 'checksums.jsonl'.
+
+    Use as a context manager around a run to scan every ``interval`` seconds in
+    the background, finishing with a final scan, or call :meth:`run_once` after a
+    run.
+
+    Parameters
+    ----------
+    directory
+        Output directory of the run.
+    codec
+        One of 'gzip', 'bz2' or 'xz', or ``None`` to only apply ``policy``.
+    level
+        Compression level, from 1 to 9.
+    policy
+        Which dumps to keep.
+    workers
+        Number of processes compressing dumps.
+    interval
+        Seconds between scans in the background.
+    proc
+        Location of the proc filesystem, used to find open files.
+    hold
+        Returns dumps that are still needed, such as by in-situ analysis, which are
+        left alone until a later scan.
+    """
+
+    def __init__(
+        self,
+        directory: Path,
+        codec: str | None = "gzip",
+        level: int = 6,
+        policy: RetentionPolicy | None = None,
+        workers: int = 1,
+        interval: float = 30.0,
+        proc: Path = Path("/proc"),
+        hold: Callable[[], set[Path]] | None = None,
+    ) -> None:
+        if codec is not None and codec not in CODECS:
+            raise ValueError(f"Unknown codec '{codec}', choose from {list(CODECS)}")
+        self.directory = Path(directory)
+        self.codec = codec
+        self.level = level
+        self.policy = policy or RetentionPolicy()
+        self.workers = workers
+        self.interval = interval
+        self.proc = proc
+        self.hold = hold
+        self.compressed: list[CompressedDump] = []
+        self.removed: list[Path] = []
+        self._seen: dict[Path, tuple[int, int]] = {}
+        self._headers: dict[Path, tuple[tuple[int, int], SdfHeader]] = {}
+        self._pending: dict[Path, Future[CompressedDump]] = {}
+        self._pool: ProcessPoolExecutor | None = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def dumps(self) -> dict[Path, SdfHeader]:
+        """Find finished and compressed dumps, with their headers.
+
+        Headers are kept between scans while a dump's size and modification time are
+        unchanged, so that compressed dumps aren't decompressed every time.
+        """
+        busy = open_files(self.proc)
+        held = self.hold() if self.hold is not None else set()
+        found = {}
+        paths = [
+            path
+            for path in finished_dumps(self.directory, self._seen)
+            if path.resolve() not in busy
+            and path not in self._pending
+            and path not in held
+        ]
+        for suffix in COMPRESSION:
+            paths.extend(sorted(self.directory.rglob(f"*.sdf{suffix}")))
+        headers = {}
+        for path in paths:
+            try:
+                stat = path.stat()
+                signature = (stat.st_size, stat.st_mtime_ns)
+                cached = self._headers.get(path)
+                if cached is not None and cached[0] == signature:
+                    header = cached[1]
+                else:
+                    with open_sdf(path) as f:
+                        header = read_header(f)
+            except (OSError, ValueError, EOFError):
+                continue
+            found[path] = header
+            headers[path] = (signature, header)
+        self._headers = headers
+        return found
+
+    def _collect(self, wait: bool = False) -> None:
+        for path, future in list(self._pending.items()):
+            if not wait and not future.done():
+                continue
+            del self._pending[path]
+            try:
+                record = future.result()
+            except OSError as exc:
+                print(f"Failed to compress {path}: {exc}", flush=True)
+                continue
+            self.compressed.append(record)
+            with (self.directory / CHECKSUMS).open("a") as f:
+                f.write(json.dumps(asdict(record)) + "\n")
+
+    def scan(self) -> None:
+        """Prune dumps, and start compressing any newly finished."""
+        self._collect()
+        dumps = self.dumps()
+        for path in expired(dumps, self.policy):
+            path.unlink(missing_ok=True)
+            self.removed.append(path)
+            del dumps[path]
+        if self.codec is None:
+            return
+        for path, header in dumps.items():
+            if path.suffix != ".sdf" or header.restart:
+                continue
+            if self._pool is None:
+                # Forking while other threads run can deadlock, so start afresh
+                context = multiprocessing.get_context("spawn")
+                self._pool = ProcessPoolExecutor(self.workers, mp_context=context)
+            self._pending[path] = self._pool.submit(
+                compress_dump, path, self.codec, self.level
+            )
+
+    def finish(self) -> None:
+        """Wait for compression to finish, and print a summary."""
+        self._collect(wait=True)
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+        size = sum(record.size for record in self.compressed)
+        compressed = sum(record.compressed_size for record in self.compressed)
+        print(
+            f"Compressed {len(self.compressed)} dumps from {format_bytes(size)} to "
+            f"{format_bytes(compressed)}, removed {len(self.removed)} dumps",
+            flush=True,
+        )
+
+    def run_once(self, settle: float = 1.0) -> None:
+        """Scan twice, ``settle`` seconds apart, and wait for compression to finish."""
+        self.dumps()
+        time.sleep(settle)
+        self.scan()
+        self.finish()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.scan()
+
+    def __enter__(self) -> "OutputManager":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self._stop.set()
+        self._thread.join()
+        # Epoch has exited, so any dump that is still unchanged is finished
+        self.dumps()
+        self.scan()
+        self.finish()
+
+
+def parse_lifecycle_args() -> argparse.Namespace:
+    """Defines command line interface for managing Epoch output."""
+
+    parser = argparse.ArgumentParser(
+        prog="compress_epoch",
+        description=(
+            "Compress the finished dumps in an Epoch output directory, and remove "
+            "those no longer needed. Restart dumps are never compressed."
+        ),
+    )
+
+    parser.add_argument("output", type=Path, help="Output directory of the run.")
+
+    parser.add_argument(
+        "--codec",
+        default="gzip",
+        choices=[*CODECS, "none"],
+        help="Compression to use, or 'none' to only remove dumps. Default is gzip.",
+    )
+
+    parser.add_argument(
+        "--level",
+        default=6,
+        type=int,
+        choices=range(1, 10),
+        help="Compression level, from 1 (fastest) to 9 (smallest). The default is 6.",
+    )
+
+    parser.add_argument(
+        "--keep-restarts",
+        default=None,
+        type=int,
+        help="Remove all but the latest this many restart dumps.",
+    )
+
+    parser.add_argument(
+        "--keep-every",
+        default=None,
+        type=int,
+        help=(
+            "Remove dumps other than restart dumps, unless their number is a "
+            "multiple of this. The latest dump is always kept."
+        ),
+    )
+
+    parser.add_argument(
+        "-j",
+        "--workers",
+        default=1,
+        type=int,
+        help="Number of processes compressing dumps. The default is 1.",
+    )
+
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="Keep scanning for finished dumps until interrupted, alongside a run.",
+    )
+
+    parser.add_argument(
+        "--interval",
+        default=30.0,
+        type=float,
+        help="Seconds between scans with --watch. The default is 30.",
+    )
+
+    parser.add_argument(
+        "--verify",
+        action="store_true",
+        help="Check compressed dumps against their checksums, instead of compressing.",
+    )
+
+    return parser.parse_args()
+
+
+def main() -> None:
+    """Entrypoint function for managing Epoch output."""
+    args = parse_lifecycle_args()
+    if args.verify:
+        failed = verify_dumps(args.output)
+        for path in failed:
+            print(f"Failed verification: {path}")
+        raise SystemExit(1 if failed else 0)
+
+    manager = OutputManager(
+        args.output,
+        codec=None if args.codec == "none" else args.codec,
+        level=args.level,
+        policy=RetentionPolicy(args.keep_restarts, args.keep_every),
+        workers=args.workers,
+        interval=args.interval,
+    )
+    if not args.watch:
+        manager.run_once()
+        return
+    try:
+        with manager:
+            while True:
+                time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,225 @@
+import json
+import re
+import subprocess
+import sys
+import time
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import IO, Any
+
+from .resources import ResourceSampler
+
+#: Line written by Epoch every ``stdout_frequency`` steps
+_PROGRESS = re.compile(
+    r"^\s*Time\s+(?P<time>[-+.\dEeDd]+)\s*,?\s*and\s+iteration\s+(?P<step>\d+)"
+    r"\s+after\s+(?P<walltime>.+?)\s*$"
+)
+#: Line written by Epoch on completion
+_RUNTIME = re.compile(r"Final runtime of core\s*=\s*(?P<walltime>.+?)\s*$")
+#: Epoch time strings, in either '1d 2h 3m 4.5s' or '01:02:03.4' format
+_DHMS = re.compile(
+    r"^(?:(?P<d>\d+)d)?\s*(?:(?P<h>\d+)h)?\s*(?:(?P<m>\d+)m)?\s*(?P<s>[\d.]+)s$"
+)
+_COLONS = re.compile(r"^(?:(?P<d>\d+)[d:]\s*)?(?P<h>\d+):(?P<m>\d+):(?P<s>[\d.]+)$")
+
+
+@dataclass
+class Progress:
+    """A progress update from Epoch's standard output."""
+
+    step: int
+    time: float
+    walltime: float | None
+
+
+def parse_walltime(text: str) -> float | None:
+    """Convert an Epoch time string to seconds. Returns ``None`` if unrecognised."""
+    text = text.strip()
+    for pattern in (_DHMS, _COLONS):
+        if match := pattern.match(text):
+            parts = {k: float(v) if v else 0.0 for k, v in match.groupdict().items()}
+            return ((parts["d"] * 24 + parts["h"]) * 60 + parts["m"]) * 60 + parts["s"]
+    try:
+        return float(text.removesuffix("s"))
+    except ValueError:
+        return None
+
+
+def parse_progress(line: str) -> Progress | None:
+    """Parse an Epoch progress line. Returns ``None`` for any other line."""
+    if (match := _PROGRESS.match(line)) is None:
+        return None
+    try:
+        # Fortran may write exponents with 'D'
+        time = float(match["time"].upper().replace("D", "E"))
+    except ValueError:
+        return None
+    return Progress(int(match["step"]), time, parse_walltime(match["walltime"]))
+
+
+def parse_runtime(line: str) -> float | None:
+    """Parse Epoch's final runtime line. Returns ``None`` for any other line."""
+    if (match := _RUNTIME.search(line)) is None:
+        return None
+    return parse_walltime(match["walltime"])
+
+
+@dataclass
+class Throughput:
+    """Rates computed from a sequence of Epoch progress updates."""
+
+    step: int
+    time: float
+    walltime: float
+    steps_per_second: float | None
+    sim_time_per_second: float | None
+    eta: float | None
+    t_end: float | None
+
+
+def format_duration(seconds: float | None) -> str:
+    """Format a duration in seconds as 'HH:MM:SS', or '?' if unknown."""
+    if seconds is None:
+        return "?"
+    minutes, secs = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours:02d}:{minutes:02d}:{secs:02d}"
+
+
+class ProgressTracker:
+    """Computes live throughput from Epoch's standard output.
+
+    Feed each line of output to :meth:`update`. Progress lines, written by Epoch
+    every ``stdout_frequency`` steps, are used to compute steps per second, simulated
+    time per wall second, and the estimated time remaining until ``t_end``.
+
+    Parameters
+    ----------
+    t_end
+        Final simulated time of the run, used to estimate time remaining.
+    metrics
+        File to which throughput is appended as JSON lines.
+    interval
+        Minimum wall time in seconds between writes to ``metrics``.
+    stream
+        Stream on which to print a compact progress line, such as ``sys.stderr``.
+    """
+
+    def __init__(
+        self,
+        t_end: float | None = None,
+        metrics: Path | None = None,
+        interval: float = 10.0,
+        stream: IO[str] | None = None,
+    ) -> None:
+        self.t_end = t_end
+        self.metrics = metrics
+        self.interval = interval
+        self.stream = stream
+        self.first: tuple[Progress, float] | None = None
+        self.latest: Throughput | None = None
+        self._last_write = -float("inf")
+        self._start = time.monotonic()
+
+    def _walltime(self, progress: Progress) -> float:
+        # Prefer Epoch's own walltime, which excludes time spent in the launcher
+        if progress.walltime is not None:
+            return progress.walltime
+        return time.monotonic() - self._start
+
+    def update(self, line: str) -> Throughput | None:
+        """Process a line of output. Returns the throughput for progress lines."""
+        progress = parse_progress(line)
+        if progress is None:
+            return None
+        walltime = self._walltime(progress)
+        if self.first is None:
+            self.first = (progress, walltime)
+        first, first_walltime = self.first
+
+        steps_per_second = sim_time_per_second = eta = None
+        elapsed = walltime - first_walltime
+        if elapsed > 0:
+            steps_per_second = (progress.step - first.step) / elapsed
+            sim_time_per_second = (progress.time - first.time) / elapsed
+            if self.t_end is not None and sim_time_per_second > 0:
+                eta = max(self.t_end - progress.time, 0.0) / sim_time_per_second
+
+        self.latest = Throughput(
+            step=progress.step,
+            time=progress.time,
+            walltime=walltime,
+            steps_per_second=steps_per_second,
+            sim_time_per_second=sim_time_per_second,
+            eta=eta,
+            t_end=self.t_end,
+        )
+        self._print(self.latest)
+        self._write(self.latest)
+        return self.latest
+
+    def _print(self, throughput: Throughput) -> None:
+        if self.stream is None:
+            return
+        rate = throughput.steps_per_second
+        sim_rate = throughput.sim_time_per_second
+        percent = f" ({100 * throughput.time / self.t_end:.1f}%)" if self.t_end else ""
+        self.stream.write(
+            f"[epoch] step {throughput.step} t={throughput.time:.4g}s{percent}"
+            f" | {f'{rate:.3g}' if rate is not None else '?'} steps/s"
+            f" | {f'{sim_rate:.3g}' if sim_rate is not None else '?'} sim s/s"
+            f" | ETA {format_duration(throughput.eta)}\n"
+        )
+        self.stream.flush()
+
+    def _write(self, throughput: Throughput, force: bool = False) -> None:
+        now = time.monotonic()
+        if self.metrics is None or (
+            now - self._last_write < self.interval and not force
+        ):
+            return
+        self._last_write = now
+        with Path(self.metrics).open("a") as f:
+            f.write(json.dumps(dict(timestamp=time.time(), **asdict(throughput))))
+            f.write("\n")
+
+    def finish(self) -> dict[str, Any]:
+        """Write the final throughput to ``metrics``, and return it as a dict."""
+        if self.latest is None:
+            return {}
+        self._write(self.latest, force=True)
+        return asdict(self.latest)
+
+
+def stream_process(
+    cmd: list[str],
+    tracker: ProgressTracker,
+    input: bytes | None = None,
+    stdout: IO[str] | None = None,
+    sampler: ResourceSampler | None = None,
+) -> int:
+    """Run ``cmd``, passing its output through unchanged while tracking progress.
+
+    Standard error is not captured. If ``sampler`` is given, it samples the process
+    and waits for it. Returns the exit code.
+    """
+    stdout = stdout or sys.stdout
+    with subprocess.Popen(
+        cmd,
+        stdin=subprocess.PIPE if input is not None else None,
+        stdout=subprocess.PIPE,
+    ) as process:
+        if sampler is not None:
+            sampler.watch(process)
+        if input is not None and process.stdin is not None:
+            process.stdin.write(input)
+            process.stdin.close()
+        assert process.stdout is not None
+        for raw in process.stdout:
+            line = raw.decode("utf-8", errors="replace")
+            stdout.write(line)
+            stdout.flush()
+            tracker.update(line)
+        if sampler is not None:
+            sampler.wait(process)
+    return process.returncode
@@ -0,0 +1,335 @@
+import argparse
+import fnmatch
+import json
+import math
+import struct
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import TYPE_CHECKING, Any
+
+from .convert import array_name, find_dumps
+from .sdf import BLOCKTYPE_PLAIN_VARIABLE, SdfFile, require_numpy
+
+if TYPE_CHECKING:
+    import numpy as np
+
+#: Directory in the output directory holding quick-look images
+QUICKLOOK = "quicklook"
+
+#: Reductions used to combine each block of cells when downsampling. 'rms' suits
+#: oscillating fields such as a laser, which average to nearly zero.
+REDUCTIONS = ("mean", "min", "max", "rms")
+
+#: Colours at even intervals of a colour map, for signed data (blue to red) and for
+#: data of one sign (black to yellow)
+_DIVERGING: list[tuple[int, int, int]] = [
+    (33, 102, 172),
+    (247, 247, 247),
+    (178, 24, 43),
+]
+_SEQUENTIAL: list[tuple[int, int, int]] = [
+    (0, 0, 4),
+    (120, 28, 109),
+    (237, 105, 37),
+    (252, 255, 164),
+]
+
+#: Cells read at a time from the full resolution data
+_SLAB_CELLS = 16 * 1024**2
+
+
+def _reduce(
+    blocks: "np.ndarray", axes: tuple[int, ...], reduction: str
+) -> "np.ndarray":
+    numpy = require_numpy()
+    if reduction == "rms":
+        return numpy.sqrt(numpy.mean(numpy.square(blocks), axis=axes))
+    return getattr(numpy, reduction)(blocks, axis=axes)
+
+
+def block_reduce(
+    array: "np.ndarray", factor: int, reduction: str = "mean"
+) -> "np.ndarray":
+    """Downsample ``array`` by combining blocks of ``factor`` cells along each axis.
+
+    Axes that don't divide exactly are padded by repeating their last cell. The
+    array is read a slab at a time along its first axis, so a memory map of a large
+    array is never read into memory whole. Returns an array of doubles.
+    """
+    numpy = require_numpy()
+    if factor == 1:
+        return numpy.asarray(array, dtype="f8")
+    shape = [math.ceil(n / factor) for n in array.shape]
+    result = numpy.empty(shape)
+    cells = math.prod(array.shape[1:]) * factor
+    rows = max(_SLAB_CELLS // max(cells, 1), 1) * factor
+    axes = tuple(range(1, 2 * array.ndim, 2))
+    for start in range(0, array.shape[0], rows):
+        slab = numpy.asarray(array[start : start + rows], dtype="f8")
+        padding = [(0, -n % factor) for n in slab.shape]
+        if any(after for _, after in padding):
+            slab = numpy.pad(slab, padding, mode="edge")
+        blocks = slab.reshape(
+            [n for size in slab.shape for n in (size // factor, factor)]
+        )
+        result[start // factor : (start + rows) // factor] = _reduce(
+            blocks, axes, reduction
+        )
+    return result
+
+
+def pyramid(
+    array: "np.ndarray",
+    largest: int = 1024,
+    smallest: int = 32,
+    reduction: str = "mean",
+) -> list["np.ndarray"]:
+    """Downsample ``array`` repeatedly, halving its resolution each time.
+
+    The first level is reduced by a power of two until no axis is longer than
+    ``largest``, and levels are added until no axis is longer than ``smallest``.
+    """
+    longest = max(array.shape)
+    factor = 2 ** max(math.ceil(math.log2(longest / largest)), 0) if longest else 1
+    levels = [block_reduce(array, factor, reduction)]
+    while max(levels[-1].shape) > smallest:
+        levels.append(block_reduce(levels[-1], 2, reduction))
+    return levels
+
+
+def to_image(array: "np.ndarray", limits: tuple[float, float]) -> "np.ndarray":
+    """Colour a 2D array as RGB bytes, with ``x`` across and ``y`` up the image.
+
+    Data of both signs is coloured blue to red, symmetrically about zero, and data
+    of one sign black to yellow.
+    """
+    numpy = require_numpy()
+    low, high = limits
+    if low < 0 < high:
+        bound = max(-low, high)
+        low, high, colours = -bound, bound, _DIVERGING
+    else:
+        colours = _SEQUENTIAL
+    scaled = (array - low) / (high - low) if high > low else numpy.zeros(array.shape)
+    scaled = numpy.nan_to_num(numpy.clip(scaled, 0, 1))
+    stops = numpy.linspace(0, 1, len(colours))
+    image = numpy.stack(
+        [numpy.interp(scaled, stops, channel) for channel in zip(*colours)], axis=-1
+    )
+    return image.astype("u1").transpose(1, 0, 2)[::-1]
+
+
+def _png_chunk(kind: bytes, data: bytes) -> bytes:
+    chunk = kind + data
+    return struct.pack(">I", len(data)) + chunk + struct.pack(">I", zlib.crc32(chunk))
+
+
+def write_png(path: Path, image: "np.ndarray") -> None:
+    """Write an RGB image, an array of bytes shaped (rows, columns, 3), as a PNG."""
+    height, width, _ = image.shape
+    # Each row of pixels starts with its filter type, here none
+    rows = b"".join(b"\0" + row.tobytes() for row in image)
+    path.write_bytes(
+        b"\x89PNG\r\n\x1a\n"
+        + _png_chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+        + _png_chunk(b"IDAT", zlib.compress(rows, 9))
+        + _png_chunk(b"IEND", b"")
+    )
+
+
+def quicklook_dump(
+    path: Path,
+    directory: Path,
+    variables: list[str] | None = None,
+    largest: int = 1024,
+    smallest: int = 32,
+    reduction: str = "mean",
+) -> dict[str, Any]:
+    """Write pyramids of the grid variables in a dump to ``directory``.
+
+    Each level is saved as a NumPy file of single precision floats, and 2D levels
+    also as PNG images. Of 3D variables, the middle slice in ``z`` is drawn. Images
+    of every level share the colour scale of the first level. Returns an entry for
+    the index, with paths relative to ``directory``.
+    """
+    numpy = require_numpy()
+    sdf = SdfFile(path)
+    entry: dict[str, Any] = dict(
+        dump=path.name, step=sdf.header.step, time=sdf.header.time, variables={}
+    )
+    for id, variable in sdf.variables.items():
+        if variable.blocktype != BLOCKTYPE_PLAIN_VARIABLE:
+            continue
+        if variables is not None and not any(
+            fnmatch.fnmatch(id, pattern) for pattern in variables
+        ):
+            continue
+        levels = pyramid(sdf[id], largest, smallest, reduction)
+        limits = (float(numpy.nanmin(levels[0])), float(numpy.nanmax(levels[0])))
+        stem = Path(path.name.split(".")[0]) / array_name(id)
+        (directory / stem).mkdir(parents=True, exist_ok=True)
+        files = []
+        for number, level in enumerate(levels):
+            files.append(dict(shape=list(level.shape), npy=f"{stem}/{number}.npy"))
+            numpy.save(directory / stem / f"{number}.npy", level.astype("f4"))
+            if level.ndim == 3:
+                level = level[:, :, level.shape[2] // 2]
+            if level.ndim == 2:
+                files[-1]["png"] = f"{stem}/{number}.png"
+                write_png(directory / stem / f"{number}.png", to_image(level, limits))
+        entry["variables"][id] = dict(
+            shape=list(variable.shape),
+            units=variable.units,
+            min=limits[0],
+            max=limits[1],
+            levels=files,
+        )
+    return entry
+
+
+def quicklook(
+    output: Path,
+    directory: Path | None = None,
+    variables: list[str] | None = None,
+    workers: int | None = None,
+    largest: int = 1024,
+    smallest: int = 32,
+    reduction: str = "mean",
+) -> list[Path]:
+    """Write quick-look pyramids of every dump in ``output`` not already done.
+
+    Dumps are processed in parallel, and 'index.json' in ``directory`` lists every
+    dump with its step, time, and the shapes and files of each level of each
+    variable. Returns the dumps processed.
+
+    Parameters
+    ----------
+    output
+        Output directory of a run.
+    directory
+        Directory in which to write the pyramids. Defaults to 'quicklook' in
+        ``output``.
+    variables
+        Block ids to draw, which may include wildcards such as 'e*'. By default,
+        every grid variable is drawn.
+    workers
+        Number of processes drawing dumps. Defaults to one per CPU.
+    largest
+        Largest size of any axis of the first level.
+    smallest
+        Levels are added until no axis is longer than this.
+    reduction
+        How to combine each block of cells, one of 'mean', 'min', 'max' or 'rms'.
+    """
+    if reduction not in REDUCTIONS:
+        raise ValueError(f"Unknown reduction '{reduction}', choose from {REDUCTIONS}")
+    directory = Path(directory) if directory is not None else Path(output) / QUICKLOOK
+    index_path = directory / "index.json"
+    index = json.loads(index_path.read_text()) if index_path.is_file() else {}
+    entries = {entry["dump"]: entry for entry in index.get("dumps", [])}
+    new = [path for path in find_dumps(output) if path.name not in entries]
+    directory.mkdir(parents=True, exist_ok=True)
+    with ProcessPoolExecutor(workers) as pool:
+        futures = [
+            pool.submit(
+                quicklook_dump,
+                path,
+                directory,
+                variables,
+                largest,
+                smallest,
+                reduction,
+            )
+            for path in new
+        ]
+        for future in futures:
+            entry = future.result()
+            entries[entry["dump"]] = entry
+    index = dict(
+        reduction=reduction,
+        dumps=sorted(entries.values(), key=lambda e: (e["step"], e["dump"])),
+    )
+    index_path.write_text(json.dumps(index, indent=1))
+    return new
+
+
+def parse_quicklook_args() -> argparse.Namespace:
+    """Defines command line interface for drawing quick looks at Epoch output."""
+
+    parser = argparse.ArgumentParser(
+        prog="quicklook_epoch",
+        description=(
+            "Draw small, downsampled images of the grid variables in each dump of an "
+            "Epoch output directory, at several resolutions, to check a run without "
+            "copying its dumps. Running it again only draws new dumps."
+        ),
+    )
+
+    parser.add_argument("output", type=Path, help="Output directory of the run.")
+
+    parser.add_argument(
+        "-d",
+        "--directory",
+        default=None,
+        type=Path,
+        help="Directory in which to write images. Defaults to 'quicklook' in output.",
+    )
+
+    parser.add_argument(
+        "-v",
+        "--variables",
+        nargs="+",
+        default=None,
+        help="Block ids to draw, which may include wildcards, such as 'e*' 'bz'.",
+    )
+
+    parser.add_argument(
+        "-j",
+        "--workers",
+        default=None,
+        type=int,
+        help="Number of processes drawing dumps. Defaults to one per CPU.",
+    )
+
+    parser.add_argument(
+        "--largest",
+        default=1024,
+        type=int,
+        help="Largest size in cells of the most detailed image. The default is 1024.",
+    )
+
+    parser.add_argument(
+        "--smallest",
+        default=32,
+        type=int,
+        help="Largest size in cells of the least detailed image. The default is 32.",
+    )
+
+    parser.add_argument(
+        "--reduction",
+        default="mean",
+        choices=REDUCTIONS,
+        help=(
+            "How to combine each block of cells. Use 'rms' for oscillating fields, "
+            "such as a laser. The default is mean."
+        ),
+    )
+
+    return parser.parse_args()
+
+
+def main() -> None:
+    """Entrypoint function for drawing quick looks at Epoch output."""
+    args = parse_quicklook_args()
+    directory = args.directory or args.output / QUICKLOOK
+    drawn = quicklook(
+        args.output,
+        directory,
+        variables=args.variables,
+        workers=args.workers,
+        largest=args.largest,
+        smallest=args.smallest,
+        reduction=args.reduction,
+    )
+    print(f"Drew {len(drawn)} new dumps in {directory}")
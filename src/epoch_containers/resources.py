@@ -0,0 +1,356 @@
+import json
+import os
+import resource
+import subprocess
+import threading
+import time
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Any
+
+#: Clock ticks per second, used to convert CPU times in /proc/<pid>/stat
+_CLK_TCK = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+
+#: Fields read from /proc/<pid>/status, in kB or counts
+_STATUS_FIELDS = dict(
+    VmRSS="rss",
+    VmHWM="hwm",
+    voluntary_ctxt_switches="voluntary_switches",
+    nonvoluntary_ctxt_switches="involuntary_switches",
+)
+
+#: Fields read from /proc/<pid>/io, in bytes
+_IO_FIELDS = dict(read_bytes="read_bytes", write_bytes="write_bytes")
+
+
+@dataclass
+class ProcSample:
+    """Resource usage of a single process, read from /proc.
+
+    Memory is in bytes, and CPU times in seconds. Everything but ``rss`` is
+    cumulative over the life of the process.
+    """
+
+    pid: int
+    rss: int = 0
+    hwm: int = 0
+    cpu_user: float = 0.0
+    cpu_system: float = 0.0
+    voluntary_switches: int = 0
+    involuntary_switches: int = 0
+    read_bytes: int = 0
+    write_bytes: int = 0
+
+
+@dataclass
+class ResourceSummary:
+    """Resource usage of the processes launched by a single rank.
+
+    Memory is in bytes, and times in seconds. ``launch`` identifies the launch of
+    MPI ranks that the rank belonged to, and ``finished`` is the time at which
+    sampling ended, in seconds since the epoch.
+    """
+
+    rank: int
+    wall: float = 0.0
+    samples: int = 0
+    peak_rss: int = 0
+    mean_rss: float = 0.0
+    cpu_user: float = 0.0
+    cpu_system: float = 0.0
+    voluntary_switches: int = 0
+    involuntary_switches: int = 0
+    read_bytes: int = 0
+    write_bytes: int = 0
+    pids: list[int] = field(default_factory=list)
+    launch: str = ""
+    finished: float = 0.0
+
+
+def read_proc(pid: int, proc: Path = Path("/proc")) -> ProcSample | None:
+    """Read the resource usage of ``pid``. Returns ``None`` if it has exited.
+
+    I/O counters need the same permissions as ptrace, and are left at zero if
+    they can't be read.
+    """
+    base = Path(proc) / str(pid)
+    try:
+        stat = (base / "stat").read_text()
+        status = (base / "status").read_text()
+    except (FileNotFoundError, ProcessLookupError, PermissionError):
+        return None
+
+    sample = ProcSample(pid)
+    # The command name may contain spaces, so split after its closing bracket
+    fields = stat.rsplit(")", 1)[-1].split()
+    sample.cpu_user = int(fields[11]) / _CLK_TCK
+    sample.cpu_system = int(fields[12]) / _CLK_TCK
+    for line in status.splitlines():
+        key, _, value = line.partition(":")
+        if key in _STATUS_FIELDS:
+            number = int(value.split()[0])
+            setattr(
+                sample, _STATUS_FIELDS[key], number * 1024 if "kB" in value else number
+            )
+    try:
+        io = (base / "io").read_text()
+    except (FileNotFoundError, ProcessLookupError, PermissionError):
+        return sample
+    for line in io.splitlines():
+        key, _, value = line.partition(":")
+        if key in _IO_FIELDS:
+            setattr(sample, _IO_FIELDS[key], int(value))
+    return sample
+
+
+def children(pid: int, proc: Path = Path("/proc")) -> list[int]:
+    """Find the direct children of ``pid``.
+
+    Uses /proc/<pid>/task/<tid>/children where the kernel provides it, and falls
+    back to reading the parent of every process.
+    """
+    tasks = Path(proc) / str(pid) / "task"
+    child_files = list(tasks.glob("*/children"))
+    if child_files:
+        pids: list[int] = []
+        for child_file in child_files:
+            try:
+                pids.extend(int(p) for p in child_file.read_text().split())
+            except (FileNotFoundError, ProcessLookupError):
+                continue
+        return pids
+    pids = []
+    for stat in Path(proc).glob("[0-9]*/stat"):
+        try:
+            fields = stat.read_text().rsplit(")", 1)[-1].split()
+        except (FileNotFoundError, ProcessLookupError, PermissionError):
+            continue
+        if int(fields[1]) == pid:
+            pids.append(int(stat.parent.name))
+    return pids
+
+
+def descendants(pid: int, proc: Path = Path("/proc")) -> list[int]:
+    """Find every descendant of ``pid``, parents before children."""
+    found: list[int] = []
+    queue = [pid]
+    while queue:
+        for child in children(queue.pop(0), proc):
+            if child not in found:
+                found.append(child)
+                queue.append(child)
+    return found
+
+
+class ResourceSampler:
+    """Samples the resource usage of Epoch, and any processes it starts.
+
+    A background thread reads /proc for ``pid`` and every descendant at a fixed
+    interval, without starting any processes of its own. Cumulative counters are
+    kept for processes that have since exited. Use as a context manager around the
+    launch of Epoch, passing the process to :meth:`watch` once it has started and
+    to :meth:`wait` to wait for it. CPU times, context switches and peak memory are
+    then taken from ``wait4`` for the process and the children it waited for, where
+    they are more accurate. Other processes started by this one, such as those
+    compressing or analysing output, aren't counted.
+
+    Parameters
+    ----------
+    interval
+        Seconds between samples.
+    rank
+        MPI rank recorded in the summary.
+    launch
+        Identity of the launch of MPI ranks recorded in the summary, such as from
+        :func:`~epoch_containers.utils.launch_id`.
+    pid
+        Process whose tree is sampled, if already known.
+    proc
+        Location of the proc filesystem.
+    """
+
+    def __init__(
+        self,
+        interval: float = 1.0,
+        rank: int = 0,
+        launch: str = "",
+        pid: int | None = None,
+        proc: Path = Path("/proc"),
+    ) -> None:
+        self.interval = interval
+        self.pid = pid
+        self.proc = proc
+        self.summary = ResourceSummary(rank, launch=launch)
+        self.started = 0.0
+        self.latest: dict[int, ProcSample] = {}
+        self._rss_total = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._start = 0.0
+        self._rusage: resource.struct_rusage | None = None
+
+    def watch(self, process: subprocess.Popen) -> None:
+        """Sample the tree of processes rooted at ``process`` from now on."""
+        self.pid = process.pid
+
+    def wait(self, process: subprocess.Popen) -> int:
+        """Wait for ``process`` to exit, recording its usage. Returns the exit code."""
+        if process.returncode is not None:
+            return process.returncode
+        _, status, self._rusage = os.wait4(process.pid, 0)
+        # Popen won't wait for it again once its exit code is set
+        process.returncode = os.waitstatus_to_exitcode(status)
+        return process.returncode
+
+    def sample(self) -> int:
+        """Sample each process in the tree once. Returns their total resident memory."""
+        if self.pid is None:
+            return 0
+        rss = 0
+        for pid in [self.pid, *descendants(self.pid, self.proc)]:
+            if (sample := read_proc(pid, self.proc)) is not None:
+                self.latest[pid] = sample
+                rss += sample.rss
+        self.summary.samples += 1
+        self.summary.peak_rss = max(self.summary.peak_rss, rss)
+        self._rss_total += rss
+        return rss
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+    def __enter__(self) -> "ResourceSampler":
+        self._start = time.monotonic()
+        self.started = time.time()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self._stop.set()
+        self._thread.join()
+        self.finish()
+
+    def finish(self) -> ResourceSummary:
+        """Combine the samples taken into the summary."""
+        summary = self.summary
+        summary.wall = time.monotonic() - self._start
+        summary.finished = time.time()
+        summary.pids = sorted(self.latest)
+        samples = self.latest.values()
+        summary.mean_rss = self._rss_total / summary.samples if summary.samples else 0
+        summary.peak_rss = max([summary.peak_rss, *(s.hwm for s in samples)])
+        summary.cpu_user = sum(s.cpu_user for s in samples)
+        summary.cpu_system = sum(s.cpu_system for s in samples)
+        summary.voluntary_switches = sum(s.voluntary_switches for s in samples)
+        summary.involuntary_switches = sum(s.involuntary_switches for s in samples)
+        summary.read_bytes = sum(s.read_bytes for s in samples)
+        summary.write_bytes = sum(s.write_bytes for s in samples)
+
+        if (usage := self._rusage) is not None:
+            # The process and its waited-for children are counted exactly by the kernel
+            summary.cpu_user = max(summary.cpu_user, usage.ru_utime)
+            summary.cpu_system = max(summary.cpu_system, usage.ru_stime)
+            summary.voluntary_switches = max(summary.voluntary_switches, usage.ru_nvcsw)
+            summary.involuntary_switches = max(
+                summary.involuntary_switches, usage.ru_nivcsw
+            )
+            # ru_maxrss is in kB
+            summary.peak_rss = max(summary.peak_rss, usage.ru_maxrss * 1024)
+        return summary
+
+
+def aggregate(summaries: list[ResourceSummary]) -> dict[str, Any]:
+    """Combine per-rank summaries into totals and per-rank maxima."""
+    if not summaries:
+        return {}
+    totals = (
+        "cpu_user",
+        "cpu_system",
+        "voluntary_switches",
+        "involuntary_switches",
+        "read_bytes",
+        "write_bytes",
+    )
+    result: dict[str, Any] = dict(
+        ranks=len(summaries),
+        wall=max(s.wall for s in summaries),
+        peak_rss=sum(s.peak_rss for s in summaries),
+        max_rank_peak_rss=max(s.peak_rss for s in summaries),
+    )
+    for key in totals:
+        result[key] = sum(getattr(s, key) for s in summaries)
+    return result
+
+
+def rank_file(directory: Path, rank: int) -> Path:
+    """Location of the summary written by each rank."""
+    return Path(directory) / f"rank{rank}.json"
+
+
+def write_summary(summary: ResourceSummary, directory: Path) -> Path:
+    """Write the summary of a single rank as JSON."""
+    path = rank_file(directory, summary.rank)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(".tmp")
+    tmp.write_text(json.dumps(asdict(summary), indent=2))
+    # Rename, so other ranks never read a partly written file
+    os.replace(tmp, path)
+    return path
+
+
+def collect_summaries(
+    directory: Path,
+    ranks: int,
+    timeout: float = 60.0,
+    launch: str = "",
+    since: float = 0.0,
+) -> list[ResourceSummary]:
+    """Read the summaries of every rank, waiting up to ``timeout`` for stragglers.
+
+    Summaries left by an earlier run in the same directory are ignored. They are
+    those from another ``launch``, if it is known, or else those that finished
+    before ``since``.
+    """
+
+    def current(path: Path) -> ResourceSummary | None:
+        try:
+            summary = ResourceSummary(**json.loads(path.read_text()))
+        except FileNotFoundError:
+            return None
+        if launch and summary.launch != launch:
+            return None
+        if not launch and summary.finished < since:
+            return None
+        return summary
+
+    deadline = time.monotonic() + timeout
+    paths = [rank_file(directory, rank) for rank in range(ranks)]
+    while True:
+        summaries = [current(path) for path in paths]
+        if all(summaries) or time.monotonic() >= deadline:
+            return [summary for summary in summaries if summary is not None]
+        time.sleep(0.1)
+
+
+def format_bytes(size: float) -> str:
+    """Format a size in bytes with binary units."""
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if abs(size) < 1024:
+            return f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} TiB"
+
+
+def format_summary(summary: ResourceSummary | dict[str, Any]) -> str:
+    """Describe a per-rank summary, or an aggregate, in one line."""
+    values = asdict(summary) if isinstance(summary, ResourceSummary) else summary
+    label = f"rank {values['rank']}" if "rank" in values else "all ranks"
+    return (
+        f"{label}: peak RSS {format_bytes(values['peak_rss'])}, "
+        f"CPU {values['cpu_user']:.2f}s user {values['cpu_system']:.2f}s sys, "
+        f"{values['voluntary_switches']} voluntary "
+        f"{values['involuntary_switches']} involuntary switches, "
+        f"read {format_bytes(values['read_bytes'])} "
+        f"wrote {format_bytes(values['write_bytes'])}"
+    )
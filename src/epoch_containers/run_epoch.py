@@ -1,9 +1,29 @@
 import argparse
+import json
+import shutil
 import subprocess
+import sys
+import time
+from contextlib import nullcontext
 from pathlib import Path
 from textwrap import dedent
 
-from .utils import exe_name
+from .deck import control_value, set_control
+from .history import RunRecord, deck_hash, file_hash, record_run
+from .insitu import AnalysisPipeline, Callback
+from .lifecycle import CODECS, OutputManager, RetentionPolicy
+from .progress import ProgressTracker, stream_process
+from .resources import (
+    ResourceSampler,
+    aggregate,
+    collect_summaries,
+    format_summary,
+    write_summary,
+)
+from .sdf import find_restart
+from .shutdown import GracefulStop, parse_time_limit, requeue_job
+from .staging import StagedOutput, single_node
+from .utils import launch_id, mpi_rank, mpi_size, select_exe
 
 
 def parse_run_args() -> argparse.Namespace:
@@ -77,13 +97,195 @@ def parse_run_args() -> argparse.Namespace:
         "--photons", action="store_true", help="Run with QED features enabled"
     )
 
+    parser.add_argument(
+        "--history",
+        default=None,
+        type=Path,
+        help=(
+            "SQLite database in which to record this run. Query it with "
+            "'epoch_history' to find performance regressions."
+        ),
+    )
+
+    parser.add_argument(
+        "--progress",
+        action="store_true",
+        help=(
+            "Print a compact progress line, with throughput and estimated time "
+            "remaining, to standard error."
+        ),
+    )
+
+    parser.add_argument(
+        "--metrics",
+        default=None,
+        type=Path,
+        help="File to which throughput is appended as JSON lines during the run.",
+    )
+
+    parser.add_argument(
+        "--sample-resources",
+        action="store_true",
+        help=(
+            "Sample the memory, CPU time, context switches and I/O of Epoch on each "
+            "rank. Summaries are written to 'resources' in the output directory."
+        ),
+    )
+
+    parser.add_argument(
+        "--sample-interval",
+        default=1.0,
+        type=float,
+        help="Seconds between resource samples. The default is 1.",
+    )
+
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help=(
+            "Continue from the latest complete restart dump in the output directory, "
+            "or start from the beginning if there isn't one."
+        ),
+    )
+
+    parser.add_argument(
+        "--graceful",
+        action="store_true",
+        help=(
+            "On SIGTERM, SIGUSR1 or SIGUSR2, ask Epoch to write a restart dump and "
+            "stop, using its stop file. Use with Slurm's --signal option."
+        ),
+    )
+
+    parser.add_argument(
+        "--walltime",
+        default=None,
+        type=parse_time_limit,
+        help=(
+            "Time limit of the job, in seconds or Slurm's format such as '1-12:00:00'. "
+            "Epoch is asked to stop --grace seconds before it. Implies --graceful."
+        ),
+    )
+
+    parser.add_argument(
+        "--grace",
+        default=300.0,
+        type=float,
+        help=(
+            "Seconds before --walltime at which to stop, allowing time to write a "
+            "restart dump. The default is 300."
+        ),
+    )
+
+    parser.add_argument(
+        "--requeue",
+        action="store_true",
+        help="Requeue the Slurm job after a graceful stop. Use with --resume.",
+    )
+
+    parser.add_argument(
+        "--stage",
+        default=None,
+        type=Path,
+        help=(
+            "Fast node-local directory, such as $TMPDIR or /dev/shm, in which to run "
+            "Epoch. Dumps are copied to the output directory as they are finished, "
+            "and everything else at the end. Only for runs on a single node."
+        ),
+    )
+
+    parser.add_argument(
+        "--drain-interval",
+        default=10.0,
+        type=float,
+        help="Seconds between checks for finished dumps to copy. The default is 10.",
+    )
+
+    parser.add_argument(
+        "--compress",
+        default=None,
+        choices=list(CODECS),
+        help=(
+            "Compress dumps in the background once Epoch has finished writing them. "
+            "Restart dumps are not compressed. Read them with 'sdf.open_sdf'."
+        ),
+    )
+
+    parser.add_argument(
+        "--keep-restarts",
+        default=None,
+        type=int,
+        help="Remove all but the latest this many restart dumps during the run.",
+    )
+
+    parser.add_argument(
+        "--keep-every",
+        default=None,
+        type=int,
+        help=(
+            "Remove dumps other than restart dumps during the run, unless their "
+            "number is a multiple of this. The latest dump is always kept."
+        ),
+    )
+
+    parser.add_argument(
+        "--analyse",
+        action="append",
+        default=None,
+        metavar="CALLBACK",
+        help=(
+            "Python function to call with the path of each dump once it is written, "
+            "while Epoch runs, such as 'package.module:function' or "
+            "'analysis.py:function' for a file in the output directory. May be "
+            "given more than once. Results are appended to 'analysis.jsonl'."
+        ),
+    )
+
+    parser.add_argument(
+        "--analysis-workers",
+        default=1,
+        type=int,
+        help="Number of processes running --analyse callbacks. The default is 1.",
+    )
+
+    parser.add_argument(
+        "--analysis-reserve",
+        default=0.2,
+        type=float,
+        help=(
+            "Fraction of memory to leave for Epoch. No callbacks are started while "
+            "less is available. The default is 0.2."
+        ),
+    )
+
     return parser.parse_args()
 
 
 def run_epoch(
-    dims: int, output: Path, photons: bool = False, bin_dir: Path | None = None
-) -> None:
-    """Launches an Epoch subprocess.
+    dims: int,
+    output: Path,
+    photons: bool = False,
+    bin_dir: Path | None = None,
+    history: Path | None = None,
+    progress: bool = False,
+    metrics: Path | None = None,
+    sample_resources: bool = False,
+    sample_interval: float = 1.0,
+    resume: bool = False,
+    graceful: bool = False,
+    walltime: float | None = None,
+    grace: float = 300.0,
+    requeue: bool = False,
+    stage: Path | None = None,
+    drain_interval: float = 10.0,
+    compress: str | None = None,
+    keep_restarts: int | None = None,
+    keep_every: int | None = None,
+    analyse: list[Callback] | None = None,
+    analysis_workers: int = 1,
+    analysis_reserve: float = 0.2,
+) -> int:
+    """Launches an Epoch subprocess. Returns its exit code.
 
     Parameters
     ----------
@@ -95,18 +297,209 @@ def run_epoch(
         Switch to run with QED features.
     bin_dir
         Directory containing Epoch executables. If not provided, assumes executables
-        are located on the system PATH.
+        are located on the system PATH. The executable built for the most capable
+        microarchitecture supported by the host CPU is chosen.
+    history
+        SQLite database in which to record the run. Under MPI, only the first rank
+        records the run.
+    progress
+        Switch to print a compact progress line to standard error.
+    metrics
+        File to which throughput is appended as JSON lines during the run.
+
+    sample_resources
+        Switch to sample the resource usage of Epoch through /proc. Each rank writes
+        a summary to 'resources/rank<N>.json' in ``output``, and the first rank
+        combines them into 'resources/summary.json'.
+    sample_interval
+        Seconds between resource samples.
+    resume
+        Switch to continue from the latest complete restart dump in ``output``, by
+        setting 'restart_snapshot' in the deck. If there are none, the run starts
+        from the beginning.
+    graceful
+        Switch to ask Epoch to write a restart dump and stop, by creating its stop
+        file, when sent SIGTERM, SIGUSR1 or SIGUSR2.
+    walltime
+        Seconds until the run will be killed. Epoch is asked to stop ``grace``
+        seconds before. Implies ``graceful``.
+    grace
+        Seconds before ``walltime`` at which to stop.
+    requeue
+        Switch to requeue the Slurm job after a graceful stop.
+    stage
+        Fast node-local directory in which to run Epoch. The deck is copied into it,
+        and dumps are copied back to ``output`` in the background as they are
+        finished. Ignored for runs across several nodes.
+    drain_interval
+        Seconds between checks for finished dumps when using ``stage``.
+    compress
+        Codec with which to compress dumps in ``output`` once Epoch has finished
+        writing them, one of 'gzip', 'bz2' or 'xz'. Restart dumps are not
+        compressed.
+    keep_restarts
+        Number of the latest restart dumps to keep, removing older ones.
+    keep_every
+        Remove other dumps unless their number is a multiple of this, keeping the
+        latest.
+    analyse
+        Callbacks to run on each dump in ``output`` while Epoch runs, as functions
+        or references such as 'package.module:function'. Dumps aren't compressed or
+        removed until every callback has run on them.
+    analysis_workers
+        Number of processes running ``analyse`` callbacks.
+    analysis_reserve
+        Fraction of memory to leave for Epoch when starting callbacks.
+
+    Epoch's output is streamed through unchanged when ``progress`` or ``metrics``
+    are set. Under MPI, only the first rank tracks progress.
     """
-    exe = exe_name(dims=dims, photons=photons)
-    if bin_dir is not None:
-        exe = str(Path(bin_dir).resolve() / exe)
+    exe = select_exe(dims, photons=photons, bin_dir=bin_dir)
+    print(f"Running Epoch executable {Path(exe).name}")
 
     if not output.is_dir():
         raise NotADirectoryError(str(output))
 
-    subprocess.run([exe], input=str(output.resolve()).encode("utf-8"))
+    # Epoch reads the deck on the first rank only
+    restart = None
+    if resume and mpi_rank() == 0:
+        restart = resume_deck(output)
+        if restart is None:
+            print("No complete restart dumps found, starting from the beginning")
+        else:
+            print(f"Resuming from restart dump {restart.name}")
+
+    staged = None
+    if stage is not None:
+        if single_node():
+            staged = StagedOutput(output, stage, drain_interval, rank=mpi_rank())
+        else:
+            print("Node-local staging needs a single node, writing to output directly")
+    run_dir = staged.directory if staged is not None else output
+
+    stdin = str(run_dir.resolve()).encode("utf-8")
+    tracker = None
+    if (progress or metrics is not None) and mpi_rank() == 0:
+        deck = output / "input.deck"
+        tracker = ProgressTracker(
+            t_end=control_value(deck.read_text(), "t_end") if deck.is_file() else None,
+            metrics=metrics,
+            stream=sys.stderr if progress else None,
+        )
+
+    sampler = None
+    if sample_resources:
+        sampler = ResourceSampler(sample_interval, rank=mpi_rank(), launch=launch_id())
+
+    pipeline = None
+    if analyse and mpi_rank() == 0:
+        pipeline = AnalysisPipeline(
+            output, analyse, workers=analysis_workers, reserve=analysis_reserve
+        )
+
+    manager = None
+    if (compress or keep_restarts is not None or keep_every) and mpi_rank() == 0:
+        policy = RetentionPolicy(keep_restarts, keep_every)
+        manager = OutputManager(
+            output,
+            codec=compress,
+            policy=policy,
+            hold=pipeline.held if pipeline is not None else None,
+        )
+
+    stopper = None
+    if graceful or walltime is not None:
+        stopper = GracefulStop(output, walltime=walltime, grace=grace)
+
+    start = time.time()
+    with (
+        manager if manager is not None else nullcontext(),
+        pipeline if pipeline is not None else nullcontext(),
+        staged if staged is not None else nullcontext(),
+        sampler if sampler is not None else nullcontext(),
+        stopper if stopper is not None else nullcontext(),
+    ):
+        if staged is not None and restart is not None:
+            staged.stage(restart)
+        if tracker is not None:
+            returncode = stream_process([exe], tracker, input=stdin, sampler=sampler)
+        elif sampler is not None:
+            with subprocess.Popen([exe], stdin=subprocess.PIPE) as process:
+                sampler.watch(process)
+                assert process.stdin is not None
+                process.stdin.write(stdin)
+                process.stdin.close()
+                returncode = sampler.wait(process)
+        else:
+            returncode = subprocess.run([exe], input=stdin).returncode
+    end = time.time()
+    throughput = tracker.finish() if tracker is not None else {}
+    if sampler is not None:
+        throughput["resources"] = report_resources(sampler, output / "resources")
+
+    if history is not None and mpi_rank() == 0:
+        exe_path = shutil.which(exe) or exe
+        record_run(
+            history,
+            RunRecord(
+                deck_hash=deck_hash(output),
+                output=str(output.resolve()),
+                launcher="native",
+                identity=f"{Path(exe_path).name}@sha256:{file_hash(Path(exe_path))}",
+                dims=dims,
+                photons=photons,
+                nprocs=mpi_size(),
+                start_time=start,
+                end_time=end,
+                exit_status=returncode,
+                args=["-d", str(dims), "-o", str(output)]
+                + (["--photons"] if photons else []),
+                metrics=throughput,
+            ),
+        )
+    if stopper is not None and stopper.reason is not None:
+        print(f"Epoch stopped early after {stopper.reason}")
+        if requeue and mpi_rank() == 0:
+            requeue_job()
+    return returncode
+
+
+def resume_deck(output: Path) -> Path | None:
+    """Set the deck in ``output`` to restart from its latest complete restart dump.
+
+    If there are none, any restart is removed from the deck so that the run starts
+    from the beginning. Returns the restart dump.
+    """
+    deck = output / "input.deck"
+    restart = find_restart(output)
+    text = deck.read_text()
+    snapshot = restart.name if restart is not None else None
+    if (new_text := set_control(text, restart_snapshot=snapshot)) != text:
+        deck.write_text(new_text)
+    return restart
+
+
+def report_resources(sampler: ResourceSampler, directory: Path) -> dict:
+    """Write this rank's resource summary, and combine all ranks on the first.
+
+    Returns the aggregate on the first rank, and an empty dict on the others.
+    """
+    write_summary(sampler.summary, directory)
+    if sampler.summary.rank != 0:
+        return {}
+    summaries = collect_summaries(
+        directory, mpi_size(), launch=sampler.summary.launch, since=sampler.started
+    )
+    total = aggregate(summaries)
+    (directory / "summary.json").write_text(
+        json.dumps(dict(aggregate=total, ranks=[vars(s) for s in summaries]), indent=2)
+    )
+    for summary in summaries:
+        print(format_summary(summary))
+    print(format_summary(total))
+    return total
 
 
 def main() -> None:
-    """Entrypoint function for running Epoch."""
-    run_epoch(**vars(parse_run_args()))
+    """Entrypoint function for running Epoch. Exits with Epoch's exit code."""
+    sys.exit(run_epoch(**vars(parse_run_args())))
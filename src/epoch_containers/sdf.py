@@ -0,0 +1,447 @@
+import bz2
+import gzip
+import lzma
+import math
+import struct
+from collections.abc import Iterable, Iterator
+from dataclasses import dataclass
+from pathlib import Path
+from types import ModuleType
+from typing import TYPE_CHECKING, Any, BinaryIO
+
+if TYPE_CHECKING:
+    import numpy as np
+
+#: Suffixes of compressed dumps, and the modules that read them
+COMPRESSION: dict[str, ModuleType] = {".gz": gzip, ".bz2": bz2, ".xz": lzma}
+
+#: Magic bytes at the start of every SDF file
+SDF_MAGIC = b"SDF1"
+
+#: Written in the native byte order, so that readers can detect it
+_ENDIANNESS = 16911887
+
+#: Length of block ids
+ID_LENGTH = 32
+
+#: File header, after the magic bytes and endianness: version, revision, code name,
+#: first block and summary locations, summary size, number of blocks, block header
+#: length, step, time, job ids, string length, code I/O version, and the restart,
+#: other domains and station file flags
+_HEADER = "ii32sqqiiiidiiiibbb"
+
+#: Block types, from the SDF specification
+BLOCKTYPE_PLAIN_MESH = 1
+BLOCKTYPE_POINT_MESH = 2
+BLOCKTYPE_PLAIN_VARIABLE = 3
+BLOCKTYPE_POINT_VARIABLE = 4
+BLOCKTYPE_CONSTANT = 5
+BLOCKTYPE_ARRAY = 6
+
+#: NumPy type codes of SDF data types, without the byte order
+DATATYPES = {1: "i4", 2: "i8", 3: "f4", 4: "f8", 6: "S1", 7: "b1"}
+
+#: Common part of each block header: next block and data locations, id, data
+#: length, block type, data type and number of dimensions. Followed by the name,
+#: and then the length of the block info for revisions after 0.
+_BLOCK = "qq32sqiii"
+
+
+@dataclass
+class SdfHeader:
+    """The file header of an SDF file."""
+
+    byteorder: str
+    version: int
+    revision: int
+    code_name: str
+    first_block_location: int
+    summary_location: int
+    summary_size: int
+    nblocks: int
+    block_header_length: int
+    step: int
+    time: float
+    jobid: tuple[int, int]
+    string_length: int
+    code_io_version: int
+    restart: bool
+    other_domains: bool
+    station_file: bool
+
+
+@dataclass
+class BlockHeader:
+    """The header of a single block in an SDF file."""
+
+    location: int
+    next_block_location: int
+    data_location: int
+    id: str
+    data_length: int
+    blocktype: int
+    datatype: int
+    ndims: int
+    name: str
+    info_length: int = 0
+    #: Location of the metadata specific to the type of block
+    info_location: int = 0
+
+
+def _string(raw: bytes) -> str:
+    return raw.split(b"\0", 1)[0].decode("ascii", errors="replace").strip()
+
+
+def read_header(f: BinaryIO) -> SdfHeader:
+    """Read the file header of an open SDF file.
+
+    Raises ``ValueError`` if it isn't an SDF file.
+    """
+    f.seek(0)
+    start = f.read(8)
+    if len(start) < 8 or start[:4] != SDF_MAGIC:
+        raise ValueError("Not an SDF file")
+    for byteorder in "<>":
+        if struct.unpack(f"{byteorder}i", start[4:])[0] == _ENDIANNESS:
+            break
+    else:
+        raise ValueError("Unrecognised byte order in SDF file")
+    fmt = f"{byteorder}{_HEADER}"
+    raw = f.read(struct.calcsize(fmt))
+    if len(raw) < struct.calcsize(fmt):
+        raise ValueError("Truncated SDF header")
+    values = struct.unpack(fmt, raw)
+    return SdfHeader(
+        byteorder=byteorder,
+        version=values[0],
+        revision=values[1],
+        code_name=_string(values[2]),
+        first_block_location=values[3],
+        summary_location=values[4],
+        summary_size=values[5],
+        nblocks=values[6],
+        block_header_length=values[7],
+        step=values[8],
+        time=values[9],
+        jobid=(values[10], values[11]),
+        string_length=values[12],
+        code_io_version=values[13],
+        restart=bool(values[14]),
+        other_domains=bool(values[15]),
+        station_file=bool(values[16]),
+    )
+
+
+def read_blocks(f: BinaryIO, header: SdfHeader | None = None) -> list[BlockHeader]:
+    """Read the headers of every block in an open SDF file, in order.
+
+    Raises ``ValueError`` if a block lies outside the file, as happens when a dump
+    was interrupted while being written.
+    """
+    header = header or read_header(f)
+    size = f.seek(0, 2)
+    fmt = f"{header.byteorder}{_BLOCK}"
+    length = struct.calcsize(fmt)
+    blocks = []
+    location = header.first_block_location
+    for _ in range(header.nblocks):
+        if location <= 0 or location + length + header.string_length > size:
+            raise ValueError(f"Block header at {location} is outside the file")
+        f.seek(location)
+        values = struct.unpack(fmt, f.read(length))
+        name = _string(f.read(header.string_length))
+        info_length = 0
+        if header.revision > 0:
+            (info_length,) = struct.unpack(f"{header.byteorder}i", f.read(4))
+        block = BlockHeader(
+            location=location,
+            next_block_location=values[0],
+            data_location=values[1],
+            id=_string(values[2]),
+            data_length=values[3],
+            blocktype=values[4],
+            datatype=values[5],
+            ndims=values[6],
+            name=name,
+            info_length=info_length,
+            info_location=location + header.block_header_length,
+        )
+        if block.data_location + block.data_length > size:
+            raise ValueError(f"Data of block '{block.id}' is outside the file")
+        blocks.append(block)
+        location = block.next_block_location
+    return blocks
+
+
+def sdf_path(path: Path) -> Path:
+    """Find an SDF file, or a compressed copy of it if it doesn't exist."""
+    path = Path(path)
+    if not path.exists():
+        for suffix in COMPRESSION:
+            if (compressed := path.with_name(path.name + suffix)).exists():
+                return compressed
+    return path
+
+
+def open_sdf(path: Path) -> BinaryIO:
+    """Open an SDF file for reading, decompressing it if needed.
+
+    Compressed dumps are recognised by their suffix, such as '0001.sdf.gz'. If
+    ``path`` doesn't exist, but a compressed copy of it does, that is opened
+    instead, so readers needn't know whether a dump has been compressed. The
+    result can be passed to :func:`read_header` and :func:`read_blocks`, though
+    seeking backwards in compressed dumps is slow.
+    """
+    path = sdf_path(path)
+    if path.suffix in COMPRESSION:
+        return COMPRESSION[path.suffix].open(path, "rb")
+    return path.open("rb")
+
+
+def is_complete(path: Path) -> bool:
+    """Check that an SDF file was written completely, and isn't truncated.
+
+    The header, summary, and the headers and data of every block must lie within
+    the file. Compressed dumps are decompressed to check them.
+    """
+    try:
+        with open_sdf(path) as f:
+            header = read_header(f)
+            size = f.seek(0, 2)
+            if header.nblocks <= 0:
+                return False
+            if header.summary_location + header.summary_size > size:
+                return False
+            read_blocks(f, header)
+    except (OSError, ValueError, EOFError, struct.error):
+        return False
+    return True
+
+
+def finished_dumps(directory: Path, seen: dict[Path, tuple[int, int]]) -> list[Path]:
+    """Find dumps in ``directory`` that Epoch has finished writing.
+
+    A dump is finished once it is complete and its size and modification time are
+    unchanged since the previous call with the same ``seen``, which is updated.
+    Checking both guards against dumps whose blocks look complete while Epoch is
+    still filling them in, so nothing is returned on the first call.
+    """
+    found = []
+    for path in sorted(Path(directory).rglob("*.sdf")):
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            continue
+        signature = (stat.st_size, stat.st_mtime_ns)
+        if seen.get(path) != signature:
+            seen[path] = signature
+        elif is_complete(path):
+            found.append(path)
+    return found
+
+
+def find_restart(directory: Path) -> Path | None:
+    """Find the restart dump with the latest step in ``directory``.
+
+    Dumps that are incomplete, or that weren't written as restart dumps, are ignored.
+    Returns ``None`` if there are none.
+    """
+    latest: tuple[int, Path] | None = None
+    for path in sorted(Path(directory).glob("*.sdf")):
+        try:
+            with path.open("rb") as f:
+                header = read_header(f)
+        except (OSError, ValueError):
+            continue
+        if not header.restart or not is_complete(path):
+            continue
+        if latest is None or header.step >= latest[0]:
+            latest = (header.step, path)
+    return None if latest is None else latest[1]
+
+
+@dataclass
+class Variable:
+    """An array in an SDF file, located without reading its data.
+
+    Arrays are stored in Fortran order. The axes of meshes are indexed separately,
+    such as 'grid/x' and 'grid/y'. Constants have an empty ``shape``.
+    """
+
+    id: str
+    name: str
+    blocktype: int
+    dtype: str
+    shape: tuple[int, ...]
+    offset: int
+    units: str = ""
+    mesh_id: str = ""
+    mult: float = 1.0
+
+    @property
+    def nbytes(self) -> int:
+        """Size of the data in bytes."""
+        return math.prod(self.shape) * int(self.dtype[2:])
+
+
+def _unpack(f: BinaryIO, fmt: str) -> tuple[Any, ...]:
+    return struct.unpack(fmt, f.read(struct.calcsize(fmt)))
+
+
+def _mesh_axes(
+    f: BinaryIO, block: BlockHeader, header: SdfHeader, dtype: str
+) -> list[Variable]:
+    order, n = header.byteorder, block.ndims
+    mults = _unpack(f, f"{order}{n}d")
+    _unpack(f, f"{order}{f'{ID_LENGTH}s' * n}")  # labels
+    units = [_string(raw) for raw in _unpack(f, f"{order}{f'{ID_LENGTH}s' * n}")]
+    _unpack(f, f"{order}i{n}d{n}d")  # geometry, minimum and maximum
+    if block.blocktype == BLOCKTYPE_PLAIN_MESH:
+        lengths = _unpack(f, f"{order}{n}i")
+    else:
+        lengths = _unpack(f, f"{order}q") * n
+    axes = []
+    offset = block.data_location
+    for axis, length in enumerate(lengths):
+        axes.append(
+            Variable(
+                id=f"{block.id}/{'xyz'[axis]}",
+                name=f"{block.name}/{'xyz'[axis]}",
+                blocktype=block.blocktype,
+                dtype=dtype,
+                shape=(length,),
+                offset=offset,
+                units=units[axis],
+                mult=mults[axis],
+            )
+        )
+        offset += axes[-1].nbytes
+    return axes
+
+
+def read_index(
+    f: BinaryIO,
+    header: SdfHeader | None = None,
+    blocks: list[BlockHeader] | None = None,
+) -> dict[str, Variable]:
+    """Locate every array in an open SDF file, by block id.
+
+    Only the metadata of each block is read. Meshes, variables, arrays and
+    constants are indexed, while blocks of other types, and of types of data
+    without a NumPy equivalent, are skipped.
+    """
+    header = header or read_header(f)
+    blocks = read_blocks(f, header) if blocks is None else blocks
+    order = header.byteorder
+    index: dict[str, Variable] = {}
+    for block in blocks:
+        if block.datatype not in DATATYPES:
+            continue
+        dtype = f"{order}{DATATYPES[block.datatype]}"
+        f.seek(block.info_location)
+        variable = Variable(block.id, block.name, block.blocktype, dtype, (), 0)
+        if block.blocktype in (BLOCKTYPE_PLAIN_MESH, BLOCKTYPE_POINT_MESH):
+            index.update(
+                (axis.id, axis) for axis in _mesh_axes(f, block, header, dtype)
+            )
+            continue
+        if block.blocktype == BLOCKTYPE_PLAIN_VARIABLE:
+            mult, units, mesh_id, *dims, _ = _unpack(
+                f, f"{order}d{ID_LENGTH}s{ID_LENGTH}s{block.ndims}ii"
+            )
+            variable.shape = tuple(dims)
+        elif block.blocktype == BLOCKTYPE_POINT_VARIABLE:
+            mult, units, mesh_id, npoints = _unpack(
+                f, f"{order}d{ID_LENGTH}s{ID_LENGTH}sq"
+            )
+            variable.shape = (npoints,)
+        elif block.blocktype == BLOCKTYPE_ARRAY:
+            mult, units, mesh_id = 1.0, b"", b""
+            variable.shape = _unpack(f, f"{order}{block.ndims}i")
+        elif block.blocktype == BLOCKTYPE_CONSTANT:
+            # The value is held in the metadata
+            index[block.id] = variable
+            variable.offset = block.info_location
+            continue
+        else:
+            continue
+        variable.offset = block.data_location
+        variable.units, variable.mesh_id = _string(units), _string(mesh_id)
+        variable.mult = mult
+        index[block.id] = variable
+    return index
+
+
+def require_numpy() -> Any:
+    """Import NumPy, explaining how to install it if missing."""
+    try:
+        import numpy
+    except ImportError as exc:
+        raise ImportError(
+            "Reading SDF data needs NumPy: pip install epoch_containers[sdf]"
+        ) from exc
+    return numpy
+
+
+class SdfFile:
+    """Lazy access to the arrays in an SDF file.
+
+    The header, blocks and metadata are read once on creation. Indexing by block id
+    then returns a read-only ``numpy.memmap`` of the data without reading it, so
+    only the parts that are used are read from disk. Slicing it reads a hyperslab
+    alone. Arrays keep the Fortran order in which Epoch wrote them, and are not
+    scaled by :attr:`Variable.mult`. Compressed dumps can't be memory mapped, so
+    their arrays are read into memory when indexed.
+
+    Parameters
+    ----------
+    path
+        SDF file, or the name of a dump that has since been compressed.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = sdf_path(path)
+        with open_sdf(self.path) as f:
+            self.header = read_header(f)
+            self.blocks = read_blocks(f, self.header)
+            self.variables = read_index(f, self.header, self.blocks)
+
+    def __contains__(self, id: str) -> bool:
+        return id in self.variables
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.variables)
+
+    def __getitem__(self, id: str) -> "np.ndarray":
+        variable = self.variables[id]
+        numpy = require_numpy()
+        if self.path.suffix not in COMPRESSION:
+            return numpy.memmap(
+                self.path,
+                dtype=variable.dtype,
+                mode="r",
+                offset=variable.offset,
+                shape=variable.shape,
+                order="F",
+            )
+        with open_sdf(self.path) as f:
+            f.seek(variable.offset)
+            data = numpy.frombuffer(f.read(variable.nbytes), dtype=variable.dtype)
+        return data.reshape(variable.shape, order="F")
+
+    def hyperslab(self, id: str, key: Any = ()) -> "np.ndarray":
+        """Read part of an array into memory, such as ``(slice(0, 10), 5)``."""
+        return require_numpy().array(self[id][key])
+
+
+def read_series(
+    paths: Iterable[Path], id: str, key: Any = ()
+) -> Iterator[tuple[float, "np.ndarray"]]:
+    """Read the same hyperslab of an array from many dumps, with their times.
+
+    Dumps that don't contain the array are skipped.
+    """
+    for path in paths:
+        sdf = SdfFile(path)
+        if id in sdf:
+            yield sdf.header.time, sdf.hyperslab(id, key)
@@ -0,0 +1,108 @@
+import os
+import re
+import signal
+import subprocess
+import threading
+from pathlib import Path
+from types import FrameType
+from typing import Any
+
+#: File which Epoch checks for every 'check_stop_file_frequency' steps. When found,
+#: Epoch writes a restart dump and exits.
+STOP_FILE = "STOP"
+
+#: Signals that trigger a graceful stop, such as those sent by Slurm's --signal
+STOP_SIGNALS = (signal.SIGTERM, signal.SIGUSR1, signal.SIGUSR2)
+
+#: Slurm time limits: 'minutes', 'minutes:seconds', 'hours:minutes:seconds',
+#: 'days-hours', 'days-hours:minutes' and 'days-hours:minutes:seconds'
+_SLURM_TIME = re.compile(r"^(?:(?P<days>\d+)-)?(?P<rest>\d+(?::\d+){0,2})$")
+
+
+def parse_time_limit(text: str) -> float:
+    """Convert a time limit in seconds, or in Slurm's format, to seconds."""
+    try:
+        return float(text)
+    except ValueError:
+        pass
+    if (match := _SLURM_TIME.match(text.strip())) is None:
+        raise ValueError(f"Unrecognised time limit: {text}")
+    parts = [int(part) for part in match["rest"].split(":")]
+    if match["days"] is not None:
+        # After days, the first part is hours rather than minutes
+        hours, minutes, seconds = [*parts, 0, 0][:3]
+        return ((int(match["days"]) * 24 + hours) * 60 + minutes) * 60.0 + seconds
+    if len(parts) == 3:
+        return (parts[0] * 60 + parts[1]) * 60.0 + parts[2]
+    return parts[0] * 60.0 + (parts[1] if len(parts) == 2 else 0)
+
+
+class GracefulStop:
+    """Asks Epoch to write a restart dump and stop before it is killed.
+
+    On entry, installs handlers for :data:`STOP_SIGNALS` and, if ``walltime`` is
+    given, starts a timer that fires ``grace`` seconds before it runs out. Either
+    creates Epoch's stop file in ``output``. On exit, the handlers are restored and
+    the stop file is removed, so that resumed runs aren't stopped straight away.
+    Must be entered from the main thread.
+
+    Parameters
+    ----------
+    output
+        Output directory of the run.
+    walltime
+        Seconds from entry at which the run will be killed.
+    grace
+        Seconds before ``walltime`` at which to stop. Should allow time for Epoch
+        to reach its next check of the stop file and write a restart dump.
+    """
+
+    def __init__(
+        self, output: Path, walltime: float | None = None, grace: float = 300.0
+    ) -> None:
+        self.stop_file = Path(output) / STOP_FILE
+        self.walltime = walltime
+        self.grace = grace
+        self.reason: str | None = None
+        self._timer: threading.Timer | None = None
+        self._handlers: dict[int, Any] = {}
+
+    def stop(self, reason: str) -> None:
+        """Create the stop file, if it hasn't been already."""
+        if self.reason is not None:
+            return
+        self.reason = reason
+        print(f"Asking Epoch to stop after {reason}", flush=True)
+        self.stop_file.touch()
+
+    def _on_signal(self, signum: int, frame: FrameType | None) -> None:
+        self.stop(f"signal {signal.Signals(signum).name}")
+
+    def __enter__(self) -> "GracefulStop":
+        # A stop file left by an earlier run would stop this one immediately
+        self.stop_file.unlink(missing_ok=True)
+        for signum in STOP_SIGNALS:
+            self._handlers[signum] = signal.signal(signum, self._on_signal)
+        if self.walltime is not None:
+            delay = max(self.walltime - self.grace, 0.0)
+            self._timer = threading.Timer(delay, self.stop, args=("walltime",))
+            self._timer.daemon = True
+            self._timer.start()
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+        for signum, handler in self._handlers.items():
+            signal.signal(signum, handler)
+        self.stop_file.unlink(missing_ok=True)
+
+
+def requeue_job() -> bool:
+    """Requeue the current Slurm job. Returns ``True`` on success."""
+    job = os.environ.get("SLURM_JOB_ID")
+    if job is None:
+        print("Not running under Slurm, so can't requeue")
+        return False
+    result = subprocess.run(["scontrol", "requeue", job])
+    return result.returncode == 0
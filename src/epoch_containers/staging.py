@@ -0,0 +1,222 @@
+import hashlib
+import os
+import shutil
+import threading
+from pathlib import Path
+from typing import Any
+
+from .resources import format_bytes
+from .sdf import finished_dumps
+from .shutdown import STOP_FILE
+from .utils import mpi_size
+
+#: Environment variables holding the number of nodes used by a Slurm job step, or
+#: failing that the whole job
+_NODE_VARS = ("SLURM_STEP_NUM_NODES", "SLURM_JOB_NUM_NODES", "SLURM_NNODES")
+
+#: Environment variables identifying a single launch of an MPI job, the same on
+#: every rank
+_LAUNCH_VARS = (
+    "SLURM_JOB_ID",
+    "SLURM_STEP_ID",
+    "PMIX_NAMESPACE",
+    "OMPI_MCA_ess_base_jobid",
+)
+
+#: Bytes read and written at a time when copying
+_CHUNK = 16 * 1024**2
+
+
+def copy_verified(source: Path, destination: Path) -> int:
+    """Copy ``source`` to ``destination``, checking the copy reads back the same.
+
+    The copy is written alongside ``destination`` and renamed into place once
+    verified, so a partial file is never left under the final name. Raises
+    ``OSError`` if the copy differs. Returns the number of bytes copied.
+    """
+    destination.parent.mkdir(parents=True, exist_ok=True)
+    partial = destination.with_name(f".{destination.name}.part")
+    expected = hashlib.sha256()
+    with source.open("rb") as src, partial.open("wb") as dst:
+        while chunk := src.read(_CHUNK):
+            expected.update(chunk)
+            dst.write(chunk)
+        dst.flush()
+        os.fsync(dst.fileno())
+    actual = hashlib.sha256()
+    with partial.open("rb") as f:
+        while chunk := f.read(_CHUNK):
+            actual.update(chunk)
+    if actual.digest() != expected.digest():
+        partial.unlink()
+        raise OSError(f"Copy of {source} to {destination} failed verification")
+    os.replace(partial, destination)
+    shutil.copystat(source, destination)
+    return source.stat().st_size
+
+
+def _signature(path: Path) -> tuple[int, int]:
+    stat = path.stat()
+    return stat.st_size, stat.st_mtime_ns
+
+
+def launch_key(output: Path) -> str:
+    """Identify a run, consistently across its ranks but not between runs.
+
+    Containers often see the same output path for every run, so this also uses the
+    job, or the process when there is only one rank.
+    """
+    parts = [str(Path(output).resolve())]
+    parts.extend(os.environ.get(var, "") for var in _LAUNCH_VARS)
+    if mpi_size() == 1:
+        parts.append(str(os.getpid()))
+    return hashlib.sha256("\0".join(parts).encode()).hexdigest()[:12]
+
+
+def single_node() -> bool:
+    """Whether this job runs on a single node, so node-local storage is shared."""
+    for var in _NODE_VARS:
+        if var in os.environ:
+            return int(os.environ[var]) <= 1
+    return True
+
+
+class StagedOutput:
+    """Runs Epoch in fast node-local storage, draining its output to ``output``.
+
+    On entry, a directory is created within ``stage``, such as ``$TMPDIR`` or
+    ``/dev/shm``, and the input deck is copied into it. Epoch should then be pointed
+    at :attr:`directory`. While it runs, a background thread moves SDF dumps that
+    have been written completely to ``output``, freeing node-local space as it
+    goes, and passes on a stop file created in ``output``. On exit, including after
+    a failure, every remaining file is copied back and verified. The stage directory
+    is removed only if everything was copied, and is otherwise left in place so
+    nothing is lost.
+
+    Under MPI, each rank should create one of these, but only the first drains
+    output. Node-local storage is only shared between ranks on the same node, so
+    staging should not be used for runs across several nodes.
+
+    Parameters
+    ----------
+    output
+        Output directory of the run, containing 'input.deck'.
+    stage
+        Fast node-local directory in which to run.
+    interval
+        Seconds between checks for finished dumps.
+    rank
+        MPI rank of this process.
+    """
+
+    def __init__(
+        self, output: Path, stage: Path, interval: float = 10.0, rank: int = 0
+    ) -> None:
+        self.output = Path(output)
+        self.directory = Path(stage) / f"epoch_{launch_key(self.output)}"
+        self.interval = interval
+        self.rank = rank
+        self.drained: list[Path] = []
+        self.drained_bytes = 0
+        self.failed: list[Path] = []
+        self._inputs: dict[Path, tuple[int, int]] = {}
+        self._seen: dict[Path, tuple[int, int]] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def stage(self, *paths: Path) -> None:
+        """Copy inputs from ``output``, such as a restart dump, into the stage."""
+        for path in paths:
+            staged = self.directory / Path(path).relative_to(self.output)
+            copy_verified(Path(path), staged)
+            self._inputs[staged] = _signature(staged)
+
+    def _is_input(self, path: Path) -> bool:
+        # Inputs are only copied back if Epoch has overwritten them
+        return path in self._inputs and self._inputs[path] == _signature(path)
+
+    def finished(self) -> list[Path]:
+        """Find dumps that Epoch has finished writing, other than the inputs."""
+        found = finished_dumps(self.directory, self._seen)
+        return [path for path in found if not self._is_input(path)]
+
+    def _move(self, path: Path) -> None:
+        destination = self.output / path.relative_to(self.directory)
+        try:
+            self.drained_bytes += copy_verified(path, destination)
+        except OSError as exc:
+            print(f"Failed to copy {path} to {destination}: {exc}", flush=True)
+            if path not in self.failed:
+                self.failed.append(path)
+            return
+        path.unlink()
+        self._seen.pop(path, None)
+        self.drained.append(destination)
+        if path in self.failed:
+            self.failed.remove(path)
+
+    def drain(self) -> list[Path]:
+        """Move finished dumps to ``output``. Returns their new locations."""
+        with self._lock:
+            start = len(self.drained)
+            for path in self.finished():
+                self._move(path)
+            return self.drained[start:]
+
+    def flush(self) -> bool:
+        """Copy everything left in the stage to ``output``.
+
+        Inputs, and the stop file, are left behind.
+
+        Returns ``True`` if every file was copied and verified.
+        """
+        with self._lock:
+            for path in sorted(self.directory.rglob("*")):
+                if not path.is_file() or path.name.endswith(".part"):
+                    continue
+                if path.name != STOP_FILE and not self._is_input(path):
+                    self._move(path)
+            return not self.failed
+
+    def forward_stop(self) -> bool:
+        """Pass on a request to stop, made with Epoch's stop file in ``output``.
+
+        Returns ``True`` if there is a request.
+        """
+        if not (self.output / STOP_FILE).exists():
+            return False
+        (self.directory / STOP_FILE).touch()
+        return True
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.forward_stop()
+            self.drain()
+
+    def __enter__(self) -> "StagedOutput":
+        self.directory.mkdir(parents=True, exist_ok=True)
+        if self.rank == 0:
+            self.stage(self.output / "input.deck")
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        if self.rank != 0:
+            return
+        self._stop.set()
+        self._thread.join()
+        if self.flush():
+            shutil.rmtree(self.directory, ignore_errors=True)
+            print(
+                f"Copied {len(self.drained)} files "
+                f"({format_bytes(self.drained_bytes)}) from {self.directory} "
+                f"to {self.output}",
+                flush=True,
+            )
+        else:
+            print(
+                f"Failed to copy {len(self.failed)} files to {self.output}, leaving "
+                f"them in {self.directory}",
+                flush=True,
+            )
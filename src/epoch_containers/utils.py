@@ -1,6 +1,214 @@
-def exe_name(dims: int, photons: bool = False) -> str:
-    """Generate the name of an Epoch executable."""
+import os
+import shutil
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Generator, Iterable
+
+#: Environment variables holding the MPI rank and number of ranks, in order of
+#: preference. Covers OpenMPI, Slurm, and PMI based launchers.
+_RANK_VARS = ("OMPI_COMM_WORLD_RANK", "PMIX_RANK", "SLURM_PROCID", "PMI_RANK")
+_SIZE_VARS = ("OMPI_COMM_WORLD_SIZE", "SLURM_NTASKS", "PMI_SIZE")
+
+#: Microarchitecture used for builds without a -march flag
+BASELINE = "baseline"
+
+#: Builds tuned on this machine, by autotune_epoch and build_epoch --pgo, in order of
+#: preference. These are chosen over the microarchitecture variants when present, and
+#: the host CPU has the flags they were built for.
+TUNED_VARIANTS = ("tuned", "pgo")
+
+#: Suffix of the file beside a tuned executable listing the CPU flags it requires
+CPU_FLAGS_SUFFIX = ".cpu_flags"
+
+#: Compiler flags targeting the CPU of the build host
+_HOST_FLAGS = ("-march=native", "-mcpu=native", "-xHost")
+
+#: CPU flags, as listed in /proc/cpuinfo, required by each x86-64 microarchitecture
+#: level. Ordered from least to most capable.
+MICROARCH_FLAGS: dict[str, frozenset[str]] = {}
+MICROARCH_FLAGS["x86-64-v2"] = frozenset(
+    ("cx16", "lahf_lm", "popcnt", "sse4_1", "sse4_2", "ssse3")
+)
+MICROARCH_FLAGS["x86-64-v3"] = MICROARCH_FLAGS["x86-64-v2"] | frozenset(
+    ("abm", "avx", "avx2", "bmi1", "bmi2", "f16c", "fma", "movbe", "xsave")
+)
+MICROARCH_FLAGS["x86-64-v4"] = MICROARCH_FLAGS["x86-64-v3"] | frozenset(
+    ("avx512f", "avx512bw", "avx512cd", "avx512dq", "avx512vl")
+)
+
+
+def exe_name(dims: int, photons: bool = False, variant: str | None = None) -> str:
+    """Generate the name of an Epoch executable.
+
+    ``variant`` is an optional suffix for special builds, such as ``"pgo"``.
+    """
     name = f"epoch_{dims}d"
     if photons:
         name += "_photons"
+    if variant and variant != BASELINE:
+        name += f"_{variant}"
     return name
+
+
+def mpi_rank() -> int:
+    """Get the MPI rank of this process from the launcher's environment.
+
+    Returns 0 when not launched by MPI.
+    """
+    for var in _RANK_VARS:
+        if var in os.environ:
+            return int(os.environ[var])
+    return 0
+
+
+def mpi_size() -> int:
+    """Get the number of MPI ranks from the launcher's environment.
+
+    Returns 1 when not launched by MPI.
+    """
+    for var in _SIZE_VARS:
+        if var in os.environ:
+            return int(os.environ[var])
+    return 1
+
+
+def launch_id() -> str:
+    """Identify this launch of MPI ranks, the same on every rank.
+
+    Taken from the PMIx namespace, the Open MPI job id, or the Slurm job and step.
+    Returns an empty string when not launched by MPI, or if unknown.
+    """
+    for var in ("PMIX_NAMESPACE", "OMPI_MCA_ess_base_jobid"):
+        if var in os.environ:
+            return os.environ[var]
+    if "SLURM_STEP_ID" in os.environ:
+        return f"{os.environ.get('SLURM_JOB_ID', '')}.{os.environ['SLURM_STEP_ID']}"
+    return ""
+
+
+def cpu_flags(cpuinfo: Path = Path("/proc/cpuinfo")) -> frozenset[str]:
+    """Read the CPU flags of the host. Returns an empty set if unavailable."""
+    try:
+        text = Path(cpuinfo).read_text()
+    except OSError:
+        return frozenset()
+    for line in text.splitlines():
+        key, _, value = line.partition(":")
+        if key.strip() == "flags":
+            return frozenset(value.split())
+    return frozenset()
+
+
+def supported_microarchs(flags: frozenset[str] | None = None) -> list[str]:
+    """List microarchitectures supported by a CPU, from most to least capable.
+
+    Always ends with :data:`BASELINE`. If ``flags`` isn't provided, uses the flags
+    of the host CPU.
+    """
+    if flags is None:
+        flags = cpu_flags()
+    levels = [level for level, req in MICROARCH_FLAGS.items() if req <= flags]
+    return [*reversed(levels), BASELINE]
+
+
+def required_cpu_flags(
+    compile_flags: Iterable[str], host: frozenset[str] | None = None
+) -> frozenset[str]:
+    """Find the CPU flags needed to run code compiled with ``compile_flags``.
+
+    Flags such as ``-march=native`` require every flag of the build host, given by
+    ``host`` or read from the host CPU, while ``-march`` set to a microarchitecture
+    level requires the flags in :data:`MICROARCH_FLAGS`.
+    """
+    required: frozenset[str] = frozenset()
+    for flag in compile_flags:
+        if flag in _HOST_FLAGS:
+            required |= cpu_flags() if host is None else host
+        elif flag.startswith("-march=") and flag[7:] in MICROARCH_FLAGS:
+            required |= MICROARCH_FLAGS[flag[7:]]
+    return required
+
+
+def write_cpu_flags(exe: Path, required: Iterable[str]) -> Path:
+    """Record the CPU flags needed to run ``exe`` beside it. Returns the new file."""
+    path = Path(exe).with_name(Path(exe).name + CPU_FLAGS_SUFFIX)
+    path.write_text(" ".join(sorted(required)) + "\n")
+    return path
+
+
+def read_cpu_flags(exe: Path) -> frozenset[str] | None:
+    """Read the CPU flags needed to run ``exe``. Returns None if not recorded."""
+    try:
+        text = Path(exe).with_name(Path(exe).name + CPU_FLAGS_SUFFIX).read_text()
+    except OSError:
+        return None
+    return frozenset(text.split())
+
+
+def select_exe(
+    dims: int,
+    photons: bool = False,
+    bin_dir: Path | None = None,
+    flags: frozenset[str] | None = None,
+) -> str:
+    """Choose the best Epoch executable that the host CPU can run.
+
+    Looks for executables tuned for this machine, see :data:`TUNED_VARIANTS`, and
+    then for those built for each supported microarchitecture, from most to least
+    capable, in ``bin_dir`` or on the system PATH. Tuned executables are skipped
+    unless the CPU flags recorded with them by :func:`write_cpu_flags` are all
+    supported, as they may have been built on another machine. Falls back to the
+    baseline executable name if none are found.
+    """
+    if flags is None:
+        flags = cpu_flags()
+    for variant in [*TUNED_VARIANTS, *supported_microarchs(flags)]:
+        name = exe_name(dims=dims, photons=photons, variant=variant)
+        if bin_dir is not None:
+            exe = Path(bin_dir).resolve() / name
+            found = str(exe) if exe.is_file() else None
+        else:
+            found = shutil.which(name)
+        if found is None:
+            continue
+        if variant in TUNED_VARIANTS:
+            required = read_cpu_flags(Path(found))
+            if required is None or not required <= flags:
+                continue
+        return found if bin_dir is not None else name
+    name = exe_name(dims=dims, photons=photons)
+    return name if bin_dir is None else str(Path(bin_dir).resolve() / name)
+
+
+class CoreBudget:
+    """Thread-safe pool of CPU cores shared between concurrent tasks.
+
+    Tasks reserve cores with :meth:`reserve`, which blocks until enough cores are
+    free. Requests larger than the whole budget are clamped to it, so they run alone
+    rather than deadlocking.
+    """
+
+    def __init__(self, cores: int) -> None:
+        if cores < 1:
+            raise ValueError("Require at least one core")
+        self.cores = cores
+        self.free = cores
+        self._condition = threading.Condition()
+
+    @contextmanager
+    def reserve(self, cores: int) -> Generator[int, Any, Any]:
+        """Reserve ``cores`` for the duration of the context.
+
+        Yields the number of cores actually reserved.
+        """
+        cores = max(1, min(cores, self.cores))
+        with self._condition:
+            self._condition.wait_for(lambda: self.free >= cores)
+            self.free -= cores
+        try:
+            yield cores
+        finally:
+            with self._condition:
+                self.free += cores
+                self._condition.notify_all()
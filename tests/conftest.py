@@ -0,0 +1,162 @@
+import math
+import struct
+from pathlib import Path
+from typing import Callable, NamedTuple
+
+import pytest
+
+_STRING_LENGTH = 64
+
+
+class SdfBlock(NamedTuple):
+    """A block to write to an SDF file, with its metadata already packed."""
+
+    id: str
+    blocktype: int
+    datatype: int
+    ndims: int
+    info: bytes
+    data: bytes
+
+
+def _write_sdf(
+    path: Path,
+    blocks: list[tuple[str, bytes] | SdfBlock],
+    step: int = 0,
+    restart: bool = False,
+    byteorder: str = "<",
+) -> Path:
+    """Write a minimal SDF file.
+
+    Blocks given as ``(id, data)`` are written as 1D variables of doubles.
+    """
+    header_fmt = f"{byteorder}4siii32sqqiiiidiiiibbb"
+    block_fmt = f"{byteorder}qq32sqiii{_STRING_LENGTH}si"
+    header_length = struct.calcsize(header_fmt)
+    block_length = struct.calcsize(block_fmt)
+    location = header_length
+    body = b""
+    for index, block in enumerate(blocks):
+        if not isinstance(block, SdfBlock):
+            block_id, data = block
+            info = struct.pack(
+                f"{byteorder}d32s32sii", 1.0, b"V/m", b"grid", len(data) // 8, 0
+            )
+            block = SdfBlock(block_id, 3, 4, 1, info, data)
+        data_location = location + block_length + len(block.info)
+        next_location = data_location + len(block.data)
+        body += struct.pack(
+            block_fmt,
+            next_location if index + 1 < len(blocks) else 0,
+            data_location,
+            block.id.encode(),
+            len(block.data),
+            block.blocktype,
+            block.datatype,
+            block.ndims,
+            f"Block {block.id}".encode(),
+            block_length + len(block.info),
+        )
+        body += block.info + block.data
+        location = next_location
+    header = struct.pack(
+        header_fmt,
+        b"SDF1",
+        16911887,
+        1,
+        4,
+        b"Epoch2d",
+        header_length,
+        header_length,
+        block_length * len(blocks),
+        len(blocks),
+        block_length,
+        step,
+        step * 1e-15,
+        1,
+        2,
+        _STRING_LENGTH,
+        1,
+        restart,
+        0,
+        0,
+    )
+    path.write_bytes(header + body)
+    return path
+
+
+@pytest.fixture
+def write_sdf() -> Callable[..., Path]:
+    """Function writing a minimal SDF file, containing blocks of raw data."""
+    return _write_sdf
+
+
+@pytest.fixture
+def stop_aware_epoch(tmp_path: Path) -> Path:
+    """Stand-in Epoch executable honouring the stop file.
+
+    Reads the output directory from its first argument, or from standard input like
+    Epoch. Polls for 'STOP' there, and on finding it writes 'restart.sdf' and exits
+    successfully. Exits with 1 if it is never asked to stop.
+    """
+    exe = tmp_path / "stop_aware_epoch"
+    exe.write_text(
+        "#!/bin/bash\n"
+        "if [[ -n $1 ]]; then OUTPUT=$1; else read OUTPUT; fi\n"
+        "for _ in $(seq 200); do\n"
+        "  if [[ -f $OUTPUT/STOP ]]; then\n"
+        "    echo restart > $OUTPUT/restart.sdf\n"
+        "    exit 0\n"
+        "  fi\n"
+        "  sleep 0.05\n"
+        "done\n"
+        "exit 1\n"
+    )
+    exe.chmod(0o755)
+    return exe
+
+
+@pytest.fixture
+def sdf_block() -> type[SdfBlock]:
+    """Block with packed metadata, to pass to ``write_sdf``."""
+    return SdfBlock
+
+
+def _plain_mesh(
+    block_id: str, axes: list[list[float]], point: bool = False, order: str = "<"
+) -> SdfBlock:
+    n = len(axes)
+    info = struct.pack(f"{order}{n}d", *[1.0] * n)
+    info += struct.pack(f"{order}{'32s' * n}", *[f"{a}".encode() for a in "xyz"[:n]])
+    info += struct.pack(f"{order}{'32s' * n}", *[b"m"] * n)
+    info += struct.pack(f"{order}i{n}d{n}d", 1, *[0.0] * n, *[1.0] * n)
+    if point:
+        info += struct.pack(f"{order}q", len(axes[0]))
+    else:
+        info += struct.pack(f"{order}{n}i", *[len(axis) for axis in axes])
+    data = b"".join(struct.pack(f"{order}{len(a)}d", *a) for a in axes)
+    return SdfBlock(block_id, 2 if point else 1, 4, n, info, data)
+
+
+def _plain_variable(
+    block_id: str, shape: tuple[int, ...], order: str = "<", start: float = 0.0
+) -> SdfBlock:
+    np = pytest.importorskip("numpy")
+    values = np.arange(start, start + math.prod(shape), dtype=f"{order}f4")
+    info = struct.pack(f"{order}d32s32s{len(shape)}ii", 2.0, b"V/m", b"grid", *shape, 0)
+    return SdfBlock(block_id, 3, 3, len(shape), info, values.tobytes())
+
+
+@pytest.fixture
+def sdf_mesh() -> Callable[..., SdfBlock]:
+    """Function making a plain or point mesh block from the values of its axes."""
+    return _plain_mesh
+
+
+@pytest.fixture
+def sdf_variable() -> Callable[..., SdfBlock]:
+    """Function making a plain variable block of single precision values.
+
+    The values count up from ``start`` in the order in which they are stored.
+    """
+    return _plain_variable
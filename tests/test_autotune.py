@@ -0,0 +1,163 @@
+import json
+from pathlib import Path
+from textwrap import dedent
+
+import pytest
+
+from epoch_containers import autotune as autotune_module
+from epoch_containers.autotune import (
+    Candidate,
+    autotune,
+    candidates,
+    load_space,
+    write_report,
+)
+from epoch_containers.utils import (
+    MICROARCH_FLAGS,
+    exe_name,
+    read_cpu_flags,
+    select_exe,
+)
+
+
+@pytest.fixture
+def mock_epoch_dir(tmp_path: Path) -> Path:
+    """Epoch repo whose 'executable' sleeps for less time when built with -O3."""
+    d = tmp_path / "autotune"
+    dd = d / "epoch1d"
+    (dd / "bin").mkdir(parents=True)
+    makefile = dedent(
+        """\
+        D := D
+        # DEFINES += $(D)PHOTONS
+        # DEFINES += $(D)VECTOR_PUSH
+        SLEEP = $(if $(findstring -O3,$(FFLAGS)),0,0.2)
+
+        epoch:
+        \tprintf '#!/bin/bash\\n# %s\\nread OUTPUT\\nsleep %s\\n' \\
+        \t  "$(DEFINES) $(FFLAGS)" "$(SLEEP)" > bin/epoch1d
+        \tchmod +x bin/epoch1d
+
+        clean:
+        \trm -f bin/epoch1d
+        """
+    )
+    (dd / "Makefile").write_text(makefile)
+    deck = d / "deck" / "input.deck"
+    deck.parent.mkdir()
+    deck.write_text("begin:control\n  nx = 10\n  t_end = 1\nend:control\n")
+    return d
+
+
+@pytest.mark.parametrize(
+    "space,expected",
+    (
+        (
+            {"opt": ["-O2", "-O3"]},
+            [
+                Candidate("candidate_0", ["-O2"], []),
+                Candidate("candidate_1", ["-O3"], []),
+            ],
+        ),
+        (
+            {"opt": ["-O3 -flto"], "defines": ["", "VECTOR_PUSH"]},
+            [
+                Candidate("candidate_0", ["-O3", "-flto"], []),
+                Candidate("candidate_1", ["-O3", "-flto"], ["VECTOR_PUSH"]),
+            ],
+        ),
+    ),
+)
+def test_candidates(space: dict, expected: list[Candidate]):
+    assert list(candidates(space)) == expected
+
+
+def test_load_space(tmp_path: Path):
+    assert load_space(None)
+    space_file = tmp_path / "space.json"
+    space_file.write_text(json.dumps({"opt": ["-O2", "-O3"]}))
+    assert load_space(space_file) == {"opt": ["-O2", "-O3"]}
+    space_file.write_text(json.dumps({"opt": "-O2"}))
+    with pytest.raises(ValueError):
+        load_space(space_file)
+
+
+@pytest.mark.parametrize("cores", (1, 4))
+def test_autotune(tmp_path: Path, mock_epoch_dir: Path, cores: int):
+    space = {"opt": ["-O2", "-O3"], "defines": ["", "VECTOR_PUSH"]}
+    results = autotune(
+        mock_epoch_dir,
+        1,
+        "gfortran",
+        mock_epoch_dir / "deck",
+        space=space,
+        steps=10,
+        cores=cores,
+    )
+    assert len(results) == 4
+    # -O3 builds are faster, so should be ranked first
+    assert all("-O3" in r.candidate.fflags for r in results[:2])
+    per_step = [r.seconds_per_step for r in results]
+    assert per_step == sorted(per_step)
+    installed = mock_epoch_dir / "bin" / exe_name(1, variant="tuned")
+    assert "-O3" in installed.read_text()
+    assert not list(mock_epoch_dir.glob(".build_*"))
+
+    report = tmp_path / "report.json"
+    write_report(results, report)
+    ranked = json.loads(report.read_text())
+    assert [r["rank"] for r in ranked] == [1, 2, 3, 4]
+    assert ranked[0]["steps"] == 10
+
+
+def test_autotune_times_after_builds(
+    monkeypatch: pytest.MonkeyPatch, mock_epoch_dir: Path
+):
+    built: list[Path] = []
+    timed: list[int] = []
+    build_epoch = autotune_module.build_epoch
+    time_run = autotune_module.time_run
+
+    def record_build(*args, **kwargs) -> Path:
+        exe = build_epoch(*args, **kwargs)
+        built.append(exe)
+        return exe
+
+    def record_run(*args, **kwargs) -> float:
+        # Every build has finished before any timing run starts
+        timed.append(len(built))
+        return time_run(*args, **kwargs)
+
+    monkeypatch.setattr(autotune_module, "build_epoch", record_build)
+    monkeypatch.setattr(autotune_module, "time_run", record_run)
+    space = {"opt": ["-O2", "-O3"], "defines": ["", "VECTOR_PUSH"]}
+    autotune(mock_epoch_dir, 1, "gfortran", mock_epoch_dir / "deck", space=space)
+    assert timed == [4] * 4
+
+
+def test_autotune_with_variants(mock_epoch_dir: Path):
+    bin_dir = mock_epoch_dir / "bin"
+    bin_dir.mkdir()
+    for variant in ("x86-64-v3", "x86-64-v4"):
+        (bin_dir / exe_name(1, variant=variant)).write_text("# untuned")
+    autotune(
+        mock_epoch_dir,
+        1,
+        "gfortran",
+        mock_epoch_dir / "deck",
+        space={"opt": ["-O2", "-O3"]},
+        steps=10,
+    )
+    # The tuned build is chosen over the microarchitecture variants
+    exe = select_exe(1, bin_dir=bin_dir, flags=MICROARCH_FLAGS["x86-64-v4"])
+    assert exe == str(bin_dir.resolve() / exe_name(1, variant="tuned"))
+    assert "-O3" in Path(exe).read_text()
+    assert read_cpu_flags(Path(exe)) == frozenset()
+
+
+def test_autotune_failures(mock_epoch_dir: Path):
+    with pytest.raises(FileNotFoundError):
+        autotune(mock_epoch_dir, 1, "gfortran", mock_epoch_dir / "no_deck")
+    # Builds of a missing directory fail for every candidate
+    with pytest.raises(RuntimeError):
+        autotune(mock_epoch_dir, 2, "gfortran", mock_epoch_dir / "deck")
@@ -0,0 +1,190 @@
+import csv
+import json
+import os
+import sys
+from pathlib import Path
+from textwrap import dedent
+
+import pytest
+
+from epoch_containers.benchmark import (
+    BenchmarkResult,
+    add_efficiency,
+    benchmark,
+    find_decks,
+    launch_cmd,
+    noop_cmd,
+    pull_container,
+    run_benchmark,
+    write_results,
+)
+from epoch_containers.utils import exe_name
+
+_DECK = dedent(
+    """\
+    begin:control
+      nx = 100
+      ny = 50
+      t_end = 50 * femto
+      stdout_frequency = 10
+    end:control
+    """
+)
+
+
+@pytest.fixture
+def deck_set(tmp_path: Path) -> Path:
+    d = tmp_path / "benchmarks" / "laptop"
+    for name in ("laser_a", "laser_b"):
+        (d / name).mkdir(parents=True)
+        (d / name / "input.deck").write_text(_DECK)
+    return d
+
+
+@pytest.fixture
+def mock_epoch_bin_dir(tmp_path: Path) -> Path:
+    """Fake Epoch which reports progress every 10 steps, up to nsteps."""
+    d = tmp_path / "bin"
+    d.mkdir()
+    script = d / exe_name(2)
+    script.write_text(
+        dedent(
+            """\
+            #!/bin/bash
+            read OUTPUT
+            nsteps=$(sed -n 's/ *nsteps = //p' $OUTPUT/input.deck)
+            for ((step = 10; step <= nsteps; step += 10)); do
+              echo "Time 1.0E-15 and iteration $step after 00:00:0$((step / 10)).0"
+            done
+            """
+        )
+    )
+    os.chmod(script, 0o755)
+    return d
+
+
+def test_find_decks(deck_set: Path):
+    decks = find_decks([deck_set])
+    assert [d.parent.name for d in decks] == ["laser_a", "laser_b"]
+    assert find_decks([deck_set / "laser_a"]) == [deck_set / "laser_a" / "input.deck"]
+    with pytest.raises(FileNotFoundError):
+        find_decks([deck_set / "missing"])
+
+
+@pytest.mark.parametrize("mode", ("docker", "singularity"))
+@pytest.mark.parametrize("photons", (False, True))
+def test_launch_cmd_container(tmp_path: Path, mode: str, photons: bool):
+    nprocs = 1 if mode == "docker" else 4
+    cmd, stdin = launch_cmd(mode, 2, tmp_path, nprocs, photons=photons, container="c")
+    assert stdin is None
+    assert cmd[:3] == [sys.executable, "run_epoch.py", mode]
+    assert ("--photons" in cmd) == photons
+    assert cmd[cmd.index("-c") + 1] == "c"
+    assert ("-n" in cmd) == (mode == "singularity")
+
+
+def test_launch_cmd_native(tmp_path: Path, mock_epoch_bin_dir: Path):
+    cmd, stdin = launch_cmd("native", 2, tmp_path, 4, bin_dir=mock_epoch_bin_dir)
+    assert cmd == ["mpirun", "-n", "4", str(mock_epoch_bin_dir / "epoch_2d")]
+    assert stdin == str(tmp_path.resolve()).encode()
+    with pytest.raises(ValueError):
+        launch_cmd("docker", 2, tmp_path, 4)
+
+
+@pytest.mark.parametrize(
+    "mode,nprocs,expected",
+    (
+        ("native", 1, ["true"]),
+        ("native", 2, ["mpirun", "-n", "2", "true"]),
+        ("docker", 1, ["docker", "run", "--rm", "--entrypoint", "true", "c"]),
+        ("singularity", 2, ["mpirun", "-n", "2", "singularity", "exec", "c", "true"]),
+    ),
+)
+def test_noop_cmd(mode: str, nprocs: int, expected: list[str]):
+    assert noop_cmd(mode, nprocs, "c") == expected
+
+
+def _result(study: str, nprocs: int, seconds_per_step: float) -> BenchmarkResult:
+    return BenchmarkResult(
+        deck="deck",
+        mode="native",
+        study=study,
+        dims=2,
+        nprocs=nprocs,
+        nx="100",
+        steps=10,
+        wall_seconds=10 * seconds_per_step,
+        epoch_seconds=None,
+        seconds_per_step=seconds_per_step,
+        launch_overhead=0.0,
+    )
+
+
+def test_add_efficiency():
+    results = [
+        _result("strong", 1, 4.0),
+        _result("strong", 2, 2.0),
+        _result("strong", 4, 2.0),
+        _result("weak", 1, 1.0),
+        _result("weak", 4, 2.0),
+    ]
+    add_efficiency(results)
+    assert [r.efficiency for r in results] == [1.0, 1.0, 0.5, 1.0, 0.5]
+
+
+def test_benchmark(tmp_path: Path, deck_set: Path, mock_epoch_bin_dir: Path):
+    results = benchmark(
+        [deck_set],
+        studies=["strong", "weak"],
+        steps=30,
+        bin_dir=mock_epoch_bin_dir,
+    )
+    assert len(results) == 4
+    for result in results:
+        assert result.returncode == 0
+        assert result.steps == 30
+        assert result.epoch_seconds == 3.0
+        assert result.seconds_per_step == pytest.approx(0.1)
+        assert result.efficiency == 1.0
+        assert result.launch_overhead > 0
+
+    write_results(results, tmp_path / "results")
+    with (tmp_path / "results.csv").open() as f:
+        rows = list(csv.DictReader(f))
+    assert len(rows) == 4
+    assert rows[0]["study"] == "strong"
+    assert json.loads((tmp_path / "results.json").read_text())[1]["study"] == "weak"
+
+
+def test_benchmark_uneven_weak_scaling(deck_set: Path, mock_epoch_bin_dir: Path):
+    with pytest.raises(ValueError, match="multiples of 2, not 3"):
+        benchmark([deck_set], nprocs=[2, 3, 4], studies=["weak"])
+
+
+def test_benchmark_pulls_container(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    log = tmp_path / "singularity.log"
+    singularity = bin_dir / "singularity"
+    singularity.write_text(f'#!/bin/bash\necho "$@" >> {log}\n')
+    singularity.chmod(0o755)
+    monkeypatch.setenv("PATH", f"{bin_dir}:{os.environ['PATH']}")
+
+    benchmark([], mode="singularity", container="oras://registry/epoch.sif:latest")
+    # The image is pulled before launching is timed, which then uses the local copy
+    pull, noop = log.read_text().splitlines()
+    image = pull.split()[1]
+    assert pull == f"pull {image} oras://registry/epoch.sif:latest"
+    assert noop == f"exec {image} true"
+    assert pull_container("epoch.sif", tmp_path) == "epoch.sif"
+
+
+def test_run_benchmark_weak_scaling(deck_set: Path, mock_epoch_bin_dir: Path):
+    deck = deck_set / "laser_a" / "input.deck"
+    result = run_benchmark(
+        deck, "native", 1, 20, study="weak", scale=2, bin_dir=mock_epoch_bin_dir
+    )
+    assert result.nx == "(100) * 2"
+    assert result.steps == 20
+    # Original deck untouched
+    assert deck.read_text() == _DECK
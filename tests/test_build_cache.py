@@ -0,0 +1,80 @@
+import os
+from pathlib import Path
+
+import pytest
+
+from epoch_containers.build_cache import BuildCache, cache_key, source_hash
+
+
+@pytest.fixture
+def mock_source_dir(tmp_path: Path) -> Path:
+    d = tmp_path / "epoch" / "epoch1d"
+    (d / "src").mkdir(parents=True)
+    (d / "obj").mkdir()
+    (d / "Makefile").write_text("all:\n")
+    (d / "src" / "epoch1d.F90").write_text("program epoch1d\nend program\n")
+    sdf = tmp_path / "epoch" / "SDF"
+    sdf.mkdir()
+    (sdf / "sdf.f90").write_text("module sdf\nend module\n")
+    return d
+
+
+def test_source_hash(mock_source_dir: Path):
+    original = source_hash(mock_source_dir)
+    # Build products are ignored
+    (mock_source_dir / "obj" / "epoch1d.o").write_bytes(b"\0\1")
+    (mock_source_dir / "src" / "epoch1d.mod").write_bytes(b"\0\1")
+    assert source_hash(mock_source_dir) == original
+    # Changes to the sources or SDF are not
+    (mock_source_dir.parent / "SDF" / "sdf.f90").write_text("module sdf2\nend module")
+    assert source_hash(mock_source_dir) != original
+
+
+@pytest.mark.parametrize(
+    "flags_a,flags_b,same",
+    (
+        ([], [], True),
+        (["PHOTONS"], ["PHOTONS"], True),
+        (["PHOTONS", "TRIDENT_PHOTONS"], ["TRIDENT_PHOTONS", "PHOTONS"], True),
+        ([], ["PHOTONS"], False),
+    ),
+)
+def test_cache_key_flags(
+    mock_source_dir: Path, flags_a: list[str], flags_b: list[str], same: bool
+):
+    key_a = cache_key(mock_source_dir, "gfortran", flags_a)
+    key_b = cache_key(mock_source_dir, "gfortran", flags_b)
+    assert (key_a == key_b) == same
+
+
+def test_cache_key_compiler(mock_source_dir: Path):
+    assert cache_key(mock_source_dir, "gfortran") != cache_key(mock_source_dir, "intel")
+
+
+def test_build_cache_get_put(tmp_path: Path):
+    cache = BuildCache(tmp_path / "cache")
+    exe = tmp_path / "epoch_1d"
+    exe.write_text("executable")
+    dest = tmp_path / "bin" / "epoch_1d"
+    assert not cache.get("abc", dest)
+    cache.put("abc", exe)
+    assert cache.get("abc", dest)
+    assert dest.read_text() == "executable"
+    # Storing the same key twice is harmless
+    cache.put("abc", exe)
+    assert len(cache.entries()) == 1
+    assert not list((tmp_path / "cache").glob(".tmp-*"))
+
+
+def test_build_cache_lru_eviction(tmp_path: Path):
+    cache = BuildCache(tmp_path / "cache", max_size=400)
+    exe = tmp_path / "epoch_1d"
+    exe.write_bytes(b"x" * 100)
+    for n, key in enumerate(("a", "b")):
+        cache.put(key, exe)
+        os.utime(cache.cache_dir / key, (n, n))
+    # Using 'a' makes 'b' the least recently used
+    assert cache.get("a", tmp_path / "restored")
+    cache.put("c", exe)
+    assert sorted(p.name for p in cache.entries()) == ["a", "c"]
+    assert cache.size() <= cache.max_size
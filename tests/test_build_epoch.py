@@ -1,12 +1,24 @@
 import itertools
+import os
+import subprocess
 import sys
 from pathlib import Path
 from textwrap import dedent
 
 import pytest
 
-from epoch_containers.build_epoch import build_epoch, compiler_flags, parse_build_args
-from epoch_containers.utils import exe_name
+from epoch_containers import build_epoch as build_epoch_module
+from epoch_containers.build_cache import BuildCache
+from epoch_containers.build_epoch import (
+    build_epoch,
+    build_matrix,
+    build_pgo,
+    compiler_flags,
+    march_flags,
+    parse_build_args,
+    share_jobs,
+)
+from epoch_containers.utils import CPU_FLAGS_SUFFIX, exe_name, read_cpu_flags
 
 
 @pytest.mark.parametrize(
@@ -52,6 +64,19 @@ def test_parse_build_args(
         assert args.photons == photons
 
 
+@pytest.mark.parametrize(
+    "options", (["--all"], ["--march", "x86-64-v3"], ["--cache-dir", "cache"])
+)
+def test_parse_build_args_pgo(monkeypatch, capsys, options: list[str]):
+    monkeypatch.setattr(sys, "argv", ["test", "--pgo", "deck", *options])
+    with pytest.raises(SystemExit) as exc:
+        parse_build_args()
+    assert exc.value.code == 2
+    assert f"{options[0]} can't be used with --pgo" in capsys.readouterr().err
+    monkeypatch.setattr(sys, "argv", ["test", "--pgo", "deck", "--jobs", "4"])
+    assert parse_build_args().pgo == [Path("deck")]
+
+
 @pytest.fixture
 def mock_epoch_dir(tmp_path: Path) -> Path:
     d = tmp_path / "build_epoch"
@@ -75,7 +100,7 @@ def mock_epoch_dir(tmp_path: Path) -> Path:
             # DEFINES += $(D)MORE_PHOTONS
 
             hello_world:
-            \techo $(DEFINES) > bin/epoch{dims}d
+            \techo $(DEFINES) $(FFLAGS) > bin/epoch{dims}d
 
             clean:
             \trm -f bin/epoch{dims}d
@@ -121,6 +146,34 @@ def test_compiler_flags(
     assert not (mock_make_dir / "Makefile.copy").is_file()
 
 
+@pytest.mark.parametrize(
+    "flags,fflags,ldflags",
+    (
+        (None, ["-O3"], None),
+        (None, None, ["-flto"]),
+        (["PHOTONS"], ["-O3", "-march=native"], ["-flto"]),
+    ),
+)
+def test_compiler_flags_extra(
+    mock_make_dir: Path,
+    flags: list[str] | None,
+    fflags: list[str] | None,
+    ldflags: list[str] | None,
+):
+    original = (mock_make_dir / "Makefile").read_text()
+    with compiler_flags(mock_make_dir, flags=flags, fflags=fflags, ldflags=ldflags):
+        lines = [
+            line.strip()
+            for line in (mock_make_dir / "Makefile").read_text().splitlines()
+        ]
+        if fflags:
+            assert f"FFLAGS += {' '.join(fflags)}" in lines
+        if ldflags:
+            assert f"LDFLAGS += {' '.join(ldflags)}" in lines
+        assert ("DEFINES += $(D)PHOTONS" in lines) == bool(flags)
+    assert (mock_make_dir / "Makefile").read_text() == original
+
+
 @pytest.mark.parametrize(
     "dims,compiler,photons",
     itertools.product(
@@ -138,3 +191,164 @@ def test_build_epoch(mock_epoch_dir: Path, dims: int, compiler: str, photons: bo
         assert "PHOTONS" in text
     else:
         assert "PHOTONS" not in text
+
+
+@pytest.mark.parametrize(
+    "jobs,builds,expected",
+    (
+        (1, 1, [1]),
+        (1, 6, [1]),
+        (6, 1, [6]),
+        (6, 6, [1, 1, 1, 1, 1, 1]),
+        (8, 6, [2, 2, 1, 1, 1, 1]),
+        (16, 3, [6, 5, 5]),
+        (4, 6, [1, 1, 1, 1]),
+    ),
+)
+def test_share_jobs(jobs: int, builds: int, expected: list[int]):
+    assert share_jobs(jobs, builds) == expected
+
+
+@pytest.mark.parametrize("jobs", (None, 1, 3, 64))
+def test_build_matrix(mock_epoch_dir: Path, jobs: int | None):
+    results = build_matrix(mock_epoch_dir, "gfortran", jobs=jobs)
+    assert len(results) == 6
+    for result in results:
+        expected_file = mock_epoch_dir / "bin" / exe_name(result.dims, result.photons)
+        assert result.exe == expected_file
+        assert expected_file.is_file()
+        assert ("PHOTONS" in expected_file.read_text()) == result.photons
+        assert result.seconds >= 0
+    # Shared Makefiles untouched, temporary build trees removed
+    for dims in range(1, 4):
+        makefile = mock_epoch_dir / f"epoch{dims}d" / "Makefile"
+        assert makefile.read_text().count("#") == 7
+    assert not list(mock_epoch_dir.glob(".build_*"))
+
+
+def test_build_matrix_subset(mock_epoch_dir: Path):
+    results = build_matrix(mock_epoch_dir, "gfortran", variants=[(2, True)], jobs=4)
+    assert [(r.dims, r.photons, r.jobs) for r in results] == [(2, True, 4)]
+    assert [p.name for p in (mock_epoch_dir / "bin").iterdir()] == ["epoch_2d_photons"]
+
+
+def test_build_epoch_jobs(monkeypatch, mock_epoch_dir: Path):
+    commands: list[list[str]] = []
+    run = subprocess.run
+
+    def record(cmd, *args, **kwargs):
+        commands.append(cmd)
+        return run(cmd, *args, **kwargs)
+
+    monkeypatch.setattr(subprocess, "run", record)
+    monkeypatch.setattr(os, "cpu_count", lambda: 6)
+    build_epoch(mock_epoch_dir, 2, "gfortran")
+    build_epoch(mock_epoch_dir, 2, "gfortran", jobs=2)
+    # Without a limit, make would start as many jobs as it can
+    assert [cmd[1] for cmd in commands if "clean" not in cmd] == ["-j6", "-j2"]
+
+
+def test_build_epoch_cache(monkeypatch, tmp_path: Path, mock_epoch_dir: Path):
+    cache = BuildCache(tmp_path / "cache")
+    exe = build_epoch(mock_epoch_dir, 2, "gfortran", photons=True, cache=cache)
+    text = exe.read_text()
+    assert len(cache.entries()) == 1
+    exe.unlink()
+
+    # An identical build should be restored without invoking make
+    def no_make(cmd, *args, **kwargs):
+        if cmd[0] == "make":
+            raise AssertionError("make should not be called on a cache hit")
+        return run(cmd, *args, **kwargs)
+
+    run = subprocess.run
+
+    with monkeypatch.context() as mpatch:
+        mpatch.setattr(subprocess, "run", no_make)
+        assert build_epoch(mock_epoch_dir, 2, "gfortran", True, cache=cache) == exe
+    assert exe.read_text() == text
+
+    # Changing the flags or the sources should miss
+    build_epoch(mock_epoch_dir, 2, "gfortran", photons=False, cache=cache)
+    assert len(cache.entries()) == 2
+    with (mock_epoch_dir / "epoch2d" / "Makefile").open("a") as f:
+        f.write("# A change to the sources\n")
+    build_epoch(mock_epoch_dir, 2, "gfortran", photons=False, cache=cache)
+    assert len(cache.entries()) == 3
+
+
+@pytest.mark.parametrize("photons", (False, True))
+def test_build_pgo(monkeypatch, mock_epoch_dir: Path, photons: bool):
+    profile_dir = mock_epoch_dir / "profiles" / exe_name(2, photons)
+    decks = [mock_epoch_dir / "deck_a", mock_epoch_dir / "deck_b" / "input.deck"]
+    decks[0].mkdir()
+    (decks[0] / "input.deck").write_text("begin:control\nend:control\n")
+    decks[1].parent.mkdir()
+    decks[1].write_text("begin:control\nend:control\n")
+    runs: list[str] = []
+
+    def mock_run_epoch(dims, output, photons=False, bin_dir=None):
+        # The instrumented build should be run under the usual name
+        exe = Path(bin_dir) / exe_name(dims, photons)
+        assert "-fprofile-generate" in exe.read_text()
+        assert (output / "input.deck").is_file()
+        (profile_dir / f"{output.name}.gcda").write_text("profile")
+        runs.append(output.name)
+
+    monkeypatch.setattr(build_epoch_module, "run_epoch", mock_run_epoch)
+    exe = build_pgo(
+        mock_epoch_dir, 2, "gfortran", photons=photons, training_decks=decks
+    )
+    assert runs == ["run_0", "run_1"]
+    assert exe == mock_epoch_dir / "bin" / exe_name(2, photons, variant="pgo")
+    assert "-fprofile-use" in exe.read_text()
+    assert ("PHOTONS" in exe.read_text()) == photons
+    assert len(list(profile_dir.iterdir())) == 2
+    assert read_cpu_flags(exe) == frozenset()
+    # Instrumented build is not kept
+    assert sorted(p.name for p in (mock_epoch_dir / "bin").iterdir()) == [
+        exe.name,
+        exe.name + CPU_FLAGS_SUFFIX,
+    ]
+
+    # Reuse existing profile data without training
+    exe.unlink()
+    runs.clear()
+    assert build_pgo(mock_epoch_dir, 2, "gfortran", photons=photons) == exe
+    assert not runs
+    assert exe.is_file()
+
+
+def test_build_pgo_missing_profile(mock_epoch_dir: Path):
+    with pytest.raises(FileNotFoundError):
+        build_pgo(mock_epoch_dir, 1, "gfortran")
+    with pytest.raises(FileNotFoundError):
+        build_pgo(mock_epoch_dir, 1, "gfortran", training_decks=[Path("no_deck")])
+
+
+def test_build_pgo_unsupported_compiler(mock_epoch_dir: Path):
+    with pytest.raises(ValueError):
+        build_pgo(mock_epoch_dir, 1, "g95")
+
+
+def test_build_matrix_march(mock_epoch_dir: Path):
+    marches = ["baseline", "x86-64-v3"]
+    results = build_matrix(
+        mock_epoch_dir, "gfortran", variants=[(1, False)], jobs=2, marches=marches
+    )
+    assert [r.march for r in results] == marches
+    assert [r.exe.name for r in results] == ["epoch_1d", "epoch_1d_x86-64-v3"]
+    assert "-march" not in results[0].exe.read_text()
+    assert "-march=x86-64-v3" in results[1].exe.read_text()
+
+
+@pytest.mark.parametrize(
+    "compiler,march,expected",
+    (
+        ("gfortran", "baseline", []),
+        ("gfortran", "x86-64-v4", ["-march=x86-64-v4"]),
+        ("intel", "x86-64-v3", ["-xCORE-AVX2"]),
+    ),
+)
+def test_march_flags(compiler: str, march: str, expected: list[str]):
+    assert march_flags(compiler, march) == expected
@@ -0,0 +1,108 @@
+import json
+import os
+import shutil
+import struct
+from pathlib import Path
+
+import pytest
+
+from epoch_containers.bundle import (
+    MANIFEST,
+    ElfInfo,
+    LibraryResolver,
+    check_bundle,
+    export_bundle,
+    read_elf,
+)
+from epoch_containers.utils import read_cpu_flags, write_cpu_flags
+
+#: A dynamically linked executable to bundle
+TRUE = Path(shutil.which("true") or "/bin/true")
+
+needs_elf = pytest.mark.skipif(
+    not TRUE.is_file() or TRUE.read_bytes()[:4] != b"\x7fELF",
+    reason="requires a dynamically linked 'true'",
+)
+
+
+def fake_library(path: Path, elf_class: int = 2, machine: int = 62) -> Path:
+    """Write the header of a little-endian ELF file, with no program headers."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(
+        b"\x7fELF"
+        + bytes([elf_class, 1, 1])
+        + bytes(9)
+        + struct.pack("<HH", 3, machine)
+        + bytes(44)
+    )
+    return path
+
+
+@needs_elf
+def test_read_elf(tmp_path: Path):
+    info = read_elf(TRUE)
+    assert info is not None
+    assert info.interpreter is not None and "ld" in info.interpreter
+    assert any(name.startswith("libc.so") for name in info.needed)
+    assert read_elf(fake_library(tmp_path / "lib.so")) == ElfInfo(2, 62)
+    (tmp_path / "script").write_text("#!/bin/sh\n")
+    assert read_elf(tmp_path / "script") is None
+
+
+def test_library_resolver(tmp_path: Path):
+    info = ElfInfo(2, 62, rpath=["$ORIGIN/../lib"])
+    (tmp_path / "bin").mkdir()
+    wrong_machine = fake_library(tmp_path / "arm" / "libfoo.so.1", machine=183)
+    cached = fake_library(tmp_path / "cached" / "libfoo.so.1")
+    resolver = LibraryResolver({"libfoo.so.1": [wrong_machine, cached]}, [])
+    assert resolver.find("libfoo.so.1", info, tmp_path / "bin") == cached
+    assert resolver.find("libmissing.so.1", info, tmp_path / "bin") is None
+
+    # RPATH is searched first, unless there is a RUNPATH
+    origin = fake_library(tmp_path / "lib" / "libfoo.so.1")
+    assert resolver.find("libfoo.so.1", info, tmp_path / "bin") == origin
+    info.runpath = [str(tmp_path / "runpath")]
+    assert resolver.find("libfoo.so.1", info, tmp_path / "bin") == cached
+
+
+@needs_elf
+def test_export_bundle(tmp_path: Path):
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    shutil.copy(TRUE, bin_dir / "epoch1d")
+    (bin_dir / "epoch2d.log").write_text("not an executable")
+    write_cpu_flags(bin_dir / "epoch1d", ["avx2"])
+    root = tmp_path / "bundle"
+    bundle = export_bundle(bin_dir, root, python=False)
+
+    assert bundle.executables == [bin_dir / "epoch1d"]
+    assert not bundle.missing
+    libc = next(name for name in bundle.libraries if name.startswith("libc.so"))
+    assert (root / str(bundle.libraries[libc]).lstrip("/")).is_file()
+    exe = root / str(bin_dir / "epoch1d").lstrip("/")
+    assert os.access(exe, os.X_OK)
+    assert read_cpu_flags(exe) == frozenset(("avx2",))
+    manifest = json.loads((root / MANIFEST).read_text())
+    assert manifest["executables"] == [str(bin_dir / "epoch1d")]
+    assert manifest["size"] == bundle.size > exe.stat().st_size
+    report = bundle.report()
+    assert report.startswith(f"Exported 1 executables to {root}")
+    assert f"  {libc} => {bundle.libraries[libc]}" in report
+
+
+@needs_elf
+@pytest.mark.skipif(
+    os.geteuid() != 0 or shutil.which("chroot") is None,
+    reason="requires root and chroot",
+)
+def test_check_bundle(tmp_path: Path):
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    shutil.copy(TRUE, bin_dir / "epoch1d")
+    bundle = export_bundle(bin_dir, tmp_path / "bundle", python=False)
+    assert check_bundle(bundle) == {bin_dir / "epoch1d": None}
+
+    # Without its libraries, it can't start
+    for path in bundle.libraries.values():
+        (bundle.root / str(path).lstrip("/")).unlink()
+    assert check_bundle(bundle)[bin_dir / "epoch1d"] is not None
@@ -0,0 +1,125 @@
+import json
+import zlib
+from pathlib import Path
+
+import pytest
+
+from epoch_containers.convert import chunk_shape, convert
+
+np = pytest.importorskip("numpy")
+
+
+@pytest.mark.parametrize(
+    "shape,itemsize,target,expected",
+    (
+        ((10, 10), 8, 800, (10, 10)),
+        ((10, 10), 8, 400, (5, 10)),
+        ((100, 10, 4), 4, 1000, (7, 5, 4)),
+        ((7,), 8, 8, (1,)),
+    ),
+)
+def test_chunk_shape(shape, itemsize: int, target: int, expected):
+    assert chunk_shape(shape, itemsize, target) == expected
+
+
+def _read(store: Path, name: str):
+    """Read an array from a Zarr store, without zarr."""
+    meta = json.loads((store / name / ".zarray").read_text())
+    values = np.zeros(meta["shape"], dtype=meta["dtype"])
+    for chunk_file in (store / name).glob("[0-9]*"):
+        index = [int(i) for i in chunk_file.name.split(".")]
+        data = np.frombuffer(zlib.decompress(chunk_file.read_bytes()), meta["dtype"])
+        chunk = data.reshape(meta["chunks"])
+        region = tuple(
+            slice(i * c, min((i + 1) * c, n))
+            for i, c, n in zip(index, meta["chunks"], meta["shape"])
+        )
+        values[region] = chunk[tuple(slice(0, r.stop - r.start) for r in region)]
+    return values
+
+
+@pytest.fixture
+def output(write_sdf, sdf_mesh, sdf_variable, tmp_path: Path) -> Path:
+    directory = tmp_path / "output"
+    directory.mkdir()
+    grid = sdf_mesh("grid", [[0.0, 1.0, 2.0, 3.0, 4.0], [0.0, 1.0, 2.0]])
+    for step in (0, 10):
+        blocks = [grid, sdf_variable("ex", (4, 2), start=step)]
+        blocks.append(sdf_variable("ey", (4, 2), start=-step))
+        write_sdf(directory / f"{step // 10:04d}.sdf", blocks, step=step)
+    return directory
+
+
+def test_convert(output: Path, write_sdf, sdf_variable):
+    store = output / "epoch.zarr"
+    converted = convert(output, store, variables=["ex"], workers=2, chunk_bytes=12)
+    assert [path.name for path in converted] == ["0000.sdf", "0001.sdf"]
+
+    ex = _read(store, "ex")
+    assert ex.shape == (2, 4, 2)
+    for time, start in enumerate((0, 10)):
+        expected = np.arange(start, start + 8, dtype="f4").reshape((4, 2), order="F")
+        np.testing.assert_array_equal(ex[time], expected)
+    assert json.loads((store / "ex" / ".zarray").read_text())["chunks"] == [1, 1, 2]
+    assert not (store / "ey").exists()
+    np.testing.assert_array_equal(_read(store, "step"), [0, 10])
+    np.testing.assert_allclose(_read(store, "time"), [0.0, 1e-14])
+    np.testing.assert_array_equal(_read(store, "grid_x"), [0.5, 1.5, 2.5, 3.5])
+    np.testing.assert_array_equal(_read(store, "grid_y_edges"), [0.0, 1.0, 2.0])
+    dims = json.loads((store / "ex" / ".zattrs").read_text())["_ARRAY_DIMENSIONS"]
+    assert dims == ["time", "grid_x", "grid_y"]
+
+    # Only new dumps are converted when run again
+    assert convert(output, store, variables=["ex"]) == []
+    write_sdf(output / "0002.sdf", [sdf_variable("ex", (4, 2), start=20)], step=20)
+    assert [path.name for path in convert(output, store, variables=["ex"])] == [
+        "0002.sdf"
+    ]
+    ex = _read(store, "ex")
+    assert ex.shape == (3, 4, 2)
+    assert ex[2, 0, 0] == 20
+    np.testing.assert_array_equal(_read(store, "step"), [0, 10, 20])
+
+    # Dumps earlier than those in the store would put times out of order
+    write_sdf(output / "late.sdf", [sdf_variable("ex", (4, 2), start=5)], step=5)
+    with pytest.raises(ValueError, match="are earlier than step 20"):
+        convert(output, store, variables=["ex"])
+    np.testing.assert_array_equal(_read(store, "step"), [0, 10, 20])
+
+
+def test_convert_same_step(output: Path, write_sdf, sdf_variable):
+    # A second output block at the same step, with another variable
+    blocks = [
+        sdf_variable("ex", (4, 2), start=100),
+        sdf_variable("bz", (4, 2), start=50),
+    ]
+    write_sdf(output / "fields0001.sdf", blocks, step=10)
+    store = output / "epoch.zarr"
+    assert len(convert(output, store, workers=4, chunk_bytes=12)) == 3
+
+    np.testing.assert_array_equal(_read(store, "step"), [0, 10])
+    # Each array at a step is written from the first dump holding it
+    assert _read(store, "ex")[1, 0, 0] == 10
+    bz = _read(store, "bz")
+    assert bz[1, 0, 0] == 50
+    assert not list((store / "bz").glob("0.*"))
+    assert not list(store.rglob("*.tmp"))
+
+
+def test_convert_zarr(output: Path):
+    zarr = pytest.importorskip("zarr")
+    store = output / "epoch.zarr"
+    convert(output, store, workers=1)
+    group = zarr.open_consolidated(str(store), mode="r")
+    assert sorted(group.array_keys()) == [
+        "ex",
+        "ey",
+        "grid_x",
+        "grid_x_edges",
+        "grid_y",
+        "grid_y_edges",
+        "step",
+        "time",
+    ]
+    assert group["ey"][1, 3, 1] == -10 + 7
+    assert group["ex"].attrs["units"] == "V/m"
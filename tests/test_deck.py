@@ -0,0 +1,98 @@
+from textwrap import dedent
+
+import pytest
+
+from epoch_containers.deck import (
+    control_value,
+    deck_blocks,
+    deck_constants,
+    evaluate,
+    set_block_values,
+    set_control,
+)
+
+_DECK = dedent(
+    """\
+    begin:control
+      nx = 500
+      ny = nx
+
+      # Final time of simulation
+      t_end = 50 * femto
+    end:control
+
+    begin:output
+      dt_snapshot = 25 * femto
+    end:output
+    """
+)
+
+
+@pytest.mark.parametrize(
+    "values,expected",
+    (
+        ({}, []),
+        ({"nx": 100}, ["  nx = 100"]),
+        ({"NX": 100}, ["  NX = 100"]),
+        ({"nsteps": 10}, ["  nsteps = 10"]),
+        ({"t_end": None}, []),
+        ({"nsteps": 10, "t_end": None}, ["  nsteps = 10"]),
+    ),
+)
+def test_set_control(values: dict, expected: list[str]):
+    deck = set_control(_DECK, **values)
+    control = deck.split("end:control")[0].splitlines()
+    for line in expected:
+        assert line in control
+    assert ("t_end" in deck) == ("t_end" not in values)
+    if not any(k.lower() == "nx" for k in values):
+        assert "  nx = 500" in control
+    # Other blocks untouched
+    assert deck.split("end:control")[1] == _DECK.split("end:control")[1]
+
+
+def test_set_block_values_new_block():
+    deck = set_block_values(_DECK, "restart", {"restart_snapshot": 3})
+    assert deck.startswith(_DECK)
+    assert deck.endswith("begin:restart\n  restart_snapshot = 3\nend:restart\n")
+    assert set_block_values(_DECK, "restart", {"restart_snapshot": None}) == _DECK
+
+
+@pytest.mark.parametrize(
+    "expr,expected",
+    (
+        ("50 * femto", 5e-14),
+        ("2^10", 1024.0),
+        ("-3 + 4 * 2", 5.0),
+        ("sqrt(16) * micron", 4e-6),
+        ("2 * PI", 6.283185307179586),
+        ("lambda0 / c", 1e-6 / 2.99792458e8),
+    ),
+)
+def test_evaluate(expr: str, expected: float):
+    assert evaluate(expr, {"lambda0": 1e-6}) == pytest.approx(expected)
+
+
+@pytest.mark.parametrize("expr", ("x", "gauss(x, 0, 1)", "1 / 0", "1 +", "'a'"))
+def test_evaluate_unsupported(expr: str):
+    with pytest.raises(ValueError):
+        evaluate(expr)
+
+
+def test_control_value():
+    deck = "begin:constant\n  t0 = 10 * femto\n  f = x\nend:constant\n" + _DECK
+    assert deck_constants(deck) == pytest.approx({"t0": 1e-14})
+    assert control_value(deck, "t_end") == pytest.approx(5e-14)
+    assert control_value(deck, "NY") == 500
+    assert control_value(deck, "nsteps") is None
+    deck = set_control(deck, t_end="5 * t0")
+    assert control_value(deck, "t_end") == pytest.approx(5e-14)
+
+
+def test_deck_blocks():
+    deck = _DECK + "begin:species\n  name = a\nend:species\n"
+    deck += "begin:species\n  Name = b # comment\nend:species\n"
+    blocks = deck_blocks(deck)
+    assert [name for name, _ in blocks] == ["control", "output", "species", "species"]
+    assert blocks[0][1] == {"nx": "500", "ny": "nx", "t_end": "50 * femto"}
+    assert [values["name"] for _, values in blocks[2:]] == ["a", "b"]
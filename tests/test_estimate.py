@@ -0,0 +1,141 @@
+import json
+import sys
+from pathlib import Path
+from textwrap import dedent
+
+import pytest
+
+from epoch_containers.estimate import (
+    estimate,
+    format_report,
+    is_dumped,
+    main,
+    recommend,
+)
+
+_DECK = dedent(
+    """\
+    begin:control
+      nx = 1000
+      ny = nx / 2
+      t_end = 100 * femto
+      x_min = 0
+      x_max = 10 * micron
+      y_min = 0
+      y_max = 5 * micron
+    end:control
+
+    begin:species
+      name = electron
+      nparticles_per_cell = 10
+      density = if(x gt 0, 1e26, 0)
+    end:species
+
+    begin:species
+      name = proton
+      npart = 1e6
+    end:species
+
+    begin:output
+      dt_snapshot = 25 * femto
+      grid = always
+      ex = always
+      ey = never
+      number_density = always + species
+      particles = always
+      px = always
+    end:output
+    """
+)
+
+
+def test_estimate():
+    result = estimate(_DECK)
+    assert result.dims == 2
+    assert result.cells == 500_000
+    assert result.species == ["electron", "proton"]
+    assert result.particles == 5_000_000 + 1_000_000
+    # CFL limit with dx = dy = 10 nm
+    assert result.dt == pytest.approx(0.95 * 1e-8 / (2.99792458e8 * 2**0.5))
+    assert result.steps == 4463
+    assert result.dumps == 5
+    # ex, number density for the total and two species, and 4 reals per particle
+    assert result.dump_bytes == 8 * (4 * 500_000 + 4 * 6_000_000)
+    assert result.total_dump_bytes == 5 * result.dump_bytes
+    assert result.cell_steps == 500_000 * 4463
+    assert result.notes == []
+    assert estimate(_DECK, photons=True).memory > result.memory
+
+
+@pytest.mark.parametrize(
+    "key,value", (("npart", "1e6"), ("nparticles", "1e6"), ("npart_per_cell", "2"))
+)
+def test_estimate_particle_keys(key: str, value: str):
+    deck = _DECK.replace("npart = 1e6", f"{key} = {value}")
+    expected = 1_000_000 if "per_cell" not in key else 2 * 500_000
+    assert estimate(deck).particles == 5_000_000 + expected
+
+
+def test_estimate_nsteps():
+    deck = _DECK.replace("t_end = 100 * femto", "nsteps = 10")
+    result = estimate(deck)
+    assert result.steps == 10
+    assert result.dumps == 0
+    assert result.t_end is None
+
+
+def test_estimate_missing():
+    deck = "begin:control\n  nx = 10\nend:control\nbegin:species\nend:species\n"
+    result = estimate(deck)
+    assert result.steps == 0
+    assert len(result.notes) == 3
+    with pytest.raises(ValueError):
+        estimate("begin:control\n  nx = x\nend:control\n")
+
+
+@pytest.mark.parametrize(
+    "value,expected",
+    (("always", True), ("always + species", True), ("never", False), ("F", False)),
+)
+def test_is_dumped(value: str, expected: bool):
+    assert is_dumped(value) == expected
+
+
+def test_recommend():
+    result = estimate(_DECK)
+    small = recommend(result)
+    assert small.nprocs == 1
+    assert small.nodes == 1
+    # A tight time limit needs more processes, filling whole nodes
+    fast = recommend(result, walltime=result.core_seconds / 100, cores_per_node=16)
+    assert fast.nprocs == 112
+    assert fast.nodes == 7
+    assert fast.walltime <= result.core_seconds / 100
+    # As does a small amount of memory per core
+    lean = recommend(result, memory_per_core=1024**3)
+    assert lean.nprocs == 2
+    assert lean.memory_per_rank * 1.5 <= 1024**3
+    assert lean.mem_per_cpu.endswith("M")
+    # Ranks aren't given too few cells to finish sooner
+    capped = recommend(result, walltime=1e-9, min_cells_per_rank=50_000)
+    assert capped.nprocs == 10
+    assert "wall time" in capped.notes[0]
+    assert small.notes == lean.notes == []
+    # But are to fit in memory
+    tight = recommend(result, memory_per_core=1024**3, min_cells_per_rank=500_000)
+    assert tight.nprocs == 2
+    assert tight.memory_per_rank * 1.5 <= 1024**3
+    assert "fewer than 500,000 cells" in tight.notes[0]
+    assert f"Note: {tight.notes[0]}" in format_report(result, tight)
+
+
+def test_main(monkeypatch, capsys, tmp_path: Path):
+    (tmp_path / "input.deck").write_text(_DECK)
+    monkeypatch.setattr(sys, "argv", ["estimate_epoch", str(tmp_path)])
+    main()
+    assert "#SBATCH --mem-per-cpu=" in capsys.readouterr().out
+    monkeypatch.setattr(sys, "argv", ["estimate_epoch", str(tmp_path), "--json"])
+    main()
+    result = json.loads(capsys.readouterr().out)
+    assert result["estimate"]["cells"] == 500_000
+    assert result["job"]["nprocs"] == 1
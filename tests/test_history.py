@@ -0,0 +1,80 @@
+import sqlite3
+from pathlib import Path
+
+import pytest
+
+from epoch_containers.history import (
+    RunRecord,
+    deck_hash,
+    find_regressions,
+    query_runs,
+    record_run,
+)
+
+
+def _run(duration: float, deck: str = "abc", nprocs: int = 4, status: int = 0):
+    return RunRecord(
+        deck_hash=deck,
+        output="/output",
+        launcher="native",
+        identity="epoch_2d@sha256:0",
+        dims=2,
+        photons=False,
+        nprocs=nprocs,
+        start_time=0.0,
+        end_time=duration,
+        exit_status=status,
+    )
+
+
+def test_deck_hash(tmp_path: Path):
+    assert deck_hash(tmp_path) == ""
+    (tmp_path / "input.deck").write_text("begin:control\nend:control\n")
+    first = deck_hash(tmp_path)
+    assert len(first) == 64
+    (tmp_path / "input.deck").write_text("begin:control\n  nx = 1\nend:control\n")
+    assert deck_hash(tmp_path) != first
+
+
+def test_record_and_query(tmp_path: Path):
+    db = tmp_path / "history" / "runs.sqlite"
+    run = _run(10.0)
+    run.args = ["-d", "2"]
+    run.metrics = {"steps": 100}
+    assert record_run(db, run) == 1
+    record_run(db, _run(5.0, deck="def"))
+    runs = query_runs(db)
+    assert [r.id for r in runs] == [1, 2]
+    assert runs[0].args == ["-d", "2"]
+    assert runs[0].metrics == {"steps": 100}
+    assert runs[0].duration == 10.0
+    assert [r.id for r in query_runs(db, deck_hash="def")] == [2]
+    # Readable without this package
+    with sqlite3.connect(db) as connection:
+        assert connection.execute("SELECT COUNT(*) FROM runs").fetchone() == (2,)
+
+
+@pytest.mark.parametrize(
+    "durations,flagged",
+    (
+        ([10, 10, 10, 10], []),
+        ([10, 10, 10, 12], [3]),
+        ([10, 10, 10, 10.5], []),
+        ([10, 10, 12], []),  # Not enough history
+        ([10, 30, 10, 10, 12], [4]),  # Median is robust to outliers
+    ),
+)
+def test_find_regressions(durations: list[float], flagged: list[int]):
+    runs = [_run(d) for d in durations]
+    regressions = find_regressions(runs, tolerance=0.1, min_history=3)
+    assert [runs.index(r.run) for r in regressions] == flagged
+    for regression in regressions:
+        assert regression.ratio > 1.1
+
+
+def test_find_regressions_groups():
+    # Different decks, process counts, and failed runs are not compared
+    runs = [_run(10), _run(10), _run(10, nprocs=8), _run(10, deck="x")]
+    runs += [_run(10, status=1), _run(20, status=1), _run(10), _run(20)]
+    regressions = find_regressions(runs, min_history=3)
+    assert [runs.index(r.run) for r in regressions] == [7]
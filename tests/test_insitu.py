@@ -0,0 +1,134 @@
+import json
+from pathlib import Path
+
+import pytest
+
+from epoch_containers.insitu import (
+    RESULTS,
+    AnalysisPipeline,
+    available_memory,
+    load_callback,
+    run_callback,
+)
+from epoch_containers.lifecycle import OutputManager
+
+CALLBACKS = """\
+from pathlib import Path
+
+
+def size(path):
+    return Path(path).stat().st_size
+
+
+def broken(path):
+    raise RuntimeError(f"can't read {Path(path).name}")
+"""
+
+
+@pytest.fixture
+def analysis(tmp_path: Path) -> Path:
+    """Output directory containing a file of callbacks, 'analysis.py'."""
+    (tmp_path / "analysis.py").write_text(CALLBACKS)
+    return tmp_path
+
+
+def meminfo(directory: Path, available: int, total: int = 1000) -> Path:
+    directory.mkdir(exist_ok=True)
+    (directory / "meminfo").write_text(
+        f"MemTotal: {total} kB\nMemFree: 1 kB\nMemAvailable: {available} kB\n"
+    )
+    return directory
+
+
+def test_load_callback(analysis: Path):
+    assert load_callback("json:dumps") is json.dumps
+    assert load_callback("analysis.py:size", analysis)(analysis / "analysis.py") > 0
+    with pytest.raises(ValueError, match="module:function"):
+        load_callback("analysis.py")
+
+
+def test_available_memory(tmp_path: Path):
+    assert available_memory(meminfo(tmp_path / "proc", 250)) == 0.25
+    assert available_memory(tmp_path / "missing") == 1.0
+
+
+def test_run_callback(analysis: Path):
+    result = run_callback("analysis.py:broken", analysis / "0001.sdf", analysis)
+    assert result.callback == "analysis.py:broken"
+    assert result.error == "RuntimeError: can't read 0001.sdf"
+    assert result.result is None
+
+
+def test_pipeline(write_sdf, analysis: Path, capsys):
+    paths = [
+        write_sdf(analysis / f"000{n}.sdf", [("ex", bytes(64 * n))], step=n)
+        for n in range(1, 3)
+    ]
+    callbacks = ["analysis.py:size", "analysis.py:broken"]
+    pipeline = AnalysisPipeline(analysis, callbacks, workers=2, interval=0.1)
+    with pipeline:
+        pass
+    # With two workers, either dump may finish first
+    assert sorted(pipeline.analysed) == paths
+    assert pipeline.after_run == 2
+    assert pipeline.held() == set()
+    results = [json.loads(line) for line in (analysis / RESULTS).open()]
+    sizes = {r["dump"]: r["result"] for r in results if r["callback"] == callbacks[0]}
+    assert sizes == {str(path): path.stat().st_size for path in paths}
+    timing = pipeline.timings["analysis.py:broken"]
+    assert (timing.calls, timing.failures) == (2, 2)
+    out = capsys.readouterr().out
+    assert "Analysed 2 dumps, 2 after Epoch finished" in out
+    assert "analysis.py:size: 2 calls, " in out
+    assert "analysis.py:broken: 2 calls, 2 failed" in out
+
+
+def test_pipeline_resume(write_sdf, analysis: Path, capsys):
+    first = write_sdf(analysis / "0001.sdf", [("ex", bytes(64))], step=1)
+    with AnalysisPipeline(analysis, ["analysis.py:size"], interval=0.1):
+        pass
+    # Resumed with a new dump, and a new callback
+    second = write_sdf(analysis / "0002.sdf", [("ex", bytes(128))], step=2)
+    callbacks = ["analysis.py:size", "analysis.py:broken"]
+    with (analysis / RESULTS).open("a") as f:
+        f.write('{"callback": "analysis.py:si')
+    pipeline = AnalysisPipeline(analysis, callbacks, interval=0.1)
+    with pipeline:
+        pass
+    assert sorted(pipeline.analysed) == [first, second]
+    assert pipeline.resumed == 0
+    assert pipeline.held() == set()
+    lines = (analysis / RESULTS).read_text().splitlines()
+    assert lines[1] == '{"callback": "analysis.py:si'
+    results = [json.loads(line) for line in lines[2:]]
+    runs = sorted((r["callback"], Path(r["dump"]).name) for r in results)
+    assert runs == [
+        ("analysis.py:broken", "0001.sdf"),
+        ("analysis.py:broken", "0002.sdf"),
+        ("analysis.py:size", "0002.sdf"),
+    ]
+
+    # Every callback has run on every dump, so nothing is run again
+    pipeline = AnalysisPipeline(analysis, callbacks, interval=0.1)
+    with pipeline:
+        pass
+    assert pipeline.resumed == 2
+    assert pipeline.held() == set()
+    assert (analysis / RESULTS).read_text().splitlines() == lines
+    assert "Analysed 2 dumps, 2 before resuming, 0 after" in capsys.readouterr().out
+
+
+def test_pipeline_backpressure(write_sdf, analysis: Path, tmp_path: Path):
+    path = write_sdf(analysis / "0001.sdf", [("ex", bytes(64))])
+    proc = meminfo(tmp_path / "proc", 100)
+    pipeline = AnalysisPipeline(analysis, ["analysis.py:size"], reserve=0.2, proc=proc)
+    pipeline.scan()
+    pipeline.scan()
+    # Short of memory, so nothing starts, and the dump is held back from compression
+    assert not pipeline._running and len(pipeline._queue) == 1
+    manager = OutputManager(analysis, hold=pipeline.held)
+    manager.dumps()
+    assert manager.dumps() == {}
+    pipeline.finish()
+    assert pipeline.analysed == [path]
+    assert path in manager.dumps()
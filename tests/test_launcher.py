@@ -0,0 +1,171 @@
+import asyncio
+import io
+import os
+import shutil
+import sys
+import time
+from pathlib import Path
+
+import pytest
+
+from epoch_containers import launcher
+from epoch_containers.launcher import EpochRun, Launcher
+
+
+def python(code: str) -> list[str]:
+    return [sys.executable, "-c", code]
+
+
+#: Sleeps until asked to stop with Epoch's stop file, ignoring SIGTERM
+STUBBORN = """\
+import signal, sys, time
+from pathlib import Path
+signal.signal(signal.SIGTERM, signal.SIG_IGN)
+print("started", flush=True)
+while not Path("STOP").exists():
+    time.sleep(0.01)
+print("writing restart dump", flush=True)
+sys.exit(3)
+"""
+
+
+def test_argv(tmp_path: Path):
+    assert launcher.run_epoch_argv(2, Path("out dir"), True, nprocs=4) == [
+        *("mpirun", "-n", "4", "run_epoch", "-d", "2", "-o", "out dir", "--photons"),
+    ]
+    docker = launcher.docker_argv("epoch:latest", tmp_path, 1, extra=["--resume"])
+    assert docker[:5] == ["docker", "run", "--rm", "-v", f"{tmp_path}:/output"]
+    assert docker[5:] == ["epoch:latest", "-d", "1", "-o", "/output", "--resume"]
+    singularity = launcher.singularity_argv("epoch.sif", tmp_path, 3, srun=True)
+    assert singularity[:3] == ["srun", "singularity", "exec"]
+    assert singularity[-5:] == ["run_epoch", "-d", "3", "-o", "/output"]
+
+
+def test_run():
+    lines: list[str] = []
+    log = io.StringIO()
+
+    async def main() -> EpochRun:
+        run = EpochRun(
+            python("import sys; print(sys.stdin.read()); print('done'); exit(2)"),
+            input=b"/output",
+            on_line=lines.append,
+            log=log,
+        )
+        assert run.status == launcher.PENDING
+        run.start()
+        assert await run == 2
+        return run
+
+    run = asyncio.run(main())
+    assert run.status == launcher.FAILED
+    assert run.returncode == 2
+    assert lines == ["/output\n", "done\n"]
+    assert log.getvalue() == "/output\ndone\n"
+    assert list(run.tail) == ["/output", "done"]
+    assert run.duration is not None and run.duration > 0
+    assert run.waited is not None and run.waited >= 0
+
+
+@pytest.mark.skipif(
+    shutil.which("run_epoch") is None, reason="requires the run_epoch command"
+)
+@pytest.mark.parametrize("code,status", ((0, launcher.SUCCEEDED), (3, launcher.FAILED)))
+def test_run_epoch_exit_code(tmp_path: Path, code: int, status: str):
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    exe = bin_dir / "epoch_1d"
+    exe.write_text(f"#!/bin/sh\nexit {code}\n")
+    exe.chmod(0o755)
+    output = tmp_path / "output"
+    output.mkdir()
+    env = dict(os.environ, PATH=f"{bin_dir}:{os.environ['PATH']}")
+
+    async def main() -> EpochRun:
+        run = EpochRun(launcher.run_epoch_argv(1, output), env=env)
+        run.start()
+        await run
+        return run
+
+    # Epoch's exit code passes through the run_epoch command
+    run = asyncio.run(main())
+    assert run.returncode == code
+    assert run.status == status
+
+
+def test_launcher_limit():
+    async def main() -> Launcher:
+        async with Launcher(limit=2) as runs:
+            for _ in range(4):
+                runs.launch(python("import time; time.sleep(0.3)"))
+            await asyncio.sleep(0.1)
+            assert [run.status for run in runs.runs] == ["running"] * 2 + [
+                "pending"
+            ] * 2
+        return runs
+
+    start = time.perf_counter()
+    runs = asyncio.run(main())
+    assert 0.6 <= time.perf_counter() - start < 1.5
+    assert runs.summary() == {launcher.SUCCEEDED: 4}
+    assert all(run.returncode == 0 for run in runs.runs)
+
+
+def test_cancel():
+    async def main() -> Launcher:
+        runs = Launcher(limit=1)
+        running = runs.launch(python("import time; time.sleep(30)"), grace=1.0)
+        pending = runs.launch(python("print('never')"))
+        await asyncio.sleep(0.2)
+        # Cancelling a task waiting for the run doesn't stop it
+        waiter = asyncio.ensure_future(running.wait())
+        await asyncio.sleep(0.1)
+        waiter.cancel()
+        await asyncio.sleep(0.1)
+        assert running.status == launcher.RUNNING
+        assert pending.status == launcher.PENDING
+        runs.cancel()
+        assert await runs.wait() == [-15, None]
+        return runs
+
+    start = time.perf_counter()
+    runs = asyncio.run(main())
+    assert time.perf_counter() - start < 5
+    assert runs.summary() == {launcher.CANCELLED: 2}
+    assert runs.runs[1].start_time is None and not runs.runs[1].tail
+
+
+def test_timeout(tmp_path: Path):
+    async def main() -> EpochRun:
+        run = EpochRun(
+            python(STUBBORN), output=tmp_path, cwd=tmp_path, timeout=0.5, grace=2.0
+        )
+        run.start()
+        await run
+        return run
+
+    run = asyncio.run(main())
+    # Asked to stop with the stop file, which is removed afterwards
+    assert run.status == launcher.TIMED_OUT
+    assert run.returncode == 3
+    assert list(run.tail) == ["started", "writing restart dump"]
+    assert not (tmp_path / "STOP").exists()
+
+
+def test_timeout_kill(tmp_path: Path):
+    async def main() -> EpochRun:
+        # Without an output directory, SIGTERM is tried, and then SIGKILL
+        run = EpochRun(python(STUBBORN), cwd=tmp_path, timeout=0.3, grace=0.3)
+        run.start()
+        await run
+        return run
+
+    run = asyncio.run(main())
+    assert run.status == launcher.TIMED_OUT
+    assert run.returncode == -9
+
+
+def test_wait_before_start():
+    run = EpochRun(["true"])
+    with pytest.raises(RuntimeError, match="hasn't been started"):
+        asyncio.run(run.wait())
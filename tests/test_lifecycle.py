@@ -0,0 +1,149 @@
+import gzip
+import json
+import os
+from pathlib import Path
+
+import pytest
+
+from epoch_containers.lifecycle import (
+    CHECKSUMS,
+    OutputManager,
+    RetentionPolicy,
+    compress_dump,
+    decompress_dump,
+    expired,
+    open_files,
+    read_checksums,
+    verify_dumps,
+)
+from epoch_containers.sdf import is_complete, open_sdf, read_header
+
+
+@pytest.mark.parametrize(
+    "codec,suffix", (("gzip", ".gz"), ("bz2", ".bz2"), ("xz", ".xz"))
+)
+def test_compress_dump(write_sdf, tmp_path: Path, codec: str, suffix: str):
+    path = write_sdf(tmp_path / "0001.sdf", [("ex", bytes(4096))], step=5)
+    original = path.read_bytes()
+    record = compress_dump(path, codec)
+    assert not path.exists()
+    compressed = tmp_path / f"0001.sdf{suffix}"
+    assert record.compressed_size == compressed.stat().st_size < record.size
+    # Readers can open the dump by its original name
+    assert is_complete(path)
+    with open_sdf(path) as f:
+        assert read_header(f).step == 5
+        f.seek(0)
+        assert f.read() == original
+    assert decompress_dump(compressed).read_bytes() == original
+
+
+def test_verify_dumps(write_sdf, tmp_path: Path):
+    path = write_sdf(tmp_path / "0001.sdf", [("ex", bytes(64))])
+    record = compress_dump(path)
+    (tmp_path / CHECKSUMS).write_text(json.dumps(vars(record)) + "\n")
+    assert read_checksums(tmp_path)["0001.sdf"].sha256 == record.sha256
+    assert verify_dumps(tmp_path) == []
+    (tmp_path / "0001.sdf.gz").write_bytes(gzip.compress(b"corrupt"))
+    assert verify_dumps(tmp_path) == [tmp_path / "0001.sdf.gz"]
+
+
+def test_open_files(tmp_path: Path):
+    path = tmp_path / "open.sdf"
+    with path.open("w"):
+        assert path.resolve() in open_files()
+    assert path.resolve() not in open_files()
+
+
+@pytest.mark.parametrize(
+    "policy,removed",
+    (
+        (RetentionPolicy(), []),
+        (RetentionPolicy(keep_restarts=1), ["r0001.sdf", "r0002.sdf"]),
+        (RetentionPolicy(keep_restarts=0), ["r0001.sdf", "r0002.sdf", "r0003.sdf"]),
+        (RetentionPolicy(keep_every=2), ["f0001.sdf", "f0003.sdf"]),
+        (RetentionPolicy(keep_every=3), ["f0001.sdf", "f0002.sdf", "f0004.sdf"]),
+    ),
+)
+def test_expired(write_sdf, tmp_path: Path, policy: RetentionPolicy, removed):
+    dumps = {}
+    for number in range(1, 4):
+        path = write_sdf(tmp_path / f"r{number:04d}.sdf", [], step=number, restart=True)
+        dumps[path] = path
+    for number in range(0, 6):
+        path = write_sdf(tmp_path / f"f{number:04d}.sdf", [], step=number)
+        dumps[path] = path
+    headers = {}
+    for path in dumps:
+        with path.open("rb") as f:
+            headers[path] = read_header(f)
+    assert sorted(p.name for p in expired(headers, policy)) == removed
+
+
+def test_output_manager(write_sdf, tmp_path: Path, capsys):
+    for number in range(4):
+        write_sdf(tmp_path / f"{number:04d}.sdf", [("ex", bytes(1024))], step=number)
+    write_sdf(tmp_path / "restart0001.sdf", [("ex", bytes(8))], step=1, restart=True)
+    write_sdf(tmp_path / "restart0002.sdf", [("ex", bytes(8))], step=2, restart=True)
+    (tmp_path / "partial.sdf").write_bytes(b"SDF1")
+
+    policy = RetentionPolicy(keep_restarts=1, keep_every=2)
+    manager = OutputManager(tmp_path, policy=policy, workers=2)
+    with (tmp_path / "0002.sdf").open("rb"):
+        manager.run_once(settle=0.01)
+
+    names = sorted(path.name for path in tmp_path.iterdir())
+    assert names == [
+        "0000.sdf.gz",
+        # Still open, so left alone
+        "0002.sdf",
+        "0003.sdf.gz",
+        CHECKSUMS,
+        "partial.sdf",
+        "restart0002.sdf",
+    ]
+    assert sorted(read_checksums(tmp_path)) == ["0000.sdf", "0003.sdf"]
+    assert verify_dumps(tmp_path) == []
+    assert "Compressed 2 dumps" in capsys.readouterr().out
+
+
+def test_output_manager_background(write_sdf, tmp_path: Path):
+    with OutputManager(tmp_path, interval=0.01) as manager:
+        write_sdf(tmp_path / "0000.sdf", [("ex", bytes(64))])
+        for _ in range(500):
+            if manager.compressed or manager._pending:
+                break
+            manager._stop.wait(0.01)
+    # Anything not compressed in the background is compressed on exit
+    assert (tmp_path / "0000.sdf.gz").is_file()
+    assert not (tmp_path / "0000.sdf").exists()
+
+
+def test_output_manager_headers(write_sdf, tmp_path: Path, monkeypatch):
+    write_sdf(tmp_path / "0000.sdf", [("ex", bytes(64))], step=3)
+    dump = tmp_path / "0000.sdf.gz"
+    dump.write_bytes(gzip.compress((tmp_path / "0000.sdf").read_bytes()))
+    (tmp_path / "0000.sdf").unlink()
+    opened: list[Path] = []
+
+    def record_open(path: Path):
+        opened.append(path)
+        return open_sdf(path)
+
+    monkeypatch.setattr("epoch_containers.lifecycle.open_sdf", record_open)
+    manager = OutputManager(tmp_path)
+    assert manager.dumps()[dump].step == 3
+    # Compressed dumps are only read again once they change
+    assert manager.dumps()[dump].step == 3
+    assert opened == [dump]
+    write_sdf(tmp_path / "0000.sdf", [("ex", bytes(64))], step=4)
+    dump.write_bytes(gzip.compress((tmp_path / "0000.sdf").read_bytes()))
+    (tmp_path / "0000.sdf").unlink()
+    os.utime(dump, ns=(0, 0))
+    assert manager.dumps()[dump].step == 4
+    assert opened == [dump, dump]
+
+
+def test_output_manager_codec(tmp_path: Path):
+    with pytest.raises(ValueError):
+        OutputManager(tmp_path, codec="zip")
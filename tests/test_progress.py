@@ -0,0 +1,123 @@
+import io
+import json
+import sys
+from pathlib import Path
+
+import pytest
+
+from epoch_containers.progress import (
+    Progress,
+    ProgressTracker,
+    format_duration,
+    parse_progress,
+    parse_runtime,
+    parse_walltime,
+    stream_process,
+)
+
+
+@pytest.mark.parametrize(
+    "text,expected",
+    (
+        ("00:00:01.500", 1.5),
+        ("01:02:03.5", 3723.5),
+        ("1d 01:00:00.0", 90000.0),
+        ("0d 0h 0m 1.234s", 1.234),
+        ("1h 2m 3s", 3723.0),
+        ("2.5s", 2.5),
+        ("12.0", 12.0),
+        ("nonsense", None),
+    ),
+)
+def test_parse_walltime(text: str, expected: float | None):
+    assert parse_walltime(text) == pytest.approx(expected)
+
+
+@pytest.mark.parametrize(
+    "line,expected",
+    (
+        (
+            "Time    8.339113054500E-15 and iteration          10 after  00:00:00.283",
+            Progress(10, 8.3391130545e-15, 0.283),
+        ),
+        (
+            " Time 1.0D-14 and iteration 20 after 0d 0h 0m 1.5s",
+            Progress(20, 1e-14, 1.5),
+        ),
+        ("Initial conditions setup complete", None),
+        ("", None),
+    ),
+)
+def test_parse_progress(line: str, expected: Progress | None):
+    progress = parse_progress(line)
+    if expected is None:
+        assert progress is None
+    else:
+        assert progress is not None
+        assert progress.step == expected.step
+        assert progress.time == pytest.approx(expected.time)
+        assert progress.walltime == pytest.approx(expected.walltime)
+
+
+def test_parse_runtime():
+    assert parse_runtime(" Final runtime of core =  0d 0h 1m 2.5s") == 62.5
+    assert parse_runtime("Time 1.0 and iteration 1 after 00:00:01") is None
+
+
+@pytest.mark.parametrize(
+    "seconds,expected",
+    ((None, "?"), (0, "00:00:00"), (59.9, "00:00:59"), (3725, "01:02:05")),
+)
+def test_format_duration(seconds: float | None, expected: str):
+    assert format_duration(seconds) == expected
+
+
+def test_progress_tracker(tmp_path: Path):
+    metrics = tmp_path / "metrics.jsonl"
+    stream = io.StringIO()
+    tracker = ProgressTracker(t_end=1e-13, metrics=metrics, interval=0, stream=stream)
+    assert tracker.update("Initial conditions setup complete") is None
+    first = tracker.update("Time 0.0 and iteration 0 after 00:00:01.000")
+    assert first is not None and first.steps_per_second is None
+    throughput = tracker.update("Time 2.0E-14 and iteration 100 after 00:00:11.000")
+    assert throughput is not None
+    assert throughput.steps_per_second == pytest.approx(10.0)
+    assert throughput.sim_time_per_second == pytest.approx(2e-15)
+    assert throughput.eta == pytest.approx(40.0)
+
+    lines = stream.getvalue().splitlines()
+    assert len(lines) == 2
+    assert lines[-1].startswith("[epoch] step 100 t=2e-14s (20.0%) | 10 steps/s")
+    assert lines[-1].endswith("ETA 00:00:40")
+
+    assert tracker.finish()["step"] == 100
+    records = [json.loads(line) for line in metrics.read_text().splitlines()]
+    assert [record["step"] for record in records] == [0, 100, 100]
+    assert records[-1]["eta"] == pytest.approx(40.0)
+
+
+def test_progress_tracker_interval(tmp_path: Path):
+    metrics = tmp_path / "metrics.jsonl"
+    tracker = ProgressTracker(metrics=metrics, interval=3600)
+    for step in range(5):
+        tracker.update(f"Time {step}.0 and iteration {step} after 00:00:0{step}.0")
+    assert len(metrics.read_text().splitlines()) == 1
+    tracker.finish()
+    assert json.loads(metrics.read_text().splitlines()[-1])["step"] == 4
+    assert ProgressTracker().finish() == {}
+
+
+def test_stream_process():
+    script = (
+        "import sys; print(sys.stdin.read()); "
+        "print('Time 1.0 and iteration 10 after 00:00:01.0'); sys.exit(3)"
+    )
+    tracker = ProgressTracker()
+    stdout = io.StringIO()
+    cmd = [sys.executable, "-c", script]
+    assert stream_process(cmd, tracker, input=b"hello", stdout=stdout) == 3
+    assert stdout.getvalue().splitlines() == [
+        "hello",
+        "Time 1.0 and iteration 10 after 00:00:01.0",
+    ]
+    assert tracker.latest is not None and tracker.latest.step == 10
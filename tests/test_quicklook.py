@@ -0,0 +1,94 @@
+import json
+import struct
+import zlib
+from pathlib import Path
+
+import pytest
+
+from epoch_containers import quicklook as ql
+
+np = pytest.importorskip("numpy")
+
+
+@pytest.mark.parametrize(
+    "reduction,expected",
+    (
+        ("mean", [[2.5, 4.5], [10.5, 12.5], [16.5, 18.5]]),
+        ("max", [[5, 7], [13, 15], [17, 19]]),
+        ("rms", None),
+    ),
+)
+def test_block_reduce(reduction: str, expected, monkeypatch):
+    # Read a couple of rows at a time, to check slabs are joined correctly
+    monkeypatch.setattr(ql, "_SLAB_CELLS", 8)
+    array = np.arange(20.0).reshape(5, 4)
+    reduced = ql.block_reduce(array, 2, reduction)
+    if expected is None:
+        expected = [[np.sqrt(np.mean(np.square(array[:2, :2])))]]
+        reduced = reduced[:1, :1]
+    np.testing.assert_allclose(reduced, expected)
+
+
+def test_pyramid():
+    levels = ql.pyramid(np.ones((1000, 300)), largest=256, smallest=16)
+    assert [level.shape for level in levels] == [
+        (250, 75),
+        (125, 38),
+        (63, 19),
+        (32, 10),
+        (16, 5),
+    ]
+
+
+def test_write_png(tmp_path: Path):
+    image = np.zeros((3, 2, 3), dtype="u1")
+    image[0, 1] = (255, 0, 0)
+    path = tmp_path / "image.png"
+    ql.write_png(path, image)
+    data = path.read_bytes()
+    assert data.startswith(b"\x89PNG\r\n\x1a\n")
+    width, height = struct.unpack(">II", data[16:24])
+    assert (width, height) == (2, 3)
+    length = struct.unpack(">I", data[33:37])[0]
+    rows = zlib.decompress(data[41 : 41 + length])
+    assert rows[:7] == bytes([0, 0, 0, 0, 255, 0, 0])
+
+
+def test_to_image():
+    # Signed data is centred on white, with x across and y up the image
+    image = ql.to_image(np.array([[-1.0, 0.0], [1.0, 0.5]]), (-1.0, 1.0))
+    assert image.shape == (2, 2, 3)
+    assert tuple(image[1, 0]) == (33, 102, 172)
+    assert tuple(image[0, 0]) == (247, 247, 247)
+    assert tuple(image[1, 1]) == (178, 24, 43)
+
+
+def test_quicklook(write_sdf, sdf_mesh, sdf_variable, tmp_path: Path):
+    grid = sdf_mesh("grid", [list(range(65)), list(range(33))])
+    for step in (0, 10):
+        blocks = [grid, sdf_variable("ey", (64, 32)), sdf_variable("ex", (64, 32))]
+        write_sdf(tmp_path / f"{step // 10:04d}.sdf", blocks, step=step)
+
+    drawn = ql.quicklook(tmp_path, variables=["ey"], workers=2, smallest=16)
+    assert [path.name for path in drawn] == ["0000.sdf", "0001.sdf"]
+    directory = tmp_path / ql.QUICKLOOK
+    index = json.loads((directory / "index.json").read_text())
+    assert [entry["step"] for entry in index["dumps"]] == [0, 10]
+    ey = index["dumps"][0]["variables"]["ey"]
+    assert list(index["dumps"][0]["variables"]) == ["ey"]
+    assert (ey["min"], ey["max"]) == (0.0, 64 * 32 - 1.0)
+    assert [level["shape"] for level in ey["levels"]] == [[64, 32], [32, 16], [16, 8]]
+    level = np.load(directory / ey["levels"][1]["npy"])
+    assert level.dtype == np.float32
+    assert level[0, 0] == np.mean([0, 1, 64, 65])
+    assert (directory / ey["levels"][1]["png"]).read_bytes()[:4] == b"\x89PNG"
+
+    # Only new dumps are drawn
+    write_sdf(tmp_path / "0002.sdf", [sdf_variable("ey", (64, 32))], step=20)
+    assert [path.name for path in ql.quicklook(tmp_path, workers=1)] == ["0002.sdf"]
+    index = json.loads((directory / "index.json").read_text())
+    assert [entry["dump"] for entry in index["dumps"]] == [
+        "0000.sdf",
+        "0001.sdf",
+        "0002.sdf",
+    ]
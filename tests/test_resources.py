@@ -0,0 +1,177 @@
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+from epoch_containers.resources import (
+    ResourceSampler,
+    ResourceSummary,
+    aggregate,
+    collect_summaries,
+    descendants,
+    format_bytes,
+    format_summary,
+    read_proc,
+    write_summary,
+)
+
+_CLK_TCK = os.sysconf("SC_CLK_TCK")
+
+
+def fake_process(
+    proc: Path,
+    pid: int,
+    ppid: int,
+    rss_kb: int = 1000,
+    ticks: tuple[int, int] = (0, 0),
+    io: bool = True,
+    children_file: bool = False,
+) -> None:
+    """Write the /proc files read by the sampler for a single process."""
+    d = proc / str(pid)
+    (d / "task" / str(pid)).mkdir(parents=True)
+    fields = ["S", str(ppid)] + ["0"] * 9 + [str(ticks[0]), str(ticks[1])] + ["0"] * 8
+    (d / "stat").write_text(f"{pid} (epoch 2d) {' '.join(fields)}\n")
+    (d / "status").write_text(
+        f"Name:\tepoch\nVmHWM:\t{2 * rss_kb} kB\nVmRSS:\t{rss_kb} kB\n"
+        "voluntary_ctxt_switches:\t5\nnonvoluntary_ctxt_switches:\t2\n"
+    )
+    if io:
+        (d / "io").write_text("rchar: 99\nread_bytes: 4096\nwrite_bytes: 8192\n")
+    if children_file:
+        kids = [p.name for p in proc.iterdir() if p.name != str(pid)]
+        (d / "task" / str(pid) / "children").write_text(" ".join(kids))
+
+
+@pytest.fixture
+def proc(tmp_path: Path) -> Path:
+    """A fake /proc, with a launcher (1) running a shell (2) running Epoch (3)."""
+    proc = tmp_path / "proc"
+    fake_process(proc, 1, 0)
+    fake_process(proc, 2, 1, rss_kb=100, ticks=(_CLK_TCK, 0), io=False)
+    fake_process(proc, 3, 2, rss_kb=1000, ticks=(4 * _CLK_TCK, _CLK_TCK))
+    fake_process(proc, 4, 0)
+    return proc
+
+
+def test_read_proc(proc: Path):
+    sample = read_proc(3, proc)
+    assert sample is not None
+    assert sample.rss == 1000 * 1024
+    assert sample.hwm == 2000 * 1024
+    assert sample.cpu_user == pytest.approx(4.0)
+    assert sample.cpu_system == pytest.approx(1.0)
+    assert (sample.voluntary_switches, sample.involuntary_switches) == (5, 2)
+    assert (sample.read_bytes, sample.write_bytes) == (4096, 8192)
+    # Unreadable I/O counters are left at zero
+    shell = read_proc(2, proc)
+    assert shell is not None and shell.read_bytes == 0
+    assert read_proc(99, proc) is None
+
+
+def test_descendants(proc: Path):
+    assert descendants(1, proc) == [2, 3]
+    assert descendants(3, proc) == []
+
+
+def test_descendants_children_file(tmp_path: Path):
+    proc = tmp_path / "proc"
+    fake_process(proc, 5, 0)
+    fake_process(proc, 6, 0, children_file=True)
+    assert descendants(6, proc) == [5]
+
+
+def test_sampler(proc: Path):
+    assert ResourceSampler(proc=proc).sample() == 0
+    # Only the tree rooted at the shell is sampled, not the launcher
+    sampler = ResourceSampler(rank=2, pid=2, proc=proc)
+    assert sampler.sample() == 1100 * 1024
+    summary = sampler.finish()
+    assert summary.rank == 2
+    assert summary.samples == 1
+    assert summary.pids == [2, 3]
+    assert summary.peak_rss == 2000 * 1024
+    assert summary.mean_rss == 1100 * 1024
+    assert summary.cpu_user == pytest.approx(5.0)
+    assert summary.cpu_system == pytest.approx(1.0)
+    assert summary.voluntary_switches == 10
+    assert summary.read_bytes == 4096
+
+
+def busy(seconds: float) -> list[str]:
+    """Command using ``seconds`` of CPU time."""
+    code = "import time\nstart = time.process_time()\n"
+    code += f"while time.process_time() - start < {seconds}: pass\n"
+    return [sys.executable, "-c", code]
+
+
+def test_sampler_live():
+    with ResourceSampler(interval=0.05) as sampler:
+        # Other processes started alongside Epoch aren't counted
+        with subprocess.Popen(busy(1.0)) as other:
+            with subprocess.Popen(busy(0.3)) as process:
+                sampler.watch(process)
+                assert sampler.wait(process) == 0
+                assert process.wait() == 0
+            other.wait()
+    summary = sampler.summary
+    assert summary.samples > 0
+    assert 0.25 <= summary.cpu_user + summary.cpu_system < 0.9
+    assert summary.peak_rss > 0
+    assert summary.wall > 0
+
+
+def test_aggregate(tmp_path: Path):
+    for rank, rss in enumerate((100, 300)):
+        write_summary(ResourceSummary(rank, wall=rank + 1, peak_rss=rss), tmp_path)
+    summaries = collect_summaries(tmp_path, 3, timeout=0.2)
+    assert [s.rank for s in summaries] == [0, 1]
+    total = aggregate(summaries)
+    assert total["ranks"] == 2
+    assert total["wall"] == 2
+    assert total["peak_rss"] == 400
+    assert total["max_rank_peak_rss"] == 300
+    assert aggregate([]) == {}
+    assert json.loads((tmp_path / "rank1.json").read_text())["peak_rss"] == 300
+    assert format_summary(summaries[0]).startswith("rank 0: peak RSS 100.0 B")
+    assert format_summary(total).startswith("all ranks: peak RSS 400.0 B")
+
+
+def test_collect_current_summaries(tmp_path: Path):
+    # Summaries left by an earlier run are ignored, such as when resuming
+    write_summary(ResourceSummary(0, peak_rss=1, launch="new"), tmp_path)
+    write_summary(ResourceSummary(1, peak_rss=2, launch="old"), tmp_path)
+    summaries = collect_summaries(tmp_path, 2, timeout=0.2, launch="new")
+    assert [s.peak_rss for s in summaries] == [1]
+    write_summary(ResourceSummary(1, peak_rss=3, launch="new"), tmp_path)
+    summaries = collect_summaries(tmp_path, 2, timeout=0.2, launch="new")
+    assert [s.peak_rss for s in summaries] == [1, 3]
+
+    # Without a launch id, those finished before this run started are ignored
+    write_summary(ResourceSummary(0, peak_rss=4, finished=200.0), tmp_path)
+    write_summary(ResourceSummary(1, peak_rss=5, finished=50.0), tmp_path)
+    summaries = collect_summaries(tmp_path, 2, timeout=0.2, since=100.0)
+    assert [s.peak_rss for s in summaries] == [4]
+
+
+def test_sampler_records_launch():
+    with ResourceSampler(interval=10, launch="job.0") as sampler:
+        pass
+    assert sampler.summary.launch == "job.0"
+    assert sampler.summary.finished >= sampler.started > 0
+
+
+@pytest.mark.parametrize(
+    "size,expected",
+    (
+        (0, "0.0 B"),
+        (1536, "1.5 KiB"),
+        (3 * 1024**3, "3.0 GiB"),
+        (1024**4, "1.0 TiB"),
+    ),
+)
+def test_format_bytes(size: int, expected: str):
+    assert format_bytes(size) == expected
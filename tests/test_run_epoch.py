@@ -1,4 +1,5 @@
 import itertools
+import json
 import os
 import sys
 from pathlib import Path
@@ -6,8 +7,10 @@ from textwrap import dedent
 
 import pytest
 
-from epoch_containers.run_epoch import parse_run_args, run_epoch
-from epoch_containers.utils import exe_name
+from epoch_containers import utils
+from epoch_containers.history import query_runs
+from epoch_containers.run_epoch import parse_run_args, resume_deck, run_epoch
+from epoch_containers.utils import MICROARCH_FLAGS, exe_name
 
 
 @pytest.mark.parametrize(
@@ -99,3 +102,166 @@ def test_run_epoch(mock_epoch_bin_dir, output_dir, dims: int, photons: bool):
         assert "PHOTONS" in text
     else:
         assert "PHOTONS" not in text
+
+
+@pytest.mark.parametrize(
+    "level,expected",
+    (
+        ("x86-64-v2", "epoch_2d"),
+        ("x86-64-v3", "epoch_2d_x86-64-v3"),
+        ("x86-64-v4", "epoch_2d_x86-64-v3"),
+    ),
+)
+def test_run_epoch_microarch(
+    monkeypatch, mock_epoch_bin_dir, output_dir, level: str, expected: str
+):
+    # Add an executable built for x86-64-v3, which writes to a different file
+    script = mock_epoch_bin_dir / exe_name(2, variant="x86-64-v3")
+    script.write_text("#!/bin/bash\nread OUTPUT\necho v3 > $OUTPUT/epoch_2d.out\n")
+    os.chmod(str(script), 0o755)
+    monkeypatch.setattr(utils, "cpu_flags", lambda: MICROARCH_FLAGS[level])
+    run_epoch(2, output_dir, bin_dir=mock_epoch_bin_dir)
+    text = (output_dir / "epoch_2d.out").read_text()
+    assert ("v3" in text) == (expected == "epoch_2d_x86-64-v3")
+
+
+def test_run_epoch_history(tmp_path: Path, mock_epoch_bin_dir, output_dir):
+    db = tmp_path / "history.sqlite"
+    (output_dir / "input.deck").write_text("begin:control\nend:control\n")
+    for _ in range(2):
+        assert run_epoch(2, output_dir, bin_dir=mock_epoch_bin_dir, history=db) == 0
+    runs = query_runs(db)
+    assert len(runs) == 2
+    assert runs[0].deck_hash == runs[1].deck_hash != ""
+    assert runs[0].identity.startswith("epoch_2d@sha256:")
+    assert runs[0].nprocs == 1
+    assert runs[0].exit_status == 0
+    assert runs[0].end_time >= runs[0].start_time
+
+
+def test_run_epoch_progress(tmp_path: Path, mock_epoch_bin_dir, output_dir, capsys):
+    # Replace the 1D executable with one that reports its progress
+    script = mock_epoch_bin_dir / exe_name(1)
+    script.write_text(
+        dedent(
+            """\
+            #!/bin/bash
+            read OUTPUT
+            echo "Time 0.0 and iteration 0 after 00:00:00.000"
+            echo "Time 2.5E-14 and iteration 50 after 00:00:05.000"
+            echo "Final runtime of core = 0d 0h 0m 10.0s"
+            """
+        )
+    )
+    (output_dir / "input.deck").write_text(
+        "begin:control\n  nx = 10\n  t_end = 50 * femto\nend:control\n"
+    )
+    db = tmp_path / "history.sqlite"
+    metrics = output_dir / "metrics.jsonl"
+    returncode = run_epoch(
+        1,
+        output_dir,
+        bin_dir=mock_epoch_bin_dir,
+        history=db,
+        progress=True,
+        metrics=metrics,
+    )
+    assert returncode == 0
+
+    captured = capsys.readouterr()
+    assert "Final runtime of core" in captured.out
+    assert "ETA 00:00:05" in captured.err
+    last = json.loads(metrics.read_text().splitlines()[-1])
+    assert last["step"] == 50
+    assert last["steps_per_second"] == pytest.approx(10.0)
+    assert query_runs(db)[0].metrics["eta"] == pytest.approx(5.0)
+
+
+def test_run_epoch_resources(tmp_path: Path, mock_epoch_bin_dir, output_dir, capsys):
+    db = tmp_path / "history.sqlite"
+    returncode = run_epoch(
+        2,
+        output_dir,
+        bin_dir=mock_epoch_bin_dir,
+        history=db,
+        sample_resources=True,
+        sample_interval=0.01,
+    )
+    assert returncode == 0
+    summary = json.loads((output_dir / "resources" / "summary.json").read_text())
+    assert summary["aggregate"]["ranks"] == 1
+    assert summary["ranks"][0]["rank"] == 0
+    assert "all ranks: peak RSS" in capsys.readouterr().out
+    assert query_runs(db)[0].metrics["resources"]["ranks"] == 1
+
+
+def test_resume_deck(write_sdf, output_dir, capsys, mock_epoch_bin_dir):
+    deck = output_dir / "input.deck"
+    deck.write_text("begin:control\n  nx = 10\n  restart_snapshot = 1\nend:control\n")
+    # Without a restart dump, the run starts from the beginning
+    assert resume_deck(output_dir) is None
+    assert "restart_snapshot" not in deck.read_text()
+
+    write_sdf(output_dir / "0001.sdf", [("ex", bytes(8))], step=10, restart=True)
+    write_sdf(output_dir / "0002.sdf", [("ex", bytes(8))], step=20, restart=False)
+    assert resume_deck(output_dir) == output_dir / "0001.sdf"
+    assert "  restart_snapshot = 0001.sdf\n" in deck.read_text()
+
+    run_epoch(1, output_dir, bin_dir=mock_epoch_bin_dir, resume=True)
+    assert "Resuming from restart dump 0001.sdf" in capsys.readouterr().out
+    assert deck.read_text().count("restart_snapshot") == 1
+
+
+def test_run_epoch_graceful(mock_epoch_bin_dir, output_dir, stop_aware_epoch, capsys):
+    exe = mock_epoch_bin_dir / exe_name(1)
+    exe.write_text(stop_aware_epoch.read_text())
+    returncode = run_epoch(
+        1, output_dir, bin_dir=mock_epoch_bin_dir, walltime=300.2, grace=300.0
+    )
+    assert returncode == 0
+    assert (output_dir / "restart.sdf").is_file()
+    assert not (output_dir / "STOP").exists()
+    assert "Epoch stopped early after walltime" in capsys.readouterr().out
+
+
+def test_run_epoch_stage(tmp_path: Path, mock_epoch_bin_dir, output_dir, capsys):
+    (output_dir / "input.deck").write_text("begin:control\nend:control\n")
+    exe = mock_epoch_bin_dir / exe_name(1)
+    exe.write_text("#!/bin/bash\nread OUTPUT\ncp $OUTPUT/input.deck $OUTPUT/0000.sdf\n")
+    stage = tmp_path / "stage"
+    assert run_epoch(1, output_dir, bin_dir=mock_epoch_bin_dir, stage=stage) == 0
+    assert (output_dir / "0000.sdf").is_file()
+    assert list(stage.iterdir()) == []
+    assert "Copied 1 files" in capsys.readouterr().out
+
+
+def test_run_epoch_compress(write_sdf, mock_epoch_bin_dir, output_dir, capsys):
+    (output_dir / "input.deck").write_text("begin:control\nend:control\n")
+    dump = write_sdf(output_dir.parent / "0000.sdf", [("ex", bytes(1024))])
+    exe = mock_epoch_bin_dir / exe_name(1)
+    exe.write_text(f"#!/bin/bash\nread OUTPUT\ncp {dump} $OUTPUT/0000.sdf\n")
+    assert run_epoch(1, output_dir, bin_dir=mock_epoch_bin_dir, compress="xz") == 0
+    assert (output_dir / "0000.sdf.xz").is_file()
+    assert not (output_dir / "0000.sdf").exists()
+    assert "Compressed 1 dumps" in capsys.readouterr().out
+
+
+def test_run_epoch_analyse(write_sdf, mock_epoch_bin_dir, output_dir, capsys):
+    (output_dir / "input.deck").write_text("begin:control\nend:control\n")
+    (output_dir / "analysis.py").write_text("def name(path):\n    return path.name\n")
+    dump = write_sdf(output_dir.parent / "0000.sdf", [("ex", bytes(1024))])
+    exe = mock_epoch_bin_dir / exe_name(1)
+    exe.write_text(f"#!/bin/bash\nread OUTPUT\ncp {dump} $OUTPUT/0000.sdf\n")
+    code = run_epoch(
+        1,
+        output_dir,
+        bin_dir=mock_epoch_bin_dir,
+        compress="gzip",
+        analyse=["analysis.py:name"],
+    )
+    assert code == 0
+    result = json.loads((output_dir / "analysis.jsonl").read_text())
+    assert result["result"] == "0000.sdf"
+    # Compressed only once analysed
+    assert (output_dir / "0000.sdf.gz").is_file()
+    assert "Analysed 1 dumps" in capsys.readouterr().out
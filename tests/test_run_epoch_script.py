@@ -0,0 +1,799 @@
+import importlib.util
+import json
+import os
+import sys
+import time
+from argparse import Namespace
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from textwrap import dedent
+
+import pytest
+
+_SCRIPT = Path(__file__).parents[1] / "run_epoch.py"
+
+
+@pytest.fixture(scope="module")
+def script():
+    """The standalone run_epoch.py script, imported as a module."""
+    spec = importlib.util.spec_from_file_location("run_epoch_script", _SCRIPT)
+    assert spec is not None and spec.loader is not None
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def test_history(script, tmp_path: Path, capsys):
+    db = tmp_path / "history.sqlite"
+    output = tmp_path / "output"
+    output.mkdir()
+    (output / "input.deck").write_text("begin:control\nend:control\n")
+    args = Namespace(
+        mode="singularity",
+        container="oras://example/epoch.sif:latest",
+        dims=2,
+        photons=True,
+        nprocs=4,
+    )
+    for duration in (10, 10, 10, 10, 15):
+        script.record_run(db, args, output, 100.0, 100.0 + duration, 0)
+
+    runs = script.query_runs(db)
+    assert len(runs) == 5
+    assert runs[0]["identity"] == args.container
+    assert runs[0]["nprocs"] == 4
+
+    regressions = script.find_regressions(runs, tolerance=0.1, min_history=3)
+    assert [(run["id"], median) for run, median in regressions] == [(5, 10)]
+
+    history_args = Namespace(db=db, command="compare", tolerance=0.1, min_history=3)
+    assert script.history(history_args) == 1
+    assert "Run 5" in capsys.readouterr().out
+    history_args.command = "list"
+    assert script.history(history_args) == 0
+
+
+def test_history_cli(script, monkeypatch, tmp_path: Path):
+    argv = ["run_epoch.py", "history", str(tmp_path / "db.sqlite"), "compare"]
+    monkeypatch.setattr(sys, "argv", argv)
+    with pytest.raises(SystemExit) as exc:
+        script.main()
+    assert exc.value.code == 0
+
+
+def test_progress_forwarding(script, tmp_path: Path):
+    args = Namespace(progress=True, metrics="metrics.jsonl")
+    extra = script.run_epoch_args(args)
+    assert extra == ["--progress", "--metrics /output/metrics.jsonl"]
+    docker = script.docker_cmd("epoch:latest", tmp_path, 2, False, extra).split()
+    assert docker[-3:] == ["--progress", "--metrics", "/output/metrics.jsonl"]
+    singularity = script.singularity_cmd("epoch.sif", tmp_path, 2, True, 4, False)
+    assert "--progress" not in singularity.split()
+
+    (tmp_path / "metrics.jsonl").write_text('{"step": 1}\n{"step": 2}\n')
+    assert script.last_metrics(tmp_path / "metrics.jsonl") == {"step": 2}
+    assert script.last_metrics(tmp_path / "missing.jsonl") == {}
+
+
+def test_resume_forwarding(script, tmp_path: Path):
+    extra = script.run_epoch_args(Namespace(resume=True))
+    assert script.docker_cmd("epoch:latest", tmp_path, 1, False, extra).split()[-1] == (
+        "--resume"
+    )
+
+
+def test_resources_forwarding(script, tmp_path: Path):
+    args = Namespace(sample_resources=True, sample_interval=0.5)
+    extra = script.run_epoch_args(args)
+    cmd = script.singularity_cmd("epoch.sif", tmp_path, 2, False, 4, True, extra)
+    assert cmd.split()[-3:] == ["--sample-resources", "--sample-interval", "0.5"]
+
+
+def test_stage_forwarding(script, tmp_path: Path):
+    args = Namespace(stage="/dev/shm", drain_interval=5.0)
+    extra = script.run_epoch_args(args)
+    cmd = script.singularity_cmd("epoch.sif", tmp_path, 2, False, 4, True, extra)
+    assert cmd.split()[-4:] == ["--stage", "/dev/shm", "--drain-interval", "5.0"]
+
+
+def test_lifecycle_forwarding(script, tmp_path: Path):
+    args = Namespace(compress="gzip", keep_restarts=2, keep_every=None)
+    extra = script.run_epoch_args(args)
+    assert extra == ["--compress gzip", "--keep-restarts 2"]
+
+
+def test_analysis_forwarding(script):
+    args = Namespace(
+        analyse=["analysis.py:spectrum", "mypackage.energy:total"],
+        analysis_workers=2,
+        analysis_reserve=0.2,
+    )
+    assert script.run_epoch_args(args) == [
+        "--analyse analysis.py:spectrum",
+        "--analyse mypackage.energy:total",
+        "--analysis-workers 2 --analysis-reserve 0.2",
+    ]
+
+
+@pytest.mark.parametrize("text,expected", (("600", 600.0), ("1-00:10", 87000.0)))
+def test_parse_time_limit(script, text: str, expected: float):
+    assert script.parse_time_limit(text) == expected
+
+
+def test_graceful_launch(script, stop_aware_epoch, tmp_path: Path, monkeypatch, capsys):
+    log = tmp_path / "scontrol.log"
+    scontrol = tmp_path / "scontrol"
+    scontrol.write_text(f'#!/bin/bash\necho "$@" > {log}\n')
+    scontrol.chmod(0o755)
+    monkeypatch.setenv("PATH", f"{tmp_path}:{os.environ['PATH']}")
+    monkeypatch.setenv("SLURM_JOB_ID", "42")
+    args = Namespace(
+        no_run=False,
+        history=None,
+        metrics=None,
+        graceful=True,
+        walltime=60.2,
+        grace=60.0,
+        requeue=True,
+    )
+    script.launch(f"{stop_aware_epoch} {tmp_path}", args, tmp_path)
+    assert (tmp_path / "restart.sdf").is_file()
+    assert not (tmp_path / "STOP").exists()
+    assert "Epoch stopped early after walltime" in capsys.readouterr().out
+    assert log.read_text() == "requeue 42\n"
+
+
+def test_set_deck_values(script):
+    deck = "begin:control\n  nx = 10 # cells\n  t_end = 1\nend:control\n"
+    deck = script.set_deck_values(deck, "control", {"NX": 20, "ny": 5})
+    assert deck == "begin:control\n  NX = 20\n  t_end = 1\n  ny = 5\nend:control\n"
+    deck = script.set_deck_values(deck, "laser", {"lambda": "1 * micron"})
+    assert deck.endswith("\nbegin:laser\n  lambda = 1 * micron\nend:laser\n")
+    assert script.deck_dims(deck) == 2
+
+
+def test_sweep_points(script, tmp_path: Path):
+    grid = tmp_path / "grid.json"
+    grid.write_text('{"laser.lambda": [1, 2]}')
+    values = script.sweep_grid(["nx=10,20", "laser.lambda=3"], grid)
+    assert values == {"laser.lambda": ["3"], "nx": ["10", "20"]}
+    points = script.sweep_points(script.sweep_grid(["nx=10,20", "ny=1,2,3"]))
+    assert len(points) == 6
+    assert points[1] == {"nx": "10", "ny": "2"}
+    name = script.point_name(points[1])
+    assert name.startswith("point_") and len(name) == 18
+    assert script.point_name({"ny": "2", "nx": "10"}) == name
+    assert script.point_name(points[0]) != name
+    with pytest.raises(ValueError):
+        script.sweep_grid(["nx"])
+
+
+@pytest.fixture
+def fake_run_epoch(tmp_path: Path, monkeypatch) -> Path:
+    """A run_epoch command that fails on its first attempt when nx is 30."""
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    exe = bin_dir / "run_epoch"
+    exe.write_text(
+        dedent(
+            """\
+            #!/bin/bash
+            output=$4
+            echo "start $(date +%s.%N)" >> $output/../times
+            sleep 0.3
+            if grep -q "nx = 30" $output/input.deck && [ ! -f $output/failed ]; then
+              touch $output/failed
+              exit 1
+            fi
+            echo "$@" > $output/args
+            """
+        )
+    )
+    exe.chmod(0o755)
+    monkeypatch.setenv("PATH", f"{bin_dir}:{os.environ['PATH']}")
+    return exe
+
+
+def test_sweep(script, fake_run_epoch, monkeypatch, tmp_path: Path, capsys):
+    template = tmp_path / "template"
+    template.mkdir()
+    (template / "input.deck").write_text("begin:control\n  nx = 1\nend:control\n")
+    output = tmp_path / "sweep"
+    argv = ["run_epoch.py", "sweep", str(template), "-m", "native", "-o", str(output)]
+    argv += ["-p", "nx=10,20,30,40", "--cores", "4", "--retries", "1"]
+    monkeypatch.setattr(sys, "argv", argv)
+    start = time.perf_counter()
+    with pytest.raises(SystemExit) as exc:
+        script.main()
+    assert exc.value.code == 0
+    # Four single process runs at once, and a retry
+    assert time.perf_counter() - start < 1.2
+    assert len((output / "times").read_text().splitlines()) == 5
+
+    points = sorted(output.glob("point_*"))
+    assert len(points) == 4
+    point = output / script.point_name({"nx": "20"})
+    assert "nx = 20" in (point / "input.deck").read_text()
+    assert json.loads((point / "params.json").read_text()) == {"nx": "20"}
+    assert (point / "args").read_text().split()[:2] == ["-d", "1"]
+    assert all((point / ".done").is_file() for point in points)
+    summary = (output / "summary.csv").read_text().splitlines()
+    assert summary[0] == "point,nx,status,attempts,seconds"
+    assert summary[3].startswith(f"{script.point_name({'nx': '30'})},30,done,2,")
+
+    # Finished points are skipped and left untouched when the sweep is extended
+    (point / "params.json").unlink()
+    argv[-5] = "nx=5,10,20,30,40"
+    with pytest.raises(SystemExit):
+        script.main()
+    assert len((output / "times").read_text().splitlines()) == 6
+    assert len(list(output.glob("point_*"))) == 5
+    assert not (point / "params.json").exists()
+    summary = (output / "summary.csv").read_text().splitlines()
+    assert summary[1].startswith(f"{script.point_name({'nx': '5'})},5,done,1,")
+    assert all(",skipped," in row for row in summary[2:])
+
+
+def test_sweep_failure(script, fake_run_epoch, tmp_path: Path):
+    template = tmp_path / "input.deck"
+    template.write_text("begin:control\n  nx = 1\n  ny = 1\nend:control\n")
+    args = Namespace(
+        template=template,
+        param=["nx=30"],
+        grid=None,
+        output=tmp_path / "sweep",
+        launcher="native",
+        container=None,
+        dims=None,
+        photons=False,
+        nprocs=1,
+        cores=2,
+        retries=0,
+        history=tmp_path / "history.sqlite",
+        no_run=False,
+    )
+    assert script.sweep(args) == 1
+    assert not (tmp_path / "sweep" / script.point_name({"nx": "30"}) / ".done").exists()
+    runs = script.query_runs(args.history)
+    assert [(run["launcher"], run["nprocs"], run["exit_status"]) for run in runs] == [
+        ("native", 1, 1)
+    ]
+    args.nprocs = 2
+    cmd = script.sweep_cmd(args, tmp_path, 2)
+    assert cmd.startswith("mpirun -n 2 run_epoch -d 2 -o ")
+
+
+@pytest.fixture
+def fake_srun(tmp_path: Path, monkeypatch) -> Path:
+    """Stand-in srun and run_epoch commands. Returns the log of srun calls."""
+    bin_dir = tmp_path / "slurm_bin"
+    bin_dir.mkdir()
+    srun = bin_dir / "srun"
+    srun.write_text(
+        dedent(
+            """\
+            #!/bin/bash
+            while [[ $1 == --* ]]; do
+              case $1 in --ntasks=*) ntasks=${1#--ntasks=};; esac
+              shift
+            done
+            echo "$ntasks $(basename $(dirname $5/x))" >> $FARM_LOG
+            exec "$@"
+            """
+        )
+    )
+    run_epoch = bin_dir / "run_epoch"
+    run_epoch.write_text(
+        "#!/bin/bash\nsleep 0.2\ngrep -q fail $4/input.deck && exit 3\nexit 0\n"
+    )
+    for exe in (srun, run_epoch):
+        exe.chmod(0o755)
+    log = tmp_path / "srun.log"
+    monkeypatch.setenv("FARM_LOG", str(log))
+    monkeypatch.setenv("PATH", f"{bin_dir}:{os.environ['PATH']}")
+    return log
+
+
+def test_farm(script, fake_srun, tmp_path: Path, monkeypatch, capsys):
+    runs = dict(small=(2, 1), large=(4, 10), medium=(2, 5), broken=(1, None))
+    with (tmp_path / "manifest.jsonl").open("w") as f:
+        f.write("# name, cores and estimate\n")
+        for name, (nprocs, estimate) in runs.items():
+            (tmp_path / name).mkdir()
+            deck = "begin:control\n  nx = 1\n  ny = 1\nend:control\n"
+            (tmp_path / name / "input.deck").write_text(
+                deck + ("# fail\n" if name == "broken" else "")
+            )
+            f.write(json.dumps(dict(output=name, nprocs=nprocs, estimate=estimate)))
+            f.write("\n")
+        f.write(json.dumps(dict(output="huge", nprocs=8, dims=1)) + "\n")
+
+    argv = ["run_epoch.py", "farm", str(tmp_path / "manifest.jsonl"), "-m", "native"]
+    argv += ["--step", "srun", "--cores", "4", "--poll", "0.01"]
+    monkeypatch.setattr(sys, "argv", argv)
+    with pytest.raises(SystemExit) as exc:
+        script.main()
+    assert exc.value.code == 1
+
+    # Longest first, then both 2 core runs together, then the unestimated run.
+    # The 2 core runs start at once, so may log in either order.
+    steps = fake_srun.read_text().splitlines()
+    assert steps[0] == "4 large"
+    assert sorted(steps[1:3]) == ["2 medium", "2 small"]
+    assert steps[3] == "1 broken"
+    out = capsys.readouterr().out
+    assert out.index("medium: started") < out.index("small: started")
+    assert (tmp_path / "large" / "exit_code").read_text() == "0\n"
+    assert (tmp_path / "large" / ".done").is_file()
+    assert (tmp_path / "broken" / "exit_code").read_text() == "3\n"
+    assert not (tmp_path / "broken" / ".done").exists()
+    log = (tmp_path / "small" / "run.log").read_text()
+    assert log.startswith("srun --exact --ntasks=2 --cpus-per-task=1 run_epoch -d 2")
+    results = [
+        json.loads(line)
+        for line in (tmp_path / "manifest.results.jsonl").read_text().splitlines()
+    ]
+    statuses = {Path(r["output"]).name: r["status"] for r in results}
+    assert statuses == dict(
+        huge="too large", large="done", medium="done", small="done", broken="failed"
+    )
+
+    # Finished runs are skipped when the farm is restarted
+    fake_srun.unlink()
+    with pytest.raises(SystemExit):
+        script.main()
+    assert fake_srun.read_text().splitlines() == ["1 broken"]
+
+
+def test_farm_start_failure(script, tmp_path: Path, monkeypatch, capsys):
+    with (tmp_path / "manifest.jsonl").open("w") as f:
+        for name in ("first", "second"):
+            (tmp_path / name).mkdir()
+            f.write(json.dumps(dict(output=name, nprocs=1, dims=1)) + "\n")
+    # Without srun, neither run can start, but the farm carries on
+    monkeypatch.setenv("PATH", str(tmp_path / "empty"))
+    argv = ["run_epoch.py", "farm", str(tmp_path / "manifest.jsonl"), "-m", "native"]
+    argv += ["--step", "srun", "--cores", "1", "--poll", "0.01"]
+    monkeypatch.setattr(sys, "argv", argv)
+    with pytest.raises(SystemExit) as exc:
+        script.main()
+    assert exc.value.code == 1
+    for name in ("first", "second"):
+        assert (tmp_path / name / "exit_code").read_text() == "127\n"
+        assert "srun" in (tmp_path / name / "run.log").read_text().splitlines()[1]
+    assert "first: could not start" in capsys.readouterr().out
+    results = (tmp_path / "manifest.results.jsonl").read_text().splitlines()
+    assert [json.loads(line)["status"] for line in results] == ["failed", "failed"]
+
+
+def test_farm_cmd(script, tmp_path: Path):
+    run = dict(output=tmp_path, nprocs=3, dims=2, photons=True, estimate=None)
+    args = Namespace(
+        launcher="singularity", container="epoch.sif", step="mpirun", exclusive=False
+    )
+    cmd = script.farm_cmd(args, run).split()
+    assert cmd[:5] == ["mpirun", "-n", "3", "--bind-to", "none"]
+    assert cmd[5:7] == ["singularity", "exec"]
+    assert cmd[-1] == "--photons"
+    args.step, args.exclusive = "srun", True
+    assert script.farm_cmd(args, run).startswith("srun --exclusive --ntasks=3 ")
+    args.launcher, args.resume = "native", True
+    assert script.farm_cmd(args, run).endswith(" --photons --resume")
+
+
+def test_sweep_manifest(script, tmp_path: Path):
+    template = tmp_path / "input.deck"
+    template.write_text("begin:control\n  nx = 1\nend:control\n")
+    args = Namespace(
+        template=template,
+        param=["nx=10,20"],
+        grid=None,
+        output=tmp_path / "sweep",
+        launcher="native",
+        container=None,
+        dims=None,
+        photons=False,
+        nprocs=2,
+        cores=2,
+        retries=0,
+        history=None,
+        no_run=True,
+    )
+    script.sweep(args)
+    runs = script.read_manifest(tmp_path / "sweep" / "manifest.jsonl")
+    assert [run["output"].name for run in runs] == [
+        script.point_name({"nx": "10"}),
+        script.point_name({"nx": "20"}),
+    ]
+    assert runs[0]["nprocs"] == 2
+    assert runs[0]["dims"] == 1
+
+
+@pytest.mark.parametrize(
+    "container,expected",
+    (
+        (
+            "oras://ghcr.io/plasmafair/epoch.sif:latest",
+            ("oras", "ghcr.io", "plasmafair/epoch.sif", "latest"),
+        ),
+        (
+            "docker://localhost:5000/epoch",
+            ("docker", "localhost:5000", "epoch", "latest"),
+        ),
+        (
+            "docker://ubuntu:22.04",
+            ("docker", "registry-1.docker.io", "library/ubuntu", "22.04"),
+        ),
+        (
+            "docker://user/epoch:v1",
+            ("docker", "registry-1.docker.io", "user/epoch", "v1"),
+        ),
+    ),
+)
+def test_split_reference(script, container: str, expected):
+    assert script.split_reference(container) == expected
+
+
+@pytest.fixture
+def fake_singularity(tmp_path: Path, monkeypatch) -> Path:
+    """Stand-in 'singularity' command, which slowly pulls an image naming its source.
+
+    Returns the log of the images pulled.
+    """
+    bin_dir = tmp_path / "singularity_bin"
+    bin_dir.mkdir()
+    exe = bin_dir / "singularity"
+    exe.write_text(
+        dedent(
+            """\
+            #!/bin/bash
+            [ "$1" = pull ] || exit 1
+            echo "$3" >> $SINGULARITY_LOG
+            grep -q missing <<< "$3" && exit 255
+            sleep 0.2
+            echo "image of ${3%@*}" > $2
+            """
+        )
+    )
+    exe.chmod(0o755)
+    log = tmp_path / "singularity.log"
+    monkeypatch.setenv("SINGULARITY_LOG", str(log))
+    monkeypatch.setenv("PATH", f"{bin_dir}:{os.environ['PATH']}")
+    return log
+
+
+def test_image_cache(script, fake_singularity, monkeypatch, tmp_path: Path):
+    resolved = []
+
+    def registry_digest(container):
+        resolved.append(container)
+        return "sha256:" + "a" * 64
+
+    monkeypatch.setattr(script, "registry_digest", registry_digest)
+    cache = script.ImageCache(tmp_path / "cache")
+    container = "oras://ghcr.io/plasmafair/epoch.sif:latest"
+    # Jobs starting together wait for a single pull
+    with ThreadPoolExecutor(4) as pool:
+        paths = list(pool.map(lambda _: cache.image(container), range(4)))
+    assert paths == [tmp_path / "cache" / f"sha256-{'a' * 64}.sif"] * 4
+    assert paths[0].read_text() == "image of oras://ghcr.io/plasmafair/epoch.sif\n"
+    assert resolved == [container]
+    pulls = fake_singularity.read_text().splitlines()
+    assert pulls == [f"oras://ghcr.io/plasmafair/epoch.sif@sha256:{'a' * 64}"]
+    assert not list((tmp_path / "cache").glob(".*.part"))
+
+    # Tags are checked again only when asked, or once the digest is old
+    cache.image(container)
+    cache.image(container, refresh=True)
+    assert resolved == [container, container]
+    assert len(fake_singularity.read_text().splitlines()) == 1
+
+
+def test_image_cache_offline(script, fake_singularity, monkeypatch, tmp_path: Path):
+    def registry_digest(container):
+        raise OSError("Network is unreachable")
+
+    monkeypatch.setattr(script, "registry_digest", registry_digest)
+    cache = script.ImageCache(tmp_path / "cache", ttl=0.0)
+    container = "docker://ghcr.io/plasmafair/epoch:latest"
+    # Jobs starting together wait for a single pull
+    with ThreadPoolExecutor(4) as pool:
+        paths = list(pool.map(lambda _: cache.image(container), range(4)))
+    path = paths[0]
+    assert paths == [path] * 4
+    # Named by the contents of the image, and found by the same name next time
+    assert path.name.startswith("sha256-")
+    assert cache.image(container) == path
+    assert len(fake_singularity.read_text().splitlines()) == 1
+
+    with pytest.raises(OSError, match="Failed to pull"):
+        cache.image("docker://ghcr.io/plasmafair/missing:latest")
+    assert not list((tmp_path / "cache").glob("*.part"))
+
+
+def test_image_cache_evict(script, tmp_path: Path):
+    cache = script.ImageCache(tmp_path, max_bytes=250, ttl=60.0)
+    now = time.time()
+    for name, age in (("old", 300), ("older", 400), ("recent", 30), ("new", 0)):
+        path = tmp_path / f"sha256-{name}.sif"
+        path.write_bytes(bytes(100))
+        os.utime(path, (now - age, now - age))
+    partial = tmp_path / ".sha256-new.sif.1.2.part"
+    partial.write_bytes(bytes(10))
+    os.utime(partial, (now - 2 * 86400, now - 2 * 86400))
+    assert [path.name for path in cache.evict()] == [
+        "sha256-older.sif",
+        "sha256-old.sif",
+    ]
+    assert sorted(path.name for path in tmp_path.glob("sha256-*")) == [
+        "sha256-new.sif",
+        "sha256-recent.sif",
+    ]
+
+
+def test_pull_cached(script, fake_singularity, monkeypatch, tmp_path: Path, capsys):
+    monkeypatch.setattr(script, "registry_digest", lambda _: "sha256:" + "b" * 64)
+    cache = tmp_path / "cache"
+    link = tmp_path / "epoch.sif"
+    argv = ["run_epoch.py", "singularity", "pull", "--image-cache", str(cache)]
+    monkeypatch.setattr(sys, "argv", [*argv, "-o", str(link)])
+    with pytest.raises(SystemExit) as exc:
+        script.main()
+    assert exc.value.code == 0
+    assert link.resolve() == cache / f"sha256-{'b' * 64}.sif"
+    assert "Cached oras://" in capsys.readouterr().out
+
+    # Launches use the cached image in place of the remote container
+    args = Namespace(image_cache=cache, cache_size=1.0, refresh=False, no_run=False)
+    container = script.cached_container(args, script._CONTAINERS["singularity"])
+    assert container == str(link.resolve())
+    assert script.cached_container(args, "epoch.sif") == "epoch.sif"
+
+
+@pytest.fixture
+def fake_docker(tmp_path: Path, monkeypatch) -> Path:
+    """Stand-in 'docker' command, keeping a file per running container.
+
+    Returns the directory of container files, which also holds a log of commands.
+    """
+    bin_dir = tmp_path / "docker_bin"
+    bin_dir.mkdir()
+    exe = bin_dir / "docker"
+    exe.write_text(
+        dedent(
+            """\
+            #!/bin/bash
+            echo "$1 ${@: -1}" >> $DOCKER_STATE/log
+            case $1 in
+              run)
+                sleep 0.2
+                name=$(sed -n 's/.* --name \\([^ ]*\\) .*/\\1/p' <<< "$*")
+                touch $DOCKER_STATE/$name
+                echo $name ;;
+              exec)
+                shift
+                while [[ $1 == --* ]]; do shift 2; done
+                [ -f $DOCKER_STATE/$1 ] || exit 1
+                shift
+                exec "$@" ;;
+              inspect)
+                [ -f $DOCKER_STATE/${@: -1} ] && echo true || echo false ;;
+              rm)
+                sleep 0.1
+                rm -f $DOCKER_STATE/${@: -1} ;;
+            esac
+            """
+        )
+    )
+    exe.chmod(0o755)
+    state = tmp_path / "docker_state"
+    state.mkdir()
+    monkeypatch.setenv("DOCKER_STATE", str(state))
+    monkeypatch.setenv("PATH", f"{bin_dir}:{os.environ['PATH']}")
+    return state
+
+
+def test_sweep_warm(script, fake_docker, fake_run_epoch, monkeypatch, tmp_path: Path):
+    template = tmp_path / "input.deck"
+    template.write_text("begin:control\n  nx = 1\nend:control\n")
+    output = tmp_path / "sweep"
+    argv = ["run_epoch.py", "sweep", str(template), "-m", "docker", "-o", str(output)]
+    argv += ["-p", "nx=10,20,40,50,60", "--cores", "2", "--warm"]
+    monkeypatch.setattr(sys, "argv", argv)
+    with pytest.raises(SystemExit) as exc:
+        script.main()
+    assert exc.value.code == 0
+    points = sorted(output.glob("point_*"))
+    assert all((point / ".done").is_file() for point in points)
+    assert (points[0] / "args").read_text().split() == ["-d", "1", "-o", str(points[0])]
+    commands = [line.split()[0] for line in (fake_docker / "log").open()]
+    # Two containers for five runs, each checked before reuse, and removed at the end
+    assert commands.count("run") == 2
+    assert commands.count("exec") == 5
+    assert commands.count("inspect") == 3
+    assert commands.count("rm") == 2
+    assert sorted(fake_docker.iterdir()) == [fake_docker / "log"]
+
+
+def test_docker_pool(script, fake_docker, tmp_path: Path, capsys):
+    with script.DockerPool("epoch", tmp_path, size=1, idle_timeout=0.4) as pool:
+        with pool.acquire() as first:
+            cmd = pool.exec_cmd(first, tmp_path / "run", 2, True).split()
+            assert cmd[:5] == [
+                "docker",
+                "exec",
+                "--workdir",
+                str(tmp_path / "run"),
+                first,
+            ]
+            assert cmd[5:] == [
+                "run_epoch",
+                "-d",
+                "2",
+                "-o",
+                str(tmp_path / "run"),
+                "--photons",
+            ]
+            with pytest.raises(ValueError, match="is not within"):
+                pool.exec_cmd(first, Path("/elsewhere"), 2, False)
+        # A container that has stopped is replaced
+        (fake_docker / first).unlink()
+        with pool.acquire() as second:
+            assert second != first
+        assert pool.replaced == 1
+        assert "has stopped" in capsys.readouterr().out
+        # Idle containers are removed
+        time.sleep(1.0)
+        assert not (fake_docker / second).exists()
+        with pool.acquire() as third:
+            assert (fake_docker / third).is_file()
+    assert not (fake_docker / third).exists()
+    assert pool.runs == 3
+    report = pool.report()
+    assert report.startswith("Ran 3 runs in 3 warm containers (1 replaced).")
+
+
+def test_docker_pool_report(script, tmp_path: Path):
+    pool = script.DockerPool("epoch:latest", tmp_path, size=2)
+    pool.runs = 5
+    pool.start_seconds = [1.0, 1.0]
+    pool.remove_seconds = [0.5, 0.5]
+    # The time saved by each reused run, and by all of them
+    assert pool.report() == (
+        "Ran 5 runs in 2 warm containers (0 replaced). Starting and removing a "
+        "container took 1.50s, which 3 runs in reused containers each saved over "
+        "'docker run', about 4.5s in total"
+    )
+
+
+@pytest.fixture
+def fake_sysfs(tmp_path: Path) -> Path:
+    """Two sockets of four cores with two threads each, and two NUMA nodes a socket.
+
+    As on Linux, the first threads of every core are numbered first.
+    """
+    sysfs = tmp_path / "sys"
+    for cpu in range(16):
+        topology = sysfs / "cpu" / f"cpu{cpu}" / "topology"
+        topology.mkdir(parents=True)
+        (topology / "physical_package_id").write_text(f"{cpu % 8 // 4}\n")
+        (topology / "core_id").write_text(f"{cpu % 4}\n")
+    (sysfs / "cpu" / "online").write_text("0-15\n")
+    for node in range(4):
+        (sysfs / "node" / f"node{node}").mkdir(parents=True)
+        cpus = f"{2 * node}-{2 * node + 1},{2 * node + 8}-{2 * node + 9}"
+        (sysfs / "node" / f"node{node}" / "cpulist").write_text(f"{cpus}\n")
+    return sysfs
+
+
+def test_read_topology(script, fake_sysfs: Path):
+    assert script.parse_cpu_list("0-2,5,8-9\n") == [0, 1, 2, 5, 8, 9]
+    cores = script.read_topology(fake_sysfs)
+    assert len(cores) == 8
+    assert cores[0] == dict(socket=0, node=0, core=0, cpus=[0, 8])
+    assert cores[5] == dict(socket=1, node=2, core=1, cpus=[5, 13])
+
+    # Without NUMA nodes, each socket is a node
+    for path in (fake_sysfs / "node").glob("node*/cpulist"):
+        path.unlink()
+    assert [core["node"] for core in script.read_topology(fake_sysfs)] == [0] * 4 + [
+        1
+    ] * 4
+
+
+@pytest.mark.parametrize(
+    "policy,step,expected",
+    (
+        ("compact", "mpirun", [0, 1, 2, 3, 4]),
+        ("spread", "mpirun", [0, 2, 4, 6, 1]),
+        ("spread", "srun", [0, 4, 1, 5, 2]),
+        ("socket", "mpirun", [0, 1, 2, 4, 5]),
+    ),
+)
+def test_rank_map(script, fake_sysfs: Path, policy: str, step: str, expected):
+    cores = script.read_topology(fake_sysfs)
+    mapped = script.rank_map(cores, 5, policy, step)
+    assert [core["cpus"][0] for core in mapped] == expected
+
+
+def test_rank_map_errors(script, fake_sysfs: Path):
+    cores = script.read_topology(fake_sysfs)
+    with pytest.raises(ValueError, match="Can't bind 9 ranks to 8 cores"):
+        script.rank_map(cores, 9, "compact")
+    with pytest.raises(ValueError, match="Can't place 4 ranks on each of 2 sockets"):
+        script.rank_map(cores[:7], 7, "socket")
+
+
+def test_binding_options(script, fake_sysfs: Path):
+    cores = script.read_topology(fake_sysfs)
+    assert script.binding_options(cores, 6, "spread") == [
+        *("--map-by", "numa", "--bind-to", "core"),
+    ]
+    assert script.binding_options(cores, 6, "socket") == [
+        *("--map-by", "ppr:3:socket", "--bind-to", "core"),
+    ]
+    assert script.binding_options(cores, 6, "compact", "srun") == [
+        "--cpu-bind=cores",
+        "--distribution=block:block",
+    ]
+    assert script.binding_options(cores, 5, "socket", "srun")[-1] == (
+        "--ntasks-per-socket=3"
+    )
+
+
+def test_bind_policy(script, fake_sysfs: Path, monkeypatch, tmp_path: Path, capsys):
+    topology = script.read_topology(fake_sysfs)
+    monkeypatch.setattr(script, "read_topology", lambda: topology)
+    argv = ["run_epoch.py", "singularity", "-o", str(tmp_path), "-n", "4"]
+    monkeypatch.setattr(sys, "argv", [*argv, "--bind-policy", "spread", "--no-run"])
+    with pytest.raises(SystemExit) as exc:
+        script.main()
+    assert exc.value.code == 0
+    out = capsys.readouterr().out
+    assert "Binding 4 ranks with the spread policy, using 2 sockets and 4 NUMA" in out
+    assert "3     1       3     2     6,14" in out
+    assert "mpirun -n 4 --map-by numa --bind-to core singularity exec" in out
+
+    # srun binds the tasks on this node, and too many is an error
+    monkeypatch.setenv("SLURM_NTASKS_PER_NODE", "16")
+    monkeypatch.setattr(sys, "argv", [*argv[:-2], "--srun", "--bind-policy", "compact"])
+    with pytest.raises(SystemExit, match="Can't bind 16 ranks to 8 cores"):
+        script.main()
+
+
+def test_bind_policy_multi_node(
+    script, fake_sysfs: Path, monkeypatch, tmp_path, capsys
+):
+    topology = script.read_topology(fake_sysfs)[:4]
+    monkeypatch.setattr(script, "read_topology", lambda: topology)
+    monkeypatch.delenv("SLURM_NTASKS_PER_NODE", raising=False)
+    monkeypatch.setenv("SLURM_NTASKS", "8")
+    monkeypatch.setenv("SLURM_TASKS_PER_NODE", "4(x2)")
+    argv = ["run_epoch.py", "singularity", "-o", str(tmp_path), "--srun"]
+    monkeypatch.setattr(sys, "argv", [*argv, "--bind-policy", "compact", "--no-run"])
+    # Four tasks on each node, not the eight in the whole job
+    with pytest.raises(SystemExit) as exc:
+        script.main()
+    assert exc.value.code == 0
+    assert "Binding 4 ranks with the compact policy" in capsys.readouterr().out
+
+    monkeypatch.setenv("SLURM_TASKS_PER_NODE", "4,2(x2)")
+    monkeypatch.setenv("SLURM_NODEID", "2")
+    assert script.slurm_tasks_on_node() == 2
+    monkeypatch.setenv("SLURM_TASKS_PER_NODE", "")
+    assert script.slurm_tasks_on_node() is None
+    monkeypatch.setenv("SLURM_NTASKS_PER_NODE", "3")
+    assert script.slurm_tasks_on_node() == 3
+
+
+@pytest.mark.parametrize(
+    "body,code", (("exit 0", 0), ("exit 3", 3), ("kill -9 $$", 137))
+)
+def test_launch_exit_code(script, tmp_path: Path, body: str, code: int):
+    epoch = tmp_path / "epoch"
+    epoch.write_text(f"#!/bin/bash\n{body}\n")
+    epoch.chmod(0o755)
+    args = Namespace(no_run=False, history=None, requeue=False)
+    # Passed on to the job scheduler, with signals as a shell would report them
+    assert script.launch(str(epoch), args, tmp_path) == code
+    assert script.launch(str(epoch), Namespace(no_run=True), tmp_path) == 0
@@ -0,0 +1,131 @@
+import gzip
+import struct
+from pathlib import Path
+
+import pytest
+
+from epoch_containers.sdf import (
+    SdfFile,
+    find_restart,
+    is_complete,
+    read_blocks,
+    read_header,
+    read_series,
+)
+
+
+@pytest.mark.parametrize("byteorder", ("<", ">"))
+def test_read_header(write_sdf, tmp_path: Path, byteorder: str):
+    path = write_sdf(
+        tmp_path / "0001.sdf",
+        [("ex", bytes(80)), ("ey", bytes(8))],
+        step=12,
+        restart=True,
+        byteorder=byteorder,
+    )
+    with path.open("rb") as f:
+        header = read_header(f)
+        blocks = read_blocks(f, header)
+    assert header.byteorder == byteorder
+    assert header.code_name == "Epoch2d"
+    assert header.step == 12
+    assert header.time == pytest.approx(12e-15)
+    assert header.restart
+    assert header.nblocks == 2
+    assert [block.id for block in blocks] == ["ex", "ey"]
+    assert [block.data_length for block in blocks] == [80, 8]
+    assert blocks[0].name == "Block ex"
+    assert blocks[1].data_location + 8 == path.stat().st_size
+
+
+def test_is_complete(write_sdf, tmp_path: Path):
+    path = write_sdf(tmp_path / "0001.sdf", [("ex", bytes(80)), ("ey", bytes(80))])
+    assert is_complete(path)
+    data = path.read_bytes()
+    for length in (len(data) - 1, len(data) - 100, 50, 0):
+        path.write_bytes(data[:length])
+        assert not is_complete(path)
+    path.write_bytes(b"not an sdf file")
+    assert not is_complete(path)
+    assert not is_complete(tmp_path / "missing.sdf")
+
+
+def test_find_restart(write_sdf, tmp_path: Path):
+    assert find_restart(tmp_path) is None
+    write_sdf(tmp_path / "0000.sdf", [("ex", bytes(8))], step=0, restart=True)
+    write_sdf(tmp_path / "0001.sdf", [("ex", bytes(8))], step=10, restart=True)
+    write_sdf(tmp_path / "0002.sdf", [("ex", bytes(8))], step=20, restart=False)
+    latest = write_sdf(tmp_path / "0003.sdf", [("ex", bytes(8))], step=30, restart=True)
+    assert find_restart(tmp_path) == latest
+    # Dumps interrupted while being written are ignored
+    latest.write_bytes(latest.read_bytes()[:-4])
+    assert find_restart(tmp_path) == tmp_path / "0001.sdf"
+
+
+@pytest.mark.parametrize("byteorder", ("<", ">"))
+def test_sdf_file(
+    write_sdf, sdf_block, sdf_mesh, sdf_variable, tmp_path: Path, byteorder: str
+):
+    np = pytest.importorskip("numpy")
+    point_info = struct.pack(f"{byteorder}d32s32sq", 1.0, b"kg", b"grid/electron", 3)
+    blocks = [
+        sdf_mesh("grid", [[0.0, 0.5, 1.0], [0.0, 1.0]], False, byteorder),
+        sdf_variable("ex", (3, 2), byteorder),
+        sdf_mesh("grid/electron", [[0.1, 0.2, 0.3]] * 2, True, byteorder),
+        sdf_block(
+            "mass", 4, 4, 1, point_info, struct.pack(f"{byteorder}3d", 1.0, 2.0, 3.0)
+        ),
+        sdf_block("nsteps", 5, 1, 1, struct.pack(f"{byteorder}i", 42), b""),
+        sdf_block("text", 7, 6, 1, b"", b"run info"),
+    ]
+    path = write_sdf(tmp_path / "0001.sdf", blocks, step=3, byteorder=byteorder)
+    sdf = SdfFile(path)
+    assert list(sdf) == [
+        "grid/x",
+        "grid/y",
+        "ex",
+        "grid/electron/x",
+        "grid/electron/y",
+        "mass",
+        "nsteps",
+    ]
+    ex = sdf.variables["ex"]
+    assert (ex.shape, ex.units, ex.mesh_id, ex.mult) == ((3, 2), "V/m", "grid", 2.0)
+    assert ex.nbytes == 24
+
+    array = sdf["ex"]
+    assert isinstance(array, np.memmap)
+    assert array.dtype == np.dtype(f"{byteorder}f4")
+    expected = np.arange(6, dtype="f4").reshape((3, 2), order="F")
+    np.testing.assert_array_equal(array, expected)
+    np.testing.assert_array_equal(sdf.hyperslab("ex", (slice(1, 3), 1)), [4.0, 5.0])
+    np.testing.assert_array_equal(sdf["grid/x"], [0.0, 0.5, 1.0])
+    np.testing.assert_array_equal(sdf["grid/y"], [0.0, 1.0])
+    np.testing.assert_array_equal(sdf["grid/electron/y"], [0.1, 0.2, 0.3])
+    np.testing.assert_array_equal(sdf["mass"], [1.0, 2.0, 3.0])
+    assert sdf["nsteps"] == 42
+    assert "text" not in sdf
+
+
+def test_sdf_file_compressed(write_sdf, sdf_variable, tmp_path: Path):
+    np = pytest.importorskip("numpy")
+    path = write_sdf(tmp_path / "0001.sdf", [sdf_variable("ex", (4, 3), "<")])
+    expected = np.array(SdfFile(path)["ex"])
+    with gzip.open(tmp_path / "0001.sdf.gz", "wb") as f:
+        f.write(path.read_bytes())
+    path.unlink()
+    sdf = SdfFile(path)
+    assert sdf.path == tmp_path / "0001.sdf.gz"
+    np.testing.assert_array_equal(sdf["ex"], expected)
+
+
+def test_read_series(write_sdf, sdf_variable, tmp_path: Path):
+    np = pytest.importorskip("numpy")
+    paths = []
+    for step in range(3):
+        blocks = [sdf_variable("ex", (4, 3), "<")] if step != 1 else []
+        paths.append(write_sdf(tmp_path / f"{step:04d}.sdf", blocks, step=step))
+    series = list(read_series(paths, "ex", (slice(None), 2)))
+    assert [time for time, _ in series] == pytest.approx([0.0, 2e-15])
+    for _, values in series:
+        np.testing.assert_array_equal(values, [8.0, 9.0, 10.0, 11.0])
@@ -0,0 +1,80 @@
+import os
+import signal
+import time
+from pathlib import Path
+
+import pytest
+
+from epoch_containers.shutdown import (
+    STOP_FILE,
+    GracefulStop,
+    parse_time_limit,
+    requeue_job,
+)
+
+
+@pytest.mark.parametrize(
+    "text,expected",
+    (
+        ("90", 90.0),
+        ("12.5", 12.5),
+        ("30", 30.0),
+        ("10:30", 630.0),
+        ("01:00:00", 3600.0),
+        ("2-0", 2 * 86400.0),
+        ("1-12", 86400.0 + 12 * 3600),
+        ("1-12:30", 86400.0 + 12 * 3600 + 30 * 60),
+        ("1-00:00:05", 86405.0),
+    ),
+)
+def test_parse_time_limit(text: str, expected: float):
+    assert parse_time_limit(text) == expected
+
+
+@pytest.mark.parametrize("text", ("", "1:2:3:4", "one hour", "1-"))
+def test_parse_time_limit_invalid(text: str):
+    with pytest.raises(ValueError):
+        parse_time_limit(text)
+
+
+def test_graceful_stop_walltime(tmp_path: Path):
+    # A stop file left by an earlier run is removed on entry
+    (tmp_path / STOP_FILE).touch()
+    with GracefulStop(tmp_path, walltime=1.05, grace=1.0) as stopper:
+        assert not (tmp_path / STOP_FILE).exists()
+        deadline = time.monotonic() + 5
+        while stopper.reason is None and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert stopper.reason == "walltime"
+        assert (tmp_path / STOP_FILE).exists()
+    assert not (tmp_path / STOP_FILE).exists()
+
+
+@pytest.mark.parametrize("signum", (signal.SIGTERM, signal.SIGUSR1))
+def test_graceful_stop_signal(tmp_path: Path, signum: int):
+    before = signal.getsignal(signum)
+    with GracefulStop(tmp_path) as stopper:
+        os.kill(os.getpid(), signum)
+        # Python runs signal handlers between bytecodes in the main thread
+        time.sleep(0.01)
+        assert stopper.reason == f"signal {signal.Signals(signum).name}"
+        assert (tmp_path / STOP_FILE).exists()
+        # Only the first request is acted on
+        stopper.stop("walltime")
+        assert stopper.reason.startswith("signal")
+    assert signal.getsignal(signum) is before
+
+
+def test_requeue_job(tmp_path: Path, monkeypatch, capsys):
+    monkeypatch.delenv("SLURM_JOB_ID", raising=False)
+    assert not requeue_job()
+    assert "Not running under Slurm" in capsys.readouterr().out
+
+    log = tmp_path / "scontrol.log"
+    scontrol = tmp_path / "scontrol"
+    scontrol.write_text(f'#!/bin/bash\necho "$@" > {log}\n')
+    scontrol.chmod(0o755)
+    monkeypatch.setenv("PATH", f"{tmp_path}:{os.environ['PATH']}")
+    monkeypatch.setenv("SLURM_JOB_ID", "1234")
+    assert requeue_job()
+    assert log.read_text() == "requeue 1234\n"
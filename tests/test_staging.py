@@ -0,0 +1,120 @@
+import os
+from pathlib import Path
+
+import pytest
+
+from epoch_containers.staging import (
+    StagedOutput,
+    copy_verified,
+    launch_key,
+    single_node,
+)
+
+
+@pytest.fixture
+def output(tmp_path: Path) -> Path:
+    d = tmp_path / "output"
+    d.mkdir()
+    (d / "input.deck").write_text("begin:control\nend:control\n")
+    return d
+
+
+def test_copy_verified(tmp_path: Path):
+    source = tmp_path / "source.sdf"
+    source.write_bytes(os.urandom(1000))
+    destination = tmp_path / "nested" / "destination.sdf"
+    assert copy_verified(source, destination) == 1000
+    assert destination.read_bytes() == source.read_bytes()
+    assert not list(destination.parent.glob(".*.part"))
+
+
+@pytest.mark.parametrize(
+    "env,expected",
+    (
+        ({}, True),
+        ({"SLURM_JOB_NUM_NODES": "1"}, True),
+        ({"SLURM_NNODES": "2"}, False),
+        ({"SLURM_STEP_NUM_NODES": "1", "SLURM_JOB_NUM_NODES": "4"}, True),
+    ),
+)
+def test_single_node(monkeypatch, env: dict[str, str], expected: bool):
+    for var in ("SLURM_STEP_NUM_NODES", "SLURM_JOB_NUM_NODES", "SLURM_NNODES"):
+        monkeypatch.delenv(var, raising=False)
+    for var, value in env.items():
+        monkeypatch.setenv(var, value)
+    assert single_node() == expected
+
+
+def test_launch_key(monkeypatch, tmp_path: Path):
+    monkeypatch.setenv("SLURM_JOB_ID", "100")
+    monkeypatch.setenv("SLURM_STEP_ID", "0")
+    monkeypatch.setenv("SLURM_NTASKS", "4")
+    key = launch_key(tmp_path)
+    assert launch_key(tmp_path) == key
+    assert launch_key(tmp_path / "other") != key
+    # Concurrent steps of a job see the same output path inside their containers
+    monkeypatch.setenv("SLURM_STEP_ID", "1")
+    assert launch_key(tmp_path) != key
+
+
+def test_staged_output(write_sdf, output: Path, tmp_path: Path, capsys):
+    stage = tmp_path / "stage"
+    # Use a long interval, so that draining is only done explicitly
+    with StagedOutput(output, stage, interval=3600) as staged:
+        assert staged.directory.parent == stage
+        assert (staged.directory / "input.deck").is_file()
+
+        write_sdf(staged.directory / "0000.sdf", [("ex", bytes(8))], step=0)
+        # Dumps are only drained once they are unchanged between checks
+        assert staged.drain() == []
+        assert staged.drain() == [output / "0000.sdf"]
+        assert not (staged.directory / "0000.sdf").exists()
+
+        # Incomplete dumps are left until the end
+        (staged.directory / "0001.sdf").write_bytes(b"SDF1")
+        staged.drain()
+        assert staged.drain() == []
+        (staged.directory / "epoch2d.dat").write_text("log")
+
+        assert not staged.forward_stop()
+        (output / "STOP").touch()
+        assert staged.forward_stop()
+        assert (staged.directory / "STOP").is_file()
+        (output / "STOP").unlink()
+
+    assert (output / "0000.sdf").is_file()
+    assert (output / "0001.sdf").read_bytes() == b"SDF1"
+    assert (output / "epoch2d.dat").read_text() == "log"
+    assert not staged.directory.exists()
+    assert "Copied 3 files" in capsys.readouterr().out
+
+
+def test_staged_output_failure(output: Path, tmp_path: Path, monkeypatch, capsys):
+    stage = tmp_path / "stage"
+    with pytest.raises(RuntimeError):
+        with StagedOutput(output, stage, interval=3600) as staged:
+            (staged.directory / "0000.sdf").write_bytes(b"partial")
+            raise RuntimeError("Epoch crashed")
+    # Output is still copied back after a failure
+    assert (output / "0000.sdf").read_bytes() == b"partial"
+
+    def fail(source: Path, destination: Path) -> int:
+        raise OSError("disk full")
+
+    with StagedOutput(output, stage, interval=3600) as staged:
+        monkeypatch.setattr("epoch_containers.staging.copy_verified", fail)
+        (staged.directory / "0001.sdf").write_bytes(b"dump")
+    # Files that couldn't be copied are left in the stage
+    assert (staged.directory / "0001.sdf").is_file()
+    assert staged.failed == [staged.directory / "0001.sdf"]
+    assert "leaving them in" in capsys.readouterr().out
+
+
+def test_staged_output_background(write_sdf, output: Path, tmp_path: Path):
+    with StagedOutput(output, tmp_path / "stage", interval=0.01) as staged:
+        write_sdf(staged.directory / "0000.sdf", [("ex", bytes(8))], step=0)
+        for _ in range(500):
+            if (output / "0000.sdf").exists():
+                break
+            staged._stop.wait(0.01)
+        assert (output / "0000.sdf").is_file()
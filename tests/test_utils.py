@@ -1,11 +1,159 @@
 import itertools
+import threading
+import time
+from pathlib import Path
 
 import pytest
 
-from epoch_containers.utils import exe_name
+from epoch_containers.utils import (
+    MICROARCH_FLAGS,
+    CoreBudget,
+    cpu_flags,
+    exe_name,
+    launch_id,
+    read_cpu_flags,
+    required_cpu_flags,
+    select_exe,
+    supported_microarchs,
+    write_cpu_flags,
+)
 
 
 @pytest.mark.parametrize("dims,photons", itertools.product((1, 2, 3), (False, True)))
 def test_exe_name(dims: int, photons: bool):
     exe = exe_name(dims=dims, photons=photons)
     assert exe == f"epoch_{dims}d{'_photons' if photons else ''}"
+
+
+def test_launch_id(monkeypatch: pytest.MonkeyPatch):
+    for var in ("PMIX_NAMESPACE", "OMPI_MCA_ess_base_jobid", "SLURM_STEP_ID"):
+        monkeypatch.delenv(var, raising=False)
+    assert launch_id() == ""
+    monkeypatch.setenv("SLURM_JOB_ID", "42")
+    monkeypatch.setenv("SLURM_STEP_ID", "3")
+    assert launch_id() == "42.3"
+    monkeypatch.setenv("PMIX_NAMESPACE", "prterun-host-1234@1")
+    assert launch_id() == "prterun-host-1234@1"
+
+
+@pytest.mark.parametrize("variant", (None, "", "baseline", "pgo", "x86-64-v3"))
+def test_exe_name_variant(variant: str | None):
+    exe = exe_name(dims=2, photons=True, variant=variant)
+    suffix = "" if variant in (None, "", "baseline") else f"_{variant}"
+    assert exe == f"epoch_2d_photons{suffix}"
+
+
+def test_cpu_flags(tmp_path: Path):
+    cpuinfo = tmp_path / "cpuinfo"
+    cpuinfo.write_text(
+        "processor\t: 0\nflags\t\t: fpu sse4_2 avx2\nbugs\t\t: spectre\n"
+        "processor\t: 1\nflags\t\t: fpu sse4_2 avx2\n"
+    )
+    assert cpu_flags(cpuinfo) == {"fpu", "sse4_2", "avx2"}
+    assert cpu_flags(tmp_path / "missing") == frozenset()
+
+
+@pytest.mark.parametrize(
+    "flags,expected",
+    (
+        (frozenset(), ["baseline"]),
+        (MICROARCH_FLAGS["x86-64-v2"], ["x86-64-v2", "baseline"]),
+        (MICROARCH_FLAGS["x86-64-v3"], ["x86-64-v3", "x86-64-v2", "baseline"]),
+        (
+            MICROARCH_FLAGS["x86-64-v4"] | {"vmx"},
+            ["x86-64-v4", "x86-64-v3", "x86-64-v2", "baseline"],
+        ),
+        # Missing a single flag drops to the level below
+        (
+            MICROARCH_FLAGS["x86-64-v4"] - {"avx512vl"},
+            ["x86-64-v3", "x86-64-v2", "baseline"],
+        ),
+    ),
+)
+def test_supported_microarchs(flags: frozenset[str], expected: list[str]):
+    assert supported_microarchs(flags) == expected
+
+
+@pytest.mark.parametrize(
+    "available,level,expected",
+    (
+        ([None], "x86-64-v4", None),
+        ([None, "x86-64-v3"], "x86-64-v4", "x86-64-v3"),
+        ([None, "x86-64-v3", "x86-64-v4"], "x86-64-v4", "x86-64-v4"),
+        ([None, "x86-64-v3", "x86-64-v4"], "x86-64-v2", None),
+        (["x86-64-v4"], "x86-64-v3", None),
+        ([], "x86-64-v3", None),
+        ([None, "x86-64-v4", "pgo"], "x86-64-v4", "pgo"),
+        ([None, "x86-64-v4", "pgo", "tuned"], "x86-64-v4", "tuned"),
+    ),
+)
+def test_select_exe(
+    tmp_path: Path, available: list[str | None], level: str, expected: str | None
+):
+    for variant in available:
+        (tmp_path / exe_name(2, variant=variant)).write_text("")
+        if variant in ("pgo", "tuned"):
+            write_cpu_flags(tmp_path / exe_name(2, variant=variant), [])
+    exe = select_exe(2, bin_dir=tmp_path, flags=MICROARCH_FLAGS[level])
+    assert exe == str(tmp_path.resolve() / exe_name(2, variant=expected))
+
+
+def test_select_exe_tuned_elsewhere(tmp_path: Path):
+    for variant in ("x86-64-v3", "pgo", "tuned"):
+        (tmp_path / exe_name(2, variant=variant)).write_text("")
+    v3 = MICROARCH_FLAGS["x86-64-v3"]
+    # Without a record of the CPU flags they need, tuned builds aren't trusted
+    exe = select_exe(2, bin_dir=tmp_path, flags=v3)
+    assert exe == str(tmp_path.resolve() / exe_name(2, variant="x86-64-v3"))
+    # Nor are those needing flags this CPU doesn't have
+    write_cpu_flags(
+        tmp_path / exe_name(2, variant="tuned"), MICROARCH_FLAGS["x86-64-v4"]
+    )
+    write_cpu_flags(tmp_path / exe_name(2, variant="pgo"), v3)
+    exe = select_exe(2, bin_dir=tmp_path, flags=v3)
+    assert exe == str(tmp_path.resolve() / exe_name(2, variant="pgo"))
+
+
+def test_required_cpu_flags(tmp_path: Path):
+    host = frozenset(("avx2", "fma", "sse4_2"))
+    assert required_cpu_flags(["-O3"], host) == frozenset()
+    assert required_cpu_flags(["-O3", "-march=native"], host) == host
+    assert required_cpu_flags(["-xHost"], host) == host
+    v3 = MICROARCH_FLAGS["x86-64-v3"]
+    assert required_cpu_flags(["-march=x86-64-v3"], host) == v3
+    exe = tmp_path / "epoch1d_tuned"
+    assert read_cpu_flags(exe) is None
+    write_cpu_flags(exe, v3)
+    assert read_cpu_flags(exe) == v3
+    write_cpu_flags(exe, [])
+    assert read_cpu_flags(exe) == frozenset()
+
+
+@pytest.mark.parametrize("cores,request_size", ((4, 1), (4, 3), (4, 8)))
+def test_core_budget(cores: int, request_size: int):
+    budget = CoreBudget(cores)
+    in_use: list[int] = [0]
+    peak: list[int] = [0]
+    lock = threading.Lock()
+
+    def task():
+        with budget.reserve(request_size) as reserved:
+            with lock:
+                in_use[0] += reserved
+                peak[0] = max(peak[0], in_use[0])
+            time.sleep(0.01)
+            with lock:
+                in_use[0] -= reserved
+
+    threads = [threading.Thread(target=task) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert 0 < peak[0] <= cores
+    assert budget.free == cores
+
+
+def test_core_budget_invalid():
+    with pytest.raises(ValueError):
+        CoreBudget(0)
@@ -0,0 +1,52 @@
+#!/bin/bash
+
+# Slurm settings
+# --------------
+
+# Runs many small Epoch runs within a single job. Set 'ntasks' to the total number of
+# cores shared between the runs, and 'time' to the time needed to run all of them.
+
+#SBATCH --job-name=epoch_farm          # Job name
+#SBATCH --mail-user=abc123@york.ac.uk  # Where to send mail
+#SBATCH --account=ACCOUNT_CODE         # Project account
+#SBATCH --mail-type=END,FAIL           # Mail events (NONE, BEGIN, END, FAIL, ALL)
+#SBATCH --ntasks=96                    # Total number of MPI processes shared by runs
+#SBATCH --cpus-per-task=1              # Number of CPUS per process (leave this as 1!)
+#SBATCH --mem-per-cpu=1gb              # Memory per task
+#SBATCH --time=04:00:00                # Total time limit hrs:min:sec
+#SBATCH --output=%x_%j.log             # Log file for stdout/stderr outputs
+#SBATCH --partition=nodes              # 'test' for small test jobs (<1m), 'nodes' otherwise
+
+# User settings
+# -------------
+
+# Manifest listing the runs, one JSON object per line, such as:
+# {"output": "run_1", "nprocs": 4, "estimate": 3600}
+# The 'sweep' subcommand of run_epoch.py writes one with '--no-run'.
+manifest="./sweep/manifest.jsonl"
+
+# Set this to the 'run_epoch.py' script.
+# Recommended to use a relative path.
+run_epoch="./run_epoch.py"
+
+# OpenMPI module used to compile Epoch
+mpi_module="OpenMPI"
+
+# -------------
+
+module purge
+module load ${mpi_module} Python Apptainer
+
+# Suppress warnings
+export PMIX_MCA_gds=^ds12
+export PMIX_MCA_psec=^munge
+
+# Fix intra-node communication issue
+# https://ciq.com/blog/workaround-for-communication-issue-with-mpi-apps-apptainer-without-setuid/
+export OMPI_MCA_pml=ucx
+export OMPI_MCA_btl='^vader,tcp,openib,uct'
+export UCX_TLS=^'posix,cma'
+
+echo "Running the Epoch runs in ${manifest} using ${SLURM_NTASKS} processes"
+
+python ${run_epoch} farm ${manifest} --step srun
@@ -17,6 +17,7 @@
 #SBATCH --time=00:01:00                # Total time limit hrs:min:sec
 #SBATCH --output=%x_%j.log             # Log file for stdout/stderr outputs
 #SBATCH --partition=nodes              # 'test' for small test jobs (<1m), 'nodes' otherwise
+#SBATCH --signal=B:USR1@300            # Warn run_epoch.py 5 minutes before the time limit
 
 # User settings
 # -------------
@@ -38,6 +39,31 @@ dims="2"
 # Ignored if running from source.
 photons=""
 
+# Record the memory, CPU time and I/O used by each process
+# Set to '--sample-resources' to activate, or just leave as an empty string. Summaries
+# are written to 'resources' in the output directory, and help to choose --mem-per-cpu.
+# Ignored if running from source.
+sample_resources=""
+
+# Stop before the time limit, writing a restart dump
+# Set to '--graceful' to stop when Slurm sends the signal requested by '--signal' above,
+# or to '--graceful --resume --requeue' to also continue from the latest restart dump
+# in a requeued job. Otherwise leave as an empty string.
+# Ignored if running from source.
+graceful="--graceful"
+
+# Run Epoch in fast node-local storage, copying dumps back to the output directory
+# Set to '--stage $TMPDIR' to activate, or just leave as an empty string. Only for jobs
+# on a single node.
+# Ignored if running from source.
+stage=""
+
+# Shared directory in which to keep container images, so that jobs started together
+# pull the image once rather than each fetching it. Leave as an empty string to pull
+# the image in every job.
+# Ignored if running from source.
+export EPOCH_IMAGE_CACHE="/mnt/scratch/users/${USER}/.epoch_images"
+
 # If running Epoch from containers, set this to the 'run_epoch.py' script
 # Ignored if running from source.
 # Recommended to use a relative path.
@@ -72,7 +98,8 @@ if [[ ${method} -eq "Singularity" ]]; then
 
   echo "Running Epoch with Apptainer using ${SLURM_NTASKS} processes"
 
-  python ${run_epoch} singularity -d ${dims} -o ${output_dir} ${photons} --srun
+  # 'exec' so that the signal sent by Slurm reaches run_epoch.py
+  exec python ${run_epoch} singularity -d ${dims} -o ${output_dir} ${photons} ${sample_resources} ${graceful} ${stage} --srun
 
   # Alternative in case the above isn't working:
   # srun singularity exec --bind ${output_dir}:/output oras://ghcr.io/plasmafair/epoch.sif:latest run_epoch -d ${dims} -o /output --srun ${photons}